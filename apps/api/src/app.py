@@ -71,6 +71,17 @@ try:
     from middleware.security import init_security_middleware
     from middleware.rate_limiting import init_rate_limiting
     from middleware.audit_logging import init_audit_logging
+    from services.cart_store import init_cart_store
+    from services.coupon_service import init_coupon_service
+    from services.event_system import init_event_system
+    from services.melhor_envio_service import init_shipping_quote_warmup
+    from services.newsletter_delivery import init_newsletter_delivery
+    from services.nfe_lote_service import init_nfe_lote_service
+    from services.notification_dispatcher import init_notification_dispatcher
+    from services.numeracao_fiscal_service import init_numeracao_fiscal
+    from services.pdv_sales import init_pdv_sales
+    from services.product_search import init_product_search
+    from services.sales_rollup_service import init_sales_rollup
     from utils.cache import init_cache_warmup
     from utils.logger import setup_logger
     from utils.monitoring import init_monitoring
@@ -153,6 +164,76 @@ def create_app(config_name = None):
     except Exception as e:
         logger.warning(f"⚠️ Audit logging falhou: {e}")
 
+    # Inicializa índice de busca de produtos
+    try:
+        backend = init_product_search(app)
+        logger.info(f"✅ Busca de produtos inicializada ({backend})")
+    except Exception as e:
+        logger.warning(f"⚠️ Busca de produtos falhou: {e}")
+
+    # Inicializa rollup diário de vendas
+    try:
+        init_sales_rollup(app)
+        logger.info("✅ Rollup de vendas inicializado")
+    except Exception as e:
+        logger.warning(f"⚠️ Rollup de vendas falhou: {e}")
+
+    # Inicializa fila de notificações em massa
+    try:
+        init_notification_dispatcher(app)
+        logger.info("✅ Fila de notificações inicializada")
+    except Exception as e:
+        logger.warning(f"⚠️ Fila de notificações falhou: {e}")
+
+    # Inicializa sistema de eventos (handlers assíncronos, outbox opcional)
+    try:
+        init_event_system(app)
+        logger.info("✅ Sistema de eventos inicializado")
+    except Exception as e:
+        logger.warning(f"⚠️ Sistema de eventos falhou: {e}")
+
+    # Inicializa alocação e conciliação da numeração fiscal
+    try:
+        init_numeracao_fiscal(app)
+        logger.info("✅ Numeração fiscal inicializada")
+    except Exception as e:
+        logger.warning(f"⚠️ Numeração fiscal falhou: {e}")
+
+    # Atualiza a tabela de vendas do PDV (reenvio idempotente de lotes offline)
+    try:
+        init_pdv_sales(app)
+        logger.info("✅ Vendas do PDV inicializadas")
+    except Exception as e:
+        logger.warning(f"⚠️ Vendas do PDV falharam: {e}")
+
+    # Inicializa gravação em background do carrinho (Redis -> banco)
+    try:
+        init_cart_store(app)
+        logger.info("✅ Carrinho em cache inicializado")
+    except Exception as e:
+        logger.warning(f"⚠️ Carrinho em cache falhou: {e}")
+
+    # Inicializa reconciliação dos contadores de uso de cupons
+    try:
+        init_coupon_service(app)
+        logger.info("✅ Serviço de cupons inicializado")
+    except Exception as e:
+        logger.warning(f"⚠️ Serviço de cupons falhou: {e}")
+
+    # Inicializa envio de campanhas de newsletter (retoma envios interrompidos)
+    try:
+        init_newsletter_delivery(app)
+        logger.info("✅ Envio de newsletter inicializado")
+    except Exception as e:
+        logger.warning(f"⚠️ Envio de newsletter falhou: {e}")
+
+    # Inicializa envio de NF-e em lote
+    try:
+        init_nfe_lote_service(app)
+        logger.info("✅ Envio de NF-e em lote inicializado")
+    except Exception as e:
+        logger.warning(f"⚠️ Envio de NF-e em lote falhou: {e}")
+
     # Inicializa cache warming
     try:
         init_cache_warmup()
@@ -160,12 +241,21 @@ def create_app(config_name = None):
     except Exception as e:
         logger.warning(f"⚠️ Cache warming falhou: {e}")
 
-    # Inicializa webhook processor (TEMPORARIAMENTE DESABILITADO)
+    # Inicializa pré-aquecimento das cotações de frete mais pedidas
     try:
-        # webhook_processor.start_processor()  # COMENTADO: estava travando o Flask
-        logger.info("✅ Webhook processor desabilitado para debug")
+        init_shipping_quote_warmup(app)
+        logger.info("✅ Pré-aquecimento de fretes inicializado")
+    except Exception as e:
+        logger.warning(f"⚠️ Pré-aquecimento de fretes falhou: {e}")
+
+    # Inicializa fila de webhooks (workers sobem sob demanda, fora da requisição)
+    try:
+        from services.webhook_processor import init_webhook_processor
+
+        init_webhook_processor(app)
+        logger.info("✅ Fila de webhooks inicializada")
     except Exception as e:
-        logger.warning(f"⚠️ Webhook processor falhou: {e}")
+        logger.warning(f"⚠️ Fila de webhooks falhou: {e}")
 
     # Registra blueprints principais
     app.register_blueprint(auth_bp, url_prefix="/api/auth")
@@ -517,11 +607,15 @@ def seed_initial_data(app):
         app.logger.error(f"❌ Erro ao verificar dados iniciais: {e}")
 
 
-# Cria a aplicação
-app = create_app()
+# Processos filhos iniciados com spawn (pool de assinatura da NF-e) reimportam o
+# script principal como __mp_main__; eles não devem criar a aplicação nem
+# iniciar workers, agendadores e pools de conexão
+if __name__ != "__mp_main__":
+    # Cria a aplicação
+    app = create_app()
 
-# Seed initial data on startup
-seed_initial_data(app)
+    # Seed initial data on startup
+    seed_initial_data(app)
 
 if __name__ == "__main__":
 
@@ -10,7 +10,13 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import func
 
 from database import db
-from models import CartItem, Customer, Lead, Order, OrderItem, Product, ProductPrice, User
+from models import Customer, Lead, Order, OrderItem, Product, User
+from services.dashboard_service import dashboard_service
+from services.notification_service import get_notification_service
+from services.product_search import product_search
+from services.sales_rollup_service import sales_rollup
+from utils.cache import invalidate_catalog_cache, invalidate_product_cache
+from utils.pagination import InvalidCursor, get_cursor_params, paginate_keyset
 from utils.logger import logger
 
 admin_bp = Blueprint("admin", __name__)
@@ -55,169 +61,8 @@ def admin_required():
 def get_dashboard():
     """Dashboard administrativo com métricas principais"""
     try:
-        # Período padrão: últimos 30 dias
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days = 30)
-
-        # Métricas de vendas
-        orders_query = Order.query.filter(
-            Order.created_at >= start_date, Order.created_at <= end_date
-        )
-
-        total_orders = orders_query.count()
-        completed_orders = orders_query.filter(Order.status == "completed").count()
-        pending_orders = orders_query.filter(Order.status == "pending").count()
-
-        # Receita total
-        total_revenue = (
-            db.session.query(func.sum(Order.total_amount))
-            .filter(
-                Order.created_at >= start_date,
-                Order.created_at <= end_date,
-                Order.status == "completed",
-            )
-            .scalar()
-            or 0
-        )
-
-        # Ticket médio
-        avg_order_value = (
-            db.session.query(func.avg(Order.total_amount))
-            .filter(
-                Order.created_at >= start_date,
-                Order.created_at <= end_date,
-                Order.status == "completed",
-            )
-            .scalar()
-            or 0
-        )
-
-        # Produtos mais vendidos
-        top_products = (
-            db.session.query(
-                OrderItem.product_name,
-                func.sum(OrderItem.quantity).label("total_quantity"),
-                func.sum(OrderItem.total_price).label("total_revenue"),
-            )
-            .join(Order)
-            .filter(
-                Order.created_at >= start_date,
-                Order.created_at <= end_date,
-                Order.status == "completed",
-            )
-            .group_by(OrderItem.product_name)
-            .order_by(func.sum(OrderItem.quantity).desc())
-            .limit(10)
-            .all()
-        )
-
-        # Clientes ativos
-        active_customers = Customer.query.filter(Customer.status == "active").count()
-
-        # Leads
-        total_leads = Lead.query.count()
-        converted_leads = Lead.query.filter(Lead.status == "converted").count()
-
-        # Carrinho abandonado
-        abandoned_carts = CartItem.query.filter(
-            CartItem.created_at >= start_date, CartItem.created_at <= end_date
-        ).count()
-
-        # Produtos cadastrados
-        total_products = Product.query.count()
-        active_products = Product.query.filter(Product.is_active).count()
-
-        # Usuários registrados
-        total_users = User.query.count()
-        admin_users = User.query.filter(User.is_admin).count()
-
-        # Vendas por dia (últimos 7 dias)
-        daily_sales = []
-        for i in range(7):
-            day_start = (end_date - timedelta(days = i)).replace(
-                hour = 0, minute = 0, second = 0, microsecond = 0
-            )
-            day_end = day_start + timedelta(days = 1)
-
-            day_orders = Order.query.filter(
-                Order.created_at >= day_start,
-                Order.created_at < day_end,
-                Order.status == "completed",
-            ).count()
-
-            day_revenue = (
-                db.session.query(func.sum(Order.total_amount))
-                .filter(
-                    Order.created_at >= day_start,
-                    Order.created_at < day_end,
-                    Order.status == "completed",
-                )
-                .scalar()
-                or 0
-            )
-
-            daily_sales.append(
-                {
-                    "date": day_start.strftime("%Y-%m-%d"),
-                    "orders": day_orders,
-                    "revenue": float(day_revenue),
-                }
-            )
-
-        return jsonify(
-            {
-                "success": True,
-                "data": {
-                    "period": {
-                        "start_date": start_date.strftime("%Y-%m-%d"),
-                        "end_date": end_date.strftime("%Y-%m-%d"),
-                    },
-                    "sales": {
-                        "total_orders": total_orders,
-                        "completed_orders": completed_orders,
-                        "pending_orders": pending_orders,
-                        "total_revenue": float(total_revenue),
-                        "avg_order_value": float(avg_order_value),
-                        "conversion_rate": (
-                            (completed_orders / total_orders * 100)
-                            if total_orders > 0
-                            else 0
-                        ),
-                    },
-                    "customers": {
-                        "active_customers": active_customers,
-                        "total_leads": total_leads,
-                        "converted_leads": converted_leads,
-                        "conversion_rate": (
-                            (converted_leads / total_leads * 100)
-                            if total_leads > 0
-                            else 0
-                        ),
-                    },
-                    "products": {
-                        "total_products": total_products,
-                        "active_products": active_products,
-                        "top_products": [
-                            {
-                                "name": product.product_name,
-                                "quantity": int(product.total_quantity),
-                                "revenue": float(product.total_revenue),
-                            }
-                            for product in top_products
-                        ],
-                    },
-                    "users": {
-                        "total_users": total_users,
-                        "admin_users": admin_users,
-                        "customer_users": total_users - admin_users,
-                    },
-                    "analytics": {
-                        "abandoned_carts": abandoned_carts,
-                        "daily_sales": daily_sales,
-                    },
-                },
-            }
-        )
+        # Agregação em poucas consultas, com cache invalidado quando pedidos mudam
+        return jsonify({"success": True, "data": dashboard_service.get_dashboard()})
 
     except Exception as e:
         return (
@@ -243,6 +88,22 @@ def get_orders():
         if status:
             query = query.filter(Order.status == status)
 
+        # Modo cursor (?after=/?before=/?pagination=cursor): sem COUNT nem OFFSET
+        cursor_params = get_cursor_params()
+        if cursor_params:
+            result = paginate_keyset(
+                query, Order.created_at, Order.id, per_page = per_page, **cursor_params
+            )
+            return jsonify(
+                {
+                    "success": True,
+                    "data": {
+                        "orders": [order.to_dict() for order in result.items],
+                        "pagination": result.pagination_dict(),
+                    },
+                }
+            )
+
         orders = query.order_by(Order.created_at.desc()).paginate(
             page = page, per_page = per_page, error_out = False
         )
@@ -262,6 +123,8 @@ def get_orders():
             }
         )
 
+    except InvalidCursor as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         return (
             jsonify({"success": False, "error": f"Erro ao listar pedidos: {str(e)}"}),
@@ -339,7 +202,9 @@ def create_admin_order():
 
         # Executar inserção
         db.session.execute(text(insert_sql), params)
+        sales_rollup.mark_order_changed(order_id)
         db.session.commit()
+        dashboard_service.invalidate()
 
         # Buscar pedido criado para retornar
         select_sql = "SELECT * FROM orders WHERE id = :id"
@@ -452,7 +317,9 @@ def update_admin_order(order_id):
             
             # Executar update seguro
             db.session.execute(stmt.values(update_values))
+            sales_rollup.mark_order_changed(clean_id)
             db.session.commit()
+            dashboard_service.invalidate()
 
         # Buscar pedido atualizado para retornar
         updated_result = db.session.execute(
@@ -506,7 +373,9 @@ def delete_admin_order(order_id):
         }
 
         db.session.execute(text(sql), params)
+        sales_rollup.mark_order_changed(clean_id)
         db.session.commit()
+        dashboard_service.invalidate()
 
         return jsonify({"success": True, "message": "Pedido cancelado com sucesso"})
 
@@ -547,7 +416,9 @@ def update_order_status(order_id):
         params = {"id": clean_id, "status": new_status, "updated_at": datetime.utcnow()}
 
         db.session.execute(text(sql), params)
+        sales_rollup.mark_order_changed(clean_id)
         db.session.commit()
+        dashboard_service.invalidate()
 
         # Buscar pedido atualizado para retornar
         updated_result = db.session.execute(
@@ -862,6 +733,8 @@ def update_admin_user(user_id):
             # Executar update seguro
             db.session.execute(stmt.values(update_values))
             db.session.commit()
+            # Contato usado pelas notificações (cache de destinatários)
+            get_notification_service().invalidate_recipient(clean_id)
 
         # Buscar usuário atualizado para retornar (sem senha)
         updated_result = db.session.execute(
@@ -917,6 +790,7 @@ def delete_admin_user(user_id):
 
         db.session.execute(text(sql), params)
         db.session.commit()
+        get_notification_service().invalidate_recipient(clean_id)
 
         return jsonify({"success": True, "message": "Usuário removido com sucesso"})
 
@@ -962,6 +836,7 @@ def toggle_user_status(user_id):
 
         db.session.execute(text(sql), params)
         db.session.commit()
+        get_notification_service().invalidate_recipient(clean_id)
 
         # Buscar usuário atualizado para retornar (sem senha)
         updated_result = db.session.execute(
@@ -1198,6 +1073,10 @@ def create_admin_product():
             
             db.session.commit()
 
+        # Manter índice de busca e listagens do catálogo atualizados
+        product_search.refresh_product(product_id)
+        invalidate_catalog_cache()
+
         # Buscar produto criado para retornar
         select_sql = "SELECT * FROM products WHERE id = :id"
         result = db.session.execute(text(select_sql), {"id": product_id})
@@ -1335,6 +1214,12 @@ def update_admin_product(product_id):
             
             db.session.commit()
 
+        # Manter índice de busca e listagens do catálogo atualizados
+        if update_fields:
+            product_search.refresh_product(clean_id)
+        invalidate_catalog_cache()
+        invalidate_product_cache(clean_id)
+
         # Buscar produto atualizado para retornar
         updated_result = db.session.execute(
             text("SELECT * FROM products WHERE id = :id"), {"id": clean_id}
@@ -1400,6 +1285,9 @@ def delete_admin_product(product_id):
 
         db.session.execute(text(sql), params)
         db.session.commit()
+        product_search.refresh_product(clean_id)
+        invalidate_catalog_cache()
+        invalidate_product_cache(clean_id)
 
         return jsonify({"success": True, "message": "Produto removido com sucesso"})
 
@@ -1445,6 +1333,9 @@ def toggle_product_status(product_id):
 
         db.session.execute(text(sql), params)
         db.session.commit()
+        product_search.refresh_product(clean_id)
+        invalidate_catalog_cache()
+        invalidate_product_cache(clean_id)
 
         # Buscar produto atualizado para retornar
         updated_result = db.session.execute(
@@ -1812,24 +1703,9 @@ def get_top_products_revenue():
         end_date = datetime.now()
         start_date = end_date - timedelta(days = int(period))
 
-        # Buscar produtos com maior receita
-        top_products = (
-            db.session.query(
-                OrderItem.product_name,
-                func.sum(OrderItem.total_price).label("total_revenue"),
-                func.sum(OrderItem.quantity).label("total_quantity"),
-                func.count(OrderItem.id).label("orders_count"),
-            )
-            .join(Order)
-            .filter(
-                Order.created_at >= start_date,
-                Order.created_at <= end_date,
-                Order.status == "completed",
-            )
-            .group_by(OrderItem.product_name)
-            .order_by(func.sum(OrderItem.total_price).desc())
-            .limit(limit)
-            .all()
+        # Buscar produtos com maior receita (rollup diário)
+        top_products = sales_rollup.top_products(
+            start_date.date(), end_date.date(), limit = limit, order_by = "revenue"
         )
 
         return jsonify(
@@ -1838,13 +1714,10 @@ def get_top_products_revenue():
                 "data": {
                     "top_products": [
                         {
-                            "product_name": product.product_name,
-                            "total_revenue": float(product.total_revenue),
-                            "total_quantity": int(product.total_quantity),
-                            "orders_count": int(product.orders_count),
+                            **product,
                             "avg_order_value": (
-                                float(product.total_revenue / product.orders_count)
-                                if product.orders_count > 0
+                                product["total_revenue"] / product["orders_count"]
+                                if product["orders_count"] > 0
                                 else 0
                             ),
                         }
@@ -2197,29 +2070,16 @@ def get_dashboard_sales():
         end_date = datetime.now()
         start_date = end_date - timedelta(days = 30)
 
-        # Métricas de vendas
-        total_orders = Order.query.filter(
-            Order.created_at >= start_date, Order.created_at <= end_date
-        ).count()
-
-        total_revenue = (
-            db.session.query(func.sum(Order.total_amount))
-            .filter(
-                Order.created_at >= start_date,
-                Order.created_at <= end_date,
-                Order.status == "completed",
-            )
-            .scalar()
-            or 0
-        )
+        # Métricas de vendas (rollup diário)
+        summary = sales_rollup.sales_summary(start_date.date(), end_date.date())
 
         return jsonify(
             {
                 "success": True,
                 "data": {
                     "sales_metrics": {
-                        "total_orders": total_orders,
-                        "total_revenue": float(total_revenue),
+                        "total_orders": summary["total_orders"],
+                        "total_revenue": summary["total_revenue"],
                         "period_days": 30,
                     }
                 },
@@ -2548,66 +2408,15 @@ def get_sales_analytics():
         end_date = datetime.now()
         start_date = end_date - timedelta(days = int(period))
 
-        # Vendas por status
-        sales_by_status = (
-            db.session.query(
-                Order.status,
-                func.count(Order.id).label("count"),
-                func.sum(Order.total_amount).label("total")
-            )
-            .filter(
-                Order.created_at >= start_date,
-                Order.created_at <= end_date
-            )
-            .group_by(Order.status)
-            .all()
-        )
-
-        # Métodos de pagamento mais usados
-        payment_methods = (
-            db.session.query(
-                Order.payment_status,
-                func.count(Order.id).label("count")
-            )
-            .filter(
-                Order.created_at >= start_date,
-                Order.created_at <= end_date
-            )
-            .group_by(Order.payment_status)
-            .all()
-        )
-
-        # Ticket médio por período
-        avg_order_value = (
-            db.session.query(func.avg(Order.total_amount))
-            .filter(
-                Order.created_at >= start_date,
-                Order.created_at <= end_date,
-                Order.status == "completed"
-            )
-            .scalar()
-            or 0
-        )
+        # Vendas por status, métodos de pagamento e ticket médio (rollup diário)
+        summary = sales_rollup.sales_summary(start_date.date(), end_date.date())
 
         return jsonify({
             "success": True,
             "data": {
-                "sales_by_status": [
-                    {
-                        "status": status.status,
-                        "count": int(status.count),
-                        "total": float(status.total) if status.total else 0
-                    }
-                    for status in sales_by_status
-                ],
-                "payment_methods": [
-                    {
-                        "method": method.payment_status,
-                        "count": int(method.count)
-                    }
-                    for method in payment_methods
-                ],
-                "avg_order_value": float(avg_order_value),
+                "sales_by_status": summary["sales_by_status"],
+                "payment_methods": summary["payment_methods"],
+                "avg_order_value": summary["avg_order_value"],
                 "period": {
                     "start_date": start_date.strftime("%Y-%m-%d"),
                     "end_date": end_date.strftime("%Y-%m-%d"),
@@ -2656,6 +2465,14 @@ def get_products_analytics():
             .all()
         )
 
+        # Produtos mais vendidos no período (rollup diário)
+        period = request.args.get("period", "30")  # dias
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days = int(period))
+        top_selling_products = sales_rollup.top_products(
+            start_date.date(), end_date.date(), limit = 10, order_by = "quantity"
+        )
+
         return jsonify({
             "success": True,
             "data": {
@@ -2683,7 +2500,8 @@ def get_products_analytics():
                         "category": product.category
                     }
                     for product in expensive_products
-                ]
+                ],
+                "top_selling_products": top_selling_products
             }
         })
 
@@ -2722,20 +2540,8 @@ def get_customers_analytics():
             .all()
         )
 
-        # Clientes com mais pedidos
-        top_customers = (
-            db.session.query(
-                Customer.name,
-                Customer.email,
-                func.count(Order.id).label("orders_count"),
-                func.sum(Order.total_amount).label("total_spent")
-            )
-            .outerjoin(Order)
-            .group_by(Customer.id, Customer.name, Customer.email)
-            .order_by(func.count(Order.id).desc())
-            .limit(10)
-            .all()
-        )
+        # Clientes com mais pedidos (rollup diário)
+        top_customers = sales_rollup.top_customers(limit = 10)
 
         return jsonify({
             "success": True,
@@ -2754,15 +2560,7 @@ def get_customers_analytics():
                     }
                     for month in new_customers_monthly
                 ],
-                "top_customers": [
-                    {
-                        "name": customer.name,
-                        "email": customer.email,
-                        "orders_count": int(customer.orders_count),
-                        "total_spent": float(customer.total_spent) if customer.total_spent else 0
-                    }
-                    for customer in top_customers
-                ]
+                "top_customers": top_customers
             }
         })
 
@@ -2815,3 +2613,85 @@ def get_order_documents(order_id):
     except Exception as e:
         logger.error(f"Error getting order documents: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
+
+
+@admin_bp.route("/webhooks/stats", methods=["GET"])
+@jwt_required()
+@admin_required()
+def get_webhook_stats():
+    """Profundidade da fila de webhooks e vazão por provedor"""
+    try:
+        from services.webhook_processor import webhook_processor
+
+        return jsonify({"success": True, "data": webhook_processor.get_stats()})
+
+    except Exception as e:
+        return (
+            jsonify({"success": False, "error": f"Erro ao carregar métricas de webhooks: {str(e)}"}),
+            500,
+        )
+
+
+@admin_bp.route("/webhooks", methods=["GET"])
+@jwt_required()
+@admin_required()
+def get_webhooks():
+    """Lista webhooks recebidos (ex.: ?status=dead para a dead-letter)"""
+    try:
+        from models.payments import PaymentWebhook
+
+        query = PaymentWebhook.query
+        status = request.args.get("status")
+        provider = request.args.get("provider")
+        if status:
+            query = query.filter(PaymentWebhook.status == status)
+        if provider:
+            query = query.filter(PaymentWebhook.provider == provider)
+
+        result = paginate_keyset(
+            query,
+            PaymentWebhook.created_at,
+            PaymentWebhook.id,
+            per_page = request.args.get("per_page", 20, type = int),
+            **get_cursor_params(),
+        )
+        return jsonify(
+            {
+                "success": True,
+                "data": {
+                    "webhooks": [webhook.to_dict() for webhook in result.items],
+                    "pagination": result.pagination_dict(),
+                },
+            }
+        )
+
+    except InvalidCursor as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return (
+            jsonify({"success": False, "error": f"Erro ao listar webhooks: {str(e)}"}),
+            500,
+        )
+
+
+@admin_bp.route("/webhooks/<webhook_id>/retry", methods=["POST"])
+@jwt_required()
+@admin_required()
+def retry_webhook(webhook_id):
+    """Devolve à fila um webhook em dead-letter"""
+    try:
+        from services.webhook_processor import webhook_processor
+
+        if not webhook_processor.requeue(webhook_id):
+            return (
+                jsonify({"success": False, "error": "Webhook não encontrado ou não está em dead-letter"}),
+                404,
+            )
+        return jsonify({"success": True, "message": "Webhook reenfileirado"})
+
+    except Exception as e:
+        db.session.rollback()
+        return (
+            jsonify({"success": False, "error": f"Erro ao reenfileirar webhook: {str(e)}"}),
+            500,
+        )
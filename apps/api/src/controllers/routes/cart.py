@@ -1,15 +1,23 @@
-from datetime import datetime
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from database import db
 from models.orders import Cart, CartItem
 from models.products import Product, ProductPrice
 from models.auth import User
+from services.cart_store import CartFlushError, CartLimitExceeded, CartLine, cart_store
 
 cart_bp = Blueprint("cart", __name__, url_prefix="/api/cart")
 
+
+def _products_by_id(lines):
+    """Produtos das linhas do carrinho em uma única consulta (chave: ID em texto)"""
+    product_ids = {line.product_id for line in lines}
+    products = Product.query.filter(Product.id.in_(product_ids)).all()
+    return {str(product.id): product for product in products}
+
+
 # ========== ROTAS DO CARRINHO ========== #
 
 
@@ -35,28 +43,26 @@ def get_cart():
                 "data": {"items": [], "total": 0, "items_count": 0}
             }), 401
 
-        # Buscar ou criar carrinho do usuário
-        cart = Cart.query.filter_by(user_id = user_id).first()
-        if not cart:
+        # Linhas do carrinho (Redis quando disponível) e produtos em uma consulta
+        lines = cart_store.get_lines(user_id)
+        if not lines:
             return jsonify({
                 "success": True,
                 "message": "Carrinho vazio",
                 "data": {"items": [], "total": 0, "items_count": 0}
             }), 200
 
-        # Buscar itens do carrinho com detalhes do produto
-        cart_items = (
-            db.session.query(CartItem, Product)
-            .join(Product)
-            .filter(CartItem.cart_id == cart.id)
-            .all()
-        )
+        products = _products_by_id(lines)
 
         items = []
         total = 0
 
-        for cart_item, product in cart_items:
-            item_total = float(product.price) * cart_item.quantity
+        for line in lines:
+            product = products.get(line.product_id)
+            if not product:
+                continue
+
+            item_total = float(product.price) * line.quantity
             total += item_total
 
             # Buscar imagem principal do produto
@@ -64,12 +70,10 @@ def get_cart():
 
             items.append(
                 {
-                    "id": cart_item.id,
-                    "product_id": cart_item.product_id,
-                    "quantity": cart_item.quantity,
-                    "added_at": (
-                        cart_item.added_at.isoformat() if cart_item.added_at else None
-                    ),
+                    "id": line.id,
+                    "product_id": line.product_id,
+                    "quantity": line.quantity,
+                    "added_at": line.added_at,
                     "product": {
                         "id": product.id,
                         "name": product.name,
@@ -107,33 +111,36 @@ def get_cart_items():
         if not user_id:
             return jsonify({"error": "user_id é obrigatório"}), 400
 
-        # Buscar ou criar carrinho do usuário
-        cart = Cart.query.filter_by(user_id = user_id).first()
-        if not cart:
+        # Linhas do carrinho com detalhes do produto e preços específicos
+        lines = cart_store.get_lines(user_id)
+        if not lines:
             return jsonify({"items": [], "total": 0, "items_count": 0})
 
-        # Buscar itens do carrinho com detalhes do produto e preços específicos
-        cart_items = (
-            db.session.query(CartItem, Product, ProductPrice)
-            .join(Product)
-            .outerjoin(ProductPrice, CartItem.product_price_id == ProductPrice.id)
-            .filter(CartItem.cart_id == cart.id)
-            .all()
-        )
+        products = _products_by_id(lines)
+        price_ids = {line.product_price_id for line in lines if line.product_price_id}
+        product_prices = {
+            str(price.id): price
+            for price in (ProductPrice.query.filter(ProductPrice.id.in_(price_ids)).all() if price_ids else [])
+        }
 
         items = []
         total = 0
 
-        for cart_item, product, product_price in cart_items:
+        for line in lines:
+            product = products.get(line.product_id)
+            if not product:
+                continue
+            product_price = product_prices.get(line.product_price_id)
+
             # Usar preço específico se disponível, senão usar preço padrão
-            if cart_item.unit_price:
-                unit_price = float(cart_item.unit_price)
+            if line.unit_price:
+                unit_price = float(line.unit_price)
             elif product_price:
                 unit_price = float(product_price.price)
             else:
                 unit_price = float(product.price)
             
-            item_total = unit_price * cart_item.quantity
+            item_total = unit_price * line.quantity
             total += item_total
 
             # Buscar imagem principal do produto
@@ -141,15 +148,13 @@ def get_cart_items():
 
             items.append(
                 {
-                    "id": cart_item.id,
-                    "product_id": cart_item.product_id,
-                    "product_price_id": cart_item.product_price_id,
-                    "weight": cart_item.weight,
+                    "id": line.id,
+                    "product_id": line.product_id,
+                    "product_price_id": line.product_price_id,
+                    "weight": line.weight,
                     "unit_price": unit_price,
-                    "quantity": cart_item.quantity,
-                    "added_at": (
-                        cart_item.added_at.isoformat() if cart_item.added_at else None
-                    ),
+                    "quantity": line.quantity,
+                    "added_at": line.added_at,
                     "product": {
                         "id": product.id,
                         "name": product.name,
@@ -218,12 +223,6 @@ def add_to_cart():
         unit_price = float(product.price)  # Preço padrão
         weight_selected = weight
 
-        # Verificar se o produto tem preços por peso configurados
-        has_weight_prices = ProductPrice.query.filter_by(
-            product_id=product_id,
-            is_active=True
-        ).count() > 0
-
         if product_price_id:
             product_price = ProductPrice.query.filter_by(
                 id=product_price_id,
@@ -237,135 +236,40 @@ def add_to_cart():
                 }), 404
             unit_price = float(product_price.price)
             weight_selected = product_price.weight
-        elif weight:
-            # Buscar por peso se não tiver product_price_id
-            product_price = ProductPrice.query.filter_by(
-                product_id=product_id,
-                weight=weight,
-                is_active=True
-            ).first()
-            if product_price:
-                unit_price = float(product_price.price)
-                weight_selected = product_price.weight
-        elif has_weight_prices:
-            # Produto tem preços por peso mas nenhum foi especificado
-            # Usar o primeiro preço disponível como padrão
-            product_price = ProductPrice.query.filter_by(
-                product_id=product_id,
-                is_active=True
-            ).first()
+        else:
+            # Buscar por peso; se o produto tem preços por peso mas nenhum foi
+            # especificado, usar o primeiro preço disponível como padrão
+            filters = {"product_id": product_id, "is_active": True}
+            if weight:
+                filters["weight"] = weight
+            product_price = ProductPrice.query.filter_by(**filters).first()
             if product_price:
                 unit_price = float(product_price.price)
                 weight_selected = product_price.weight
         # Se não tem preços por peso, usar preço padrão do produto (já definido acima)
 
-        # 🔒 CORREÇÃO DE RACE CONDITION - Usar transação atômica para carrinho
-        import logging
-        import time
-        import threading
-        
-        race_logger = logging.getLogger('race_condition_monitor')
-        thread_id = threading.get_ident()
-        timestamp = time.time()
-        
+        # Estoque não é reservado no carrinho (a baixa acontece no checkout),
+        # então não há lock: o limite é verificado atomicamente pelo cart_store
+        stock = product.stock_quantity or 0
+        if stock < quantity:
+            return jsonify({
+                "success": False,
+                "message": f"Estoque insuficiente. Disponível: {stock}"
+            }), 400
+
+        line = CartLine(
+            product_id=str(product.id),
+            product_price_id=str(product_price_id) if product_price_id else None,
+            weight=weight_selected,
+            unit_price=unit_price,
+        )
         try:
-            race_logger.info(f"🔒 CART_ATOMIC_TRANSACTION_START [Thread:{thread_id}] Product:{product.name}")
-            
-            # 🔒 SELECT FOR UPDATE - Lock pessimista no produto para verificação de estoque
-            product_locked = db.session.query(Product).filter(
-                Product.id == product_id,
-                Product.is_active == True
-            ).with_for_update().first()
-            
-            if not product_locked:
-                race_logger.error(f"❌ CART_PRODUCT_NOT_FOUND [Thread:{thread_id}] ProductID:{product_id}")
-                return jsonify({
-                    "success": False,
-                    "message": "Produto não encontrado"
-                }), 404
-            
-            race_logger.info(f"🔒 CART_PRODUCT_LOCKED [Thread:{thread_id}] Product:{product_locked.name} Stock:{product_locked.stock_quantity}")
-            
-            # Verificar estoque dentro da transação (dados atualizados)
-            if product_locked.stock_quantity < quantity:
-                race_logger.warning(f"❌ CART_STOCK_INSUFFICIENT_ATOMIC [Thread:{thread_id}] Product:{product_locked.name} Available:{product_locked.stock_quantity} Requested:{quantity}")
-                return jsonify({
-                    "success": False,
-                    "message": f"Estoque insuficiente. Disponível: {product_locked.stock_quantity}"
-                }), 400
-            
-            # Buscar ou criar carrinho do usuário
-            cart = Cart.query.filter_by(user_id = user_id).first()
-            if not cart:
-                cart = Cart(user_id = user_id)
-                db.session.add(cart)
-                db.session.flush()
-            
-            # 🔥 CORREÇÃO CRÍTICA: Verificar se já existe considerando peso/preço específico
-            existing_item = None
-            if product_price_id:
-                # Buscar por product_price_id específico
-                existing_item = CartItem.query.filter_by(
-                    cart_id=cart.id,
-                    product_id=product_id,
-                    product_price_id=product_price_id
-                ).first()
-            else:
-                # Buscar por peso se não tiver product_price_id
-                existing_item = CartItem.query.filter_by(
-                    cart_id=cart.id,
-                    product_id=product_id,
-                    weight=weight_selected
-                ).first()
-            
-            if existing_item:
-                # Item já existe - verificar quantidade total dentro da transação
-                current_in_cart = existing_item.quantity
-                new_quantity = current_in_cart + quantity
-                
-                race_logger.info(f"🔄 CART_UPDATE_EXISTING_ATOMIC [Thread:{thread_id}] Product:{product_locked.name} CurrentInCart:{current_in_cart} Adding:{quantity} NewTotal:{new_quantity}")
-                
-                # Verificar se a nova quantidade não excede o estoque (dados atualizados)
-                if new_quantity > product_locked.stock_quantity:
-                    race_logger.warning(f"❌ CART_TOTAL_EXCEEDS_STOCK_ATOMIC [Thread:{thread_id}] Product:{product_locked.name} RequestedTotal:{new_quantity} Available:{product_locked.stock_quantity}")
-                    return jsonify({
-                        "success": False,
-                        "message": f"Quantidade total excede estoque. Máximo: {product_locked.stock_quantity}, atual no carrinho: {existing_item.quantity}"
-                    }), 400
-                
-                # Atualizar quantidade atomicamente
-                existing_item.quantity = new_quantity
-                existing_item.updated_at = datetime.utcnow()
-                
-                race_logger.info(f"✅ CART_UPDATE_SUCCESS_ATOMIC [Thread:{thread_id}] Product:{product_locked.name} FinalQuantity:{new_quantity}")
-                
-            else:
-                # Criar novo item atomicamente
-                race_logger.info(f"➕ CART_NEW_ITEM_ATOMIC [Thread:{thread_id}] Product:{product_locked.name} Quantity:{quantity}")
-                
-                cart_item = CartItem(
-                    cart_id=cart.id,
-                    product_id=product_id,
-                    product_price_id=product_price_id,
-                    weight=weight_selected,
-                    unit_price=unit_price,
-                    quantity=quantity,
-                    added_at=datetime.utcnow()
-                )
-                db.session.add(cart_item)
-                
-            race_logger.info(f"🔒 CART_ATOMIC_TRANSACTION_SUCCESS [Thread:{thread_id}] - Cart operation completed successfully")
-            
-            # Commit das alterações
-            db.session.commit()
-                
-        except Exception as e:
-            race_logger.error(f"💥 CART_ATOMIC_TRANSACTION_FAILED [Thread:{thread_id}] Error:{str(e)}")
-            db.session.rollback()
+            cart_store.add(user_id, line, quantity, max_quantity=stock)
+        except CartLimitExceeded as e:
             return jsonify({
                 "success": False,
-                "message": f"Erro interno: {str(e)}"
-            }), 500
+                "message": f"Quantidade total excede estoque. Máximo: {stock}, atual no carrinho: {e.in_cart}"
+            }), 400
 
         return jsonify({
             "success": True,
@@ -414,37 +318,20 @@ def update_cart_item(product_id):
                 "message": "quantity deve ser maior que zero"
             }), 400
 
-        # Buscar carrinho do usuário
-        cart = Cart.query.filter_by(user_id = user_id).first()
-        if not cart:
-            return jsonify({
-                "success": False,
-                "message": "Carrinho não encontrado"
-            }), 404
-
-        # Buscar item do carrinho pelo product_id
-        cart_item = CartItem.query.filter_by(
-            cart_id = cart.id, product_id = product_id
-        ).first()
-
-        if not cart_item:
-            return jsonify({
-                "success": False,
-                "message": "Item não encontrado no carrinho"
-            }), 404
-
         # Verificar estoque disponível
         product = Product.query.get(product_id)
-        if product and quantity > product.stock_quantity:
+        if product and quantity > (product.stock_quantity or 0):
             return jsonify({
                 "success": False,
                 "message": f"Quantidade excede estoque disponível: {product.stock_quantity}"
             }), 400
 
         # Atualizar quantidade
-        cart_item.quantity = quantity
-        cart_item.updated_at = datetime.utcnow()
-        db.session.commit()
+        if not cart_store.set_quantity(user_id, product_id, quantity):
+            return jsonify({
+                "success": False,
+                "message": "Item não encontrado no carrinho"
+            }), 404
 
         return jsonify({
             "success": True,
@@ -477,20 +364,7 @@ def remove_from_cart(product_id):
                 "message": "Token JWT inválido"
             }), 401
 
-        # Buscar carrinho do usuário
-        cart = Cart.query.filter_by(user_id = user_id).first()
-        if not cart:
-            return jsonify({
-                "success": False,
-                "message": "Carrinho não encontrado"
-            }), 404
-
-        # Buscar item do carrinho pelo product_id
-        cart_item = CartItem.query.filter_by(
-            cart_id = cart.id, product_id = product_id
-        ).first()
-
-        if not cart_item:
+        if not cart_store.remove(user_id, product_id):
             return jsonify({
                 "success": False,
                 "message": "Produto não encontrado no carrinho"
@@ -500,9 +374,6 @@ def remove_from_cart(product_id):
         product = Product.query.get(product_id)
         product_name = product.name if product else "Produto desconhecido"
 
-        db.session.delete(cart_item)
-        db.session.commit()
-
         return jsonify({
             "success": True,
             "message": "Produto removido do carrinho com sucesso",
@@ -534,23 +405,14 @@ def clear_cart():
                 "message": "Token JWT inválido"
             }), 401
 
-        # Buscar carrinho do usuário
-        cart = Cart.query.filter_by(user_id = user_id).first()
-
-        if not cart:
+        items_count = cart_store.clear(user_id)
+        if not items_count:
             return jsonify({
                 "success": True,
                 "message": "Carrinho já está vazio",
                 "data": {"items_removed": 0}
             }), 200
 
-        # Contar itens antes de deletar
-        items_count = CartItem.query.filter_by(cart_id = cart.id).count()
-
-        # Deletar todos os itens
-        CartItem.query.filter_by(cart_id = cart.id).delete()
-        db.session.commit()
-
         return jsonify({
             "success": True,
             "message": "Carrinho limpo com sucesso",
@@ -575,17 +437,8 @@ def get_cart_count():
         if not user_id:
             return jsonify({"error": "user_id é obrigatório"}), 400
 
-        # Buscar carrinho do usuário
-        cart = Cart.query.filter_by(user_id = user_id).first()
-        if not cart:
-            return jsonify({"count": 0})
-
-        count = (
-            db.session.query(db.func.sum(CartItem.quantity))
-            .filter(CartItem.cart_id == cart.id)
-            .scalar()
-            or 0
-        )
+        # Badge do cabeçalho: lido do Redis, sem consultar o banco
+        count = cart_store.count(user_id)
 
         return jsonify({"count": int(count)})
 
@@ -684,6 +537,13 @@ def get_user_cart(user_id):
         if not user:
             return jsonify({"error": "Usuário não encontrado"}), 404
 
+        # Persistir alterações ainda pendentes no Redis antes de ler do banco
+        try:
+            cart_store.flush(user_id)
+        except CartFlushError as e:
+            # Consulta do admin: mostra o último estado gravado
+            current_app.logger.warning(str(e))
+
         # Buscar carrinho do usuário
         cart = Cart.query.filter_by(user_id = user_id).first()
         if not cart:
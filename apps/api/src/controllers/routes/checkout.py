@@ -12,12 +12,16 @@ from datetime import datetime, timedelta
 
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import insert
 
 from database import db
 from models.auth import User
 from models.customers import Customer
 from models.orders import Cart, CartItem, Order, OrderItem, OrderStatus
 from models.products import Product
+from services.cart_store import CartFlushError, cart_store
+from services.shipping_rates import shipping_rates
+from services.stock_reservation import InsufficientStockError, as_uuid, reserve_stock
 
 logger = logging.getLogger(__name__)
 
@@ -353,7 +357,7 @@ def get_address_by_cep(cep):
 
 
 def calculate_shipping_mock(origin_cep, destination_cep, products, subtotal=0):
-    """Calcula frete de forma simulada"""
+    """Calcula frete de forma simulada (tabela de fretes por faixa de CEP)"""
     try:
         # Converter subtotal para float se necessário
         try:
@@ -365,83 +369,11 @@ def calculate_shipping_mock(origin_cep, destination_cep, products, subtotal=0):
         total_weight = sum(
             p.get("weight", 0.5) * p.get("quantity", 1) for p in products
         )
-        total_weight = max(total_weight, 0.3)  # Peso mínimo
-
-        # Verificar se é Santa Maria pelo CEP (970xx-xxx ou 971xx-xxx)
-        clean_cep = destination_cep.replace("-", "").replace(" ", "")
-        is_santa_maria = clean_cep.startswith("970") or clean_cep.startswith("971")
-        
-        # FRETE GRÁTIS PARA SANTA MARIA (compras acima de R$ 200)
-        logger.info(f"DEBUG: CEP={clean_cep}, Santa Maria={is_santa_maria}, Subtotal={subtotal_value}")
-        if is_santa_maria and subtotal_value >= 200.00:
-            logger.info("🎉 FRETE GRÁTIS APLICADO!")
-            return [
-                {
-                    "id": str(uuid.uuid4()),
-                    "carrier_name": "Mestres do Café",
-                    "service_name": "Entrega Local Grátis",
-                    "service_code": "LOCAL_FREE",
-                    "price": 0.00,
-                    "delivery_time": 1,
-                    "description": "Frete grátis para Santa Maria - Entrega em 24h",
-                    "is_free": True,
-                }
-            ]
-
-        # Determinar região de destino para cálculo normal
-        dest_state = get_state_from_cep(destination_cep)
-        
-        # Preços base por estado
-        state_prices = {
-            "SP": 15.00,
-            "RJ": 18.00,
-            "MG": 20.00,
-            "PR": 22.00,
-            "SC": 25.00,
-            "RS": 28.00,
-            "ES": 20.00,
-            "BA": 25.00,
-            "PE": 30.00,
-            "CE": 32.00,
-            "DF": 25.00,
-        }
-
-        base_price = state_prices.get(dest_state, 30.00)
-        weight_multiplier = max(1.0, total_weight / 1.0)
-        
-        options = [
-            {
-                "id": str(uuid.uuid4()),
-                "carrier_name": "Correios",
-                "service_name": "PAC",
-                "service_code": "04510",
-                "price": round(base_price * 0.8 * weight_multiplier, 2),
-                "delivery_time": 7,
-                "description": "Entrega padrão dos Correios",
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "carrier_name": "Correios",
-                "service_name": "SEDEX",
-                "service_code": "04014",
-                "price": round(base_price * 1.5 * weight_multiplier, 2),
-                "delivery_time": 3,
-                "description": "Entrega expressa dos Correios",
-            },
-        ]
-        
-        # Adicionar opção local para Santa Maria (com desconto)
-        if is_santa_maria:
-            options.append({
-                "id": str(uuid.uuid4()),
-                "carrier_name": "Mestres do Café",
-                "service_name": "Entrega Local",
-                "service_code": "LOCAL",
-                "price": round(base_price * 0.5 * weight_multiplier, 2),
-                "delivery_time": 1,
-                "description": "Entrega local em Santa Maria - 24h",
-            })
 
+        # Frete grátis local (Santa Maria acima de R$ 200) e preços por UF vêm da tabela
+        options = shipping_rates.quote(destination_cep, total_weight, subtotal_value)
+        for option in options:
+            option["id"] = str(uuid.uuid4())
         return options
 
     except Exception as e:
@@ -451,45 +383,14 @@ def calculate_shipping_mock(origin_cep, destination_cep, products, subtotal=0):
 
 def get_state_from_cep(cep):
     """Determina o estado baseado no CEP"""
-    clean_cep = cep.replace("-", "").replace(" ", "")
-    if len(clean_cep) < 2:
-        return "SP"
-
-    prefix = clean_cep[:2]
-    states = {
-        "01": "SP",
-        "02": "SP",
-        "03": "SP",
-        "04": "SP",
-        "05": "SP",
-        "20": "RJ",
-        "21": "RJ",
-        "22": "RJ",
-        "23": "RJ",
-        "24": "RJ",
-        "30": "MG",
-        "31": "MG",
-        "32": "MG",
-        "33": "MG",
-        "34": "MG",
-        "70": "DF",
-        "71": "DF",
-        "72": "DF",
-        "73": "DF",
-    }
-
-    return states.get(prefix, "SP")
+    info = shipping_rates.lookup(cep)
+    return info.uf if info else "SP"
 
 
 def is_santa_maria_cep(cep):
     """Verifica se o CEP é de Santa Maria (RS)"""
-    clean_cep = cep.replace("-", "").replace(" ", "")
-    if len(clean_cep) < 5:
-        return False
-    
-    # CEPs de Santa Maria: 97000-000 a 97199-999
-    prefix = clean_cep[:5]
-    return prefix.startswith("970") or prefix.startswith("971")
+    info = shipping_rates.lookup(cep)
+    return info is not None and info.zone == "santa_maria"
 
 
 # ========== ROTAS PRINCIPAIS ========== #
@@ -511,6 +412,14 @@ def start_checkout():
         if not user:
             return jsonify({"error": "Usuário não encontrado"}), 404
 
+        # Gravar no banco alterações do carrinho ainda pendentes no Redis; sem
+        # isso o pedido seria montado com um carrinho desatualizado
+        try:
+            cart_store.flush(user_id)
+        except CartFlushError as e:
+            logger.error(f"Checkout sem carrinho atualizado para o usuário {user_id}: {e}")
+            return jsonify({"error": "Carrinho indisponível no momento, tente novamente"}), 503
+
         # Buscar carrinho do usuário
         user_cart = Cart.query.filter_by(user_id = user_id).first()
         if not user_cart:
@@ -802,37 +711,34 @@ def complete_checkout():
         db.session.add(order)
         db.session.flush()  # Para obter o ID do pedido
 
-        # Criar itens do pedido e atualizar estoque
+        # Reservar estoque de todos os itens (lock ordenado + baixa em um UPDATE)
+        try:
+            reserved = reserve_stock(
+                (item_data["product_id"], item_data["quantity"]) for item_data in cart_data
+            )
+        except (InsufficientStockError, ValueError) as e:
+            db.session.rollback()
+            return jsonify({"error": str(e)}), 400
+
+        # Criar itens do pedido em um único INSERT
+        order_items = []
         for item_data in cart_data:
-            product = Product.query.get(item_data["product_id"])
+            product = reserved.get(as_uuid(item_data["product_id"]))
             if not product:
                 continue
 
-            # Verificar estoque disponível
-            if product.stock_quantity < item_data["quantity"]:
-                db.session.rollback()
-                return (
-                    jsonify(
-                        {
-                            "error": f"Estoque insuficiente para {product.name}. Disponível: {product.stock_quantity}"
-                        }
-                    ),
-                    400,
-                )
-
-            # Atualizar estoque do produto
-            product.stock_quantity -= item_data["quantity"]
-
-            order_item_data = {
+            order_items.append({
                 "order_id": order.id,
                 "product_id": product.id,
                 "product_name": product.name,
+                "product_sku": product.sku,
                 "quantity": item_data["quantity"],
                 "unit_price": item_data["price"],
                 "total_price": item_data["subtotal"],
-            }
-            order_item = OrderItem(**order_item_data)
-            db.session.add(order_item)
+            })
+
+        if order_items:
+            db.session.execute(insert(OrderItem), order_items)
 
         # Limpar carrinho
         user_cart = Cart.query.filter_by(user_id = user_id).first()
@@ -841,6 +747,12 @@ def complete_checkout():
 
         db.session.commit()
 
+        # O carrinho no Redis também é esvaziado (senão o próximo flush o regravaria)
+        try:
+            cart_store.clear(user_id)
+        except Exception as e:
+            logger.warning(f"Erro ao limpar carrinho em cache do usuário {user_id}: {e}")
+
         return jsonify(
             {
                 "message": "Checkout finalizado com sucesso",
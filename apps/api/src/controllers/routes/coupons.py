@@ -1,10 +1,12 @@
 from datetime import datetime
+from decimal import Decimal
 
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from database import db
 from models.coupons import Coupon, CouponUsage
+from services.coupon_service import CouponError, coupon_service
 
 coupons_bp = Blueprint("coupons", __name__, url_prefix="/api/coupons")
 
@@ -87,6 +89,7 @@ def create_coupon():
 
         db.session.add(coupon)
         db.session.commit()
+        coupon_service.invalidate(coupon.code)
 
         return (
             jsonify(
@@ -125,6 +128,7 @@ def update_coupon(coupon_id):
             return jsonify({"error": "Cupom não encontrado"}), 404
 
         data = request.get_json()
+        previous_code = coupon.code
 
         # Atualizar campos
         for field in [
@@ -158,6 +162,7 @@ def update_coupon(coupon_id):
 
         coupon.updated_at = datetime.utcnow()
         db.session.commit()
+        coupon_service.invalidate(previous_code, coupon.code)
 
         return jsonify(
             {"message": "Cupom atualizado com sucesso", "coupon": coupon.to_dict()}
@@ -177,66 +182,20 @@ def validate_coupon(code):
         customer_id = data.get("customer_id")
         order_value = data.get("order_value", 0)
 
-        coupon = Coupon.query.filter_by(code = code).first()
-        if not coupon:
-            return jsonify({"error": "Cupom não encontrado"}), 404
-
-        # Verificar se cupom está ativo
-        if coupon.status != "active":
-            return jsonify({"error": "Cupom não está ativo"}), 400
-
-        # Verificar datas de validade
-        today = datetime.now().date()
-        if coupon.valid_from and today < coupon.valid_from:
-            return jsonify({"error": "Cupom ainda não é válido"}), 400
-
-        if coupon.valid_until and today > coupon.valid_until:
-            return jsonify({"error": "Cupom expirado"}), 400
-
-        # Verificar valor mínimo do pedido
-        if order_value < coupon.minimum_order:
-            return (
-                jsonify(
-                    {"error": f"Valor mínimo do pedido: R$ {coupon.minimum_order}"}
-                ),
-                400,
-            )
-
-        # Verificar limite de uso geral
-        if coupon.usage_limit:
-            usage_count = CouponUsage.query.filter_by(coupon_id = coupon.id).count()
-            if usage_count >= coupon.usage_limit:
-                return jsonify({"error": "Limite de uso do cupom atingido"}), 400
-
-        # Verificar limite de uso por cliente
-        if customer_id and coupon.customer_usage_limit:
-            customer_usage = CouponUsage.query.filter_by(
-                coupon_id = coupon.id, customer_id = customer_id
-            ).count()
-            if customer_usage >= coupon.customer_usage_limit:
-                return (
-                    jsonify({"error": "Limite de uso do cupom por cliente atingido"}),
-                    400,
-                )
-
-        # Calcular desconto
-        if coupon.coupon_type == "percentage":
-            discount_amount = order_value * (coupon.discount_value / 100)
-        else:  # fixed
-            discount_amount = coupon.discount_value
-
-        # Garantir que desconto não seja maior que o valor do pedido
-        discount_amount = min(discount_amount, order_value)
+        # Catálogo e contadores de uso em cache: nenhuma contagem no banco
+        coupon, discount_amount = coupon_service.validate(code, order_value, customer_id)
 
         return jsonify(
             {
                 "valid": True,
-                "coupon": coupon.to_dict(),
+                "coupon": coupon["data"],
                 "discount_amount": float(discount_amount),
-                "final_amount": float(order_value - discount_amount),
+                "final_amount": float(Decimal(str(order_value)) - discount_amount),
             }
         )
 
+    except CouponError as e:
+        return jsonify({"error": e.message}), e.status_code
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -248,36 +207,16 @@ def apply_coupon():
     try:
         data = request.get_json()
 
-        required_fields = ["code", "customer_id", "order_id", "order_value"]
+        required_fields = ["code", "customer_id", "order_id"]
         for field in required_fields:
             if field not in data:
                 return jsonify({"error": f"Campo obrigatório: {field}"}), 400
 
-        coupon = Coupon.query.filter_by(code = data["code"]).first()
-        if not coupon:
-            return jsonify({"error": "Cupom não encontrado"}), 404
-
-        # Validar cupom primeiro
-        validation_response = validate_coupon(data["code"])
-        if validation_response[1] != 200:
-            return validation_response
-
-        # Criar registro de uso
-        usage = CouponUsage(
-            coupon_id = coupon.id,
-            customer_id = data["customer_id"],
-            order_id = data["order_id"],
-            discount_amount = validation_response[0].json["discount_amount"],
+        # Valida e reserva o uso atomicamente (limites garantidos sob concorrência)
+        usage = coupon_service.redeem(
+            data["code"], data.get("order_value", 0), data["customer_id"], data["order_id"]
         )
 
-        db.session.add(usage)
-
-        # Atualizar contador de uso
-        coupon.usage_count += 1
-        coupon.updated_at = datetime.utcnow()
-
-        db.session.commit()
-
         return (
             jsonify(
                 {
@@ -289,6 +228,8 @@ def apply_coupon():
             201,
         )
 
+    except CouponError as e:
+        return jsonify({"error": e.message}), e.status_code
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
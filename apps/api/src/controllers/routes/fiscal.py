@@ -24,6 +24,7 @@ from flask import Blueprint, request, jsonify, send_file, Response
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from database import db
+from utils.pagination import InvalidCursor, get_cursor_params, paginate_keyset
 
 logger = logging.getLogger(__name__)
 
@@ -437,8 +438,11 @@ def emitir_nfe():
         ],
         "pagamentos": [
             {"forma": "01", "valor": 99.80}
-        ]
+        ],
+        "assincrono": false
     }
+
+    Com "assincrono": true a NF-e é enfileirada e enviada em lote (202)
     """
     from services.fiscal_service import get_fiscal_service, DadosEmissao
 
@@ -479,8 +483,15 @@ def emitir_nfe():
     dados.informacoes_complementares = data.get('informacoes_complementares')
     dados.order_id = data.get('order_id')
 
-    # Emite
     fiscal_service = get_fiscal_service()
+
+    # Envio em lote: nota fica na fila e é autorizada em background
+    if data.get('assincrono'):
+        resultado = fiscal_service.enfileirar_nfe(dados)
+        status_code = 202 if resultado.sucesso else 400
+        return jsonify(resultado.to_dict()), status_code
+
+    # Emite
     resultado = fiscal_service.emitir_nfe(dados)
 
     status_code = 201 if resultado.sucesso else 400
@@ -488,6 +499,20 @@ def emitir_nfe():
     return jsonify(resultado.to_dict()), status_code
 
 
+@fiscal_bp.route('/nfe/lote/<lote_id>', methods=['GET'])
+@fiscal_admin_required
+@handle_fiscal_error
+def obter_lote_nfe(lote_id):
+    """Situação de um lote de NF-e enviado de forma assíncrona"""
+    from services.nfe_lote_service import nfe_lote_service
+
+    lote = nfe_lote_service.get_lote(lote_id)
+    if not lote:
+        return jsonify({'sucesso': False, 'erro': 'Lote não encontrado'}), 404
+
+    return jsonify({'sucesso': True, 'lote': lote.to_dict()})
+
+
 @fiscal_bp.route('/nfce/emitir', methods=['POST'])
 @fiscal_admin_required
 @handle_fiscal_error
@@ -699,6 +724,19 @@ def status_sefaz():
     })
 
 
+@fiscal_bp.route('/sefaz/metricas', methods=['GET'])
+@fiscal_admin_required
+@handle_fiscal_error
+def metricas_sefaz():
+    """Latência por webservice e uso dos pools de conexão com a SEFAZ"""
+    from services.sefaz_service import SefazServiceFactory
+
+    return jsonify({
+        'sucesso': True,
+        'servicos': SefazServiceFactory.metricas()
+    })
+
+
 # =============================================================================
 # ROTAS DE INUTILIZAÇÃO
 # =============================================================================
@@ -736,13 +774,25 @@ def inutilizar_numeracao():
             'erro': 'Justificativa deve ter pelo menos 15 caracteres'
         }), 400
 
+    # Faixa já registrada pela conciliação da numeração (números reservados sem nota)
+    inut = InutilizacaoNumeracao.query.filter_by(
+        empresa_id=empresa.id,
+        modelo=data['modelo'],
+        serie=data['serie'],
+        ambiente=empresa.ambiente_atual,
+        numero_inicial=data['numero_inicial'],
+        numero_final=data['numero_final'],
+        status='pendente'
+    ).first()
+    ano = inut.ano if inut else datetime.now().year
+
     # Gera XML
     builder = NFeInutilizacaoBuilder()
     xml_inut = builder.build_inutilizacao(
         empresa=empresa,
         modelo=data['modelo'],
         serie=data['serie'],
-        ano=datetime.now().year,
+        ano=ano,
         numero_inicial=data['numero_inicial'],
         numero_final=data['numero_final'],
         justificativa=justificativa,
@@ -764,31 +814,33 @@ def inutilizar_numeracao():
     # Envia para SEFAZ
     sefaz = SefazServiceFactory.criar_servico(
         uf=empresa.uf,
-        ambiente=empresa.ambiente_atual
+        ambiente=empresa.ambiente_atual,
+        empresa_id=str(empresa.id)
     )
 
     resultado = sefaz.inutilizar_numeracao(resultado_assinatura.xml_assinado)
 
     # Registra
-    inut = InutilizacaoNumeracao(
-        empresa_id=empresa.id,
-        modelo=data['modelo'],
-        serie=data['serie'],
-        ambiente=empresa.ambiente_atual,
-        ano=datetime.now().year,
-        numero_inicial=data['numero_inicial'],
-        numero_final=data['numero_final'],
-        justificativa=justificativa,
-        protocolo=resultado.protocolo,
-        codigo_status=resultado.codigo_status,
-        motivo=resultado.motivo,
-        xml_envio=resultado_assinatura.xml_assinado,
-        xml_retorno=resultado.xml_retorno,
-        status='autorizado' if resultado.sucesso else 'rejeitado',
-        criado_por=get_jwt_identity()
-    )
-
-    db.session.add(inut)
+    if inut is None:
+        inut = InutilizacaoNumeracao(
+            empresa_id=empresa.id,
+            modelo=data['modelo'],
+            serie=data['serie'],
+            ambiente=empresa.ambiente_atual,
+            ano=ano,
+            numero_inicial=data['numero_inicial'],
+            numero_final=data['numero_final'],
+            criado_por=get_jwt_identity()
+        )
+        db.session.add(inut)
+
+    inut.justificativa = justificativa
+    inut.protocolo = resultado.protocolo
+    inut.codigo_status = resultado.codigo_status
+    inut.motivo = resultado.motivo
+    inut.xml_envio = resultado_assinatura.xml_assinado
+    inut.xml_retorno = resultado.xml_retorno
+    inut.status = 'autorizado' if resultado.sucesso else 'rejeitado'
     db.session.commit()
 
     status_code = 200 if resultado.sucesso else 400
@@ -800,6 +852,27 @@ def inutilizar_numeracao():
     }), status_code
 
 
+@fiscal_bp.route('/numeracao/pendentes/<empresa_id>', methods=['GET'])
+@fiscal_admin_required
+@handle_fiscal_error
+def listar_inutilizacoes_pendentes(empresa_id):
+    """Faixas reservadas e não utilizadas, aguardando inutilização na SEFAZ"""
+    from models.fiscal import InutilizacaoNumeracao
+
+    pendentes = InutilizacaoNumeracao.query.filter_by(
+        empresa_id=empresa_id, status='pendente'
+    ).order_by(
+        InutilizacaoNumeracao.modelo,
+        InutilizacaoNumeracao.serie,
+        InutilizacaoNumeracao.numero_inicial
+    ).all()
+
+    return jsonify({
+        'sucesso': True,
+        'pendentes': [inut.to_dict() for inut in pendentes]
+    })
+
+
 # =============================================================================
 # ROTAS DE SÉRIES FISCAIS
 # =============================================================================
@@ -907,6 +980,44 @@ def listar_cfop():
     })
 
 
+# =============================================================================
+# ROTAS DE IMPOSTOS DO PEDIDO
+# =============================================================================
+
+@fiscal_bp.route('/pedido/<order_id>/impostos', methods=['POST'])
+@fiscal_admin_required
+@handle_fiscal_error
+def calcular_impostos_pedido(order_id):
+    """
+    Calcula (ou recalcula) ICMS, PIS, COFINS e IPI dos itens de um pedido
+
+    Body (opcional):
+    {
+        "uf_origem": "SP",
+        "uf_destino": "RJ"
+    }
+    """
+    from models.orders import Order
+    from services.tax_service import TaxCalculationService
+
+    try:
+        order = db.session.get(Order, uuid.UUID(order_id))
+    except ValueError:
+        order = None
+    if not order:
+        return jsonify({'sucesso': False, 'erro': 'Pedido não encontrado'}), 404
+
+    data = request.get_json(silent=True) or {}
+    resultado = TaxCalculationService(db.session).calculate_order_taxes(
+        order,
+        origin_state=data.get('uf_origem', 'SP'),
+        destination_state=data.get('uf_destino')
+    )
+
+    status_code = 200 if resultado['success'] else 400
+    return jsonify(resultado), status_code
+
+
 # =============================================================================
 # ROTAS DE RELATÓRIOS
 # =============================================================================
@@ -992,6 +1103,23 @@ def relatorio_auditoria():
     if data_fim:
         query = query.filter(AuditoriaFiscal.data_hora <= data_fim)
 
+    # Modo cursor (?after=/?before=/?pagination=cursor): navega além dos 200 mais recentes
+    cursor_params = get_cursor_params()
+    if cursor_params:
+        try:
+            resultado = paginate_keyset(
+                query, AuditoriaFiscal.data_hora, AuditoriaFiscal.id,
+                per_page=request.args.get('per_page', 50, type=int), max_per_page=200,
+                **cursor_params
+            )
+        except InvalidCursor as e:
+            return jsonify({'sucesso': False, 'erro': str(e), 'codigo': 'CURSOR_INVALIDO'}), 400
+        return jsonify({
+            'sucesso': True,
+            'registros': [a.to_dict() for a in resultado.items],
+            'paginacao': resultado.pagination_dict()
+        })
+
     auditorias = query.order_by(AuditoriaFiscal.data_hora.desc()).limit(200).all()
 
     return jsonify({
@@ -292,22 +292,24 @@ def get_agencies():
 def webhook():
     """
     Webhook para receber notificações do Melhor Envio
+    A notificação é gravada na fila durável e processada em background
     """
     try:
+        from services.webhook_processor import webhook_processor, WebhookProvider
+
         webhook_data = request.get_json()
 
         if not webhook_data:
             return jsonify({"error": "No data received"}), 400
 
-        me_service = MelhorEnvioService()
-        result = me_service.process_webhook(webhook_data)
+        webhook_id, created = webhook_processor.enqueue(
+            WebhookProvider.MELHOR_ENVIO,
+            webhook_data.get('event', 'unknown'),
+            webhook_data
+        )
 
-        if result['success']:
-            logger.info(f"Webhook processed successfully: {webhook_data}")
-            return jsonify({"status": "ok"}), 200
-        else:
-            logger.error(f"Error processing webhook: {result['error']}")
-            return jsonify({"error": result['error']}), 400
+        logger.info(f"Webhook queued: {webhook_id} (duplicate={not created})")
+        return jsonify({"status": "ok", "webhook_id": str(webhook_id), "duplicate": not created}), 200
 
     except Exception as e:
         logger.error(f"Error in webhook: {str(e)}")
@@ -155,11 +155,9 @@ def create_preference():
 
             db.session.add(payment)
             order.payment_status = 'pending'
-            db.session.commit()
-
-            logger.info(f"Preference created for order {order.id}: {result['preference_id']}")
+            db.session.flush()
 
-            # Disparar evento de criação de pagamento
+            # Disparar evento de criação de pagamento (na mesma transação)
             event_system.emit_event(
                 EventType.PAYMENT_CREATED,
                 user_id = user.id,
@@ -171,6 +169,9 @@ def create_preference():
                     'preference_id': result['preference_id']
                 }
             )
+            db.session.commit()
+
+            logger.info(f"Preference created for order {order.id}: {result['preference_id']}")
 
             return jsonify({
                 "success": True,
@@ -278,11 +279,9 @@ def process_payment():
 
             db.session.add(payment)
             order.payment_status = payment.status
-            db.session.commit()
+            db.session.flush()
 
-            logger.info(f"Payment processed for order {order.id}: {result['payment_id']}")
-
-            # Disparar evento baseado no status do pagamento
+            # Disparar evento baseado no status do pagamento (na mesma transação)
             if result['status'] == 'approved':
                 event_system.emit_event(
                     EventType.PAYMENT_APPROVED,
@@ -306,6 +305,9 @@ def process_payment():
                         'rejection_reason': result.get('status_detail', 'Payment rejected')
                     }
                 )
+            db.session.commit()
+
+            logger.info(f"Payment processed for order {order.id}: {result['payment_id']}")
 
             return jsonify({
                 "success": True,
@@ -345,13 +347,13 @@ def webhook_test():
 def webhook():
     """
     Webhook robusto para receber notificações do Mercado Pago
+    A notificação é gravada na fila durável e processada em background
     """
     try:
         from services.webhook_processor import (
             webhook_processor,
             WebhookProvider,
-            validate_webhook_request,
-            process_webhook_robust
+            validate_webhook_request
         )
 
         # Obter dados da requisição
@@ -382,20 +384,16 @@ def webhook():
         elif 'action' in notification_data:
             event_type = notification_data.get('action')
 
-        # Processar com o sistema robusto
-        result = process_webhook_robust(
+        # Enfileira (idempotente pelo id da notificação ou da entrega) e confirma o recebimento
+        webhook_id, created = webhook_processor.enqueue(
             WebhookProvider.MERCADO_PAGO,
             event_type,
             notification_data,
-            signature
+            delivery_id=request.headers.get('X-Request-Id')
         )
 
-        if result['success']:
-            logger.info(f"Robust webhook processed: {result['webhook_id']}")
-            return jsonify({"status": "ok", "webhook_id": result['webhook_id']}), 200
-        else:
-            logger.error(f"Error processing robust webhook: {result['error']}")
-            return jsonify({"error": result['error']}), 400
+        logger.info(f"Webhook queued: {webhook_id} (duplicate={not created})")
+        return jsonify({"status": "ok", "webhook_id": str(webhook_id), "duplicate": not created}), 200
 
     except Exception as e:
         logger.error(f"Error in robust webhook endpoint: {str(e)}")
@@ -10,6 +10,7 @@ from sqlalchemy.exc import SQLAlchemyError
 
 from database import db
 from models import NewsletterSubscriber, NewsletterTemplate, NewsletterCampaign, User
+from services.newsletter_delivery import newsletter_delivery
 from utils.validators import validate_required_fields
 import secrets
 import re
@@ -254,15 +255,20 @@ def send_campaign(campaign_id):
             return jsonify({'success': False, 'error': 'Campanha já foi enviada'}), 400
 
         # Contar destinatários
-        subscribers = NewsletterSubscriber.query.filter_by(status='active').all()
-        campaign.total_recipients = len(subscribers)
+        campaign.total_recipients = NewsletterSubscriber.query.filter_by(status='active').count()
         campaign.status = 'sending'
         campaign.sent_at = datetime.utcnow()
+        campaign.total_sent = 0
+        campaign.total_failed = 0
+        campaign.delivery_cursor = None
+        campaign.delivery_heartbeat_at = None
+        # URL base dos links de descadastro (o envio roda fora da requisição)
+        campaign.extra_data = dict(campaign.extra_data or {}, delivery_base_url=request.host_url)
 
         db.session.commit()
 
         # Enviar campanha em background
-        _send_campaign_async(campaign.id)
+        newsletter_delivery.enqueue(campaign.id)
 
         return jsonify({
             'success': True,
@@ -291,7 +297,9 @@ def get_campaign_stats(campaign_id):
             'success': True,
             'stats': {
                 'total_recipients': campaign.total_recipients,
+                'status': campaign.status,
                 'total_sent': campaign.total_sent,
+                'total_failed': campaign.total_failed,
                 'total_delivered': campaign.total_delivered,
                 'total_opened': campaign.total_opened,
                 'total_clicked': campaign.total_clicked,
@@ -398,105 +406,6 @@ def _send_verification_email(email: str, token: str):
         return False
 
 
-def _send_campaign_async(campaign_id: str):
-    """
-    Enviar campanha de newsletter em background
-
-    Em produção, usar Celery/RQ para processar de forma assíncrona.
-    Por enquanto, processa de forma síncrona com controle de rate.
-    """
-    try:
-        import threading
-        from time import sleep
-
-        def send_campaign_worker():
-            """Worker para enviar campanha"""
-            try:
-                from services.notification_service import NotificationService
-                from flask import current_app
-
-                # Precisamos de app context para queries do banco
-                with current_app.app_context():
-                    campaign = NewsletterCampaign.query.get(campaign_id)
-                    if not campaign:
-                        logger.error(f"Campanha {campaign_id} não encontrada")
-                        return
-
-                    # Buscar assinantes ativos
-                    subscribers = NewsletterSubscriber.query.filter_by(status='active').all()
-
-                    if not subscribers:
-                        campaign.status = 'sent'
-                        campaign.total_sent = 0
-                        db.session.commit()
-                        return
-
-                    notification_service = NotificationService()
-
-                    sent_count = 0
-                    failed_count = 0
-
-                    # Enviar para cada assinante (com rate limiting)
-                    for subscriber in subscribers:
-                        try:
-                            # Renderizar template com dados do assinante
-                            html_body = campaign.html_content
-                            plain_body = campaign.plain_content or "Versão sem HTML não disponível"
-
-                            # Personalizar com nome do assinante se disponível
-                            if subscriber.first_name:
-                                html_body = html_body.replace('{{name}}', subscriber.first_name)
-                                plain_body = plain_body.replace('{{name}}', subscriber.first_name)
-                            else:
-                                html_body = html_body.replace('{{name}}', 'Cliente')
-                                plain_body = plain_body.replace('{{name}}', 'Cliente')
-
-                            # Adicionar link de unsubscribe
-                            unsubscribe_link = f"{request.host_url}api/newsletter/unsubscribe?email={subscriber.email}"
-                            html_body = html_body.replace('{{unsubscribe_link}}', unsubscribe_link)
-                            plain_body += f"\n\nPara cancelar sua inscrição: {unsubscribe_link}"
-
-                            # Enviar email
-                            success = notification_service.email_provider.send_email(
-                                to_email=subscriber.email,
-                                subject=campaign.subject,
-                                html_body=html_body,
-                                plain_body=plain_body
-                            )
-
-                            if success:
-                                sent_count += 1
-                            else:
-                                failed_count += 1
-
-                            # Rate limiting: 10 emails/segundo
-                            sleep(0.1)
-
-                        except Exception as e:
-                            logger.error(f"Erro ao enviar para {subscriber.email}: {str(e)}")
-                            failed_count += 1
-
-                    # Atualizar campanha
-                    campaign.status = 'sent'
-                    campaign.total_sent = sent_count
-                    campaign.total_failed = failed_count
-                    db.session.commit()
-
-                    logger.info(f"Campanha {campaign_id} enviada: {sent_count} sucesso, {failed_count} falhas")
-
-            except Exception as e:
-                logger.error(f"Erro no worker de campanha {campaign_id}: {str(e)}")
-
-        # Iniciar worker em thread separada
-        thread = threading.Thread(target=send_campaign_worker, daemon=True)
-        thread.start()
-
-        logger.info(f"Worker de campanha {campaign_id} iniciado")
-
-    except Exception as e:
-        logger.error(f"Erro ao iniciar envio de campanha {campaign_id}: {str(e)}")
-
-
 # Importar logger
 import logging
 logger = logging.getLogger(__name__)
@@ -15,6 +15,8 @@ from models.notifications import (
     NotificationSubscription,
     NotificationTemplate,
 )
+from services.notification_dispatcher import notification_dispatcher
+from utils.pagination import InvalidCursor, get_cursor_params, paginate_keyset
 from services.notification_service import (
     NotificationChannel,
     NotificationType,
@@ -51,6 +53,28 @@ def get_user_notifications():
             except KeyError:
                 return jsonify({"error": "Tipo de notificação inválido"}), 400
 
+        unread_count = (
+            Notification.query.filter_by(user_id = user_id)
+            .filter(Notification.read_at.is_(None))
+            .count()
+        )
+
+        # Modo cursor (?after=/?before=/?pagination=cursor): sem COUNT nem OFFSET
+        cursor_params = get_cursor_params()
+        if cursor_params:
+            result = paginate_keyset(
+                query, Notification.created_at, Notification.id, per_page = per_page, **cursor_params
+            )
+            return jsonify(
+                {
+                    "notifications": [
+                        notification.to_dict() for notification in result.items
+                    ],
+                    "pagination": result.pagination_dict(),
+                    "unread_count": unread_count,
+                }
+            )
+
         # Ordenação e paginação
         query = query.order_by(Notification.created_at.desc())
         paginated = query.paginate(page = page, per_page = per_page, error_out = False)
@@ -68,12 +92,12 @@ def get_user_notifications():
                     "has_next": paginated.has_next,
                     "has_prev": paginated.has_prev,
                 },
-                "unread_count": Notification.query.filter_by(user_id = user_id)
-                .filter(Notification.read_at.is_(None))
-                .count(),
+                "unread_count": unread_count,
             }
         )
 
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Erro ao buscar notificações: {str(e)}"}), 500
 
@@ -203,24 +227,23 @@ def update_notification_preferences():
         except KeyError as e:
             return jsonify({"error": f"Tipo ou canal inválido: {str(e)}"}), 400
 
-        # Buscar ou criar preferência
+        # Buscar ou criar preferência (uma linha por tipo, um flag por canal)
         preference = NotificationSubscription.query.filter_by(
-            user_id = user_id, notification_type = notification_type, channel = channel
+            user_id = user_id, notification_type = notification_type.value
         ).first()
 
         if not preference:
             preference = NotificationSubscription(
                 user_id = user_id,
-                notification_type = notification_type,
-                channel = channel,
-                enabled = data["enabled"],
+                notification_type = notification_type.value,
             )
             db.session.add(preference)
         else:
-            preference.enabled = data["enabled"]
             preference.updated_at = datetime.utcnow()
+        setattr(preference, f"{channel.value}_enabled", bool(data["enabled"]))
 
         db.session.commit()
+        get_notification_service().invalidate_recipient(user_id)
 
         return jsonify(
             {
@@ -296,42 +319,44 @@ def broadcast_notification():
             "image_url": data.get("image_url"),
         }
 
-        # Enviar para todos os usuários ativos
-        # TODO: Implementar query para usuários ativos
-        from models.auth import User
+        # Enfileirar envio em background; o progresso é consultado pelo job
+        job = notification_dispatcher.enqueue_broadcast(
+            notification_type = notification_type,
+            data = notification_data,
+            channels = data.get("channels", [NotificationChannel.IN_APP.value]),
+            created_by = get_jwt_identity(),
+        )
 
-        users = User.query.filter_by(is_active = True).all()
+        return (
+            jsonify(
+                {
+                    "message": "Broadcast enfileirado",
+                    "job_id": str(job.id),
+                    "status": job.status,
+                    "progress_url": f"/api/notifications/broadcast/{job.id}",
+                }
+            ),
+            202,
+        )
 
-        sent_count = 0
-        failed_count = 0
+    except Exception as e:
+        return jsonify({"error": f"Erro no broadcast: {str(e)}"}), 500
 
-        for user in users:
-            try:
-                success = get_notification_service().send_notification(
-                    user_id = user.id,
-                    notification_type = notification_type,
-                    data = notification_data,
-                    channels = data.get("channels", [NotificationChannel.IN_APP.value]),
-                )
-                if success:
-                    sent_count += 1
-                else:
-                    failed_count += 1
-            except Exception as e:
-                failed_count += 1
-                print(f"Erro ao enviar para usuário {user.id}: {str(e)}")
 
-        return jsonify(
-            {
-                "message": f"Broadcast concluído: {sent_count} enviadas, {failed_count} falharam",
-                "sent_count": sent_count,
-                "failed_count": failed_count,
-                "total_users": len(users),
-            }
-        )
+@notifications_bp.route("/broadcast/<job_id>", methods=["GET"])
+@require_admin
+@jwt_required()
+def get_broadcast_progress(job_id):
+    """Consultar progresso de um broadcast"""
+    try:
+        job = notification_dispatcher.get_job(job_id)
+        if not job:
+            return jsonify({"error": "Job não encontrado"}), 404
+
+        return jsonify({"job": job.to_dict()})
 
     except Exception as e:
-        return jsonify({"error": f"Erro no broadcast: {str(e)}"}), 500
+        return jsonify({"error": f"Erro ao consultar broadcast: {str(e)}"}), 500
 
 
 # Endpoints administrativos
@@ -367,17 +392,17 @@ def create_notification_template():
             return jsonify({"error": f"Tipo ou canal inválido: {str(e)}"}), 400
 
         template = NotificationTemplate(
-            name = data["name"],
-            notification_type = notification_type,
-            channel = channel,
+            type = notification_type.value,
+            channel = channel.value,
             template_content = data["template_content"],
-            subject_template = data.get("subject_template"),
+            subject = data.get("subject"),
             variables = data.get("variables", []),
-            is_active = data.get("is_active", True),
+            active = data.get("active", True),
         )
 
         db.session.add(template)
         db.session.commit()
+        get_notification_service().invalidate_template(template.type, template.channel)
 
         return (
             jsonify(
@@ -393,6 +418,48 @@ def create_notification_template():
         return jsonify({"error": f"Erro ao criar template: {str(e)}"}), 500
 
 
+@notifications_bp.route("/admin/templates/<template_id>", methods=["PUT"])
+@require_admin
+@jwt_required()
+def update_notification_template(template_id):
+    """Atualizar template de notificação"""
+    try:
+        data = request.get_json()
+
+        template = NotificationTemplate.query.filter_by(id = template_id).first()
+        if not template:
+            return jsonify({"error": "Template não encontrado"}), 404
+
+        previous = (template.type, template.channel)
+
+        if "channel" in data:
+            try:
+                template.channel = NotificationChannel[data["channel"].upper()].value
+            except KeyError as e:
+                return jsonify({"error": f"Canal inválido: {str(e)}"}), 400
+
+        for field in ("subject", "template_content", "variables", "active"):
+            if field in data:
+                setattr(template, field, data[field])
+
+        db.session.commit()
+
+        # Versão antiga e nova saem do cache de templates compilados
+        service = get_notification_service()
+        service.invalidate_template(*previous)
+        service.invalidate_template(template.type, template.channel)
+
+        return jsonify(
+            {
+                "message": "Template atualizado com sucesso",
+                "template": template.to_dict(),
+            }
+        )
+
+    except Exception as e:
+        return jsonify({"error": f"Erro ao atualizar template: {str(e)}"}), 500
+
+
 @notifications_bp.route("/admin/logs", methods=["GET"])
 @require_admin
 @jwt_required()
@@ -450,9 +517,27 @@ def get_notification_logs():
             except ValueError:
                 return jsonify({"error": "Formato de data inválido para date_to"}), 400
 
-        # Ordenação e paginação
-        query = query.order_by(NotificationLog.sent_at.desc())
-        paginated = query.paginate(page = page, per_page = per_page, error_out = False)
+        # Modo cursor (?after=/?before=/?pagination=cursor): sem COUNT nem OFFSET
+        cursor_params = get_cursor_params()
+        if cursor_params:
+            result = paginate_keyset(
+                query, NotificationLog.sent_at, NotificationLog.id, per_page = per_page, **cursor_params
+            )
+            logs = result.items
+            pagination = result.pagination_dict()
+        else:
+            # Ordenação e paginação
+            query = query.order_by(NotificationLog.sent_at.desc())
+            paginated = query.paginate(page = page, per_page = per_page, error_out = False)
+            logs = paginated.items
+            pagination = {
+                "page": page,
+                "per_page": per_page,
+                "total": paginated.total,
+                "pages": paginated.pages,
+                "has_next": paginated.has_next,
+                "has_prev": paginated.has_prev,
+            }
 
         # Estatísticas rápidas
         total_sent = NotificationLog.query.filter_by(status="sent").count()
@@ -460,15 +545,8 @@ def get_notification_logs():
 
         return jsonify(
             {
-                "logs": [log.to_dict() for log in paginated.items],
-                "pagination": {
-                    "page": page,
-                    "per_page": per_page,
-                    "total": paginated.total,
-                    "pages": paginated.pages,
-                    "has_next": paginated.has_next,
-                    "has_prev": paginated.has_prev,
-                },
+                "logs": [log.to_dict() for log in logs],
+                "pagination": pagination,
                 "stats": {
                     "total_sent": total_sent,
                     "total_failed": total_failed,
@@ -481,6 +559,8 @@ def get_notification_logs():
             }
         )
 
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Erro ao buscar logs: {str(e)}"}), 500
 
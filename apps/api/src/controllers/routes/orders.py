@@ -7,6 +7,7 @@ from database import db
 from models.auth import User
 from models.orders import Order, OrderItem
 from models.products import Product
+from utils.pagination import InvalidCursor, get_cursor_params, paginate_keyset
 
 orders_bp = Blueprint("orders", __name__)
 
@@ -25,25 +26,38 @@ def get_orders():
         if user_id:
             query = query.filter_by(user_id = user_id)
 
+        def serialize(order):
+            return {
+                "id": order.id,
+                "user_id": order.user_id,
+                "user_name": order.user.name if order.user else None,
+                "total_amount": float(order.total_amount),
+                "status": order.status,
+                "payment_status": order.payment_status,
+                "created_at": order.created_at.isoformat(),
+                "items_count": len(order.items),  # Sem N+1!
+            }
+
+        # Modo cursor (?after=/?before=/?pagination=cursor): sem COUNT nem OFFSET
+        cursor_params = get_cursor_params()
+        if cursor_params:
+            result = paginate_keyset(
+                query, Order.created_at, Order.id, per_page = per_page, **cursor_params
+            )
+            return jsonify(
+                {
+                    "orders": [serialize(order) for order in result.items],
+                    "pagination": result.pagination_dict(),
+                }
+            )
+
         orders = query.order_by(Order.created_at.desc()).paginate(
             page = page, per_page = per_page, error_out = False
         )
 
         return jsonify(
             {
-                "orders": [
-                    {
-                        "id": order.id,
-                        "user_id": order.user_id,
-                        "user_name": order.user.name if order.user else None,
-                        "total_amount": float(order.total_amount),
-                        "status": order.status,
-                        "payment_status": order.payment_status,
-                        "created_at": order.created_at.isoformat(),
-                        "items_count": len(order.items),  # Sem N+1!
-                    }
-                    for order in orders.items
-                ],
+                "orders": [serialize(order) for order in orders.items],
                 "pagination": {
                     "page": orders.page,
                     "pages": orders.pages,
@@ -52,6 +66,8 @@ def get_orders():
             }
         )
 
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
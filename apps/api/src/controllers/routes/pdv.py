@@ -2,20 +2,16 @@
 Rotas para o sistema de PDV (Ponto de Venda)
 """
 
-from datetime import datetime, timedelta
+from datetime import datetime
 from decimal import Decimal
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from sqlalchemy import desc, func, and_
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import desc, func
 
 from database import db
-from models import (
-    CashRegister, CashSession, CashMovement, Sale, SaleItem,
-    Product, User, Customer
-)
+from models import CashRegister, CashSession, CashMovement, Sale
+from services import pdv_sales
 from utils.validators import validate_required_fields
-import secrets
 
 pdv_bp = Blueprint('pdv', __name__)
 
@@ -229,41 +225,18 @@ def create_movement():
         user_id = get_jwt_identity()
         data = request.get_json()
 
-        validation = validate_required_fields(data, ['session_id', 'type', 'amount'])
-        if not validation['valid']:
-            return jsonify({'success': False, 'error': validation['message']}), 400
-
-        # Verificar se a sessão existe e está aberta
-        session = CashSession.query.get(data['session_id'])
-        if not session or session.status != 'open':
-            return jsonify({'success': False, 'error': 'Sessão de caixa inválida ou fechada'}), 400
-
-        amount = Decimal(str(data['amount']))
-
-        # Criar movimentação
-        movement = CashMovement(
-            session_id=data['session_id'],
-            type=data['type'],
-            amount=amount,
-            description=data.get('description'),
-            created_by=user_id
-        )
-        db.session.add(movement)
-
-        # Atualizar saldo esperado da sessão
-        if data['type'] == 'withdrawal':  # Sangria
-            session.expected_balance -= amount
-        elif data['type'] == 'deposit':  # Suprimento
-            session.expected_balance += amount
-
-        db.session.commit()
+        movement = pdv_sales.record_movement(data, user_id)
+        session = db.session.get(CashSession, movement.session_id)
 
         return jsonify({
             'success': True,
             'message': 'Movimentação registrada com sucesso',
             'movement': movement.to_dict(),
-            'new_balance': float(session.expected_balance)
+            'new_balance': float(session.expected_balance or 0)
         }), 201
+    except pdv_sales.SaleValidationError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': e.message}), e.status_code
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -293,86 +266,39 @@ def create_sale():
         user_id = get_jwt_identity()
         data = request.get_json()
 
-        validation = validate_required_fields(data, ['session_id', 'items', 'payment_method'])
-        if not validation['valid']:
-            return jsonify({'success': False, 'error': validation['message']}), 400
-
-        # Verificar sessão
-        session = CashSession.query.get(data['session_id'])
-        if not session or session.status != 'open':
-            return jsonify({'success': False, 'error': 'Sessão de caixa inválida ou fechada'}), 400
-
-        # Calcular totais
-        subtotal = Decimal('0')
-        items_data = data['items']
-
-        # Validar itens e calcular subtotal
-        for item in items_data:
-            product = Product.query.get(item['product_id'])
-            if not product:
-                return jsonify({
-                    'success': False,
-                    'error': f'Produto {item["product_id"]} não encontrado'
-                }), 404
-
-            quantity = Decimal(str(item['quantity']))
-            unit_price = Decimal(str(item.get('unit_price', product.price)))
-            subtotal += quantity * unit_price
-
-        discount = Decimal(str(data.get('discount', 0)))
-        total = subtotal - discount
-
-        # Criar venda
-        sale = Sale(
-            cash_register_id=session.cash_register_id,
-            session_id=session.id,
-            customer_id=data.get('customer_id'),
-            subtotal=subtotal,
-            discount=discount,
-            total=total,
-            payment_method=data['payment_method'],
-            payment_received=Decimal(str(data.get('payment_received', total))),
-            change_amount=Decimal(str(data.get('change_amount', 0))),
-            notes=data.get('notes'),
-            sold_by=user_id
-        )
-        db.session.add(sale)
-        db.session.flush()  # Para obter o ID da venda
-
-        # Criar itens da venda
-        for item in items_data:
-            product = Product.query.get(item['product_id'])
-            quantity = Decimal(str(item['quantity']))
-            unit_price = Decimal(str(item.get('unit_price', product.price)))
-
-            sale_item = SaleItem(
-                sale_id=sale.id,
-                product_id=product.id,
-                product_name=product.name,
-                quantity=quantity,
-                unit_price=unit_price,
-                subtotal=quantity * unit_price,
-                discount=Decimal(str(item.get('discount', 0)))
-            )
-            sale_item.total = sale_item.subtotal - sale_item.discount
-            db.session.add(sale_item)
-
-            # Atualizar estoque
-            if product.stock_quantity is not None:
-                product.stock_quantity -= quantity
-
-        # Atualizar saldo da sessão
-        session.expected_balance += total
-        session.total_sales = (session.total_sales or 0) + 1
-        session.total_amount = (session.total_amount or Decimal('0')) + total
-
-        db.session.commit()
+        sale = pdv_sales.record_sale(data, user_id)
 
         return jsonify({
             'success': True,
             'message': 'Venda registrada com sucesso',
             'sale': sale.to_dict()
         }), 201
+    except pdv_sales.SaleValidationError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': e.message}), e.status_code
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@pdv_bp.route('/sales/batch', methods=['POST'])
+@jwt_required()
+def create_sales_batch():
+    """Registrar lote de vendas feitas offline por um terminal"""
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json() or {}
+
+        batch = pdv_sales.record_sales(data.get('sales'), user_id)
+
+        return jsonify({
+            'success': True,
+            'message': f'{batch["created"]} venda(s) registrada(s)',
+            **batch
+        }), 200
+    except pdv_sales.SaleValidationError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': e.message}), e.status_code
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -451,32 +377,19 @@ def cancel_sale(sale_id):
         if sale.status == 'cancelled':
             return jsonify({'success': False, 'error': 'Venda já está cancelada'}), 400
 
-        data = request.get_json()
-
-        # Cancelar venda
-        sale.status = 'cancelled'
-        sale.cancelled_at = datetime.utcnow()
-        sale.cancel_reason = data.get('reason')
+        data = request.get_json() or {}
 
-        # Reverter estoque
-        for item in sale.items:
-            product = Product.query.get(item.product_id)
-            if product and product.stock_quantity is not None:
-                product.stock_quantity += item.quantity
-
-        # Reverter saldo da sessão
-        if sale.session:
-            sale.session.expected_balance -= sale.total
-            sale.session.total_sales = max(0, (sale.session.total_sales or 1) - 1)
-            sale.session.total_amount = (sale.session.total_amount or Decimal('0')) - sale.total
-
-        db.session.commit()
+        # Estoque e contadores da sessão revertidos no banco
+        sale = pdv_sales.cancel_sale(sale, data.get('reason'))
 
         return jsonify({
             'success': True,
             'message': 'Venda cancelada com sucesso',
             'sale': sale.to_dict()
         }), 200
+    except pdv_sales.SaleValidationError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': e.message}), e.status_code
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1,5 +1,3 @@
-import re
-import unicodedata
 import uuid
 import os
 from functools import wraps
@@ -9,6 +7,8 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from database import db
 from models import Product, ProductCategory, ProductPrice
+from services.product_search import normalize_search_text, product_search
+from utils.cache import CATALOG_TAG, cached
 
 products_bp = Blueprint("products", __name__)
 
@@ -44,21 +44,6 @@ def convert_to_uuid(id_string):
         return None
 
 
-def normalize_search_text(text):
-    """Normaliza texto para busca, removendo acentos e caracteres especiais"""
-    if not text:
-        return ""
-
-    # Normalizar caracteres Unicode (remover acentos)
-    text = unicodedata.normalize("NFD", text)
-    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
-
-    # Converter para minúscula e remover caracteres especiais
-    text = re.sub(r"[^a-zA-Z0-9\s]", "", text.lower())
-
-    return text.strip()
-
-
 def generate_search_variations(text):
     """Gera variações do texto de busca para incluir acentos comuns"""
     if not text:
@@ -108,7 +93,7 @@ def get_products():
         is_active = request.args.get("is_active", True, type=lambda x: x.lower() == 'true')
         limit = request.args.get("limit", type=int)
         # Suportar both orderBy e order_by para compatibilidade
-        order_by = request.args.get("orderBy") or request.args.get("order_by", "created_at")
+        order_by = request.args.get("orderBy") or request.args.get("order_by")
         ascending = request.args.get("ascending", False, type=lambda x: x.lower() == 'true')
 
         query = Product.query.filter_by(is_active = is_active)
@@ -120,38 +105,10 @@ def get_products():
             query = query.filter_by(category = category)
 
         if search:
-            # Sanitizar parâmetro de busca para prevenir SQL injection
-            safe_search = search.replace('%', '\\%').replace('_', '\\_')
-            
-            # Gerar variações do termo de busca para incluir acentos
-            search_variations = generate_search_variations(safe_search)
-            normalized_search = normalize_search_text(safe_search)
-
-            # Criar condições OR para todas as variações
-            search_conditions = []
-            for variation in search_variations:
-                # Sanitizar cada variação também
-                safe_variation = variation.replace('%', '\\%').replace('_', '\\_')
-                search_conditions.extend(
-                    [
-                        Product.name.ilike(f"%{safe_variation}%"),
-                        Product.description.ilike(f"%{safe_variation}%"),
-                        Product.origin.ilike(f"%{safe_variation}%"),
-                    ]
-                )
-
-            # Adicionar busca com termo normalizado
-            safe_normalized = normalized_search.replace('%', '\\%').replace('_', '\\_')
-            search_conditions.extend(
-                [
-                    Product.name.ilike(f"%{safe_normalized}%"),
-                    Product.description.ilike(f"%{safe_normalized}%"),
-                    Product.origin.ilike(f"%{safe_normalized}%"),
-                ]
-            )
+            # Índice de busca sem acentos (trigramas no PostgreSQL, invertido em memória
+            # no SQLite); sem ordenação explícita os resultados saem por relevância
+            query = product_search.filter_query(query, search, rank = not order_by)
 
-            query = query.filter(db.or_(*search_conditions))
-        
         # Aplicar ordenação
         if order_by == "sca_score":
             if ascending:
@@ -168,7 +125,7 @@ def get_products():
                 query = query.order_by(Product.name.asc())
             else:
                 query = query.order_by(Product.name.desc())
-        else:  # default to created_at
+        elif order_by or not search:  # default to created_at
             if ascending:
                 query = query.order_by(Product.created_at.asc())
             else:
@@ -532,25 +489,63 @@ def get_product(product_id):
         return jsonify({"error": f"Erro ao buscar produto: {str(e)}"}), 500
 
 
+@cached(timeout = 600, key_prefix = "catalog", tags = [CATALOG_TAG])
+def _categories_payload():
+    categories = ProductCategory.query.filter_by(is_active = True).all()
+
+    return {
+        "categories": [
+            {
+                "id": str(category.id),
+                "name": category.name,
+                "description": category.description,
+                "image_url": category.image_url,
+            }
+            for category in categories
+        ]
+    }
+
+
+@cached(timeout = 300, key_prefix = "catalog", tags = [CATALOG_TAG])
+def _featured_products_payload():
+    # Produtos em destaque (com maior pontuação SCA)
+    products = (
+        Product.query.filter_by(is_active = True)
+        .filter(Product.sca_score >= 85)
+        .order_by(Product.sca_score.desc())
+        .limit(6)
+        .all()
+    )
+
+    return {
+        "products": [
+            {
+                "id": str(product.id),
+                "name": product.name,
+                "description": product.description,
+                "price": float(product.price),
+                "image_url": product.image_url,
+                "category": (
+                    product.category.name if hasattr(product.category, 'name') else product.category
+                ),
+                "origin": product.origin,
+                "sca_score": product.sca_score,
+                "weight": product.weight,
+                "in_stock": product.in_stock,
+                "promotional_price": float(product.promotional_price) if product.promotional_price else None,
+                "average_rating": product.average_rating,
+                "total_reviews": product.total_reviews
+            }
+            for product in products
+        ]
+    }
+
+
 @products_bp.route("/categories", methods=["GET"])
 @jwt_required()
 def get_categories():
     try:
-        categories = ProductCategory.query.filter_by(is_active = True).all()
-
-        return jsonify(
-            {
-                "categories": [
-                    {
-                        "id": category.id,
-                        "name": category.name,
-                        "description": category.description,
-                        "image_url": category.image_url,
-                    }
-                    for category in categories
-                ]
-            }
-        )
+        return jsonify(_categories_payload())
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -560,39 +555,7 @@ def get_categories():
 @jwt_required()
 def get_featured_products():
     try:
-        # Produtos em destaque (com maior pontuação SCA)
-        products = (
-            Product.query.filter_by(is_active = True)
-            .filter(Product.sca_score >= 85)
-            .order_by(Product.sca_score.desc())
-            .limit(6)
-            .all()
-        )
-
-        return jsonify(
-            {
-                "products": [
-                    {
-                        "id": product.id,
-                        "name": product.name,
-                        "description": product.description,
-                        "price": float(product.price),
-                        "image_url": product.image_url,
-                        "category": (
-                            product.category.name if hasattr(product.category, 'name') else product.category
-                        ),
-                        "origin": product.origin,
-                        "sca_score": product.sca_score,
-                        "weight": product.weight,
-                        "in_stock": product.in_stock,
-                        "promotional_price": float(product.promotional_price) if product.promotional_price else None,
-                        "average_rating": product.average_rating,
-                        "total_reviews": product.total_reviews
-                    }
-                    for product in products
-                ]
-            }
-        )
+        return jsonify(_featured_products_payload())
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -606,40 +569,9 @@ def search_products():
         if not query:
             return jsonify({"products": []})
 
-        # Sanitizar query para prevenir SQL injection
-        safe_query = query.replace('%', '\\%').replace('_', '\\_')
-        
-        # Gerar variações do termo de busca para incluir acentos
-        search_variations = generate_search_variations(safe_query)
-        normalized_query = normalize_search_text(safe_query)
-
-        # Criar condições OR para todas as variações
-        search_conditions = []
-        for variation in search_variations:
-            # Sanitizar cada variação também
-            safe_variation = variation.replace('%', '\\%').replace('_', '\\_')
-            search_conditions.extend(
-                [
-                    Product.name.ilike(f"%{safe_variation}%"),
-                    Product.description.ilike(f"%{safe_variation}%"),
-                    Product.origin.ilike(f"%{safe_variation}%"),
-                ]
-            )
-
-        # Adicionar busca com termo normalizado
-        safe_normalized = normalized_query.replace('%', '\\%').replace('_', '\\_')
-        search_conditions.extend(
-            [
-                Product.name.ilike(f"%{safe_normalized}%"),
-                Product.description.ilike(f"%{safe_normalized}%"),
-                Product.origin.ilike(f"%{safe_normalized}%"),
-            ]
-        )
-
-        # Busca melhorada com normalização UTF-8
+        # Busca sem acentos ordenada por relevância
         products = (
-            Product.query.filter_by(is_active = True)
-            .filter(db.or_(*search_conditions))
+            product_search.filter_query(Product.query.filter_by(is_active = True), query)
             .limit(10)
             .all()
         )
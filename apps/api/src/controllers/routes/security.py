@@ -83,8 +83,7 @@ def unblock_ip():
             }), 400
 
         # Remove do bloqueio
-        if ip_address in rate_limiter.blocked_ips:
-            del rate_limiter.blocked_ips[ip_address]
+        rate_limiter.unblock_ip(ip_address)
 
         # Log do evento
         security_logger.log_business_event({
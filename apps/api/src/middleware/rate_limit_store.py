@@ -0,0 +1,373 @@
+"""
+Armazenamento compartilhado de rate limiting
+Contadores de janela deslizante atômicos (Redis + Lua) com fallback em memória,
+e o decorator usado por middleware/rate_limiting.py e middleware/security.py
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+from flask import make_response
+
+from utils.cache import cache_manager
+
+logger = logging.getLogger(__name__)
+
+# Teto de identificadores mantidos pelo backend em memória (~200 bytes cada)
+MEMORY_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MEMORY_MAX_KEYS', 100000))
+MEMORY_PURGE_INTERVAL = int(os.environ.get('RATE_LIMIT_MEMORY_PURGE_INTERVAL', 60))
+
+KEY_PREFIX = "mc:rl"
+
+
+@dataclass
+class RateLimitResult:
+    """Resultado de uma verificação de rate limit"""
+
+    allowed: bool
+    count: int  # requisições estimadas na janela deslizante (incluindo esta)
+    limit: int
+    window: int
+    retry_after: int = 0  # segundos até poder tentar novamente (quando bloqueado)
+    reset_after: int = 0  # segundos até o fim da janela atual
+    reset_at: int = 0  # fim da janela atual (epoch em segundos)
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.limit - self.count)
+
+
+def _window_end(now: float, window: int) -> int:
+    """Fim (epoch) da janela fixa que contém `now`"""
+    return (int(now // window) + 1) * window
+
+
+def _sliding_estimate(previous: int, current: int, elapsed: float, window: int) -> float:
+    """Contagem da janela deslizante aproximada por duas janelas fixas"""
+    return previous * (window - elapsed) / window + current
+
+
+# Janela deslizante aproximada: contador da janela fixa atual + contador da
+# anterior ponderado pelo tempo restante. O(1) por requisição e atômico.
+# KEYS[1] = chave base, KEYS[2] = chave de bloqueio
+# ARGV = limite, janela, agora, duração do bloqueio, contar rejeitadas (0/1)
+_SLIDING_WINDOW_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local block_duration = tonumber(ARGV[4])
+local count_rejected = ARGV[5] == '1'
+
+local block_ttl = redis.call('TTL', KEYS[2])
+if block_ttl > 0 then
+    return {0, limit, block_ttl}
+end
+
+local index = math.floor(now / window)
+local current_key = KEYS[1] .. ':' .. index
+local previous = tonumber(redis.call('GET', KEYS[1] .. ':' .. (index - 1)) or '0')
+local current = tonumber(redis.call('GET', current_key) or '0')
+local elapsed = now - index * window
+local estimated = previous * (window - elapsed) / window + current
+
+if estimated + 1 > limit then
+    if count_rejected then
+        redis.call('INCR', current_key)
+        redis.call('EXPIRE', current_key, window * 2)
+    end
+    if block_duration > 0 then
+        redis.call('SET', KEYS[2], '1', 'EX', block_duration)
+        return {0, math.floor(estimated + 1), block_duration}
+    end
+    return {0, math.floor(estimated + 1), math.ceil(window - elapsed)}
+end
+
+redis.call('INCR', current_key)
+redis.call('EXPIRE', current_key, window * 2)
+return {1, math.floor(estimated + 1), 0}
+"""
+
+
+class RedisRateLimitBackend:
+    """Backend compartilhado entre workers (Redis)"""
+
+    def __init__(self, client):
+        self.client = client
+        self._script = client.register_script(_SLIDING_WINDOW_SCRIPT)
+
+    def hit(self, key: str, limit: int, window: int, block_duration: int = 0,
+            count_rejected: bool = False) -> RateLimitResult:
+        now = time.time()
+        allowed, count, retry_after = self._script(
+            keys = [f"{KEY_PREFIX}:{key}", f"{KEY_PREFIX}:block:{key}"],
+            args = [limit, window, now, block_duration, int(count_rejected)],
+        )
+        return RateLimitResult(
+            allowed = bool(allowed),
+            count = int(count),
+            limit = limit,
+            window = window,
+            retry_after = int(retry_after),
+            reset_after = int(math.ceil(window - now % window)),
+            reset_at = _window_end(now, window),
+        )
+
+    def block(self, key: str, duration: int) -> None:
+        self.client.set(f"{KEY_PREFIX}:block:{key}", 1, ex = duration)
+
+    def unblock(self, key: str) -> None:
+        self.client.delete(f"{KEY_PREFIX}:block:{key}")
+
+    def blocked_for(self, key: str) -> int:
+        ttl = self.client.ttl(f"{KEY_PREFIX}:block:{key}")
+        return max(0, int(ttl or 0))
+
+
+class MemoryRateLimitBackend:
+    """
+    Backend por processo, usado quando o Redis não está disponível
+    Mesmo algoritmo do Redis; memória limitada a `max_keys` identificadores
+    (LRU) e entradas vencidas removidas a cada `purge_interval` segundos
+    """
+
+    def __init__(self, max_keys: int = MEMORY_MAX_KEYS, purge_interval: int = MEMORY_PURGE_INTERVAL):
+        self.max_keys = max_keys
+        self.purge_interval = purge_interval
+        self._counters: "OrderedDict[str, list]" = OrderedDict()  # key -> [index, current, previous, window]
+        self._blocks: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._next_purge = time.monotonic() + purge_interval
+
+    def hit(self, key: str, limit: int, window: int, block_duration: int = 0,
+            count_rejected: bool = False) -> RateLimitResult:
+        now = time.time()
+        index = int(now // window)
+        elapsed = now - index * window
+        reset_after = int(math.ceil(window - elapsed))
+        reset_at = _window_end(now, window)
+
+        with self._lock:
+            self._maybe_purge_locked()
+
+            blocked_until = self._blocks.get(key)
+            if blocked_until is not None:
+                if blocked_until > now:
+                    return RateLimitResult(False, limit, limit, window,
+                                           int(math.ceil(blocked_until - now)), reset_after, reset_at)
+                del self._blocks[key]
+
+            entry = self._counters.get(key)
+            if entry is None or entry[0] < index - 1:
+                entry = [index, 0, 0, window]
+            elif entry[0] == index - 1:
+                entry = [index, 0, entry[1], window]
+            self._counters[key] = entry
+            self._counters.move_to_end(key)
+
+            estimated = _sliding_estimate(entry[2], entry[1], elapsed, window)
+            count = int(estimated + 1)
+
+            if estimated + 1 > limit:
+                if count_rejected:
+                    entry[1] += 1
+                if block_duration > 0:
+                    self._blocks[key] = now + block_duration
+                    retry_after = block_duration
+                else:
+                    retry_after = reset_after
+                self._evict_locked()
+                return RateLimitResult(False, count, limit, window, retry_after, reset_after, reset_at)
+
+            entry[1] += 1
+            self._evict_locked()
+            return RateLimitResult(True, count, limit, window, 0, reset_after, reset_at)
+
+    def block(self, key: str, duration: int) -> None:
+        with self._lock:
+            self._blocks[key] = time.time() + duration
+
+    def unblock(self, key: str) -> None:
+        with self._lock:
+            self._blocks.pop(key, None)
+
+    def blocked_for(self, key: str) -> int:
+        with self._lock:
+            blocked_until = self._blocks.get(key, 0)
+        return max(0, int(math.ceil(blocked_until - time.time())))
+
+    def _evict_locked(self) -> None:
+        while len(self._counters) > self.max_keys:
+            self._counters.popitem(last = False)
+        while len(self._blocks) > self.max_keys:
+            self._blocks.pop(next(iter(self._blocks)))
+
+    def _maybe_purge_locked(self) -> None:
+        if time.monotonic() >= self._next_purge:
+            self._purge_locked()
+
+    def _purge_locked(self) -> int:
+        now = time.time()
+        expired = [
+            key for key, (index, _, _, window) in self._counters.items()
+            if index < int(now // window) - 1
+        ]
+        for key in expired:
+            del self._counters[key]
+
+        expired_blocks = [key for key, until in self._blocks.items() if until <= now]
+        for key in expired_blocks:
+            del self._blocks[key]
+
+        self._next_purge = time.monotonic() + self.purge_interval
+        return len(expired) + len(expired_blocks)
+
+    def purge(self) -> int:
+        """Remove contadores e bloqueios vencidos"""
+        with self._lock:
+            return self._purge_locked()
+
+    def __len__(self):
+        return len(self._counters)
+
+
+class RateLimitStore:
+    """
+    Seleciona o backend: Redis quando disponível (limites valem para todos os
+    workers), senão memória do processo. Erros do Redis caem para a memória.
+    """
+
+    def __init__(self):
+        self.memory = MemoryRateLimitBackend()
+        self._redis_backend = None
+        self._redis_client = None
+
+    def _backend(self):
+        client = cache_manager.redis_client
+        if client is None:
+            return self.memory
+        if client is not self._redis_client:
+            self._redis_backend = RedisRateLimitBackend(client)
+            self._redis_client = client
+        return self._redis_backend
+
+    def _call(self, method: str, *args, **kwargs):
+        backend = self._backend()
+        try:
+            return getattr(backend, method)(*args, **kwargs)
+        except Exception as e:
+            if backend is self.memory:
+                raise
+            logger.error(f"Redis rate limit error: {e}. Using memory backend.")
+            return getattr(self.memory, method)(*args, **kwargs)
+
+    def hit(self, key: str, limit: int, window: int, block_duration: int = 0,
+            count_rejected: bool = False) -> RateLimitResult:
+        """Registra uma requisição e informa se está dentro do limite"""
+        return self._call('hit', key, limit, window, block_duration, count_rejected)
+
+    def block(self, key: str, duration: int) -> None:
+        self._call('block', key, duration)
+
+    def unblock(self, key: str) -> None:
+        self._call('unblock', key)
+
+    def blocked_for(self, key: str) -> int:
+        """Segundos restantes de bloqueio (0 se não bloqueado)"""
+        return self._call('blocked_for', key)
+
+    def purge(self) -> int:
+        return self.memory.purge()
+
+
+# Instância global do armazenamento de rate limit
+rate_limit_store = RateLimitStore()
+
+
+def _as_response(response):
+    if isinstance(response, tuple):
+        return make_response(*response)
+    return response
+
+
+class RequestRateLimiter:
+    """
+    Decorator de rate limiting parametrizado por política
+
+    Args:
+        limits: {limit_type: {"requests", "window", ["block_duration"]}}
+        identify: Função que retorna o identificador do cliente
+        limited_response: Monta a resposta 429 a partir de (result, limit_type)
+        default_limit: Tipo usado quando limit_type não está configurado
+        scope: Prefixo que separa os contadores de cada política
+        count_rejected: Conta também requisições rejeitadas (para escalonar bloqueios)
+        precheck: Executado antes da contagem; se retornar resposta, ela é usada
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, int]], identify: Callable[[], str],
+                 limited_response: Callable[[RateLimitResult, str], Any],
+                 default_limit: str, scope: str, count_rejected: bool = False,
+                 precheck: Optional[Callable[[], Any]] = None, store: RateLimitStore = None):
+        self.limits = limits
+        self.identify = identify
+        self.limited_response = limited_response
+        self.default_limit = default_limit
+        self.scope = scope
+        self.count_rejected = count_rejected
+        self.precheck = precheck
+        self.store = store or rate_limit_store
+
+    def config(self, limit_type: str) -> Dict[str, int]:
+        return self.limits.get(limit_type, self.limits[self.default_limit])
+
+    def check(self, limit_type: str, identifier: Optional[str] = None) -> RateLimitResult:
+        """Conta uma requisição para o identificador (padrão: cliente atual)"""
+        config = self.config(limit_type)
+        identifier = identifier or self.identify()
+        return self.store.hit(
+            f"{self.scope}:{limit_type}:{identifier}",
+            config['requests'],
+            config['window'],
+            config.get('block_duration', 0),
+            self.count_rejected,
+        )
+
+    def limit(self, limit_type: str):
+        """Decorator que aplica o limite `limit_type` ao endpoint"""
+        def decorator(f):
+            @wraps(f)
+            def wrapped(*args, **kwargs):
+                if self.precheck is not None:
+                    early = self.precheck()
+                    if early is not None:
+                        return early
+
+                result = self.check(limit_type)
+                if not result.allowed:
+                    response = _as_response(self.limited_response(result, limit_type))
+                    response.headers['Retry-After'] = str(result.retry_after)
+                    self._add_headers(response, result)
+                    return response
+
+                response = _as_response(f(*args, **kwargs))
+                self._add_headers(response, result)
+                return response
+
+            return wrapped
+        return decorator
+
+    @staticmethod
+    def _add_headers(response, result: RateLimitResult) -> None:
+        if hasattr(response, 'headers'):
+            response.headers['X-RateLimit-Limit'] = str(result.limit)
+            response.headers['X-RateLimit-Remaining'] = str(result.remaining)
+            response.headers['X-RateLimit-Window'] = str(result.window)
+            # Reset em epoch, como antes; Reset-After em segundos relativos
+            response.headers['X-RateLimit-Reset'] = str(result.reset_at)
+            response.headers['X-RateLimit-Reset-After'] = str(result.reset_after)
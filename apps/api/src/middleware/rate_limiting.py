@@ -4,15 +4,12 @@ Proteção contra abuso de APIs com múltiplas estratégias
 """
 
 import time
-from functools import wraps
 from flask import request, jsonify, g
-from datetime import datetime, timedelta
 import logging
 
-logger = logging.getLogger(__name__)
+from middleware.rate_limit_store import RateLimitResult, RequestRateLimiter, rate_limit_store
 
-# Rate limits em memória (usar Redis em produção)
-_rate_limit_storage = {}
+logger = logging.getLogger(__name__)
 
 # Configurações de rate limit por endpoint
 RATE_LIMIT_CONFIG = {
@@ -93,58 +90,46 @@ def get_client_identifier():
     return hashlib.md5(identifier.encode()).hexdigest()
 
 
-def is_rate_limited(identifier: str, limit_type: str) -> tuple:
-    """
-    Verifica se o identificador excedeu o rate limit
-    Retorna: (is_limited, retry_after_seconds)
-    """
-
-    config = RATE_LIMIT_CONFIG.get(limit_type, RATE_LIMIT_CONFIG['api_public'])
-    current_time = time.time()
-
-    # Chave para o storage
-    storage_key = f"{limit_type}:{identifier}"
+def _limited_response(result: RateLimitResult, limit_type: str):
+    retry_after = result.retry_after
 
-    # Verificar se está bloqueado
-    block_key = f"block:{storage_key}"
-    if block_key in _rate_limit_storage:
-        block_until = _rate_limit_storage[block_key]
-        if current_time < block_until:
-            retry_after = int(block_until - current_time)
-            return True, retry_after
-        else:
-            # Remover bloqueio expirado
-            del _rate_limit_storage[block_key]
+    logger.warning(
+        f"Rate limit hit: {request.method} {request.path} "
+        f"on {limit_type} (retry after {retry_after}s)"
+    )
 
-    # Obter ou inicializar histórico de requests
-    if storage_key not in _rate_limit_storage:
-        _rate_limit_storage[storage_key] = []
+    return jsonify({
+        'success': False,
+        'error': 'Limite de requisições excedido',
+        'message': f'Você excedeu o limite de requisições. Tente novamente em {retry_after} segundos.',
+        'retry_after': retry_after,
+        'limit_type': limit_type,
+        'status_code': 429
+    }), 429
 
-    request_history = _rate_limit_storage[storage_key]
 
-    # Remover requests antigos (fora da janela)
-    window_start = current_time - config['window']
-    request_history = [req_time for req_time in request_history if req_time > window_start]
-    _rate_limit_storage[storage_key] = request_history
+# Contadores compartilhados entre workers (Redis) com fallback em memória
+_limiter = RequestRateLimiter(
+    limits = RATE_LIMIT_CONFIG,
+    identify = get_client_identifier,
+    limited_response = _limited_response,
+    default_limit = 'api_public',
+    scope = 'api',
+)
 
-    # Verificar se excedeu o limite
-    if len(request_history) >= config['requests']:
-        # Bloquear por block_duration
-        block_until = current_time + config['block_duration']
-        _rate_limit_storage[block_key] = block_until
 
+def is_rate_limited(identifier: str, limit_type: str) -> tuple:
+    """
+    Verifica se o identificador excedeu o rate limit
+    Retorna: (is_limited, retry_after_seconds)
+    """
+    result = _limiter.check(limit_type, identifier)
+    if not result.allowed:
         logger.warning(
             f"Rate limit exceeded for {identifier} on {limit_type}. "
-            f"Blocked for {config['block_duration']}s"
+            f"Retry after {result.retry_after}s"
         )
-
-        return True, config['block_duration']
-
-    # Adicionar request atual ao histórico
-    request_history.append(current_time)
-    _rate_limit_storage[storage_key] = request_history
-
-    return False, 0
+    return not result.allowed, result.retry_after
 
 
 def rate_limit(limit_type: str = 'api_public'):
@@ -157,85 +142,14 @@ def rate_limit(limit_type: str = 'api_public'):
         def my_endpoint():
             ...
     """
-    def decorator(f):
-        @wraps(f)
-        def wrapped(*args, **kwargs):
-            # Obter identificador do cliente
-            client_id = get_client_identifier()
-
-            # Verificar rate limit
-            is_limited, retry_after = is_rate_limited(client_id, limit_type)
-
-            if is_limited:
-                logger.warning(
-                    f"Rate limit hit: {request.method} {request.path} "
-                    f"by {client_id[:8]}... (retry after {retry_after}s)"
-                )
-
-                response = jsonify({
-                    'success': False,
-                    'error': 'Limite de requisições excedido',
-                    'message': f'Você excedeu o limite de requisições. Tente novamente em {retry_after} segundos.',
-                    'retry_after': retry_after,
-                    'limit_type': limit_type,
-                    'status_code': 429
-                })
-                response.status_code = 429
-                response.headers['Retry-After'] = str(retry_after)
-                response.headers['X-RateLimit-Limit'] = str(RATE_LIMIT_CONFIG[limit_type]['requests'])
-                response.headers['X-RateLimit-Window'] = str(RATE_LIMIT_CONFIG[limit_type]['window'])
-
-                return response
-
-            # Adicionar headers informativos
-            config = RATE_LIMIT_CONFIG.get(limit_type, RATE_LIMIT_CONFIG['api_public'])
-            storage_key = f"{limit_type}:{client_id}"
-            remaining = config['requests'] - len(_rate_limit_storage.get(storage_key, []))
-
-            # Executar função original
-            response = f(*args, **kwargs)
-
-            # Se response é um tuple (data, status_code), converter para Response
-            if isinstance(response, tuple):
-                from flask import make_response
-                response = make_response(response[0], response[1] if len(response) > 1 else 200)
-
-            # Adicionar headers de rate limit
-            if hasattr(response, 'headers'):
-                response.headers['X-RateLimit-Limit'] = str(config['requests'])
-                response.headers['X-RateLimit-Remaining'] = str(max(0, remaining))
-                response.headers['X-RateLimit-Window'] = str(config['window'])
-
-            return response
-
-        return wrapped
-    return decorator
+    return _limiter.limit(limit_type)
 
 
 def cleanup_expired_entries():
-    """Remove entradas expiradas do storage (executar periodicamente)"""
-    current_time = time.time()
-    keys_to_remove = []
-
-    for key, value in _rate_limit_storage.items():
-        if key.startswith('block:'):
-            # Remover bloqueios expirados
-            if current_time >= value:
-                keys_to_remove.append(key)
-        elif isinstance(value, list):
-            # Remover históricos antigos
-            # Manter apenas últimos 24h
-            value = [t for t in value if current_time - t < 86400]
-            if not value:
-                keys_to_remove.append(key)
-            else:
-                _rate_limit_storage[key] = value
-
-    for key in keys_to_remove:
-        del _rate_limit_storage[key]
-
-    if keys_to_remove:
-        logger.info(f"Cleaned up {len(keys_to_remove)} expired rate limit entries")
+    """Remove entradas expiradas do storage em memória (no Redis as chaves expiram sozinhas)"""
+    removed = rate_limit_store.purge()
+    if removed:
+        logger.info(f"Cleaned up {removed} expired rate limit entries")
 
 
 # Adicionar ao Flask app
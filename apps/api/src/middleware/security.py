@@ -6,19 +6,19 @@ Rate limiting, CSRF protection, input validation e security headers
 import time
 import hashlib
 import secrets
-from collections import defaultdict, deque
 from datetime import datetime, timedelta
 from functools import wraps
 from typing import Dict, Any, Optional
 from flask import request, jsonify, g, current_app
+from middleware.rate_limit_store import RateLimitResult, RequestRateLimiter, rate_limit_store
 from utils.cache import cache_manager
 
 class RateLimiter:
     """Rate limiter baseado em IP e usuário"""
 
     def __init__(self):
-        self.ip_requests = defaultdict(lambda: deque(maxlen = 1000))
-        self.user_requests = defaultdict(lambda: deque(maxlen = 1000))
+        # Visão local dos bloqueios feitos por este processo (para relatórios);
+        # o bloqueio efetivo fica no rate_limit_store, compartilhado entre workers
         self.blocked_ips = {}
 
         # Configurações de rate limiting
@@ -29,56 +29,75 @@ class RateLimiter:
             "api": {"requests": 1000, "window": 3600}      # 1000 req/hora para API geral
         }
 
+        # Rejeitadas também contam, para escalar para bloqueio de IP
+        self.limiter = RequestRateLimiter(
+            limits = self.limits,
+            identify = lambda: self.get_identifier(request),
+            limited_response = self._limited_response,
+            default_limit = "default",
+            scope = "security",
+            count_rejected = True,
+            precheck = self._blocked_response,
+        )
+
     def is_blocked(self, ip_address: str) -> bool:
         """Verifica se IP está bloqueado"""
-        if ip_address in self.blocked_ips:
-            blocked_until = self.blocked_ips[ip_address]
-            if datetime.now() < blocked_until:
-                return True
-            else:
-                del self.blocked_ips[ip_address]
+        if rate_limit_store.blocked_for(f"ip:{ip_address}") > 0:
+            return True
+        self.blocked_ips.pop(ip_address, None)
         return False
 
     def block_ip(self, ip_address: str, duration_minutes: int = 15):
         """Bloqueia IP por um período"""
         self.blocked_ips[ip_address] = datetime.now() + timedelta(minutes = duration_minutes)
+        rate_limit_store.block(f"ip:{ip_address}", duration_minutes * 60)
 
-        # Cache no Redis também
-        cache_key = f"blocked_ip:{ip_address}"
-        cache_manager.set(cache_key, True, timeout = duration_minutes * 60)
+    def unblock_ip(self, ip_address: str):
+        """Remove bloqueio de IP"""
+        self.blocked_ips.pop(ip_address, None)
+        rate_limit_store.unblock(f"ip:{ip_address}")
 
     def check_rate_limit(self, identifier: str, limit_type: str = "default") -> tuple[bool, Dict[str, Any]]:
         """Verifica rate limit para um identificador"""
-        now = time.time()
-        limit_config = self.limits.get(limit_type, self.limits["default"])
-        window = limit_config["window"]
-        max_requests = limit_config["requests"]
-
-        # Busca do cache primeiro
-        cache_key = f"rate_limit:{limit_type}:{identifier}"
-        cached_requests = cache_manager.get(cache_key)
+        return self._limit_info(self.limiter.check(limit_type, identifier))
 
-        if cached_requests is None:
-            cached_requests = []
+    @staticmethod
+    def _limit_info(result: RateLimitResult) -> tuple[bool, Dict[str, Any]]:
+        return result.allowed, {
+            "requests_count": result.count,
+            "max_requests": result.limit,
+            "window_seconds": result.window,
+            "reset_time": result.reset_at
+        }
 
-        # Remove requests antigas
-        recent_requests = [req_time for req_time in cached_requests if now - req_time < window]
+    def _blocked_response(self):
+        if self.is_blocked(self.get_client_ip(request)):
+            return jsonify({
+                "error": "IP temporariamente bloqueado",
+                "code": "IP_BLOCKED"
+            }), 429
+        return None
 
-        # Adiciona request atual
-        recent_requests.append(now)
+    def _limited_response(self, result: RateLimitResult, limit_type: str):
+        _, limit_info = self._limit_info(result)
 
-        # Atualiza cache
-        cache_manager.set(cache_key, recent_requests, timeout = window)
+        # Considera bloquear IP se muitas tentativas
+        if limit_info["requests_count"] > limit_info["max_requests"] * 2:
+            self.block_ip(self.get_client_ip(request), 15)  # 15 minutos
 
-        # Verifica limite
-        is_allowed = len(recent_requests) <= max_requests
+        return jsonify({
+            "error": "Rate limit excedido",
+            "limit_info": limit_info,
+            "code": "RATE_LIMITED"
+        }), 429
 
-        return is_allowed, {
-            "requests_count": len(recent_requests),
-            "max_requests": max_requests,
-            "window_seconds": window,
-            "reset_time": now + window - (now % window)
-        }
+    @staticmethod
+    def get_client_ip(request) -> str:
+        """Obtém IP real do cliente (primeiro X-Forwarded-For)"""
+        ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
+        if ip and ', ' in ip:
+            ip = ip.split(', ')[0].strip()
+        return ip
 
     def get_identifier(self, request) -> str:
         """Obtém identificador único para rate limiting"""
@@ -88,11 +107,7 @@ class RateLimiter:
             return f"user:{user_id}"
 
         # Fallback para IP
-        ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-        if ip and ', ' in ip:
-            ip = ip.split(', ')[0].strip()
-
-        return f"ip:{ip}"
+        return f"ip:{self.get_client_ip(request)}"
 
 class CSRFProtection:
     """Proteção CSRF para formulários e APIs"""
@@ -226,45 +241,7 @@ input_validator = InputValidator()
 
 def rate_limit(limit_type: str = "default"):
     """Decorator para rate limiting"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-            if ip_address and ', ' in ip_address:
-                ip_address = ip_address.split(', ')[0].strip()
-
-            # Verifica se IP está bloqueado
-            if rate_limiter.is_blocked(ip_address):
-                return jsonify({
-                    "error": "IP temporariamente bloqueado",
-                    "code": "IP_BLOCKED"
-                }), 429
-
-            # Verifica rate limit
-            identifier = rate_limiter.get_identifier(request)
-            is_allowed, limit_info = rate_limiter.check_rate_limit(identifier, limit_type)
-
-            if not is_allowed:
-                # Considera bloquear IP se muitas tentativas
-                if limit_info["requests_count"] > limit_info["max_requests"] * 2:
-                    rate_limiter.block_ip(ip_address, 15)  # 15 minutos
-
-                return jsonify({
-                    "error": "Rate limit excedido",
-                    "limit_info": limit_info,
-                    "code": "RATE_LIMITED"
-                }), 429
-
-            # Adiciona informações de rate limit no cabeçalho
-            response = func(*args, **kwargs)
-            if hasattr(response, 'headers'):
-                response.headers['X-RateLimit-Limit'] = str(limit_info["max_requests"])
-                response.headers['X-RateLimit-Remaining'] = str(max(0, limit_info["max_requests"] - limit_info["requests_count"]))
-                response.headers['X-RateLimit-Reset'] = str(int(limit_info["reset_time"]))
-
-            return response
-        return wrapper
-    return decorator
+    return rate_limiter.limiter.limit(limit_type)
 
 def validate_input():
     """Decorator para validação de entrada"""
@@ -33,6 +33,7 @@ from .newsletter import (
 )
 from .notifications import (
     Notification,
+    NotificationJob,
     NotificationLog,
     NotificationSubscription,
     NotificationTemplate,
@@ -56,11 +57,17 @@ from .products import (
     StockMovement,
 )
 from .suppliers import PurchaseOrder, PurchaseOrderItem, Supplier
-from .system import AuditLog, SystemLog, SystemSetting
+from .system import AuditLog, EventOutbox, SystemLog, SystemSetting
 from .tenancy import Tenant, TenantSubscription, TenantSettings
 from .vendors import Vendor, VendorCommission, VendorOrder, VendorProduct, VendorReview
 from .wishlist import Wishlist, WishlistItem, WishlistShare
 from .pdv import CashRegister, CashSession, CashMovement, Sale, SaleItem
+from .sales_rollup import (
+    DailyCustomerSalesRollup,
+    DailyProductSalesRollup,
+    DailySalesRollup,
+    SalesRollupPendingDay,
+)
 from .erp import (
     PurchaseRequest,
     PurchaseRequestItem,
@@ -100,6 +107,8 @@ from .fiscal import (
     CartaCorrecao,
     InutilizacaoNumeracao,
     LogComunicacaoSefaz,
+    LoteNFe,
+    FaixaNumeracaoFiscal,
     ConfiguracaoSefaz,
     ContingenciaFiscal,
     AuditoriaFiscal,
@@ -168,6 +177,7 @@ __all__ = [
     "NotificationTemplate",
     "NotificationSubscription",
     "NotificationLog",
+    "NotificationJob",
     # Media
     "MediaFile",
     # Financial
@@ -199,6 +209,7 @@ __all__ = [
     "SystemSetting",
     "SystemLog",
     "AuditLog",
+    "EventOutbox",
     # Reviews
     "Review",
     "ReviewHelpful",
@@ -215,6 +226,11 @@ __all__ = [
     "CashMovement",
     "Sale",
     "SaleItem",
+    # Sales rollups
+    "DailySalesRollup",
+    "DailyProductSalesRollup",
+    "DailyCustomerSalesRollup",
+    "SalesRollupPendingDay",
     # ERP Advanced
     "PurchaseRequest",
     "PurchaseRequestItem",
@@ -251,6 +267,8 @@ __all__ = [
     "CartaCorrecao",
     "InutilizacaoNumeracao",
     "LogComunicacaoSefaz",
+    "LoteNFe",
+    "FaixaNumeracaoFiscal",
     "ConfiguracaoSefaz",
     "ContingenciaFiscal",
     "AuditoriaFiscal",
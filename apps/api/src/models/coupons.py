@@ -11,6 +11,7 @@ from sqlalchemy import (
     Date,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
 )
@@ -97,6 +98,11 @@ class CouponUsage(db.Model):
     # Relacionamentos
     coupon = relationship("Coupon", back_populates="usage_records")
 
+    # Contagem de usos por cliente (limite usage_limit_per_customer)
+    __table_args__ = (
+        Index('idx_coupon_usage_coupon_user', 'coupon_id', 'user_id'),
+    )
+
     def __repr__(self):
         return f"<CouponUsage(id={self.id}, coupon_id={self.coupon_id}, discount_amount={self.discount_amount})>"
 
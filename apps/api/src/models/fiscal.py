@@ -79,6 +79,7 @@ class StatusDocumentoFiscal(Enum):
     """Status do documento fiscal no ciclo de vida"""
     RASCUNHO = "rascunho"
     ASSINADO = "assinado"
+    EM_LOTE = "em_lote"  # Reservado por um worker para um lote NF-e
     ENVIADO = "enviado"
     AUTORIZADO = "autorizado"
     REJEITADO = "rejeitado"
@@ -603,9 +604,15 @@ class SerieFiscal(db.Model):
         return f'<SerieFiscal Modelo:{self.modelo} Série:{self.serie}>'
 
     def obter_proximo_numero(self):
-        """Obtém o próximo número disponível e incrementa o contador"""
-        self.numero_atual += 1
-        return self.numero_atual
+        """
+        Obtém o próximo número disponível
+
+        A série precisa estar gravada no banco: o número vem do alocador
+        atômico (services/numeracao_fiscal_service.py), seguro entre workers.
+        """
+        from services.numeracao_fiscal_service import numeracao_fiscal
+
+        return numeracao_fiscal.proximo_numero(self)
 
     def to_dict(self):
         return {
@@ -785,7 +792,7 @@ class DocumentoFiscal(db.Model):
             name='check_tipo_operacao'
         ),
         CheckConstraint(
-            "status IN ('rascunho', 'assinado', 'enviado', 'autorizado', 'rejeitado', 'denegado', 'cancelado', 'inutilizado', 'contingencia')",
+            "status IN ('rascunho', 'assinado', 'em_lote', 'enviado', 'autorizado', 'rejeitado', 'denegado', 'cancelado', 'inutilizado', 'contingencia')",
             name='check_status_documento_fiscal'
         ),
         Index('idx_doc_fiscal_empresa', 'empresa_id'),
@@ -1392,6 +1399,110 @@ class LogComunicacaoSefaz(db.Model):
         }
 
 
+# =============================================================================
+# MODELO: LOTE DE NF-e (ENVIO ASSÍNCRONO)
+# =============================================================================
+
+class LoteNFe(db.Model):
+    """
+    Lote enviNFe enviado à SEFAZ com processamento assíncrono (indSinc=0)
+
+    Agrupa até 50 NF-e da mesma empresa/série. Após o envio a SEFAZ devolve
+    um número de recibo (nRec), consultado depois via retConsReciNFe.
+
+    Status: montando, enviado, processado, erro
+    """
+    __tablename__ = 'lotes_nfe'
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    empresa_id = Column(UUID(as_uuid=True), ForeignKey('empresas_emissoras.id'), nullable=False)
+    serie_fiscal_id = Column(UUID(as_uuid=True), ForeignKey('series_fiscais.id'))
+
+    id_lote = Column(String(15), nullable=False)  # idLote do enviNFe
+    ambiente = Column(String(1), nullable=False)
+    status = Column(String(20), nullable=False, default='montando')
+
+    # Documentos do lote (chaves de acesso, na ordem do enviNFe)
+    chaves_acesso = Column(JSONB, nullable=False, default=list)
+    quantidade = Column(Integer, nullable=False, default=0)
+
+    # Retorno do envio (retEnviNFe)
+    numero_recibo = Column(String(15))  # nRec
+    tempo_medio_s = Column(Integer)  # tMed informado pela SEFAZ
+
+    # Retorno da consulta (retConsReciNFe)
+    codigo_status = Column(Integer)
+    motivo = Column(Text)
+    tentativas_consulta = Column(Integer, default=0)
+    proxima_consulta_em = Column(DateTime(timezone=True))
+
+    enviado_em = Column(DateTime(timezone=True))
+    processado_em = Column(DateTime(timezone=True))
+    criado_em = Column(DateTime(timezone=True), default=datetime.utcnow)
+
+    __table_args__ = (
+        CheckConstraint(
+            "status IN ('montando', 'enviado', 'processado', 'erro')",
+            name='check_status_lote_nfe'
+        ),
+        Index('idx_lote_nfe_status_consulta', 'status', 'proxima_consulta_em'),
+        Index('idx_lote_nfe_empresa', 'empresa_id'),
+    )
+
+    def __repr__(self):
+        return f'<LoteNFe {self.id_lote} - {self.status}>'
+
+    def to_dict(self):
+        return {
+            'id': str(self.id),
+            'empresa_id': str(self.empresa_id),
+            'id_lote': self.id_lote,
+            'ambiente': self.ambiente,
+            'status': self.status,
+            'quantidade': self.quantidade,
+            'chaves_acesso': self.chaves_acesso or [],
+            'numero_recibo': self.numero_recibo,
+            'codigo_status': self.codigo_status,
+            'motivo': self.motivo,
+            'tentativas_consulta': self.tentativas_consulta,
+            'enviado_em': self.enviado_em.isoformat() if self.enviado_em else None,
+            'processado_em': self.processado_em.isoformat() if self.processado_em else None
+        }
+
+
+# =============================================================================
+# MODELO: FAIXA DE NUMERAÇÃO RESERVADA
+# =============================================================================
+
+class FaixaNumeracaoFiscal(db.Model):
+    """
+    Faixa de números reservada atomicamente em uma série fiscal
+
+    Cada reserva (um número por NF-e ou um bloco para o PDV) é registrada na
+    mesma transação que avança SerieFiscal.numero_atual. Após o prazo de uso,
+    os números da faixa sem DocumentoFiscal viram inutilizações pendentes.
+    """
+    __tablename__ = 'faixas_numeracao_fiscal'
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    serie_fiscal_id = Column(UUID(as_uuid=True), ForeignKey('series_fiscais.id'), nullable=False)
+
+    numero_inicial = Column(Integer, nullable=False)
+    numero_final = Column(Integer, nullable=False)
+
+    instancia = Column(String(100))  # host:pid que reservou
+    reservada_em = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+    conciliada_em = Column(DateTime(timezone=True))  # lacunas já registradas
+
+    __table_args__ = (
+        CheckConstraint("numero_final >= numero_inicial", name='check_faixa_numeracao'),
+        Index('idx_faixa_numeracao_conciliacao', 'conciliada_em', 'reservada_em'),
+    )
+
+    def __repr__(self):
+        return f'<FaixaNumeracaoFiscal {self.numero_inicial}-{self.numero_final}>'
+
+
 # =============================================================================
 # MODELO: CONFIGURAÇÃO WEBSERVICES SEFAZ
 # =============================================================================
@@ -196,6 +196,7 @@ class NewsletterCampaign(db.Model):
     # Estatísticas
     total_recipients = Column(Integer, default=0)
     total_sent = Column(Integer, default=0)
+    total_failed = Column(Integer, default=0)
     total_delivered = Column(Integer, default=0)
     total_opened = Column(Integer, default=0)
     total_clicked = Column(Integer, default=0)
@@ -208,6 +209,10 @@ class NewsletterCampaign(db.Model):
     click_rate = Column(Integer, default=0)  # Percentual
     bounce_rate = Column(Integer, default=0)  # Percentual
 
+    # Progresso do envio (retomada após falha): último assinante processado
+    delivery_cursor = Column(String(64))
+    delivery_heartbeat_at = Column(DateTime)
+
     # Metadados
     extra_data = Column(JSONB)  # Dados adicionais
 
@@ -259,6 +264,7 @@ class NewsletterCampaign(db.Model):
             'sent_at': self.sent_at.isoformat() if self.sent_at else None,
             'total_recipients': self.total_recipients,
             'total_sent': self.total_sent,
+            'total_failed': self.total_failed,
             'total_delivered': self.total_delivered,
             'total_opened': self.total_opened,
             'total_clicked': self.total_clicked,
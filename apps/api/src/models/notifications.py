@@ -11,6 +11,10 @@ from sqlalchemy.dialects.postgresql import JSON, UUID
 class Notification(db.Model):
     """Modelo para notificações in-app"""
     __tablename__ = 'notifications'
+    __table_args__ = (
+        # Paginação por cursor dentro das notificações do usuário
+        db.Index('idx_notifications_user_created_id', 'user_id', 'created_at', 'id'),
+    )
 
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False)
@@ -122,6 +126,9 @@ class NotificationSubscription(db.Model):
 class NotificationLog(db.Model):
     """Log de notificações enviadas"""
     __tablename__ = 'notification_logs'
+    __table_args__ = (
+        db.Index('idx_notification_logs_sent_id', 'sent_at', 'id'),
+    )
 
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = db.Column(UUID(as_uuid=True), nullable=False)  # Não FK para manter histórico
@@ -158,3 +165,59 @@ class NotificationLog(db.Model):
 
     def __repr__(self):
         return f'<NotificationLog {self.id}: {self.notification_type}-{self.channel}>'
+
+
+class NotificationJob(db.Model):
+    """Fila durável de envios em massa (broadcast) processada em background"""
+    __tablename__ = 'notification_jobs'
+
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    kind = db.Column(db.String(20), default='broadcast', nullable=False)
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, completed, failed
+    notification_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(JSON, default={})  # title, content, metadata, action_url, image_url
+    channels = db.Column(JSON, default=[])
+    created_by = db.Column(UUID(as_uuid=True), nullable=True)
+
+    # Progresso (atualizado a cada lote de usuários)
+    total_recipients = db.Column(db.Integer, default=0, nullable=False)
+    processed_count = db.Column(db.Integer, default=0, nullable=False)
+    sent_count = db.Column(db.Integer, default=0, nullable=False)
+    failed_count = db.Column(db.Integer, default=0, nullable=False)
+    cursor = db.Column(db.String(64), nullable=True)  # último user_id processado (retomada)
+    error_message = db.Column(db.Text, nullable=True)
+
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('idx_notification_jobs_status_created', 'status', 'created_at'),
+    )
+
+    def to_dict(self):
+        """Converte modelo para dicionário"""
+        progress = (
+            round(self.processed_count / self.total_recipients * 100, 1)
+            if self.total_recipients else (100.0 if self.status == 'completed' else 0.0)
+        )
+        return {
+            'id': str(self.id),
+            'kind': self.kind,
+            'status': self.status,
+            'notification_type': self.notification_type,
+            'channels': self.channels,
+            'total_recipients': self.total_recipients,
+            'processed_count': self.processed_count,
+            'sent_count': self.sent_count,
+            'failed_count': self.failed_count,
+            'progress_percent': progress,
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    def __repr__(self):
+        return f'<NotificationJob {self.id}: {self.kind}-{self.status}>'
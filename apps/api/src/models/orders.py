@@ -42,6 +42,10 @@ class PaymentStatus(Enum):
 
 class Order(db.Model):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Paginação por cursor: (created_at, id) é a chave de ordenação
+        db.Index("idx_orders_created_id", "created_at", "id"),
+    )
 
     id = Column(UUID(as_uuid = True), primary_key = True, default = uuid.uuid4)
     order_number = Column(String(50), unique = True, nullable = False)
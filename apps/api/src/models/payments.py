@@ -241,17 +241,33 @@ class EscrowTransaction(db.Model):
 
 
 class PaymentWebhook(db.Model):
+    """Caixa de entrada durável de webhooks (Mercado Pago, Melhor Envio)"""
     __tablename__ = 'payment_webhooks'
 
     id = Column(UUID(as_uuid = True), primary_key = True, default = uuid4)
     provider = Column(String(50), nullable = False)
     event_type = Column(String(100), nullable = False)
+    # Chave de idempotência: id do evento ou da entrega no provedor, recurso
+    # (IPN legado) ou hash do payload
+    event_id = Column(String(150), nullable = False)
     payload = Column(Text, nullable = False)
+
+    # Fila: received -> processing -> processed | failed (nova tentativa) | dead
+    status = Column(String(20), default = 'received', nullable = False)
+    attempts = Column(Integer, default = 0, nullable = False)
+    next_attempt_at = Column(DateTime, default = datetime.utcnow, nullable = False)
+    locked_at = Column(DateTime)
+
     processed = Column(Boolean, default = False)
     processing_error = Column(Text)
     created_at = Column(DateTime, default = datetime.utcnow)
     processed_at = Column(DateTime)
 
+    __table_args__ = (
+        db.UniqueConstraint('provider', 'event_id', name = 'uq_payment_webhooks_provider_event'),
+        db.Index('idx_payment_webhooks_status_next', 'status', 'next_attempt_at'),
+    )
+
     def __repr__(self):
         return f"<PaymentWebhook(id={self.id}, provider={self.provider}, event_type={self.event_type})>"
 
@@ -260,7 +276,11 @@ class PaymentWebhook(db.Model):
             'id': str(self.id),
             'provider': self.provider,
             'event_type': self.event_type,
+            'event_id': self.event_id,
             'payload': self.payload,
+            'status': self.status,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
             'processed': self.processed,
             'processing_error': self.processing_error,
             'created_at': self.created_at.isoformat() if self.created_at else None,
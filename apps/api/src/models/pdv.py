@@ -6,7 +6,7 @@ from datetime import datetime
 from decimal import Decimal
 from sqlalchemy import (
     Column, String, Text, Integer, Numeric, Boolean, DateTime, Date, ForeignKey,
-    CheckConstraint, Index
+    CheckConstraint, Index, UniqueConstraint
 )
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
@@ -152,6 +152,20 @@ class CashMovement(db.Model):
         ),
     )
 
+    def __repr__(self):
+        return f'<CashMovement {self.type} {self.amount}>'
+
+    def to_dict(self):
+        return {
+            'id': str(self.id),
+            'session_id': str(self.session_id),
+            'type': self.type,
+            'amount': float(self.amount),
+            'reason': self.reason,
+            'authorized_by': str(self.authorized_by) if self.authorized_by else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 
 class Sale(db.Model):
     """Vendas realizadas no PDV"""
@@ -192,6 +206,9 @@ class Sale(db.Model):
     # Status
     status = Column(String(20), default='completed')  # completed, cancelled, refunded
 
+    # Identificador gerado pelo terminal (vendas enfileiradas offline)
+    client_reference = Column(String(100))
+
     # Timestamps
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
     cancelled_at = Column(DateTime(timezone=True))
@@ -212,6 +229,7 @@ class Sale(db.Model):
         ),
         Index('idx_sale_session', 'session_id'),
         Index('idx_sale_created', 'created_at'),
+        UniqueConstraint('cash_register_id', 'client_reference', name='uq_sale_register_client_reference'),
     )
 
     def __repr__(self):
@@ -258,6 +276,10 @@ class SaleItem(db.Model):
     sale = relationship('Sale', back_populates='items')
     product = relationship('Product')
 
+    __table_args__ = (
+        Index('idx_sale_item_sale', 'sale_id'),
+    )
+
     def __repr__(self):
         return f'<SaleItem sale={self.sale_id} product={self.product_id}>'
 
@@ -0,0 +1,129 @@
+"""
+Modelos de agregados diários de vendas (rollups)
+Mantidos incrementalmente pelo SalesRollupService para os endpoints de analytics
+"""
+
+import uuid
+
+from sqlalchemy import (
+    DECIMAL,
+    Column,
+    Date,
+    DateTime,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+)
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+
+from database import db
+
+
+class DailySalesRollup(db.Model):
+    """Pedidos por dia, status e status de pagamento"""
+
+    __tablename__ = "daily_sales_rollup"
+
+    id = Column(UUID(as_uuid = True), primary_key = True, default = uuid.uuid4)
+    day = Column(Date, nullable = False)
+    status = Column(String(20))
+    payment_status = Column(String(20))
+
+    orders_count = Column(Integer, nullable = False, default = 0)
+    total_amount = Column(DECIMAL(14, 2), nullable = False, default = 0)
+
+    updated_at = Column(DateTime, default = func.now(), onupdate = func.now())
+
+    __table_args__ = (
+        UniqueConstraint("day", "status", "payment_status", name = "uq_daily_sales_rollup"),
+    )
+
+    def __repr__(self):
+        return f"<DailySalesRollup(day={self.day}, status={self.status}, orders={self.orders_count})>"
+
+    def to_dict(self):
+        return {
+            "day": self.day.isoformat() if self.day else None,
+            "status": self.status,
+            "payment_status": self.payment_status,
+            "orders_count": self.orders_count,
+            "total_amount": float(self.total_amount) if self.total_amount else 0.0,
+        }
+
+
+class DailyProductSalesRollup(db.Model):
+    """Itens vendidos por dia e produto (somente pedidos concluídos)"""
+
+    __tablename__ = "daily_product_sales_rollup"
+
+    id = Column(UUID(as_uuid = True), primary_key = True, default = uuid.uuid4)
+    day = Column(Date, nullable = False)
+    product_id = Column(UUID(as_uuid = True))
+    product_name = Column(String(255), nullable = False)
+
+    quantity = Column(Integer, nullable = False, default = 0)
+    revenue = Column(DECIMAL(14, 2), nullable = False, default = 0)
+    order_lines = Column(Integer, nullable = False, default = 0)
+
+    updated_at = Column(DateTime, default = func.now(), onupdate = func.now())
+
+    def __repr__(self):
+        return f"<DailyProductSalesRollup(day={self.day}, product={self.product_name})>"
+
+    def to_dict(self):
+        return {
+            "day": self.day.isoformat() if self.day else None,
+            "product_id": str(self.product_id) if self.product_id else None,
+            "product_name": self.product_name,
+            "quantity": self.quantity,
+            "revenue": float(self.revenue) if self.revenue else 0.0,
+            "order_lines": self.order_lines,
+        }
+
+
+class DailyCustomerSalesRollup(db.Model):
+    """Pedidos por dia e cliente (todos os status)"""
+
+    __tablename__ = "daily_customer_sales_rollup"
+
+    id = Column(UUID(as_uuid = True), primary_key = True, default = uuid.uuid4)
+    day = Column(Date, nullable = False)
+    customer_id = Column(UUID(as_uuid = True), nullable = False)
+
+    orders_count = Column(Integer, nullable = False, default = 0)
+    total_amount = Column(DECIMAL(14, 2), nullable = False, default = 0)
+
+    updated_at = Column(DateTime, default = func.now(), onupdate = func.now())
+
+    __table_args__ = (
+        UniqueConstraint("day", "customer_id", name = "uq_daily_customer_sales_rollup"),
+    )
+
+    def __repr__(self):
+        return f"<DailyCustomerSalesRollup(day={self.day}, customer={self.customer_id})>"
+
+    def to_dict(self):
+        return {
+            "day": self.day.isoformat() if self.day else None,
+            "customer_id": str(self.customer_id),
+            "orders_count": self.orders_count,
+            "total_amount": float(self.total_amount) if self.total_amount else 0.0,
+        }
+
+
+class SalesRollupPendingDay(db.Model):
+    """Dias com pedidos alterados aguardando recálculo do rollup"""
+
+    __tablename__ = "sales_rollup_pending_days"
+
+    day = Column(Date, primary_key = True)
+    marked_at = Column(DateTime, nullable = False, default = func.now())
+
+    def __repr__(self):
+        return f"<SalesRollupPendingDay(day={self.day})>"
+
+
+Index("idx_daily_product_sales_rollup_day", DailyProductSalesRollup.day)
+Index("idx_daily_customer_sales_rollup_customer", DailyCustomerSalesRollup.customer_id)
@@ -4,7 +4,7 @@ Modelos de sistema
 
 import uuid
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, String, Text
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Index, String, Text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 
@@ -111,3 +111,29 @@ class AuditLog(db.Model):
             "user_agent": self.user_agent,
             "created_at": self.created_at.isoformat(),
         }
+
+
+class EventOutbox(db.Model):
+    """Outbox transacional do EventSystem (opcional)"""
+    __tablename__ = "event_outbox"
+
+    id = Column(UUID(as_uuid = True), primary_key = True, default = uuid.uuid4)
+    event_id = Column(String(64), unique = True, nullable = False)
+    event_type = Column(String(50), nullable = False)
+    user_id = Column(String(64))
+    payload = Column(Text, nullable = False)
+    origin = Column(String(64), nullable = False)  # processo que emitiu
+    occurred_at = Column(DateTime, nullable = False)
+    created_at = Column(DateTime, nullable = False)
+
+    # Entrega: reservado por um processo, concluído depois dos handlers
+    claimed_by = Column(String(64))
+    claimed_at = Column(DateTime)
+    processed_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("idx_event_outbox_pending", "processed_at", "created_at"),
+    )
+
+    def __repr__(self):
+        return f"<EventOutbox(event_id={self.event_id}, type={self.event_type})>"
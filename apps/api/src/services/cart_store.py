@@ -0,0 +1,580 @@
+"""
+Armazenamento do carrinho de compras
+Com Redis, o carrinho de cada usuário vive em um hash (linhas + contador de
+itens) e as operações são scripts Lua atômicos; o banco (Cart/CartItem) é
+atualizado em background (write-behind) a partir de um conjunto de carrinhos
+alterados, que sobrevive a reinícios da aplicação. Sem Redis, as operações vão
+direto ao banco, como antes.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, insert
+
+from database import db
+from utils.cache import cache_manager
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "mc:cart"
+DIRTY_KEY = f"{KEY_PREFIX}:dirty"
+CART_TTL = int(os.environ.get("CART_REDIS_TTL", 7 * 86400))
+
+FLUSH_INTERVAL = int(os.environ.get("CART_FLUSH_INTERVAL", 5))
+FLUSH_BATCH_SIZE = 200
+LOCK_NAME = "cart:flush"
+LOCK_TIMEOUT = 60
+# Lock por carrinho: o flush do checkout não espera o lote do worker
+USER_LOCK_TIMEOUT = 30
+LOCK_WAIT = 5.0
+LOCK_POLL = 0.05
+
+# Contador de unidades no hash (linhas usam o prefixo "l:")
+_COUNT = "__count"
+
+# Resultado dos scripts quando o carrinho ainda não está no Redis
+_NOT_LOADED = -2
+
+# Soma `qty` à linha (criando-a com ARGV[2] se não existir), respeitando o máximo.
+# KEYS = carrinho, conjunto de alterados
+# ARGV = campo, linha, qty, máximo (-1 = sem), ttl, usuário, agora
+# Retorna {quantidade final, quantidade anterior}; {-1, anterior} se exceder o máximo
+_ADD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return {-2, 0} end
+local qty = tonumber(ARGV[3])
+local max = tonumber(ARGV[4])
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+local line = cjson.decode(raw or ARGV[2])
+local previous = raw and tonumber(line.quantity) or 0
+local total = previous + qty
+if max >= 0 and total > max then return {-1, previous} end
+line.quantity = total
+line.updated_at = ARGV[7]
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(line))
+redis.call('HINCRBY', KEYS[1], '__count', qty)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[5]))
+redis.call('SADD', KEYS[2], ARGV[6])
+return {total, previous}
+"""
+
+# Define a quantidade da primeira linha do produto (0 remove a linha).
+# ARGV = prefixo do campo ("l:<product_id>|"), quantidade, ttl, usuário, agora
+# Retorna a quantidade anterior, -1 se o produto não estiver no carrinho
+_SET_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return -2 end
+local fields = redis.call('HKEYS', KEYS[1])
+table.sort(fields)
+for _, name in ipairs(fields) do
+    if string.sub(name, 1, string.len(ARGV[1])) == ARGV[1] then
+        local line = cjson.decode(redis.call('HGET', KEYS[1], name))
+        local previous = tonumber(line.quantity)
+        local qty = tonumber(ARGV[2])
+        if qty == 0 then
+            redis.call('HDEL', KEYS[1], name)
+        else
+            line.quantity = qty
+            line.updated_at = ARGV[5]
+            redis.call('HSET', KEYS[1], name, cjson.encode(line))
+        end
+        redis.call('HINCRBY', KEYS[1], '__count', qty - previous)
+        redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+        redis.call('SADD', KEYS[2], ARGV[4])
+        return previous
+    end
+end
+return -1
+"""
+
+# Esvazia o carrinho (mantendo-o carregado); retorna o número de linhas removidas
+_CLEAR_SCRIPT = """
+local lines = 0
+for _, name in ipairs(redis.call('HKEYS', KEYS[1])) do
+    if string.sub(name, 1, 2) == 'l:' then lines = lines + 1 end
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], '__loaded', '1', '__count', '0')
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+redis.call('SADD', KEYS[2], ARGV[2])
+return lines
+"""
+
+# Carrega o carrinho vindo do banco, a menos que outro processo já o tenha feito
+# ARGV = ttl, contador, pares campo/linha...
+_LOAD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[1], '__loaded', '1', '__count', ARGV[2])
+for i = 3, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+return 1
+"""
+
+
+class CartLimitExceeded(Exception):
+    """Quantidade total no carrinho excederia o estoque"""
+
+    def __init__(self, in_cart: int):
+        self.in_cart = in_cart
+        super().__init__(f"Quantidade excede o estoque (atual no carrinho: {in_cart})")
+
+
+class CartFlushError(Exception):
+    """Não foi possível gravar o carrinho do Redis no banco"""
+
+
+@dataclass
+class CartLine:
+    """Linha do carrinho (produto + preço/peso escolhido)"""
+
+    product_id: str
+    quantity: int = 0
+    product_price_id: Optional[str] = None
+    weight: Optional[str] = None
+    unit_price: Optional[float] = None
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    added_at: Optional[str] = None
+    updated_at: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        """Mesma regra de agrupamento do carrinho: preço específico ou, na falta dele, peso"""
+        if self.product_price_id:
+            return f"l:{self.product_id}|p:{self.product_price_id}"
+        return f"l:{self.product_id}|w:{self.weight or ''}"
+
+    @classmethod
+    def from_json(cls, raw: str) -> "CartLine":
+        data = json.loads(raw)
+        return cls(**{name: data.get(name) for name in cls.__dataclass_fields__})
+
+    @classmethod
+    def from_item(cls, item) -> "CartLine":
+        return cls(
+            id=str(item.id),
+            product_id=str(item.product_id),
+            product_price_id=str(item.product_price_id) if item.product_price_id else None,
+            weight=item.weight,
+            unit_price=float(item.unit_price) if item.unit_price is not None else None,
+            quantity=item.quantity,
+            added_at=item.added_at.isoformat() if item.added_at else None,
+            updated_at=item.updated_at.isoformat() if item.updated_at else None,
+        )
+
+
+def _as_uuid(value) -> uuid.UUID:
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _load_db_lines(user_id) -> List[CartLine]:
+    from models.orders import Cart, CartItem
+
+    items = (
+        db.session.query(CartItem)
+        .join(Cart, Cart.id == CartItem.cart_id)
+        .filter(Cart.user_id == _as_uuid(user_id))
+        .order_by(CartItem.added_at, CartItem.id)
+        .all()
+    )
+    return [CartLine.from_item(item) for item in items]
+
+
+class RedisCartBackend:
+    """Carrinho no Redis; o banco é atualizado por flush()"""
+
+    def __init__(self, client):
+        self.client = client
+        self._add = client.register_script(_ADD_SCRIPT)
+        self._set = client.register_script(_SET_SCRIPT)
+        self._clear = client.register_script(_CLEAR_SCRIPT)
+        self._load = client.register_script(_LOAD_SCRIPT)
+
+    @staticmethod
+    def _key(user_id) -> str:
+        return f"{KEY_PREFIX}:{user_id}"
+
+    def _ensure_loaded(self, user_id) -> None:
+        # Linhas duplicadas no banco (mesmo produto/peso) viram uma só
+        lines: Dict[str, CartLine] = {}
+        for line in _load_db_lines(user_id):
+            if line.key in lines:
+                lines[line.key].quantity += line.quantity
+            else:
+                lines[line.key] = line
+
+        args = [CART_TTL, sum(line.quantity for line in lines.values())]
+        for key, line in lines.items():
+            args += [key, json.dumps(asdict(line))]
+        self._load(keys=[self._key(user_id)], args=args)
+
+    def _run(self, user_id, script, args):
+        """Executa o script; se o carrinho não estiver no Redis, carrega do banco e repete"""
+        keys = [self._key(user_id), DIRTY_KEY]
+        result = script(keys=keys, args=args)
+        if (result[0] if isinstance(result, list) else result) == _NOT_LOADED:
+            self._ensure_loaded(user_id)
+            result = script(keys=keys, args=args)
+        return result
+
+    def get_lines(self, user_id) -> List[CartLine]:
+        data = self.client.hgetall(self._key(user_id))
+        if not data:
+            self._ensure_loaded(user_id)
+            data = self.client.hgetall(self._key(user_id))
+        lines = [CartLine.from_json(raw) for name, raw in data.items() if name.startswith("l:")]
+        return sorted(lines, key=lambda line: (line.added_at or "", line.id))
+
+    def count(self, user_id) -> int:
+        count = self.client.hget(self._key(user_id), _COUNT)
+        if count is None:
+            self._ensure_loaded(user_id)
+            count = self.client.hget(self._key(user_id), _COUNT)
+        return int(count or 0)
+
+    def add(self, user_id, line: CartLine, quantity: int, max_quantity: Optional[int] = None) -> int:
+        now = datetime.utcnow().isoformat()
+        line.added_at = line.added_at or now
+        total, previous = self._run(user_id, self._add, [
+            line.key, json.dumps(asdict(line)), quantity,
+            -1 if max_quantity is None else max_quantity, CART_TTL, str(user_id), now,
+        ])
+        if total == -1:
+            raise CartLimitExceeded(previous)
+        return total
+
+    def set_quantity(self, user_id, product_id, quantity: int) -> bool:
+        previous = self._run(user_id, self._set, [
+            f"l:{product_id}|", quantity, CART_TTL, str(user_id), datetime.utcnow().isoformat(),
+        ])
+        return previous >= 0
+
+    def clear(self, user_id) -> int:
+        return self._clear(keys=[self._key(user_id), DIRTY_KEY], args=[CART_TTL, str(user_id)])
+
+    def pop_dirty(self, limit: int) -> List[str]:
+        return self.client.spop(DIRTY_KEY, limit) or []
+
+    def mark_dirty(self, user_ids: List[str]) -> None:
+        if user_ids:
+            self.client.sadd(DIRTY_KEY, *user_ids)
+
+    def snapshot(self, user_id) -> Optional[List[CartLine]]:
+        """Linhas atuais, ou None se o carrinho não estiver no Redis"""
+        data = self.client.hgetall(self._key(user_id))
+        if not data:
+            return None
+        return [CartLine.from_json(raw) for name, raw in data.items() if name.startswith("l:")]
+
+
+class DatabaseCartBackend:
+    """Carrinho direto no banco (sem Redis): cada operação é gravada na hora"""
+
+    def _cart(self, user_id, create: bool = False):
+        from models.orders import Cart
+
+        # Lock no carrinho do usuário serializa alterações concorrentes (no
+        # lugar do lock no produto, que bloqueava carrinhos de todos os usuários)
+        cart = Cart.query.filter_by(user_id=_as_uuid(user_id)).with_for_update().first()
+        if cart is None and create:
+            cart = Cart(user_id=_as_uuid(user_id))
+            db.session.add(cart)
+            db.session.flush()
+        return cart
+
+    def get_lines(self, user_id) -> List[CartLine]:
+        return _load_db_lines(user_id)
+
+    def count(self, user_id) -> int:
+        from models.orders import Cart, CartItem
+
+        count = (
+            db.session.query(func.sum(CartItem.quantity))
+            .join(Cart, Cart.id == CartItem.cart_id)
+            .filter(Cart.user_id == _as_uuid(user_id))
+            .scalar()
+        )
+        return int(count or 0)
+
+    def add(self, user_id, line: CartLine, quantity: int, max_quantity: Optional[int] = None) -> int:
+        from models.orders import CartItem
+
+        cart = self._cart(user_id, create=True)
+        filters = dict(cart_id=cart.id, product_id=_as_uuid(line.product_id))
+        if line.product_price_id:
+            filters["product_price_id"] = _as_uuid(line.product_price_id)
+        else:
+            filters["weight"] = line.weight
+        item = CartItem.query.filter_by(**filters).first()
+
+        previous = item.quantity if item else 0
+        total = previous + quantity
+        if max_quantity is not None and total > max_quantity:
+            db.session.rollback()
+            raise CartLimitExceeded(previous)
+
+        if item:
+            item.quantity = total
+            item.updated_at = datetime.utcnow()
+        else:
+            db.session.add(CartItem(
+                cart_id=cart.id,
+                product_id=_as_uuid(line.product_id),
+                product_price_id=_as_uuid(line.product_price_id) if line.product_price_id else None,
+                weight=line.weight,
+                unit_price=line.unit_price,
+                quantity=total,
+                added_at=datetime.utcnow(),
+            ))
+        db.session.commit()
+        return total
+
+    def set_quantity(self, user_id, product_id, quantity: int) -> bool:
+        from models.orders import CartItem
+
+        cart = self._cart(user_id)
+        item = cart and CartItem.query.filter_by(cart_id=cart.id, product_id=_as_uuid(product_id)).first()
+        if not item:
+            return False
+        if quantity == 0:
+            db.session.delete(item)
+        else:
+            item.quantity = quantity
+            item.updated_at = datetime.utcnow()
+        db.session.commit()
+        return True
+
+    def clear(self, user_id) -> int:
+        from models.orders import CartItem
+
+        cart = self._cart(user_id)
+        if not cart:
+            return 0
+        removed = CartItem.query.filter_by(cart_id=cart.id).delete()
+        db.session.commit()
+        return removed
+
+
+class CartStore:
+    """
+    Seleciona o backend do carrinho: Redis quando disponível, senão o banco
+
+    Interface comum: get_lines, count, add, set_quantity (0 remove) e clear.
+    """
+
+    def __init__(self, flush_interval: int = FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.database = DatabaseCartBackend()
+        self._redis_backend = None
+        self._redis_client = None
+        self._app = None
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    def _backend(self):
+        client = cache_manager.redis_client
+        if client is None:
+            return self.database
+        if client is not self._redis_client:
+            self._redis_backend = RedisCartBackend(client)
+            self._redis_client = client
+        return self._redis_backend
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+
+    def init_app(self, app) -> None:
+        """Inicia o flush em background (retoma carrinhos alterados antes do reinício)"""
+        self._app = app
+        self.start()
+
+    def start(self) -> None:
+        with self._worker_lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._worker_loop, name="cart-flush", daemon=True)
+            self._worker.start()
+
+    def get_lines(self, user_id) -> List[CartLine]:
+        return self._backend().get_lines(user_id)
+
+    def count(self, user_id) -> int:
+        """Total de unidades no carrinho (com Redis, sem consultar o banco)"""
+        return self._backend().count(user_id)
+
+    def add(self, user_id, line: CartLine, quantity: int, max_quantity: Optional[int] = None) -> int:
+        """
+        Soma `quantity` à linha do carrinho
+
+        Returns:
+            Quantidade final da linha
+
+        Raises:
+            CartLimitExceeded: o total passaria de `max_quantity`
+        """
+        return self._backend().add(user_id, line, quantity, max_quantity)
+
+    def set_quantity(self, user_id, product_id, quantity: int) -> bool:
+        """Define a quantidade do produto (0 remove); False se não estiver no carrinho"""
+        return self._backend().set_quantity(user_id, product_id, quantity)
+
+    def remove(self, user_id, product_id) -> bool:
+        return self.set_quantity(user_id, product_id, 0)
+
+    def clear(self, user_id) -> int:
+        """Esvazia o carrinho; retorna o número de linhas removidas"""
+        return self._backend().clear(user_id)
+
+    def flush(self, user_id=None) -> int:
+        """
+        Grava no banco os carrinhos alterados no Redis
+
+        Args:
+            user_id: Grava só este carrinho (ex.: antes de ler Cart/CartItem no
+                checkout), esperando até LOCK_WAIT por um flush em andamento dele
+
+        Returns:
+            Número de carrinhos gravados
+
+        Raises:
+            CartFlushError: o carrinho de `user_id` não pôde ser gravado
+        """
+        backend = self._backend()
+        if backend is self.database:
+            return 0
+
+        if user_id is not None:
+            backend.client.srem(DIRTY_KEY, str(user_id))
+            try:
+                flushed = self._flush_user(backend, str(user_id), wait=LOCK_WAIT)
+            except Exception as e:
+                backend.mark_dirty([str(user_id)])
+                raise CartFlushError(f"Erro ao gravar carrinho {user_id}: {e}") from e
+            if flushed is None:
+                backend.mark_dirty([str(user_id)])
+                raise CartFlushError(f"Carrinho {user_id} ocupado por outro flush")
+            return int(flushed)
+
+        # Um único lote por vez entre os workers
+        token = cache_manager.acquire_lock(LOCK_NAME, timeout=LOCK_TIMEOUT)
+        if token is None:
+            return 0
+
+        try:
+            flushed = 0
+            for dirty_user in backend.pop_dirty(FLUSH_BATCH_SIZE):
+                try:
+                    result = self._flush_user(backend, dirty_user)
+                except Exception as e:
+                    logger.error(f"Erro ao gravar carrinho {dirty_user}: {e}")
+                    result = None
+                if result is None:
+                    # Gravado por um checkout agora ou com erro: fica para o próximo ciclo
+                    backend.mark_dirty([dirty_user])
+                elif result:
+                    flushed += 1
+            return flushed
+        finally:
+            cache_manager.release_lock(LOCK_NAME, token)
+
+    def _flush_user(self, backend: "RedisCartBackend", user_id: str, wait: float = 0) -> Optional[bool]:
+        """
+        Grava um carrinho sob o lock dele
+
+        Returns:
+            Resultado de _persist, ou None se o lock não foi obtido em `wait` segundos
+        """
+        lock_name = f"{LOCK_NAME}:{user_id}"
+        token = cache_manager.acquire_lock(lock_name, timeout=USER_LOCK_TIMEOUT)
+        deadline = time.monotonic() + wait
+        while token is None and time.monotonic() < deadline:
+            time.sleep(LOCK_POLL)
+            token = cache_manager.acquire_lock(lock_name, timeout=USER_LOCK_TIMEOUT)
+        if token is None:
+            return None
+
+        try:
+            return self._persist(backend, user_id)
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            cache_manager.release_lock(lock_name, token)
+
+    # ------------------------------------------------------------------
+    # Write-behind
+    # ------------------------------------------------------------------
+
+    def _worker_loop(self) -> None:
+        with self._app.app_context():
+            while True:
+                try:
+                    while self.flush() >= FLUSH_BATCH_SIZE:
+                        pass
+                except Exception as e:
+                    logger.error(f"Erro no flush de carrinhos: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+                time.sleep(self.flush_interval)
+
+    @staticmethod
+    def _persist(backend: RedisCartBackend, user_id: str) -> bool:
+        """Substitui os itens do carrinho no banco pelo estado atual do Redis"""
+        from models.orders import Cart, CartItem
+
+        lines = backend.snapshot(user_id)
+        if lines is None:
+            # Expirou no Redis: o banco continua valendo
+            return False
+
+        user_uuid = _as_uuid(user_id)
+        cart = Cart.query.filter_by(user_id=user_uuid).first()
+        if cart is None:
+            if not lines:
+                return True
+            cart = Cart(user_id=user_uuid)
+            db.session.add(cart)
+            db.session.flush()
+
+        CartItem.query.filter_by(cart_id=cart.id).delete(synchronize_session=False)
+        if lines:
+            db.session.execute(insert(CartItem), [
+                {
+                    "id": _as_uuid(line.id),
+                    "cart_id": cart.id,
+                    "product_id": _as_uuid(line.product_id),
+                    "product_price_id": _as_uuid(line.product_price_id) if line.product_price_id else None,
+                    "weight": line.weight,
+                    "unit_price": line.unit_price,
+                    "quantity": line.quantity,
+                    "added_at": _parse_datetime(line.added_at),
+                    "updated_at": _parse_datetime(line.updated_at) or datetime.utcnow(),
+                }
+                for line in lines
+            ])
+        cart.updated_at = datetime.utcnow()
+        db.session.commit()
+        return True
+
+
+# Instância global do carrinho
+cart_store = CartStore()
+
+
+def init_cart_store(app) -> None:
+    """Inicia a gravação em background dos carrinhos mantidos no Redis"""
+    cart_store.init_app(app)
@@ -23,6 +23,10 @@ import os
 import uuid
 import hashlib
 import base64
+import threading
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
 from datetime import datetime, timedelta
 from typing import Optional, Tuple, Dict, Any, List
 from dataclasses import dataclass
@@ -58,6 +62,24 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 
+# Tag assinada e atributo de referência por tipo de documento
+TAGS_ASSINATURA = {
+    "nfe": ("infNFe", "Id"),
+    "evento": ("infEvento", "Id"),
+    "inutilizacao": ("infInut", "Id"),
+}
+
+# Assinatura em lote: processos dedicados (RSA e C14N usam CPU e seguram o GIL
+# em boa parte do trabalho). Lotes pequenos são assinados no próprio processo.
+# Há um pool por certificado, compartilhado entre instâncias do serviço e
+# encerrado depois de ASSINATURA_POOL_OCIOSO segundos sem lotes.
+ASSINATURA_PROCESSOS = int(os.getenv("ASSINATURA_PROCESSOS", min(os.cpu_count() or 1, 4)))
+ASSINATURA_LOTE_MINIMO = int(os.getenv("ASSINATURA_LOTE_MINIMO", 8))
+ASSINATURA_POOL_OCIOSO = float(os.getenv("ASSINATURA_POOL_OCIOSO", 300))
+
+C14N_ALGORITHM = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+
+
 class TipoCertificado(Enum):
     """Tipos de certificado digital"""
     A1 = "A1"  # Arquivo (validade 1 ano)
@@ -102,6 +124,204 @@ class ResultadoAssinatura:
     algoritmo: str = "RSA-SHA256"
 
 
+class ContextoAssinatura:
+    """
+    Material de assinatura preparado uma vez por certificado carregado
+
+    Guarda a chave privada já desserializada, o certificado em PEM e o
+    thumbprint; o XMLSigner é criado uma vez por thread e reaproveitado.
+    """
+
+    def __init__(self, chave_privada, certificado_pem: str, thumbprint: str):
+        self.chave_privada = chave_privada
+        self.certificado_pem = certificado_pem
+        self.thumbprint = thumbprint
+        self._local = threading.local()
+
+    @classmethod
+    def do_certificado(cls, certificado, chave_privada) -> "ContextoAssinatura":
+        thumbprint = hashlib.sha256(
+            certificado.public_bytes(serialization.Encoding.DER)
+        ).hexdigest().upper()
+        certificado_pem = certificado.public_bytes(serialization.Encoding.PEM).decode('ascii')
+        return cls(chave_privada, certificado_pem, thumbprint)
+
+    def chave_pem(self) -> bytes:
+        """Chave em PKCS8 (somente para repassar aos processos de assinatura em lote)"""
+        return self.chave_privada.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+
+    def _signer(self):
+        signer = getattr(self._local, "signer", None)
+        if signer is None:
+            signer = self._local.signer = XMLSigner(
+                method=methods.enveloped,
+                signature_algorithm="rsa-sha256",
+                digest_algorithm="sha256",
+                c14n_algorithm=C14N_ALGORITHM
+            )
+        return signer
+
+    def assinar(self, xml_string: str, tag_assinar: str, id_attribute: str) -> ResultadoAssinatura:
+        try:
+            # Parse do XML
+            doc = etree.fromstring(xml_string.encode('utf-8'))
+
+            # Encontra elemento a assinar
+            elementos = _XPATH_LOCAL_NAME(doc, nome=tag_assinar)
+            if not elementos:
+                return ResultadoAssinatura(
+                    sucesso=False,
+                    erro=f"Tag '{tag_assinar}' não encontrada no XML"
+                )
+
+            elemento_id = elementos[0].get(id_attribute)
+            if not elemento_id:
+                return ResultadoAssinatura(
+                    sucesso=False,
+                    erro=f"Atributo '{id_attribute}' não encontrado"
+                )
+
+            # Assina
+            signed_doc = self._signer().sign(
+                doc,
+                key=self.chave_privada,
+                cert=self.certificado_pem,
+                reference_uri=f"#{elemento_id}"
+            )
+
+            # Converte para string (lxml só emite a declaração ao serializar em bytes)
+            xml_assinado = etree.tostring(
+                signed_doc,
+                encoding='UTF-8',
+                xml_declaration=True
+            ).decode('utf-8')
+
+            return ResultadoAssinatura(
+                sucesso=True,
+                xml_assinado=xml_assinado,
+                certificado_usado=self.thumbprint
+            )
+
+        except Exception as e:
+            logger.error(f"Erro ao assinar XML: {str(e)}")
+            return ResultadoAssinatura(
+                sucesso=False,
+                erro=f"Erro ao assinar: {str(e)}"
+            )
+
+
+if SIGNXML_AVAILABLE:
+    _XPATH_LOCAL_NAME = etree.XPath("//*[local-name()=$nome]")
+
+
+# Contexto de cada processo do pool de assinatura em lote
+_contexto_processo: Optional[ContextoAssinatura] = None
+
+
+def _inicializar_processo_assinatura(chave_pem: bytes, certificado_pem: str, thumbprint: str) -> None:
+    global _contexto_processo
+    chave = serialization.load_pem_private_key(chave_pem, password=None)
+    _contexto_processo = ContextoAssinatura(chave, certificado_pem, thumbprint)
+
+
+def _assinar_no_processo(args: Tuple[str, str, str]) -> ResultadoAssinatura:
+    xml_string, tag_assinar, id_attribute = args
+    return _contexto_processo.assinar(xml_string, tag_assinar, id_attribute)
+
+
+@dataclass
+class _PoolAssinatura:
+    pool: ProcessPoolExecutor
+    lotes: int = 0
+    timer: Optional[threading.Timer] = None
+
+
+class PoolsAssinatura:
+    """
+    Pools de processos de assinatura por certificado (thumbprint)
+
+    Instâncias do serviço com o mesmo certificado dividem o mesmo pool. O pool
+    sai do registro quando fica ASSINATURA_POOL_OCIOSO segundos sem lotes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools: Dict[str, _PoolAssinatura] = {}
+
+    def __len__(self):
+        return len(self._pools)
+
+    def obter(self, contexto: ContextoAssinatura, processos: int) -> ProcessPoolExecutor:
+        """Pool do certificado (criado na primeira chamada), reservado até liberar()"""
+        with self._lock:
+            registro = self._pools.get(contexto.thumbprint)
+            if registro is None:
+                # spawn: o processo da API tem threads (worker de lotes, pools HTTP)
+                registro = self._pools[contexto.thumbprint] = _PoolAssinatura(ProcessPoolExecutor(
+                    max_workers=min(processos, ASSINATURA_PROCESSOS),
+                    mp_context=get_context("spawn"),
+                    initializer=_inicializar_processo_assinatura,
+                    initargs=(contexto.chave_pem(), contexto.certificado_pem, contexto.thumbprint)
+                ))
+            if registro.timer is not None:
+                registro.timer.cancel()
+                registro.timer = None
+            registro.lotes += 1
+            return registro.pool
+
+    def liberar(self, thumbprint: str, pool: ProcessPoolExecutor) -> None:
+        """Fim de um lote; sem outros lotes, o pool começa a contar o tempo ocioso"""
+        with self._lock:
+            registro = self._pools.get(thumbprint)
+            if registro is None or registro.pool is not pool:
+                return
+            registro.lotes -= 1
+            if registro.lotes == 0:
+                registro.timer = threading.Timer(ASSINATURA_POOL_OCIOSO, self.encerrar_ocioso, (thumbprint, pool))
+                registro.timer.daemon = True
+                registro.timer.start()
+
+    def encerrar_ocioso(self, thumbprint: str, pool: Optional[ProcessPoolExecutor] = None) -> bool:
+        """Encerra o pool do certificado se nenhum lote o estiver usando"""
+        with self._lock:
+            registro = self._pools.get(thumbprint)
+            if registro is None or registro.lotes or (pool is not None and registro.pool is not pool):
+                return False
+            del self._pools[thumbprint]
+        if registro.timer is not None:
+            registro.timer.cancel()
+        registro.pool.shutdown(wait=False, cancel_futures=True)
+        return True
+
+    def descartar(self, thumbprint: str, pool: ProcessPoolExecutor) -> None:
+        """Remove um pool quebrado (sem derrubar um pool novo do mesmo certificado)"""
+        with self._lock:
+            registro = self._pools.get(thumbprint)
+            if registro is None or registro.pool is not pool:
+                registro = None
+            else:
+                del self._pools[thumbprint]
+        if registro is not None and registro.timer is not None:
+            registro.timer.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def encerrar_todos(self) -> None:
+        with self._lock:
+            registros, self._pools = list(self._pools.values()), {}
+        for registro in registros:
+            if registro.timer is not None:
+                registro.timer.cancel()
+            registro.pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Pools de assinatura do processo (compartilhados entre CertificateService)
+pools_assinatura = PoolsAssinatura()
+
+
 class CertificateService:
     """
     Serviço de gerenciamento de certificados digitais ICP-Brasil
@@ -136,6 +356,8 @@ class CertificateService:
         self.certificados_path = certificados_path or os.getenv("CERTIFICADOS_PATH", "/tmp/certificados")
         self._certificado_atual = None
         self._chave_privada_atual = None
+        self._cadeia_atual = []
+        self._contexto_assinatura: Optional[ContextoAssinatura] = None
 
         # Cria diretório se não existir
         if not os.path.exists(self.certificados_path):
@@ -210,6 +432,9 @@ class CertificateService:
             # Armazena para uso posterior
             self._certificado_atual = certificate
             self._chave_privada_atual = private_key
+            self._cadeia_atual = list(additional_certs or [])
+            self._liberar_pool_assinatura()
+            self._contexto_assinatura = ContextoAssinatura.do_certificado(certificate, private_key)
 
             return info.is_valid, info
 
@@ -404,77 +629,87 @@ class CertificateService:
                 erro="Biblioteca signxml não disponível"
             )
 
-        if not self._certificado_atual or not self._chave_privada_atual:
+        contexto = self._obter_contexto_assinatura()
+        if contexto is None:
             return ResultadoAssinatura(
                 sucesso=False,
                 erro="Nenhum certificado carregado"
             )
 
-        try:
-            # Parse do XML
-            doc = etree.fromstring(xml_string.encode('utf-8'))
-
-            # Encontra elemento a assinar
-            elementos = doc.xpath(f"//*[local-name()='{tag_assinar}']")
-            if not elementos:
-                return ResultadoAssinatura(
-                    sucesso=False,
-                    erro=f"Tag '{tag_assinar}' não encontrada no XML"
-                )
-
-            elemento = elementos[0]
-            elemento_id = elemento.get(id_attribute)
-            if not elemento_id:
-                return ResultadoAssinatura(
-                    sucesso=False,
-                    erro=f"Atributo '{id_attribute}' não encontrado"
-                )
+        return contexto.assinar(xml_string, tag_assinar, id_attribute)
 
-            # Configura assinador
-            signer = XMLSigner(
-                method=methods.enveloped,
-                signature_algorithm="rsa-sha256",
-                digest_algorithm="sha256",
-                c14n_algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+    def _obter_contexto_assinatura(self) -> Optional[ContextoAssinatura]:
+        if not self._certificado_atual or not self._chave_privada_atual:
+            return None
+        if self._contexto_assinatura is None:
+            self._contexto_assinatura = ContextoAssinatura.do_certificado(
+                self._certificado_atual, self._chave_privada_atual
             )
+        return self._contexto_assinatura
 
-            # Serializa chave privada
-            private_key_pem = self._chave_privada_atual.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption()
-            )
+    def assinar_lote(
+        self,
+        xmls: List[str],
+        tipo: str = "nfe",
+        max_processos: int = None
+    ) -> List[ResultadoAssinatura]:
+        """
+        Assina vários documentos do mesmo tipo em um pool de processos
 
-            # Serializa certificado
-            cert_pem = self._certificado_atual.public_bytes(serialization.Encoding.PEM)
+        Cada processo recebe a chave uma única vez (pela inicialização do
+        pool, em memória) e reaproveita seu próprio contexto de assinatura.
+        O pool é o do certificado em pools_assinatura, e o tamanho dele é
+        definido pelo primeiro lote.
 
-            # Assina
-            signed_doc = signer.sign(
-                doc,
-                key=private_key_pem,
-                cert=cert_pem,
-                reference_uri=f"#{elemento_id}"
-            )
+        Args:
+            xmls: XMLs a assinar
+            tipo: nfe, evento ou inutilizacao
+            max_processos: Limite de processos (padrão: ASSINATURA_PROCESSOS)
 
-            # Converte para string
-            xml_assinado = etree.tostring(
-                signed_doc,
-                encoding='unicode',
-                xml_declaration=True
-            )
+        Returns:
+            Lista de ResultadoAssinatura na mesma ordem de `xmls`
+        """
+        if tipo not in TAGS_ASSINATURA:
+            return [ResultadoAssinatura(sucesso=False, erro=f"Tipo de documento desconhecido: {tipo}")] * len(xmls)
+        if not SIGNXML_AVAILABLE:
+            return [ResultadoAssinatura(sucesso=False, erro="Biblioteca signxml não disponível")] * len(xmls)
 
-            return ResultadoAssinatura(
-                sucesso=True,
-                xml_assinado=xml_assinado,
-                certificado_usado=self._extrair_info_certificado(self._certificado_atual).thumbprint
-            )
+        contexto = self._obter_contexto_assinatura()
+        if contexto is None:
+            return [ResultadoAssinatura(sucesso=False, erro="Nenhum certificado carregado")] * len(xmls)
 
-        except Exception as e:
-            logger.error(f"Erro ao assinar XML: {str(e)}")
-            return ResultadoAssinatura(
-                sucesso=False,
-                erro=f"Erro ao assinar: {str(e)}"
-            )
+        tag_assinar, id_attribute = TAGS_ASSINATURA[tipo]
+        processos = max_processos or ASSINATURA_PROCESSOS
+
+        if len(xmls) >= ASSINATURA_LOTE_MINIMO and processos > 1:
+            pool = None
+            try:
+                pool = pools_assinatura.obter(contexto, processos)
+                chunksize = max(1, len(xmls) // (processos * 4))
+                return list(pool.map(
+                    _assinar_no_processo,
+                    [(xml, tag_assinar, id_attribute) for xml in xmls],
+                    chunksize=chunksize
+                ))
+            except (BrokenProcessPool, OSError) as e:
+                logger.error(f"Pool de assinatura indisponível, assinando no processo atual: {str(e)}")
+                if pool is not None:
+                    pools_assinatura.descartar(contexto.thumbprint, pool)
+                    pool = None
+            except (RuntimeError, CancelledError) as e:
+                # Pool encerrado durante o lote (submit recusado ou tarefas
+                # canceladas); o lote segue com o contexto com que começou
+                logger.warning(f"Pool de assinatura encerrado durante o lote, assinando no processo atual: {str(e)}")
+            finally:
+                if pool is not None:
+                    pools_assinatura.liberar(contexto.thumbprint, pool)
+
+        return [contexto.assinar(xml, tag_assinar, id_attribute) for xml in xmls]
+
+    def _liberar_pool_assinatura(self) -> None:
+        """Encerra já o pool do certificado atual se nenhum lote o estiver usando"""
+        if self._contexto_assinatura is not None:
+            pools_assinatura.encerrar_ocioso(self._contexto_assinatura.thumbprint)
 
     def assinar_xml_nfe(self, xml_string: str) -> ResultadoAssinatura:
         """
@@ -542,10 +777,23 @@ class CertificateService:
             serialization.Encoding.PEM
         ).decode('utf-8')
 
+    def obter_credenciais_tls(self) -> Optional[Tuple[Any, Any, List[Any]]]:
+        """
+        Certificado, chave privada e cadeia carregados (objetos cryptography)
+
+        Usado para autenticação mútua TLS com a SEFAZ sem reabrir o PFX.
+        """
+        if not self._certificado_atual or not self._chave_privada_atual:
+            return None
+        return self._certificado_atual, self._chave_privada_atual, self._cadeia_atual
+
     def limpar_certificado(self):
         """Remove certificado da memória"""
+        self._liberar_pool_assinatura()
         self._certificado_atual = None
         self._chave_privada_atual = None
+        self._cadeia_atual = []
+        self._contexto_assinatura = None
 
 
 class CertificateManager:
@@ -579,7 +827,10 @@ class CertificateManager:
         sucesso, info = service.carregar_certificado_a1(pfx_data, senha)
 
         if sucesso:
+            anterior = self._certificados.get(empresa_id)
             self._certificados[empresa_id] = service
+            if anterior is not None:
+                anterior.limpar_certificado()
 
         return sucesso, info
 
@@ -620,6 +871,24 @@ class CertificateManager:
                 erro=f"Tipo de documento desconhecido: {tipo}"
             )
 
+    def assinar_lote_empresa(
+        self,
+        empresa_id: str,
+        xmls: List[str],
+        tipo: str = "nfe"
+    ) -> List[ResultadoAssinatura]:
+        """
+        Assina vários XMLs com o certificado da empresa (ver CertificateService.assinar_lote)
+        """
+        service = self._certificados.get(empresa_id)
+        if not service:
+            return [ResultadoAssinatura(
+                sucesso=False,
+                erro=f"Certificado não encontrado para empresa {empresa_id}"
+            )] * len(xmls)
+
+        return service.assinar_lote(xmls, tipo=tipo)
+
     def verificar_status_certificados(self) -> Dict[str, Dict]:
         """Retorna status de todos os certificados registrados"""
         status = {}
@@ -0,0 +1,470 @@
+"""
+Validação e uso de cupons
+O catálogo de cupons fica em cache por código (near-cache do processo + Redis)
+e os limites de uso são contadores atômicos no Redis (global e por cliente),
+semeados a partir de CouponUsage e reconciliados em background. Validar um
+cupom não consulta o banco; aplicar incrementa os contadores em um script Lua
+antes de gravar o CouponUsage. Sem Redis, o limite global é garantido por um
+UPDATE condicional em coupons.usage_count e o limite por cliente por uma
+contagem indexada, serializada pelo lock de linha desse UPDATE.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import func, update
+
+from database import db
+from models.coupons import Coupon, CouponUsage
+from utils.cache import cache_manager
+
+logger = logging.getLogger(__name__)
+
+CATALOG_TTL = 300
+MISSING_TTL = 30
+COUNTER_PREFIX = "mc:coupon:uses"
+COUNTER_TTL = 86400
+
+RECONCILE_INTERVAL = int(os.environ.get("COUPON_RECONCILE_INTERVAL", 60))
+LOCK_NAME = "coupon:reconcile"
+LOCK_TIMEOUT = 300
+
+# Resultados do script de reserva
+_NOT_LOADED = -2
+_GLOBAL_LIMIT = -1
+_CUSTOMER_LIMIT = -3
+
+# Reserva um uso se os limites permitirem.
+# KEYS = contador global, [contador do cliente]
+# ARGV = limite global (-1 = sem), limite por cliente (-1 = sem), ttl
+_RESERVE_SCRIPT = """
+for i = 1, #KEYS do
+    if redis.call('EXISTS', KEYS[i]) == 0 then return -2 end
+end
+local limit = tonumber(ARGV[1])
+if limit >= 0 and tonumber(redis.call('GET', KEYS[1])) >= limit then return -1 end
+local customer_limit = tonumber(ARGV[2])
+if #KEYS > 1 and customer_limit >= 0 and tonumber(redis.call('GET', KEYS[2])) >= customer_limit then
+    return -3
+end
+for i = 1, #KEYS do
+    redis.call('INCR', KEYS[i])
+    redis.call('EXPIRE', KEYS[i], ARGV[3])
+end
+return 1
+"""
+
+# Devolve uma reserva (o CouponUsage não foi gravado)
+_RELEASE_SCRIPT = """
+for i = 1, #KEYS do
+    if tonumber(redis.call('GET', KEYS[i]) or '0') > 0 then redis.call('DECR', KEYS[i]) end
+end
+return 1
+"""
+
+# Corrige o contador somente se ninguém o alterou desde a leitura
+_COMPARE_AND_SET_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+class CouponError(Exception):
+    """Cupom inválido para o pedido (mensagem exibida ao cliente)"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        self.message = message
+        self.status_code = status_code
+        super().__init__(message)
+
+
+def _normalize_code(code: str) -> str:
+    return (code or "").strip()
+
+
+def _as_uuid(value) -> Optional[uuid.UUID]:
+    if value is None or isinstance(value, uuid.UUID):
+        return value
+    return uuid.UUID(str(value))
+
+
+def _snapshot(coupon: Coupon) -> Dict[str, Any]:
+    """Campos usados na validação + a representação da API"""
+    return {
+        "id": str(coupon.id),
+        "type": coupon.type,
+        "value": str(coupon.value or 0),
+        "minimum_amount": str(coupon.minimum_amount or 0),
+        "maximum_discount": str(coupon.maximum_discount) if coupon.maximum_discount is not None else None,
+        "usage_limit": coupon.usage_limit,
+        "usage_limit_per_customer": coupon.usage_limit_per_customer,
+        "start_date": coupon.start_date.isoformat() if coupon.start_date else None,
+        "end_date": coupon.end_date.isoformat() if coupon.end_date else None,
+        "is_active": bool(coupon.is_active),
+        "data": coupon.to_dict(),
+    }
+
+
+def calculate_discount(snapshot: Dict[str, Any], order_value: Decimal) -> Decimal:
+    """Desconto do cupom, limitado ao desconto máximo e ao valor do pedido"""
+    value = Decimal(snapshot["value"])
+    if snapshot["type"] == "percentage":
+        discount = order_value * value / Decimal(100)
+    else:  # fixed
+        discount = value
+
+    if snapshot["maximum_discount"] is not None:
+        discount = min(discount, Decimal(snapshot["maximum_discount"]))
+    return min(discount, order_value).quantize(Decimal("0.01"))
+
+
+class CouponService:
+    """Catálogo de cupons em cache e contadores de uso atômicos"""
+
+    def __init__(self, reconcile_interval: int = RECONCILE_INTERVAL):
+        self.reconcile_interval = reconcile_interval
+        self._scripts = None
+        self._scripts_client = None
+        self._app = None
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        # Contadores acima do banco na passada anterior (reserva possivelmente perdida)
+        self._suspect: Dict[str, str] = {}
+
+    # ------------------------------------------------------------------
+    # Catálogo
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _catalog_key(code: str) -> str:
+        return f"coupon:code:{code}"
+
+    def get(self, code: str) -> Optional[Dict[str, Any]]:
+        """Cupom pelo código (cache; códigos inexistentes também ficam em cache)"""
+        code = _normalize_code(code)
+        cached = cache_manager.get_layered(self._catalog_key(code))
+        if cached is not None:
+            return cached or None
+
+        coupon = Coupon.query.filter_by(code=code).first()
+        snapshot = _snapshot(coupon) if coupon else {}
+        cache_manager.set_layered(
+            self._catalog_key(code), snapshot, timeout=CATALOG_TTL if coupon else MISSING_TTL
+        )
+        return snapshot or None
+
+    def invalidate(self, *codes: str) -> None:
+        """Remove cupons do catálogo (chamar após criar ou editar)"""
+        for code in codes:
+            if code:
+                cache_manager.delete(self._catalog_key(_normalize_code(code)))
+
+    # ------------------------------------------------------------------
+    # Contadores
+    # ------------------------------------------------------------------
+
+    def _redis(self):
+        client = cache_manager.redis_client
+        if client is not None and client is not self._scripts_client:
+            self._scripts = {
+                "reserve": client.register_script(_RESERVE_SCRIPT),
+                "release": client.register_script(_RELEASE_SCRIPT),
+                "compare_and_set": client.register_script(_COMPARE_AND_SET_SCRIPT),
+            }
+            self._scripts_client = client
+        return client
+
+    @staticmethod
+    def _counter_keys(coupon_id: str, customer_id=None) -> list:
+        keys = [f"{COUNTER_PREFIX}:{coupon_id}"]
+        if customer_id:
+            keys.append(f"{COUNTER_PREFIX}:{coupon_id}:{customer_id}")
+        return keys
+
+    @staticmethod
+    def _db_usage(coupon_id: str, customer_id=None) -> int:
+        query = db.session.query(func.count(CouponUsage.id)).filter(CouponUsage.coupon_id == _as_uuid(coupon_id))
+        if customer_id:
+            query = query.filter(CouponUsage.user_id == _as_uuid(customer_id))
+        return query.scalar() or 0
+
+    def _seed(self, client, coupon_id: str, customer_id=None) -> None:
+        """Cria os contadores ausentes a partir do CouponUsage (não sobrescreve)"""
+        keys = self._counter_keys(coupon_id, customer_id)
+        owners = [None, customer_id]
+        for key, owner in zip(keys, owners):
+            if not client.exists(key):
+                client.set(key, self._db_usage(coupon_id, owner), ex=COUNTER_TTL, nx=True)
+
+    def usage(self, snapshot: Dict[str, Any], customer_id=None) -> Tuple[int, int]:
+        """Usos (global, do cliente)"""
+        client = self._redis()
+        if client is None:
+            total = db.session.query(Coupon.usage_count).filter(Coupon.id == _as_uuid(snapshot["id"])).scalar()
+            return total or 0, self._db_usage(snapshot["id"], customer_id) if customer_id else 0
+
+        keys = self._counter_keys(snapshot["id"], customer_id)
+        values = client.mget(keys)
+        if None in values:
+            self._seed(client, snapshot["id"], customer_id)
+            values = client.mget(keys)
+        total = int(values[0] or 0)
+        return total, int(values[1] or 0) if customer_id else 0
+
+    def _reserve(self, client, snapshot: Dict[str, Any], customer_id=None) -> None:
+        keys = self._counter_keys(snapshot["id"], customer_id)
+        args = [
+            snapshot["usage_limit"] if snapshot["usage_limit"] else -1,
+            snapshot["usage_limit_per_customer"] if snapshot["usage_limit_per_customer"] else -1,
+            COUNTER_TTL,
+        ]
+        result = self._scripts["reserve"](keys=keys, args=args)
+        if result == _NOT_LOADED:
+            self._seed(client, snapshot["id"], customer_id)
+            result = self._scripts["reserve"](keys=keys, args=args)
+
+        if result == _GLOBAL_LIMIT:
+            raise CouponError("Limite de uso do cupom atingido")
+        if result == _CUSTOMER_LIMIT:
+            raise CouponError("Limite de uso do cupom por cliente atingido")
+
+    def _release(self, snapshot: Dict[str, Any], customer_id=None) -> None:
+        try:
+            self._scripts["release"](keys=self._counter_keys(snapshot["id"], customer_id), args=[])
+        except Exception as e:
+            logger.error(f"Erro ao devolver reserva do cupom {snapshot['id']}: {e}")
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+
+    def validate(self, code: str, order_value, customer_id=None,
+                 check_usage: bool = True) -> Tuple[Dict[str, Any], Decimal]:
+        """
+        Valida o cupom para o pedido
+
+        Returns:
+            (cupom, desconto)
+
+        Raises:
+            CouponError: cupom inexistente, inativo, fora da validade, abaixo do
+                valor mínimo ou com limite de uso atingido
+        """
+        snapshot = self.get(code)
+        if not snapshot:
+            raise CouponError("Cupom não encontrado", 404)
+
+        if not snapshot["is_active"]:
+            raise CouponError("Cupom não está ativo")
+
+        today = date.today().isoformat()
+        if snapshot["start_date"] and today < snapshot["start_date"]:
+            raise CouponError("Cupom ainda não é válido")
+        if snapshot["end_date"] and today > snapshot["end_date"]:
+            raise CouponError("Cupom expirado")
+
+        order_value = Decimal(str(order_value or 0))
+        if order_value < Decimal(snapshot["minimum_amount"]):
+            raise CouponError(f"Valor mínimo do pedido: R$ {snapshot['minimum_amount']}")
+
+        if check_usage:
+            total, customer_total = self.usage(snapshot, customer_id)
+            if snapshot["usage_limit"] and total >= snapshot["usage_limit"]:
+                raise CouponError("Limite de uso do cupom atingido")
+            if customer_id and snapshot["usage_limit_per_customer"] and \
+                    customer_total >= snapshot["usage_limit_per_customer"]:
+                raise CouponError("Limite de uso do cupom por cliente atingido")
+
+        return snapshot, calculate_discount(snapshot, order_value)
+
+    def redeem(self, code: str, order_value, customer_id, order_id) -> CouponUsage:
+        """
+        Registra o uso do cupom respeitando os limites sob concorrência
+
+        Raises:
+            CouponError: cupom inválido ou limite atingido
+        """
+        snapshot, discount = self.validate(code, order_value, customer_id, check_usage=False)
+
+        client = self._redis()
+        if client is not None:
+            self._reserve(client, snapshot, customer_id)
+            try:
+                usage = CouponUsage(
+                    coupon_id=_as_uuid(snapshot["id"]), user_id=_as_uuid(customer_id),
+                    order_id=_as_uuid(order_id), discount_amount=discount,
+                )
+                db.session.add(usage)
+                db.session.commit()
+                return usage
+            except Exception:
+                db.session.rollback()
+                self._release(snapshot, customer_id)
+                raise
+
+        # Sem Redis: o UPDATE condicional trava a linha do cupom até o commit,
+        # serializando a contagem por cliente logo abaixo
+        result = db.session.execute(
+            update(Coupon)
+            .where(
+                Coupon.id == _as_uuid(snapshot["id"]),
+                (Coupon.usage_limit.is_(None)) | (Coupon.usage_limit <= 0) |
+                (func.coalesce(Coupon.usage_count, 0) < Coupon.usage_limit),
+            )
+            .values(usage_count=func.coalesce(Coupon.usage_count, 0) + 1, updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            db.session.rollback()
+            raise CouponError("Limite de uso do cupom atingido")
+
+        limit = snapshot["usage_limit_per_customer"]
+        if customer_id and limit and self._db_usage(snapshot["id"], customer_id) >= limit:
+            db.session.rollback()
+            raise CouponError("Limite de uso do cupom por cliente atingido")
+
+        usage = CouponUsage(
+            coupon_id=_as_uuid(snapshot["id"]), user_id=_as_uuid(customer_id),
+            order_id=_as_uuid(order_id), discount_amount=discount,
+        )
+        db.session.add(usage)
+        db.session.commit()
+        return usage
+
+    # ------------------------------------------------------------------
+    # Reconciliação
+    # ------------------------------------------------------------------
+
+    def init_app(self, app) -> None:
+        """Garante o índice de uso por cliente e inicia a reconciliação"""
+        self._app = app
+        with app.app_context():
+            for index in CouponUsage.__table__.indexes:
+                index.create(db.engine, checkfirst=True)
+        self.start()
+
+    def start(self) -> None:
+        with self._worker_lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._worker_loop, name="coupon-reconcile", daemon=True)
+            self._worker.start()
+
+    def reconcile(self) -> Dict[str, int]:
+        """
+        Alinha contadores e coupons.usage_count com o CouponUsage
+
+        Contadores abaixo do banco sobem na hora. Contadores acima do banco
+        (reserva de um processo que caiu antes do commit) só descem se
+        continuarem iguais na passada seguinte, para não desfazer reservas de
+        pedidos ainda em andamento.
+        """
+        stats = {"coupons": 0, "counters": 0}
+        token = cache_manager.acquire_lock(LOCK_NAME, timeout=LOCK_TIMEOUT)
+        if token is None:
+            return stats
+
+        try:
+            counts = dict(
+                db.session.query(CouponUsage.coupon_id, func.count(CouponUsage.id))
+                .group_by(CouponUsage.coupon_id)
+                .all()
+            )
+
+            client = self._redis()
+            if client is not None:
+                # Com Redis o uso não atualiza coupons.usage_count a cada pedido
+                stale = Coupon.query.filter(Coupon.id.in_(list(counts))).all() if counts else []
+                for coupon in stale:
+                    if coupon.usage_count != counts[coupon.id]:
+                        coupon.usage_count = counts[coupon.id]
+                        stats["coupons"] += 1
+                db.session.commit()
+                stats["counters"] = self._reconcile_counters(client, counts)
+
+            return stats
+        finally:
+            cache_manager.release_lock(LOCK_NAME, token)
+
+    def _expected_counters(self, keys: list, counts: Dict[Any, int]) -> Dict[str, int]:
+        """Valor de cada contador segundo o CouponUsage (global e por cliente)"""
+        expected: Dict[str, int] = {}
+        pairs = {}
+        for key in keys:
+            parts = key[len(COUNTER_PREFIX) + 1:].split(":")
+            try:
+                ids = [_as_uuid(part) for part in parts]
+            except ValueError:
+                continue
+            if len(ids) == 1:
+                expected[key] = counts.get(ids[0], 0)
+            elif len(ids) == 2:
+                pairs[tuple(ids)] = key
+
+        if pairs:
+            rows = (
+                db.session.query(CouponUsage.coupon_id, CouponUsage.user_id, func.count(CouponUsage.id))
+                .filter(CouponUsage.coupon_id.in_({coupon_id for coupon_id, _ in pairs}))
+                .filter(CouponUsage.user_id.in_({customer_id for _, customer_id in pairs}))
+                .group_by(CouponUsage.coupon_id, CouponUsage.user_id)
+                .all()
+            )
+            customer_counts = {(coupon_id, user_id): count for coupon_id, user_id, count in rows}
+            for pair, key in pairs.items():
+                expected[key] = customer_counts.get(pair, 0)
+        return expected
+
+    def _reconcile_counters(self, client, counts: Dict[Any, int]) -> int:
+        """
+        Corrige os contadores do Redis, inclusive os por cliente
+
+        Um contador por cliente inflado por uma reserva perdida recusaria o
+        cupom a esse cliente até o TTL expirar.
+        """
+        keys = sorted(client.scan_iter(match=f"{COUNTER_PREFIX}:*", count=1000))
+        expected_by_key = self._expected_counters(keys, counts)
+        keys = list(expected_by_key)
+        current = client.mget(keys) if keys else []
+
+        fixed = 0
+        suspect: Dict[str, str] = {}
+        for key, value in zip(keys, current):
+            expected = expected_by_key[key]
+            if value is None:
+                continue
+            if int(value) < expected or (int(value) > expected and self._suspect.get(key) == value):
+                fixed += self._scripts["compare_and_set"](keys=[key], args=[value, expected, COUNTER_TTL])
+            elif int(value) > expected:
+                suspect[key] = value
+        self._suspect = suspect
+        return fixed
+
+    def _worker_loop(self) -> None:
+        with self._app.app_context():
+            while True:
+                time.sleep(self.reconcile_interval)
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    logger.error(f"Erro na reconciliação de cupons: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+# Instância global do serviço de cupons
+coupon_service = CouponService()
+
+
+def init_coupon_service(app) -> None:
+    """Inicia a reconciliação dos contadores de uso de cupons"""
+    coupon_service.init_app(app)
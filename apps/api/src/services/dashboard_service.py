@@ -0,0 +1,273 @@
+"""
+Serviço de agregação do dashboard administrativo
+Calcula as métricas de pedidos em uma única consulta agrupada por dia
+e mantém o resultado em cache até que algum pedido mude
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+from sqlalchemy import case, event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from database import db
+from models import CartItem, Customer, Lead, Order, OrderItem, Product, User
+from utils.cache import cache_delete, cache_get, cache_set
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_CACHE_KEY = "admin:dashboard"
+
+# Backstop: mesmo sem eventos o cache expira
+DASHBOARD_CACHE_TIMEOUT = 300
+
+# Campos de Order que afetam as métricas do dashboard
+_TRACKED_ORDER_FIELDS = ("status", "total_amount", "created_at")
+
+
+def day_bucket(column):
+    """Trunca um timestamp para o dia, de acordo com o dialeto do banco"""
+    if db.engine.dialect.name == "postgresql":
+        return func.date_trunc("day", column)
+    return func.date(column)
+
+
+def bucket_key(value) -> str:
+    """Converte o valor retornado por day_bucket em 'YYYY-MM-DD'"""
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m-%d")
+    return str(value)[:10]
+
+
+class DashboardService:
+    """
+    Agregador do dashboard administrativo
+    Substitui as ~25 consultas sequenciais por três: métricas de pedidos
+    (agregados condicionais por dia), contadores (subconsultas escalares)
+    e produtos mais vendidos
+    """
+
+    def __init__(self, period_days: int = 30, daily_days: int = 7):
+        self.period_days = period_days
+        self.daily_days = daily_days
+
+    def get_dashboard(self, use_cache: bool = True) -> Dict[str, Any]:
+        """Retorna os dados do dashboard (do cache, quando disponível)"""
+        if use_cache:
+            cached = cache_get(DASHBOARD_CACHE_KEY)
+            if cached is not None:
+                return cached
+
+        data = self.build_dashboard()
+        if use_cache:
+            cache_set(DASHBOARD_CACHE_KEY, data, timeout = DASHBOARD_CACHE_TIMEOUT)
+        return data
+
+    def invalidate(self) -> None:
+        """Invalida o dashboard em cache"""
+        cache_delete(DASHBOARD_CACHE_KEY)
+
+    def build_dashboard(self) -> Dict[str, Any]:
+        """Calcula o dashboard a partir do banco"""
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days = self.period_days)
+
+        sales, daily_sales = self._order_metrics(start_date, end_date)
+        counters = self._counters(start_date, end_date)
+        top_products = self._top_products(start_date, end_date)
+
+        total_leads = counters["total_leads"]
+        converted_leads = counters["converted_leads"]
+        total_users = counters["total_users"]
+        admin_users = counters["admin_users"]
+
+        return {
+            "period": {
+                "start_date": start_date.strftime("%Y-%m-%d"),
+                "end_date": end_date.strftime("%Y-%m-%d"),
+            },
+            "sales": sales,
+            "customers": {
+                "active_customers": counters["active_customers"],
+                "total_leads": total_leads,
+                "converted_leads": converted_leads,
+                "conversion_rate": (
+                    (converted_leads / total_leads * 100)
+                    if total_leads > 0
+                    else 0
+                ),
+            },
+            "products": {
+                "total_products": counters["total_products"],
+                "active_products": counters["active_products"],
+                "top_products": top_products,
+            },
+            "users": {
+                "total_users": total_users,
+                "admin_users": admin_users,
+                "customer_users": total_users - admin_users,
+            },
+            "analytics": {
+                "abandoned_carts": counters["abandoned_carts"],
+                "daily_sales": daily_sales,
+            },
+        }
+
+    def _order_metrics(self, start_date: datetime, end_date: datetime):
+        """Métricas de vendas e vendas diárias em uma única consulta agrupada"""
+        day = day_bucket(Order.created_at)
+        completed = Order.status == "completed"
+
+        rows = (
+            db.session.query(
+                day.label("day"),
+                func.count(Order.id).label("total_orders"),
+                func.sum(case((completed, 1), else_ = 0)).label("completed_orders"),
+                func.sum(case((Order.status == "pending", 1), else_ = 0)).label("pending_orders"),
+                func.sum(case((completed, Order.total_amount), else_ = 0)).label("revenue"),
+                func.count(case((completed, Order.total_amount))).label("revenue_orders"),
+            )
+            .filter(Order.created_at >= start_date, Order.created_at <= end_date)
+            .group_by(day)
+            .all()
+        )
+
+        total_orders = completed_orders = pending_orders = revenue_orders = 0
+        total_revenue = 0.0
+        by_day = {}
+
+        for row in rows:
+            day_revenue = float(row.revenue or 0)
+            total_orders += int(row.total_orders or 0)
+            completed_orders += int(row.completed_orders or 0)
+            pending_orders += int(row.pending_orders or 0)
+            revenue_orders += int(row.revenue_orders or 0)
+            total_revenue += day_revenue
+            by_day[bucket_key(row.day)] = (int(row.completed_orders or 0), day_revenue)
+
+        sales = {
+            "total_orders": total_orders,
+            "completed_orders": completed_orders,
+            "pending_orders": pending_orders,
+            "total_revenue": total_revenue,
+            "avg_order_value": (total_revenue / revenue_orders) if revenue_orders else 0.0,
+            "conversion_rate": (
+                (completed_orders / total_orders * 100)
+                if total_orders > 0
+                else 0
+            ),
+        }
+
+        daily_sales = []
+        for i in range(self.daily_days):
+            date_key = (end_date - timedelta(days = i)).strftime("%Y-%m-%d")
+            day_orders, day_revenue = by_day.get(date_key, (0, 0.0))
+            daily_sales.append(
+                {
+                    "date": date_key,
+                    "orders": day_orders,
+                    "revenue": day_revenue,
+                }
+            )
+
+        return sales, daily_sales
+
+    def _counters(self, start_date: datetime, end_date: datetime) -> Dict[str, int]:
+        """Contadores de clientes, leads, carrinhos, produtos e usuários em um único SELECT"""
+
+        def count(model, *criteria):
+            return (
+                select(func.count())
+                .select_from(model)
+                .where(*criteria)
+                .scalar_subquery()
+            )
+
+        stmt = select(
+            count(Customer, Customer.status == "active").label("active_customers"),
+            count(Lead).label("total_leads"),
+            count(Lead, Lead.status == "converted").label("converted_leads"),
+            count(
+                CartItem,
+                CartItem.created_at >= start_date,
+                CartItem.created_at <= end_date,
+            ).label("abandoned_carts"),
+            count(Product).label("total_products"),
+            count(Product, Product.is_active).label("active_products"),
+            count(User).label("total_users"),
+            count(User, User.is_admin).label("admin_users"),
+        )
+
+        row = db.session.execute(stmt).one()
+        return {key: int(value or 0) for key, value in row._mapping.items()}
+
+    def _top_products(self, start_date: datetime, end_date: datetime, limit: int = 10):
+        """Produtos mais vendidos no período"""
+        rows = (
+            db.session.query(
+                OrderItem.product_name,
+                func.sum(OrderItem.quantity).label("total_quantity"),
+                func.sum(OrderItem.total_price).label("total_revenue"),
+            )
+            .join(Order)
+            .filter(
+                Order.created_at >= start_date,
+                Order.created_at <= end_date,
+                Order.status == "completed",
+            )
+            .group_by(OrderItem.product_name)
+            .order_by(func.sum(OrderItem.quantity).desc())
+            .limit(limit)
+            .all()
+        )
+
+        return [
+            {
+                "name": product.product_name,
+                "quantity": int(product.total_quantity),
+                "revenue": float(product.total_revenue),
+            }
+            for product in rows
+        ]
+
+
+# Instância global do serviço de dashboard
+dashboard_service = DashboardService()
+
+
+# ----------------------------------------------------------------------
+# Invalidação por eventos do ORM
+# Pedidos alterados via ORM marcam a sessão; o cache é invalidado somente
+# após o commit. Rotas que usam SQL direto chamam dashboard_service.invalidate().
+# ----------------------------------------------------------------------
+
+def _mark_orders_changed(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info["dashboard_orders_changed"] = True
+
+
+def _mark_orders_updated(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in _TRACKED_ORDER_FIELDS):
+        _mark_orders_changed(mapper, connection, target)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("dashboard_orders_changed", False):
+        try:
+            dashboard_service.invalidate()
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao invalidar cache do dashboard: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop("dashboard_orders_changed", None)
+
+
+event.listen(Order, "after_insert", _mark_orders_changed)
+event.listen(Order, "after_update", _mark_orders_updated)
+event.listen(Order, "after_delete", _mark_orders_changed)
@@ -1,16 +1,59 @@
 """
 Sistema de eventos para Mestres do Café Enterprise API
 Gerencia eventos de pagamentos, pedidos e notificações
+
+Barramento em processo: handlers se registram por EventType e cada um recebe
+os eventos por uma fila própria e limitada, consumida por uma thread dedicada.
+emit() apenas enfileira, nunca executa handlers na requisição; com a fila de um
+handler cheia o evento é descartado para ele (contado em "dropped") em vez de
+bloquear quem emitiu. O histórico é um buffer circular.
+
+Um evento emitido com alterações pendentes na sessão só é entregue depois do
+commit delas (e descartado no rollback). Com EVENT_OUTBOX_ENABLED o evento é
+gravado na tabela event_outbox na mesma transação, e um consumidor em cada
+processo reserva as linhas confirmadas: cada evento roda uma única vez nos
+handlers da aplicação, mesmo com vários processos, e sobrevive a reinícios.
 """
 
+import json
 import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 from enum import Enum
-from typing import Dict, Any
-from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from flask import has_app_context
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import Session
 
 # Logger básico
 logger = logging.getLogger('event_system')
 
+EVENT_QUEUE_SIZE = int(os.environ.get('EVENT_QUEUE_SIZE', 1000))
+EVENT_HISTORY_SIZE = int(os.environ.get('EVENT_HISTORY_SIZE', 1000))
+EVENT_OUTBOX_ENABLED = os.environ.get('EVENT_OUTBOX_ENABLED', 'false').lower() == 'true'
+
+OUTBOX_BATCH_SIZE = 200
+OUTBOX_POLL_INTERVAL = 2
+# Reserva de um processo que morreu antes de concluir a entrega
+OUTBOX_CLAIM_TIMEOUT = timedelta(minutes=5)
+OUTBOX_RETENTION = timedelta(days=1)
+OUTBOX_CLEANUP_INTERVAL = 600
+
+# Eventos aguardando o commit da sessão: [(EventSystem, Event)]
+_SESSION_EVENTS = 'event_system_pending'
+# Outboxes com linhas gravadas na transação (acordados após o commit)
+_SESSION_OUTBOXES = 'event_system_outboxes'
+# A transação já tem escrita enviada ao banco (flush ou DML direto)
+_SESSION_WROTE = 'event_system_wrote'
+
 
 class EventType(Enum):
     """
@@ -22,41 +65,216 @@ class EventType(Enum):
     PAYMENT_REJECTED = "payment_rejected"
     PAYMENT_PENDING = "payment_pending"
     PAYMENT_REFUNDED = "payment_refunded"
-    
+
     # Eventos de pedidos
     ORDER_CREATED = "order_created"
     ORDER_CONFIRMED = "order_confirmed"
     ORDER_SHIPPED = "order_shipped"
     ORDER_DELIVERED = "order_delivered"
     ORDER_CANCELLED = "order_cancelled"
-    
+
     # Eventos de usuário
     USER_REGISTERED = "user_registered"
     USER_LOGIN = "user_login"
     USER_LOGOUT = "user_logout"
-    
+
     # Eventos de produtos
     PRODUCT_CREATED = "product_created"
     PRODUCT_STOCK_LOW = "product_stock_low"
     PRODUCT_OUT_OF_STOCK = "product_out_of_stock"
-    
+
     # Eventos de notificação
     NOTIFICATION_SENT = "notification_sent"
     EMAIL_SENT = "email_sent"
     SMS_SENT = "sms_sent"
 
 
+@dataclass(frozen=True)
+class Event:
+    """Evento emitido (imutável: o mesmo objeto vai para todos os handlers)"""
+
+    id: str
+    type: EventType
+    timestamp: datetime
+    user_id: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    origin: Optional[str] = None  # processo de origem; None = este processo
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'type': self.type.value,
+            'timestamp': self.timestamp.isoformat(),
+            'user_id': self.user_id,
+            'data': self.data
+        }
+
+
+EventHandler = Callable[[Event], None]
+
+
+class _Subscription:
+    """Handler registrado, com fila limitada, thread própria e métricas"""
+
+    def __init__(self, system: 'EventSystem', name: str, handler: EventHandler,
+                 event_types: Optional[frozenset], queue_size: int):
+        self.system = system
+        self.name = name
+        self.handler = handler
+        self.event_types = event_types
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+        self._lock = threading.Lock()
+        self.delivered = 0
+        self.errors = 0
+        self.dropped = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_error: Optional[str] = None
+
+        self.thread = threading.Thread(target=self._run, name=f"event-handler-{name}", daemon=True)
+        self.thread.start()
+
+    def offer(self, event: Event) -> bool:
+        """Enfileira sem bloquear; False se a fila está cheia"""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped == 1 or dropped % 100 == 0:
+                logger.warning(f"Fila do handler {self.name} cheia: {dropped} eventos descartados")
+            return False
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            handled = self.delivered + self.errors
+            return {
+                'event_types': sorted(t.value for t in self.event_types) if self.event_types else None,
+                'queued': self.queue.qsize(),
+                'delivered': self.delivered,
+                'errors': self.errors,
+                'dropped': self.dropped,
+                'avg_latency_ms': round(self.total_seconds * 1000 / handled, 2) if handled else None,
+                'max_latency_ms': round(self.max_seconds * 1000, 2),
+                'last_error': self.last_error
+            }
+
+    def _run(self) -> None:
+        while True:
+            event = self.queue.get()
+            try:
+                if event is None:  # unsubscribe
+                    return
+                self._handle(event)
+            finally:
+                self.queue.task_done()
+
+    def _handle(self, event: Event) -> None:
+        app = self.system._app
+        started = time.monotonic()
+        error = None
+        with app.app_context() if app is not None else nullcontext():
+            try:
+                self.handler(event)
+            except Exception as e:
+                error = str(e)
+                logger.error(f"Erro no handler {self.name} para {event.type.value}: {error}")
+            finally:
+                if app is not None:
+                    from database import db
+                    db.session.remove()
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            if error is None:
+                self.delivered += 1
+            else:
+                self.errors += 1
+                self.last_error = error
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+
+
 class EventSystem:
     """
     Sistema centralizado de eventos
-    Versão simplificada funcional para desenvolvimento
     """
 
-    def __init__(self):
-        self.event_handlers = {}
-        self.event_history = []
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE, history_size: int = EVENT_HISTORY_SIZE):
+        self.queue_size = queue_size
+        self.origin = uuid.uuid4().hex
+        self.event_history: deque = deque(maxlen=history_size)
+
+        self._app = None
+        self._lock = threading.Lock()
+        self._subscriptions: Dict[str, _Subscription] = {}
+        # Rotas por tipo (None = todos), trocadas inteiras a cada (des)registro
+        self._routes: Dict[Optional[EventType], Tuple[_Subscription, ...]] = {}
+        self._type_counts: Counter = Counter()
+        self._total_events = 0
+        self._outbox: Optional[_EventOutbox] = None
         logger.info("Sistema de eventos inicializado")
 
+    # ------------------------------------------------------------------
+    # Registro de handlers
+    # ------------------------------------------------------------------
+
+    def subscribe(
+        self,
+        event_types: Union[EventType, Iterable[EventType], None],
+        handler: EventHandler,
+        name: Optional[str] = None,
+        queue_size: Optional[int] = None
+    ) -> EventHandler:
+        """
+        Registra um handler para um ou mais tipos de evento (None = todos)
+
+        O handler roda em uma thread própria, com app context quando o sistema
+        foi inicializado com o app, e recebe o Event.
+        """
+        if isinstance(event_types, EventType):
+            event_types = [event_types]
+        types = frozenset(event_types) if event_types is not None else None
+        name = name or f"{handler.__module__}.{handler.__qualname__}"
+
+        with self._lock:
+            if name in self._subscriptions:
+                raise ValueError(f"Handler já registrado: {name}")
+            self._subscriptions[name] = _Subscription(
+                self, name, handler, types, queue_size or self.queue_size
+            )
+            self._rebuild_routes()
+        return handler
+
+    def on(self, *event_types: EventType, name: Optional[str] = None):
+        """Decorator: @event_system.on(EventType.PAYMENT_APPROVED)"""
+        def decorator(handler: EventHandler) -> EventHandler:
+            return self.subscribe(event_types or None, handler, name=name)
+        return decorator
+
+    def unsubscribe(self, name: str) -> bool:
+        with self._lock:
+            subscription = self._subscriptions.pop(name, None)
+            if subscription is None:
+                return False
+            self._rebuild_routes()
+        subscription.queue.put(None)
+        return True
+
+    def _rebuild_routes(self) -> None:
+        routes: Dict[Optional[EventType], List[_Subscription]] = {}
+        for subscription in self._subscriptions.values():
+            for event_type in subscription.event_types or (None,):
+                routes.setdefault(event_type, []).append(subscription)
+        self._routes = {event_type: tuple(subs) for event_type, subs in routes.items()}
+
+    # ------------------------------------------------------------------
+    # Emissão
+    # ------------------------------------------------------------------
+
     def emit(
         self,
         event_type: EventType,
@@ -64,136 +282,350 @@ class EventSystem:
         data: Dict[str, Any] = None
     ) -> str:
         """
-        Emite um evento no sistema
+        Emite um evento no sistema (não espera pelos handlers)
+
+        Chame antes do commit da alteração que originou o evento: ele segue a
+        transação (entregue após o commit, descartado no rollback). Sem
+        alterações pendentes na sessão, é entregue (ou gravado) na hora.
         """
         try:
-            event_id = f"evt_{datetime.now().timestamp():.0f}"
-            
-            event_data = {
-                'id': event_id,
-                'type': event_type.value,
-                'timestamp': datetime.now().isoformat(),
-                'user_id': user_id,
-                'data': data or {}
-            }
-            
-            # Armazenar no histórico
-            self.event_history.append(event_data)
-            
-            # Processar evento
-            self._process_event(event_data)
-            
-            logger.info(f"Evento emitido: {event_type.value} - ID: {event_id}")
-            return event_id
-            
+            if self._app is None and has_app_context():
+                from flask import current_app
+                self._app = current_app._get_current_object()
+
+            event = Event(
+                id=f"evt_{uuid.uuid4().hex}",
+                type=event_type,
+                timestamp=datetime.utcnow(),
+                user_id=str(user_id) if user_id is not None else None,
+                data=dict(data or {})
+            )
+
+            self._record(event)
+            if self._outbox is not None and has_app_context():
+                self._outbox.add(event)
+            else:
+                self._publish(event)
+
+            logger.info(f"Evento emitido: {event_type.value} - ID: {event.id}")
+            return event.id
+
         except Exception as e:
             logger.error(f"Erro ao emitir evento: {str(e)}")
             return None
 
-    def _process_event(self, event_data: Dict[str, Any]) -> None:
-        """
-        Processa um evento emitido
-        """
-        try:
-            event_type = event_data.get('type')
-            
-            if not event_type:
-                return
-            
-            # Processar baseado no tipo
-            if event_type.startswith('payment_'):
-                self._handle_payment_event(event_data)
-            elif event_type.startswith('order_'):
-                self._handle_order_event(event_data)
-            elif event_type.startswith('user_'):
-                self._handle_user_event(event_data)
-            elif event_type.startswith('product_'):
-                self._handle_product_event(event_data)
-            
-        except Exception as e:
-            logger.error(f"Erro no processamento do evento: {str(e)}")
+    # Nome usado pelas rotas do Mercado Pago
+    emit_event = emit
 
-    def _handle_payment_event(self, event_data: Dict[str, Any]) -> None:
-        """
-        Processa eventos relacionados a pagamentos
-        """
-        try:
-            event_type = event_data.get('type')
-            logger.info(f"Processando evento de pagamento: {event_type}")
-            
-            # Em produção, aqui seria:
-            # - Atualizar status no banco
-            # - Enviar notificações
-            # - Disparar webhooks
-            
-        except Exception as e:
-            logger.error(f"Erro no evento de pagamento: {str(e)}")
+    def _record(self, event: Event) -> None:
+        with self._lock:
+            self.event_history.append(event)
+            self._type_counts[event.type.value] += 1
+            self._total_events += 1
 
-    def _handle_order_event(self, event_data: Dict[str, Any]) -> None:
-        """
-        Processa eventos relacionados a pedidos
-        """
-        try:
-            event_type = event_data.get('type')
-            logger.info(f"Processando evento de pedido: {event_type}")
-            
-        except Exception as e:
-            logger.error(f"Erro no evento de pedido: {str(e)}")
+    def _publish(self, event: Event) -> None:
+        """Entrega local; com alterações pendentes, só após o commit"""
+        session = _current_session()
+        if session is not None and _has_pending_changes(session):
+            session.info.setdefault(_SESSION_EVENTS, []).append((self, event))
+        else:
+            self._dispatch(event)
 
-    def _handle_user_event(self, event_data: Dict[str, Any]) -> None:
-        """
-        Processa eventos relacionados a usuários
-        """
-        try:
-            event_type = event_data.get('type')
-            logger.info(f"Processando evento de usuário: {event_type}")
-            
-        except Exception as e:
-            logger.error(f"Erro no evento de usuário: {str(e)}")
+    def _dispatch(self, event: Event, inline: bool = False) -> None:
+        """Entrega aos handlers: pelas filas ou, com `inline`, na thread atual"""
+        routes = self._routes
+        for subscription in routes.get(event.type, ()) + routes.get(None, ()):
+            if inline:
+                subscription._handle(event)
+            else:
+                subscription.offer(event)
 
-    def _handle_product_event(self, event_data: Dict[str, Any]) -> None:
-        """
-        Processa eventos relacionados a produtos
-        """
-        try:
-            event_type = event_data.get('type')
-            logger.info(f"Processando evento de produto: {event_type}")
-            
-        except Exception as e:
-            logger.error(f"Erro no evento de produto: {str(e)}")
+    # ------------------------------------------------------------------
+    # Consulta
+    # ------------------------------------------------------------------
 
     def get_events(self, limit: int = 100) -> list:
         """
         Retorna histórico de eventos
         """
         try:
-            return self.event_history[-limit:]
+            with self._lock:
+                events = list(self.event_history)
+            return [event.to_dict() for event in events[-limit:]]
         except Exception as e:
             logger.error(f"Erro ao obter eventos: {str(e)}")
             return []
 
     def get_event_stats(self) -> Dict[str, Any]:
         """
-        Retorna estatísticas dos eventos
+        Retorna estatísticas dos eventos e métricas por handler
         """
         try:
-            total_events = len(self.event_history)
-            event_types = {}
-            
-            for event in self.event_history:
-                event_type = event.get('type', 'unknown')
-                event_types[event_type] = event_types.get(event_type, 0) + 1
-            
-            return {
-                'total_events': total_events,
-                'event_types': event_types,
-                'last_event': self.event_history[-1] if self.event_history else None
-            }
-            
+            with self._lock:
+                last_event = self.event_history[-1].to_dict() if self.event_history else None
+                stats = {
+                    'total_events': self._total_events,
+                    'event_types': dict(self._type_counts),
+                    'last_event': last_event
+                }
+                subscriptions = list(self._subscriptions.values())
+
+            stats['handlers'] = {sub.name: sub.metrics() for sub in subscriptions}
+            stats['outbox'] = self._outbox.metrics() if self._outbox is not None else None
+            return stats
+
         except Exception as e:
             logger.error(f"Erro ao obter estatísticas: {str(e)}")
             return {'total_events': 0, 'event_types': {}}
 
+    def wait_idle(self, timeout: float = 5.0) -> bool:
+        """Aguarda as filas dos handlers esvaziarem; False se estourar o timeout"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+        for subscription in subscriptions:
+            while subscription.queue.unfinished_tasks:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.01)
+        return True
+
+    # ------------------------------------------------------------------
+    # Inicialização
+    # ------------------------------------------------------------------
+
+    def init_app(self, app, outbox: bool = EVENT_OUTBOX_ENABLED) -> None:
+        """Registra o app (handlers rodam com app context) e liga o outbox"""
+        self._app = app
+        if outbox and self._outbox is None:
+            self._outbox = _EventOutbox(self, app)
+            self._outbox.start()
+
+
+class _EventOutbox:
+    """
+    Outbox transacional na tabela event_outbox
+
+    add() grava a linha na sessão de quem emitiu, então o evento existe se e
+    somente se a transação for confirmada. O consumidor de cada processo
+    reserva linhas pendentes (FOR UPDATE SKIP LOCKED + compare-and-set em
+    claimed_at), roda os handlers e marca processed_at: a entrega é "pelo
+    menos uma vez" para o grupo de handlers da aplicação, não uma por processo.
+    """
+
+    def __init__(self, system: EventSystem, app):
+        self.system = system
+        self.app = app
+        self.written = 0
+        self.processed = 0
+        self.reclaimed = 0
+        self._wakeup = threading.Event()
+        self._last_cleanup = 0.0
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        from database import db
+        from models.system import EventOutbox
+
+        with self.app.app_context():
+            EventOutbox.__table__.create(db.engine, checkfirst=True)
+        self._thread = threading.Thread(target=self._run, name="event-outbox", daemon=True)
+        self._thread.start()
+
+    def add(self, event: Event) -> None:
+        """Grava o evento na transação atual (ou sozinho, se não houver alterações pendentes)"""
+        from database import db
+        from models.system import EventOutbox
+
+        session = db.session
+        commit = not _has_pending_changes(session)
+        session.add(EventOutbox(
+            id=uuid.uuid4(),
+            event_id=event.id,
+            event_type=event.type.value,
+            user_id=event.user_id,
+            payload=json.dumps(event.data, default=str),
+            origin=self.system.origin,
+            occurred_at=event.timestamp,
+            created_at=datetime.utcnow()
+        ))
+        session.info.setdefault(_SESSION_OUTBOXES, set()).add(self)
+        if commit:
+            session.commit()
+        self.written += 1
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'written': self.written,
+            'processed': self.processed,
+            'reclaimed': self.reclaimed
+        }
+
+    def process_pending(self) -> int:
+        """Entrega os eventos pendentes no contexto atual; retorna quantos rodaram"""
+        processed = 0
+        while True:
+            rows = self._claim()
+            for row in rows:
+                self._deliver(row)
+            processed += len(rows)
+            if len(rows) < OUTBOX_BATCH_SIZE:
+                return processed
+
+    def _run(self) -> None:
+        from database import db
+
+        with self.app.app_context():
+            while True:
+                try:
+                    self.process_pending()
+                    self._cleanup()
+                except Exception as e:
+                    logger.error(f"Erro no outbox de eventos: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+                self._wakeup.wait(OUTBOX_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def _claim(self) -> list:
+        """Reserva um lote de linhas pendentes (ou com reserva vencida) para este processo"""
+        from sqlalchemy import or_, select, update
+        from database import db
+        from models.system import EventOutbox
+
+        now = datetime.utcnow()
+        candidates = db.session.execute(
+            select(EventOutbox.id, EventOutbox.claimed_at)
+            .where(
+                EventOutbox.processed_at.is_(None),
+                or_(
+                    EventOutbox.claimed_at.is_(None),
+                    EventOutbox.claimed_at < now - OUTBOX_CLAIM_TIMEOUT
+                )
+            )
+            .order_by(EventOutbox.created_at, EventOutbox.id)
+            .limit(OUTBOX_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        ).all()
+
+        claimed = []
+        for candidate in candidates:
+            unchanged = (
+                EventOutbox.claimed_at.is_(None) if candidate.claimed_at is None
+                else EventOutbox.claimed_at == candidate.claimed_at
+            )
+            result = db.session.execute(
+                update(EventOutbox)
+                .where(EventOutbox.id == candidate.id, EventOutbox.processed_at.is_(None), unchanged)
+                .values(claimed_by=self.system.origin, claimed_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                claimed.append(candidate.id)
+                if candidate.claimed_at is not None:
+                    self.reclaimed += 1
+        db.session.commit()
+
+        if not claimed:
+            return []
+        return (
+            EventOutbox.query
+            .filter(EventOutbox.id.in_(claimed))
+            .order_by(EventOutbox.created_at, EventOutbox.id)
+            .all()
+        )
+
+    def _deliver(self, row) -> None:
+        """Roda os handlers do evento nesta thread e marca a linha como processada"""
+        from sqlalchemy import update
+        from database import db
+        from models.system import EventOutbox
+
+        try:
+            event_type = EventType(row.event_type)
+        except ValueError:
+            event_type = None
+
+        if event_type is not None:
+            # Erros dos handlers ficam nas métricas de cada um, como na entrega local
+            self.system._dispatch(Event(
+                id=row.event_id,
+                type=event_type,
+                timestamp=row.occurred_at,
+                user_id=row.user_id,
+                data=json.loads(row.payload),
+                origin=row.origin
+            ), inline=True)
+
+        db.session.execute(
+            update(EventOutbox)
+            .where(EventOutbox.id == row.id, EventOutbox.claimed_by == self.system.origin)
+            .values(processed_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        self.processed += 1
+
+    def _cleanup(self) -> None:
+        if time.monotonic() - self._last_cleanup < OUTBOX_CLEANUP_INTERVAL:
+            return
+        from database import db
+        from models.system import EventOutbox
+
+        self._last_cleanup = time.monotonic()
+        EventOutbox.query.filter(
+            EventOutbox.processed_at < datetime.utcnow() - OUTBOX_RETENTION
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def _current_session():
+    if not has_app_context():
+        return None
+    from database import db
+    return db.session
+
+
+def _has_pending_changes(session) -> bool:
+    return bool(session.new or session.dirty or session.deleted or session.info.get(_SESSION_WROTE))
+
+
+@sa_event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    session.info[_SESSION_WROTE] = True
+
+
+@sa_event.listens_for(Session, "do_orm_execute")
+def _track_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info[_SESSION_WROTE] = True
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _deliver_after_commit(session):
+    session.info.pop(_SESSION_WROTE, None)
+    for system, event in session.info.pop(_SESSION_EVENTS, ()):
+        system._dispatch(event)
+    for outbox in session.info.pop(_SESSION_OUTBOXES, ()):
+        outbox.wake()
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(_SESSION_WROTE, None)
+    session.info.pop(_SESSION_EVENTS, None)
+    session.info.pop(_SESSION_OUTBOXES, None)
+
 
 # Instância global do sistema de eventos
-event_system = EventSystem()
\ No newline at end of file
+event_system = EventSystem()
+
+
+def init_event_system(app) -> None:
+    """Registra o app no sistema de eventos e liga o outbox se configurado"""
+    event_system.init_app(app)
@@ -34,6 +34,7 @@ from dataclasses import dataclass, field
 from enum import Enum
 
 from database import db
+from services.numeracao_fiscal_service import NumeracaoIndisponivel, numeracao_fiscal
 
 logger = logging.getLogger(__name__)
 
@@ -223,208 +224,16 @@ class FiscalService:
             if not ok:
                 return ResultadoEmissao(sucesso=False, mensagem=msg)
 
-            # Importa modelos
-            from models.fiscal import (
-                EmpresaEmissora, SerieFiscal, DocumentoFiscal,
-                ItemDocumentoFiscal, PagamentoDocumentoFiscal,
-                AuditoriaFiscal, LogComunicacaoSefaz
-            )
-
-            # 1. Obtém empresa emissora
-            empresa = EmpresaEmissora.query.get(dados.empresa_id)
-            if not empresa:
-                return ResultadoEmissao(
-                    sucesso=False,
-                    mensagem=f"Empresa não encontrada: {dados.empresa_id}"
-                )
-
-            if not empresa.is_active:
-                return ResultadoEmissao(
-                    sucesso=False,
-                    mensagem="Empresa não está ativa"
-                )
-
-            # 2. Verifica certificado
-            cert_service = self.cert_manager.obter_servico(str(empresa.id))
-            if not cert_service or not cert_service.certificado_esta_valido():
-                return ResultadoEmissao(
-                    sucesso=False,
-                    mensagem="Certificado digital não disponível ou inválido",
-                    erros=["Certificado digital não encontrado ou expirado"]
-                )
-
-            # 3. Obtém série e próximo número
-            modelo = dados.modelo or "55"
-            serie_fiscal = SerieFiscal.query.filter_by(
-                empresa_id=empresa.id,
-                modelo=modelo,
-                ambiente=empresa.ambiente_atual,
-                is_active=True,
-                is_default=True
-            ).first()
-
-            if not serie_fiscal:
-                # Cria série padrão se não existir
-                serie_fiscal = SerieFiscal(
-                    empresa_id=empresa.id,
-                    modelo=modelo,
-                    serie=1,
-                    ambiente=empresa.ambiente_atual,
-                    is_default=True
-                )
-                db.session.add(serie_fiscal)
-
-            # Incrementa número
-            numero = serie_fiscal.obter_proximo_numero()
-
-            # 4. Valida dados obrigatórios
-            erros_validacao = self._validar_dados_emissao(dados, modelo)
-            if erros_validacao:
-                return ResultadoEmissao(
-                    sucesso=False,
-                    mensagem="Dados inválidos para emissão",
-                    erros=erros_validacao
-                )
-
-            # 5. Cria documento fiscal
-            doc = DocumentoFiscal(
-                empresa_id=empresa.id,
-                serie_fiscal_id=serie_fiscal.id,
-                modelo=modelo,
-                serie=serie_fiscal.serie,
-                numero=numero,
-                tipo_operacao=dados.tipo_operacao,
-                finalidade=dados.finalidade,
-                tipo_emissao="1",  # Normal
-                indicador_presenca=dados.indicador_presenca,
-                ambiente=empresa.ambiente_atual,
-                status="rascunho",
-                data_emissao=datetime.utcnow()
-            )
-
-            # Destinatário
-            doc.dest_tipo_pessoa = dados.dest_tipo_pessoa
-            doc.dest_cpf = dados.dest_cpf
-            doc.dest_cnpj = dados.dest_cnpj
-            doc.dest_nome = dados.dest_nome
-            doc.dest_email = dados.dest_email
-            doc.dest_telefone = dados.dest_telefone
-            doc.dest_ie = dados.dest_ie
-
-            # Endereço
-            doc.dest_logradouro = dados.dest_logradouro
-            doc.dest_numero = dados.dest_numero
-            doc.dest_complemento = dados.dest_complemento
-            doc.dest_bairro = dados.dest_bairro
-            doc.dest_cep = dados.dest_cep
-            doc.dest_municipio = dados.dest_municipio
-            doc.dest_codigo_municipio_ibge = dados.dest_codigo_municipio
-            doc.dest_uf = dados.dest_uf
-
-            # Transporte
-            doc.modalidade_frete = dados.modalidade_frete
-
-            # Informações adicionais
-            doc.informacoes_complementares = dados.informacoes_complementares
-            doc.informacoes_fisco = dados.informacoes_fisco
-
-            # Referências
-            doc.order_id = dados.order_id
-            doc.sale_id = dados.sale_id
-
-            # 6. Processa itens e calcula totais
-            valor_produtos = Decimal('0')
-            valor_icms_base = Decimal('0')
-            valor_icms = Decimal('0')
-            valor_pis = Decimal('0')
-            valor_cofins = Decimal('0')
-            valor_ipi = Decimal('0')
-
-            for idx, item_dados in enumerate(dados.itens, 1):
-                # Calcula impostos do item
-                item_calculado = self._calcular_impostos_item(
-                    item_dados, empresa.regime_tributario, dados.dest_uf, empresa.uf
-                )
+            from models.fiscal import LogComunicacaoSefaz
 
-                item = ItemDocumentoFiscal(
-                    documento_id=doc.id,
-                    numero_item=idx,
-                    codigo_produto=item_dados.get('codigo', str(idx)),
-                    descricao=item_dados.get('descricao', 'Produto'),
-                    ncm=item_dados.get('ncm', ''),
-                    cfop=item_dados.get('cfop', '5102'),
-                    unidade_comercial=item_dados.get('unidade', 'UN'),
-                    quantidade_comercial=Decimal(str(item_dados.get('quantidade', 1))),
-                    valor_unitario_comercial=Decimal(str(item_dados.get('valor_unitario', 0))),
-                    unidade_tributavel=item_dados.get('unidade', 'UN'),
-                    quantidade_tributavel=Decimal(str(item_dados.get('quantidade', 1))),
-                    valor_unitario_tributavel=Decimal(str(item_dados.get('valor_unitario', 0))),
-                    valor_total_bruto=item_calculado['valor_total'],
-                    codigo_barras=item_dados.get('codigo_barras'),
-                    cest=item_dados.get('cest'),
-                    icms_origem=item_dados.get('origem', '0'),
-                    icms_cst=item_calculado['icms_cst'],
-                    icms_base=item_calculado['icms_base'],
-                    icms_aliquota=item_calculado['icms_aliquota'],
-                    icms_valor=item_calculado['icms_valor'],
-                    pis_cst=item_calculado['pis_cst'],
-                    pis_base=item_calculado['pis_base'],
-                    pis_aliquota=item_calculado['pis_aliquota'],
-                    pis_valor=item_calculado['pis_valor'],
-                    cofins_cst=item_calculado['cofins_cst'],
-                    cofins_base=item_calculado['cofins_base'],
-                    cofins_aliquota=item_calculado['cofins_aliquota'],
-                    cofins_valor=item_calculado['cofins_valor']
-                )
-
-                doc.itens.append(item)
-
-                # Acumula totais
-                valor_produtos += item_calculado['valor_total']
-                valor_icms_base += item_calculado['icms_base']
-                valor_icms += item_calculado['icms_valor']
-                valor_pis += item_calculado['pis_valor']
-                valor_cofins += item_calculado['cofins_valor']
-
-            # Totais do documento
-            doc.valor_produtos = valor_produtos
-            doc.valor_icms_base = valor_icms_base
-            doc.valor_icms = valor_icms
-            doc.valor_pis = valor_pis
-            doc.valor_cofins = valor_cofins
-            doc.valor_ipi = valor_ipi
-            doc.valor_total = valor_produtos  # + frete + outras despesas - desconto
-
-            # 7. Processa pagamentos
-            for pag_dados in dados.pagamentos:
-                pag = PagamentoDocumentoFiscal(
-                    documento_id=doc.id,
-                    indicador_pagamento=pag_dados.get('indicador', '0'),
-                    forma_pagamento=pag_dados.get('forma', '01'),
-                    valor=Decimal(str(pag_dados.get('valor', 0))),
-                    valor_troco=Decimal(str(pag_dados.get('troco', 0)))
-                )
-                doc.pagamentos.append(pag)
-
-            # 8. Gera chave de acesso
-            doc.gerar_chave_acesso()
-
-            # 9. Gera XML
-            try:
-                xml_original = self.xml_builder.build_nfe(doc)
-                doc.xml_original = xml_original
-                doc.status = "rascunho"
-            except Exception as e:
-                logger.error(f"Erro ao gerar XML: {str(e)}")
-                return ResultadoEmissao(
-                    sucesso=False,
-                    mensagem="Erro ao gerar XML da NF-e",
-                    erros=[str(e)]
-                )
+            # 1-9. Monta documento e XML
+            doc, empresa, erro = self._montar_documento(dados)
+            if erro:
+                return erro
 
             # 10. Assina XML
             resultado_assinatura = self.cert_manager.assinar_xml_empresa(
-                str(empresa.id), xml_original, tipo="nfe"
+                str(empresa.id), doc.xml_original, tipo="nfe"
             )
 
             if not resultado_assinatura.sucesso:
@@ -440,7 +249,8 @@ class FiscalService:
             # 11. Envia para SEFAZ
             sefaz = self.sefaz_factory.criar_servico(
                 uf=empresa.uf,
-                ambiente=empresa.ambiente_atual
+                ambiente=empresa.ambiente_atual,
+                empresa_id=str(empresa.id)
             )
 
             resultado_sefaz = sefaz.autorizar_nfe(doc.xml_assinado, sincrono=True)
@@ -524,6 +334,251 @@ class FiscalService:
                 erros=[str(e)]
             )
 
+    def enfileirar_nfe(self, dados: DadosEmissao) -> ResultadoEmissao:
+        """
+        Gera a NF-e e a deixa pendente para envio em lote
+
+        O documento é gravado com status "rascunho"; o NFeLoteService agrupa
+        os pendentes por empresa/série (até 50 por lote), assina, envia com
+        indSinc=0 e consulta o recibo em background.
+
+        Args:
+            dados: DadosEmissao com todos os dados necessários
+
+        Returns:
+            ResultadoEmissao (sucesso indica que a nota foi enfileirada)
+        """
+        try:
+            ok, msg = self._validar_servicos()
+            if not ok:
+                return ResultadoEmissao(sucesso=False, mensagem=msg)
+
+            dados.modelo = "55"
+            doc, empresa, erro = self._montar_documento(dados)
+            if erro:
+                return erro
+
+            db.session.add(doc)
+            db.session.commit()
+
+            from services.nfe_lote_service import nfe_lote_service
+            nfe_lote_service.notificar()
+
+            return ResultadoEmissao(
+                sucesso=True,
+                mensagem="NF-e enfileirada para envio em lote",
+                documento_id=str(doc.id),
+                chave_acesso=doc.chave_acesso,
+                numero_nota=doc.numero,
+                serie=doc.serie
+            )
+
+        except Exception as e:
+            logger.error(f"Erro ao enfileirar NF-e: {str(e)}")
+            db.session.rollback()
+            return ResultadoEmissao(
+                sucesso=False,
+                mensagem="Erro interno na emissão",
+                erros=[str(e)]
+            )
+
+    def _montar_documento(self, dados: DadosEmissao):
+        """
+        Passos 1-9 da emissão: empresa, certificado, numeração, itens,
+        pagamentos, chave de acesso e XML (sem assinatura)
+
+        Returns:
+            Tuple (documento, empresa, None) ou (None, None, ResultadoEmissao com o erro)
+        """
+        from models.fiscal import (
+            EmpresaEmissora, DocumentoFiscal,
+            ItemDocumentoFiscal, PagamentoDocumentoFiscal
+        )
+
+        # 1. Obtém empresa emissora
+        empresa = EmpresaEmissora.query.get(dados.empresa_id)
+        if not empresa:
+            return None, None, ResultadoEmissao(
+                sucesso=False,
+                mensagem=f"Empresa não encontrada: {dados.empresa_id}"
+            )
+
+        if not empresa.is_active:
+            return None, None, ResultadoEmissao(
+                sucesso=False,
+                mensagem="Empresa não está ativa"
+            )
+
+        # 2. Verifica certificado
+        cert_service = self.cert_manager.obter_servico(str(empresa.id))
+        if not cert_service or not cert_service.certificado_esta_valido():
+            return None, None, ResultadoEmissao(
+                sucesso=False,
+                mensagem="Certificado digital não disponível ou inválido",
+                erros=["Certificado digital não encontrado ou expirado"]
+            )
+
+        # 3. Valida dados obrigatórios (antes de consumir numeração)
+        modelo = dados.modelo or "55"
+        erros_validacao = self._validar_dados_emissao(dados, modelo)
+        if erros_validacao:
+            return None, None, ResultadoEmissao(
+                sucesso=False,
+                mensagem="Dados inválidos para emissão",
+                erros=erros_validacao
+            )
+
+        # 4. Obtém série (cria a padrão se não existir) e reserva o próximo número
+        try:
+            serie_fiscal = numeracao_fiscal.garantir_serie_padrao(
+                empresa.id, modelo, empresa.ambiente_atual
+            )
+            numero = serie_fiscal.obter_proximo_numero()
+        except NumeracaoIndisponivel as e:
+            return None, None, ResultadoEmissao(
+                sucesso=False,
+                mensagem="Numeração fiscal indisponível",
+                erros=[str(e)]
+            )
+
+        # 5. Cria documento fiscal
+        doc = DocumentoFiscal(
+            empresa=empresa,
+            serie_fiscal=serie_fiscal,
+            modelo=modelo,
+            serie=serie_fiscal.serie,
+            numero=numero,
+            tipo_operacao=dados.tipo_operacao,
+            finalidade=dados.finalidade,
+            tipo_emissao="1",  # Normal
+            indicador_presenca=dados.indicador_presenca,
+            ambiente=empresa.ambiente_atual,
+            status="rascunho",
+            data_emissao=datetime.utcnow()
+        )
+
+        # Destinatário
+        doc.dest_tipo_pessoa = dados.dest_tipo_pessoa
+        doc.dest_cpf = dados.dest_cpf
+        doc.dest_cnpj = dados.dest_cnpj
+        doc.dest_nome = dados.dest_nome
+        doc.dest_email = dados.dest_email
+        doc.dest_telefone = dados.dest_telefone
+        doc.dest_ie = dados.dest_ie
+
+        # Endereço
+        doc.dest_logradouro = dados.dest_logradouro
+        doc.dest_numero = dados.dest_numero
+        doc.dest_complemento = dados.dest_complemento
+        doc.dest_bairro = dados.dest_bairro
+        doc.dest_cep = dados.dest_cep
+        doc.dest_municipio = dados.dest_municipio
+        doc.dest_codigo_municipio_ibge = dados.dest_codigo_municipio
+        doc.dest_uf = dados.dest_uf
+
+        # Transporte
+        doc.modalidade_frete = dados.modalidade_frete
+
+        # Informações adicionais
+        doc.informacoes_complementares = dados.informacoes_complementares
+        doc.informacoes_fisco = dados.informacoes_fisco
+
+        # Referências
+        doc.order_id = dados.order_id
+        doc.sale_id = dados.sale_id
+
+        # 6. Processa itens e calcula totais
+        valor_produtos = Decimal('0')
+        valor_icms_base = Decimal('0')
+        valor_icms = Decimal('0')
+        valor_pis = Decimal('0')
+        valor_cofins = Decimal('0')
+        valor_ipi = Decimal('0')
+
+        for idx, item_dados in enumerate(dados.itens, 1):
+            # Calcula impostos do item
+            item_calculado = self._calcular_impostos_item(
+                item_dados, empresa.regime_tributario, dados.dest_uf, empresa.uf
+            )
+
+            item = ItemDocumentoFiscal(
+                documento_id=doc.id,
+                numero_item=idx,
+                codigo_produto=item_dados.get('codigo', str(idx)),
+                descricao=item_dados.get('descricao', 'Produto'),
+                ncm=item_dados.get('ncm', ''),
+                cfop=item_dados.get('cfop', '5102'),
+                unidade_comercial=item_dados.get('unidade', 'UN'),
+                quantidade_comercial=Decimal(str(item_dados.get('quantidade', 1))),
+                valor_unitario_comercial=Decimal(str(item_dados.get('valor_unitario', 0))),
+                unidade_tributavel=item_dados.get('unidade', 'UN'),
+                quantidade_tributavel=Decimal(str(item_dados.get('quantidade', 1))),
+                valor_unitario_tributavel=Decimal(str(item_dados.get('valor_unitario', 0))),
+                valor_total_bruto=item_calculado['valor_total'],
+                codigo_barras=item_dados.get('codigo_barras'),
+                cest=item_dados.get('cest'),
+                icms_origem=item_dados.get('origem', '0'),
+                icms_cst=item_calculado['icms_cst'],
+                icms_base=item_calculado['icms_base'],
+                icms_aliquota=item_calculado['icms_aliquota'],
+                icms_valor=item_calculado['icms_valor'],
+                pis_cst=item_calculado['pis_cst'],
+                pis_base=item_calculado['pis_base'],
+                pis_aliquota=item_calculado['pis_aliquota'],
+                pis_valor=item_calculado['pis_valor'],
+                cofins_cst=item_calculado['cofins_cst'],
+                cofins_base=item_calculado['cofins_base'],
+                cofins_aliquota=item_calculado['cofins_aliquota'],
+                cofins_valor=item_calculado['cofins_valor']
+            )
+
+            doc.itens.append(item)
+
+            # Acumula totais
+            valor_produtos += item_calculado['valor_total']
+            valor_icms_base += item_calculado['icms_base']
+            valor_icms += item_calculado['icms_valor']
+            valor_pis += item_calculado['pis_valor']
+            valor_cofins += item_calculado['cofins_valor']
+
+        # Totais do documento
+        doc.valor_produtos = valor_produtos
+        doc.valor_icms_base = valor_icms_base
+        doc.valor_icms = valor_icms
+        doc.valor_pis = valor_pis
+        doc.valor_cofins = valor_cofins
+        doc.valor_ipi = valor_ipi
+        doc.valor_total = valor_produtos  # + frete + outras despesas - desconto
+
+        # 7. Processa pagamentos
+        for pag_dados in dados.pagamentos:
+            pag = PagamentoDocumentoFiscal(
+                documento_id=doc.id,
+                indicador_pagamento=pag_dados.get('indicador', '0'),
+                forma_pagamento=pag_dados.get('forma', '01'),
+                valor=Decimal(str(pag_dados.get('valor', 0))),
+                valor_troco=Decimal(str(pag_dados.get('troco', 0)))
+            )
+            doc.pagamentos.append(pag)
+
+        # 8. Gera chave de acesso
+        doc.gerar_chave_acesso()
+
+        # 9. Gera XML
+        try:
+            xml_original = self.xml_builder.build_nfe(doc)
+            doc.xml_original = xml_original
+            doc.status = "rascunho"
+        except Exception as e:
+            logger.error(f"Erro ao gerar XML: {str(e)}")
+            return None, None, ResultadoEmissao(
+                sucesso=False,
+                mensagem="Erro ao gerar XML da NF-e",
+                erros=[str(e)]
+            )
+
+        return doc, empresa, None
+
     def emitir_nfce(self, dados: DadosEmissao) -> ResultadoEmissao:
         """
         Emite uma NFC-e (Nota Fiscal de Consumidor Eletrônica)
@@ -614,7 +669,8 @@ class FiscalService:
             empresa = doc.empresa
             sefaz = self.sefaz_factory.criar_servico(
                 uf=empresa.uf,
-                ambiente=empresa.ambiente_atual
+                ambiente=empresa.ambiente_atual,
+                empresa_id=str(empresa.id)
             )
 
             resultado_sefaz = sefaz.enviar_evento(resultado_assinatura.xml_assinado)
@@ -748,7 +804,8 @@ class FiscalService:
             empresa = doc.empresa
             sefaz = self.sefaz_factory.criar_servico(
                 uf=empresa.uf,
-                ambiente=empresa.ambiente_atual
+                ambiente=empresa.ambiente_atual,
+                empresa_id=str(empresa.id)
             )
 
             resultado_sefaz = sefaz.enviar_evento(resultado_assinatura.xml_assinado)
@@ -819,9 +876,11 @@ class FiscalService:
             # Obtém documento local
             doc = DocumentoFiscal.query.filter_by(chave_acesso=chave_acesso).first()
 
+            empresa_id = None
             if doc:
                 uf = doc.empresa.uf
                 ambiente = doc.ambiente
+                empresa_id = str(doc.empresa_id)
             else:
                 # Extrai UF da chave
                 uf_codigo = chave_acesso[:2]
@@ -833,7 +892,7 @@ class FiscalService:
                 ambiente = "2"  # Assume homologação
 
             # Consulta SEFAZ
-            sefaz = self.sefaz_factory.criar_servico(uf=uf, ambiente=ambiente)
+            sefaz = self.sefaz_factory.criar_servico(uf=uf, ambiente=ambiente, empresa_id=empresa_id)
             resultado = sefaz.consultar_protocolo(chave_acesso)
 
             return ResultadoEmissao(
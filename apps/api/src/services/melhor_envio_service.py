@@ -5,13 +5,73 @@ Implementação funcional para cálculo de frete e gestão de envios
 
 import os
 import json
+import math
+import threading
+import time
 import uuid
 import requests
-from typing import Dict, Any, List
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List, Optional, Tuple
 from decimal import Decimal
 from datetime import datetime
+from services.shipping_rates import shipping_rates
+from utils.cache import cache_manager, cached
 from utils.logger import logger
 
+# Conexões HTTPS mantidas abertas com a API (compartilhadas entre instâncias)
+HTTP_POOL_SIZE = int(os.environ.get('MELHOR_ENVIO_POOL_SIZE', 10))
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+# Cache de cotações: chave = (origem, prefixo de 5 dígitos do destino, perfil
+# dos volumes arredondado para cima nas faixas abaixo)
+QUOTE_CACHE_TTL = int(os.environ.get('SHIPPING_QUOTE_TTL', 1800))
+QUOTE_STALE_TTL = QUOTE_CACHE_TTL
+DESTINATION_PREFIX = 5
+WEIGHT_BUCKET_KG = 0.25
+DIMENSION_BUCKET_CM = 5
+INSURANCE_BUCKET = 50
+
+# Pré-aquecimento das cotações mais pedidas
+WARM_TOP = int(os.environ.get('SHIPPING_QUOTE_WARM_TOP', 20))
+WARM_INTERVAL = max(60, QUOTE_CACHE_TTL // 3)
+DEMAND_KEY = 'mc:shipping:demand'
+DEMAND_MAX_ENTRIES = 500
+WARM_LOCK = 'shipping:warmup'
+
+
+class ShippingQuoteError(Exception):
+    """API não retornou cotação (não vai para o cache)"""
+
+
+def _create_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+http_session = _create_session()
+
+
+def _digits(cep: str) -> str:
+    return ''.join(ch for ch in str(cep or '') if ch.isdigit())
+
+
+def _round_up(value, step) -> float:
+    return round(math.ceil(float(value) / step - 1e-9) * step, 2)
+
+
+def _quote_identity(service, origin: str, destination: str, packages) -> Tuple:
+    """Identidade da cotação no cache: o CEP completo do destino não entra"""
+    return (service.environment, origin, destination[:DESTINATION_PREFIX], packages)
+
+
+def _region_cep(destination: str) -> str:
+    """CEP da região (prefixo + zeros): cotado no pré-aquecimento, mesma chave de cache"""
+    return destination[:DESTINATION_PREFIX].ljust(8, '0')
+
 
 class MelhorEnvioService:
     """
@@ -45,53 +105,143 @@ class MelhorEnvioService:
     def calculate_shipping(self, origin_cep: str, destination_cep: str, products: List[Dict]) -> Dict[str, Any]:
         """
         Calcula opções de frete entre CEPs
+
+        Cotações ficam em cache por origem, região de destino (prefixo do CEP) e
+        perfil dos volumes; chamadas simultâneas iguais fazem uma só requisição.
         """
         try:
             # Se não tiver API key, retornar valores fixos para desenvolvimento
             if not self.api_key:
                 logger.warning("MELHOR_ENVIO_API_KEY não configurada - usando valores fixos")
-                return self._get_fallback_quotes()
-            
-            # Preparar dados para a API
-            formatted_products = self._format_products(products)
-            
-            payload = {
-                "from": {"postal_code": origin_cep.replace('-', '')},
-                "to": {"postal_code": destination_cep.replace('-', '')},
-                "products": formatted_products
+                return self._get_fallback_quotes(destination_cep, products)
+
+            origin = _digits(origin_cep)
+            destination = _digits(destination_cep)
+            packages = self._package_profile(self._format_products(products))
+            self._record_demand(origin, destination, packages)
+
+            quotes = self._quote(origin, destination, packages)
+
+            return {
+                'success': True,
+                'quotes': [dict(quote) for quote in quotes],
+                'fallback': False
             }
-            
-            # Fazer requisição para API
-            response = requests.post(
+
+        except ShippingQuoteError as e:
+            logger.error(str(e))
+            return self._get_fallback_quotes(destination_cep, products)
+        except Exception as e:
+            logger.error(f"Erro inesperado no cálculo de frete: {str(e)}")
+            import traceback
+            logger.error(f"🔍 DEBUG Stack trace: {traceback.format_exc()}")
+            return self._get_fallback_quotes(destination_cep, products)
+
+    @cached(timeout=QUOTE_CACHE_TTL, key_prefix="shipping_quote", stale_ttl=QUOTE_STALE_TTL,
+            key_args=_quote_identity)
+    def _quote(self, origin: str, destination: str, packages) -> List[Dict]:
+        """Consulta a API; erros levantam ShippingQuoteError para não irem ao cache"""
+        payload = {
+            "from": {"postal_code": origin},
+            "to": {"postal_code": destination},
+            "products": [
+                {
+                    'id': str(index),
+                    'width': width,
+                    'height': height,
+                    'length': length,
+                    'weight': weight,
+                    'insurance_value': insurance,
+                    'quantity': quantity
+                }
+                for index, (width, height, length, weight, insurance, quantity) in enumerate(packages, 1)
+            ]
+        }
+
+        try:
+            response = http_session.post(
                 f"{self.base_url}/api/v2/me/shipment/calculate",
                 headers=self.headers,
                 json=payload,
-                timeout=30
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
             )
-            
-            if response.status_code == 200:
-                data = response.json()
-                quotes = self._format_quotes(data)
-                
-                logger.info(f"Frete calculado: {origin_cep} → {destination_cep}")
-                
-                return {
-                    'success': True,
-                    'quotes': quotes,
-                    'fallback': False
-                }
-            else:
-                logger.error(f"Erro na API Melhor Envio: {response.status_code}")
-                return self._get_fallback_quotes()
-                
         except requests.exceptions.RequestException as e:
-            logger.error(f"Erro de conexão com Melhor Envio: {str(e)}")
-            return self._get_fallback_quotes()
+            raise ShippingQuoteError(f"Erro de conexão com Melhor Envio: {str(e)}")
+
+        if response.status_code != 200:
+            raise ShippingQuoteError(f"Erro na API Melhor Envio: {response.status_code}")
+
+        quotes = self._format_quotes(response.json())
+        logger.info(f"Frete calculado: {origin} → {destination[:DESTINATION_PREFIX]}*")
+        return quotes
+
+    @staticmethod
+    def _package_profile(formatted_products: List[Dict]) -> Tuple:
+        """
+        Volumes arredondados para cima nas faixas de peso/dimensão/valor
+
+        A cotação de uma faixa vale para todos os carrinhos dentro dela (o
+        preço nunca fica abaixo do real); volumes iguais são agrupados.
+        """
+        quantities: Dict[Tuple, int] = {}
+        for product in formatted_products:
+            profile = (
+                _round_up(product['width'], DIMENSION_BUCKET_CM),
+                _round_up(product['height'], DIMENSION_BUCKET_CM),
+                _round_up(product['length'], DIMENSION_BUCKET_CM),
+                _round_up(product['weight'], WEIGHT_BUCKET_KG),
+                _round_up(product['insurance_value'] or 0, INSURANCE_BUCKET),
+            )
+            quantities[profile] = quantities.get(profile, 0) + int(product['quantity'] or 1)
+        return tuple(sorted(profile + (quantity,) for profile, quantity in quantities.items()))
+
+    # ------------------------------------------------------------------
+    # Pré-aquecimento
+    # ------------------------------------------------------------------
+
+    def _record_demand(self, origin: str, destination: str, packages) -> None:
+        """
+        Conta as cotações pedidas para pré-aquecer as mais frequentes
+
+        Registra a mesma identidade do cache (prefixo do CEP e perfil dos
+        volumes): o conjunto fica limitado e o CEP do cliente não é guardado.
+        """
+        client = cache_manager.redis_client
+        if client is None:
+            return
+        try:
+            member = json.dumps([origin, destination[:DESTINATION_PREFIX], packages])
+            client.zincrby(DEMAND_KEY, 1, member)
         except Exception as e:
-            logger.error(f"Erro inesperado no cálculo de frete: {str(e)}")
-            import traceback
-            logger.error(f"🔍 DEBUG Stack trace: {traceback.format_exc()}")
-            return self._get_fallback_quotes()
+            logger.warning(f"Erro ao registrar demanda de frete: {e}")
+
+    def warm_quotes(self, limit: int = WARM_TOP) -> int:
+        """Recalcula as cotações mais pedidas antes de vencerem"""
+        client = cache_manager.redis_client
+        if client is None or not self.api_key:
+            return 0
+
+        warmed = 0
+        seen = set()
+        for member in client.zrevrange(DEMAND_KEY, 0, DEMAND_MAX_ENTRIES - 1):
+            origin, destination, packages = json.loads(member)
+            packages = tuple(tuple(package) for package in packages)
+            identity = (origin, destination[:DESTINATION_PREFIX], packages)
+            if identity in seen:
+                continue
+            seen.add(identity)
+
+            try:
+                if MelhorEnvioService._quote.refresh(self, origin, _region_cep(destination), packages) is not None:
+                    warmed += 1
+            except ShippingQuoteError as e:
+                logger.warning(f"Pré-aquecimento de frete falhou: {e}")
+            if len(seen) >= limit:
+                break
+
+        # Mantém apenas as entradas mais pedidas
+        client.zremrangebyrank(DEMAND_KEY, 0, -DEMAND_MAX_ENTRIES - 1)
+        return warmed
 
     def create_shipment(self, order_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -113,7 +263,7 @@ class MelhorEnvioService:
             payload = self._prepare_shipment_data(order_data)
             
             # Criar envio na API
-            response = requests.post(
+            response = http_session.post(
                 f"{self.base_url}/api/v2/me/shipment/generate",
                 headers=self.headers,
                 json=payload,
@@ -162,7 +312,7 @@ class MelhorEnvioService:
                 }
             
             # Consultar API de rastreamento
-            response = requests.get(
+            response = http_session.get(
                 f"{self.base_url}/api/v2/me/shipment/tracking",
                 headers=self.headers,
                 params={'tracking': tracking_code},
@@ -194,7 +344,7 @@ class MelhorEnvioService:
                 logger.info(f"Simulando cancelamento da etiqueta {shipment_id}")
                 return {'success': True, 'message': 'Etiqueta cancelada'}
             
-            response = requests.delete(
+            response = http_session.delete(
                 f"{self.base_url}/api/v2/me/shipment/{shipment_id}",
                 headers=self.headers,
                 timeout=30
@@ -227,7 +377,7 @@ class MelhorEnvioService:
                     ]
                 }
             
-            response = requests.get(
+            response = http_session.get(
                 f"{self.base_url}/api/v2/me/agencies",
                 headers=self.headers,
                 params={'city': city, 'state': state},
@@ -257,7 +407,7 @@ class MelhorEnvioService:
                 'redirect_uri': os.environ.get('MELHOR_ENVIO_REDIRECT_URI')
             }
             
-            response = requests.post(
+            response = http_session.post(
                 f"{self.base_url}/oauth/token",
                 json=payload,
                 timeout=30
@@ -298,31 +448,29 @@ class MelhorEnvioService:
             logger.error(f"Erro ao processar webhook: {str(e)}")
             return {'success': False, 'error': str(e)}
 
-    def _get_fallback_quotes(self) -> Dict[str, Any]:
+    def _get_fallback_quotes(self, destination_cep: Optional[str] = None,
+                             products: Optional[List[Dict]] = None) -> Dict[str, Any]:
         """
-        Retorna cotações padrão quando a API não está disponível
+        Retorna cotações tabeladas (por faixa de CEP) quando a API não está disponível
         """
+        weight = sum(
+            float(product.get('weight', 0.3)) * int(product.get('quantity', 1))
+            for product in (products or []) if isinstance(product, dict)
+        )
+        options = shipping_rates.quote(destination_cep, weight)
         return {
             'success': True,
             'quotes': [
                 {
-                    'id': 1,
-                    'name': 'PAC',
-                    'service_name': 'PAC',
-                    'company': 'Correios',
-                    'price': 15.00,
-                    'delivery_time': '5-7 dias úteis',
-                    'packages': [{'price': 15.00, 'discount': 0}]
-                },
-                {
-                    'id': 2,
-                    'name': 'SEDEX',
-                    'service_name': 'SEDEX',
-                    'company': 'Correios',
-                    'price': 25.00,
-                    'delivery_time': '1-2 dias úteis',
-                    'packages': [{'price': 25.00, 'discount': 0}]
+                    'id': index,
+                    'name': option['service_name'],
+                    'service_name': option['service_name'],
+                    'company': option['carrier_name'],
+                    'price': option['price'],
+                    'delivery_time': f"{option['delivery_time']} dias úteis",
+                    'packages': [{'price': option['price'], 'discount': 0}]
                 }
+                for index, option in enumerate(options, 1)
             ],
             'fallback': True
         }
@@ -418,4 +566,56 @@ class MelhorEnvioService:
                 'receipt': order_data.get('receipt', False),
                 'own_hand': order_data.get('own_hand', False)
             }
-        }
\ No newline at end of file
+        }
+
+
+class ShippingQuoteWarmer:
+    """Mantém quentes no cache as cotações mais pedidas (origem/região/volumes)"""
+
+    def __init__(self, interval: int = WARM_INTERVAL):
+        self.interval = interval
+        self._app = None
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self._app = app
+        self.start()
+
+    def start(self) -> None:
+        with self._worker_lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._worker_loop, name="shipping-quote-warmer", daemon=True)
+            self._worker.start()
+
+    def warm(self) -> int:
+        """Uma passada de pré-aquecimento (um worker por vez)"""
+        token = cache_manager.acquire_lock(WARM_LOCK, timeout=self.interval)
+        if token is None:
+            return 0
+        try:
+            return MelhorEnvioService().warm_quotes()
+        finally:
+            cache_manager.release_lock(WARM_LOCK, token)
+
+    def _worker_loop(self) -> None:
+        with self._app.app_context():
+            while True:
+                try:
+                    warmed = self.warm()
+                    if warmed:
+                        logger.info(f"🔥 {warmed} cotações de frete pré-aquecidas")
+                except Exception as e:
+                    logger.error(f"Erro no pré-aquecimento de fretes: {e}")
+
+                time.sleep(self.interval)
+
+
+# Instância global do pré-aquecimento de cotações
+shipping_quote_warmer = ShippingQuoteWarmer()
+
+
+def init_shipping_quote_warmup(app) -> None:
+    """Inicia o pré-aquecimento periódico das cotações de frete mais pedidas"""
+    shipping_quote_warmer.init_app(app)
@@ -0,0 +1,529 @@
+"""
+Envio de campanhas de newsletter
+Assinantes ativos são lidos em streaming (yield_per) e enviados em lotes por
+um pool de conexões SMTP persistentes, com vazão limitada por token bucket.
+O template da campanha é compilado uma vez; para cada destinatário só as
+variáveis são preenchidas. Ao fim de cada lote os contadores da campanha são
+incrementados e o último assinante processado é gravado: um envio
+interrompido é retomado desse ponto (no máximo o lote em andamento é reenviado).
+"""
+
+import html
+import logging
+import os
+import queue
+import re
+import smtplib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formataddr
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+from urllib.parse import quote
+
+from sqlalchemy import func, inspect, or_, select, text, update
+
+from database import db
+from models.newsletter import NewsletterCampaign, NewsletterSubscriber
+
+logger = logging.getLogger(__name__)
+
+CAMPAIGN_CHUNK_SIZE = int(os.environ.get("NEWSLETTER_CHUNK_SIZE", 200))
+SMTP_POOL_SIZE = int(os.environ.get("NEWSLETTER_SMTP_CONNECTIONS", 4))
+SEND_RATE_PER_SECOND = float(os.environ.get("NEWSLETTER_RATE_PER_SECOND", 50))
+# Muitos servidores SMTP limitam mensagens por sessão
+MESSAGES_PER_CONNECTION = 100
+
+# Campanhas "sending" sem checkpoint há mais tempo que isso são retomadas
+CAMPAIGN_STALE_AFTER = timedelta(minutes = 5)
+WORKER_POLL_INTERVAL = 60
+
+DEFAULT_NAME = "Cliente"
+DEFAULT_TEXT = "Versão sem HTML não disponível"
+UNSUBSCRIBE_FOOTER = "\n\nPara cancelar sua inscrição: {{unsubscribe_link}}"
+
+# Colunas do envio que tabelas newsletter_campaigns criadas antes dele não têm
+DELIVERY_COLUMNS = ("total_failed", "delivery_cursor", "delivery_heartbeat_at")
+
+_PLACEHOLDER = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+# Erros em que a sessão SMTP continua utilizável (só o destinatário falhou)
+_RECIPIENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+class CompiledTemplate:
+    """Template com placeholders {{var}} separado uma vez em trechos fixos e variáveis"""
+
+    def __init__(self, source: Optional[str], escape: bool = False):
+        source = source or ""
+        self.escape = escape
+        parts = _PLACEHOLDER.split(source)
+        self._literals = parts[0::2]
+        self._names = parts[1::2]
+        self._raw = [match.group(0) for match in _PLACEHOLDER.finditer(source)]
+
+    @property
+    def variables(self) -> set:
+        return set(self._names)
+
+    def render(self, context: Dict[str, Any]) -> str:
+        """Preenche as variáveis; placeholders sem valor são mantidos"""
+        out = [self._literals[0]]
+        for name, raw, literal in zip(self._names, self._raw, self._literals[1:]):
+            value = context.get(name)
+            if value is None:
+                out.append(raw)
+            else:
+                out.append(html.escape(str(value)) if self.escape else str(value))
+            out.append(literal)
+        return "".join(out)
+
+
+class TokenBucket:
+    """Limitador de vazão compartilhado entre threads (rate tokens/s)"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+@dataclass(frozen = True)
+class SMTPSettings:
+    """Servidor e remetente (mesmas chaves de config do EmailProvider)"""
+
+    host: str = "localhost"
+    port: int = 587
+    username: str = ""
+    password: str = ""
+    use_tls: bool = True
+    sender_email: str = "noreply@mestrescafe.com"
+    sender_name: str = "Mestres do Café"
+    timeout: float = 30
+
+    @classmethod
+    def from_config(cls, config) -> "SMTPSettings":
+        return cls(
+            host = config.get("SMTP_SERVER", "localhost"),
+            port = int(config.get("SMTP_PORT", 587)),
+            username = config.get("SMTP_USERNAME", ""),
+            password = config.get("SMTP_PASSWORD", ""),
+            use_tls = config.get("SMTP_USE_TLS", True),
+            sender_email = config.get("SENDER_EMAIL", "noreply@mestrescafe.com"),
+            sender_name = config.get("SENDER_NAME", "Mestres do Café"),
+        )
+
+
+class _PooledConnection:
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.sent = 0
+
+
+class SMTPConnectionPool:
+    """
+    Conexões SMTP persistentes (handshake, STARTTLS e login uma vez por sessão)
+
+    No máximo `size` conexões abertas; cada uma é reciclada depois de
+    `messages_per_connection` mensagens.
+    """
+
+    def __init__(self, settings: SMTPSettings, size: int = SMTP_POOL_SIZE,
+                 messages_per_connection: int = MESSAGES_PER_CONNECTION):
+        self.settings = settings
+        self.messages_per_connection = messages_per_connection
+        self.connections_opened = 0
+        self._idle: "queue.LifoQueue[_PooledConnection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def send(self, message: MIMEMultipart) -> None:
+        """Envia a mensagem; levanta a exceção do smtplib em caso de falha"""
+        with self._slots:
+            connection = self._take()
+            try:
+                try:
+                    connection.smtp.send_message(message)
+                except smtplib.SMTPServerDisconnected:
+                    # Sessão ociosa derrubada pelo servidor: uma nova tentativa
+                    self._close(connection)
+                    connection = self._connect()
+                    connection.smtp.send_message(message)
+            except _RECIPIENT_ERRORS:
+                self._release(connection)
+                raise
+            except Exception:
+                self._close(connection)
+                raise
+
+            connection.sent += 1
+            self._release(connection)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def _take(self) -> _PooledConnection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _connect(self) -> _PooledConnection:
+        settings = self.settings
+        smtp = smtplib.SMTP(settings.host, settings.port, timeout = settings.timeout)
+        try:
+            if settings.use_tls:
+                smtp.starttls()
+            if settings.username and settings.password:
+                smtp.login(settings.username, settings.password)
+        except Exception:
+            smtp.close()
+            raise
+        with self._lock:
+            self.connections_opened += 1
+        return _PooledConnection(smtp)
+
+    def _release(self, connection: _PooledConnection) -> None:
+        if connection.sent >= self.messages_per_connection:
+            self._close(connection)
+        else:
+            self._idle.put(connection)
+
+    @staticmethod
+    def _close(connection: _PooledConnection) -> None:
+        try:
+            connection.smtp.quit()
+        except Exception:
+            connection.smtp.close()
+
+
+class SMTPUnavailable(Exception):
+    """Nenhuma mensagem do lote saiu por falha de conexão com o servidor SMTP"""
+
+
+class NewsletterDelivery:
+    """Fila de campanhas em envio e worker em background"""
+
+    def __init__(self, chunk_size: int = CAMPAIGN_CHUNK_SIZE, pool_size: int = SMTP_POOL_SIZE,
+                 rate_per_second: float = SEND_RATE_PER_SECOND):
+        self.chunk_size = chunk_size
+        self.pool_size = pool_size
+        self.rate_per_second = rate_per_second
+        # Sobrescreve a config do app (ex.: servidor SMTP local nos testes)
+        self.smtp_settings: Optional[SMTPSettings] = None
+        self._app = None
+        self._wakeup = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+
+    def init_app(self, app) -> None:
+        """Registra o app e retoma campanhas interrompidas"""
+        self._app = app
+        with app.app_context():
+            self._upgrade_schema()
+            pending = NewsletterCampaign.query.filter(NewsletterCampaign.status == "sending").count()
+        if pending:
+            self.start()
+
+    def _upgrade_schema(self) -> None:
+        """
+        Atualiza uma tabela newsletter_campaigns anterior ao envio (idempotente)
+
+        Adiciona as colunas que faltam e zera total_failed das campanhas
+        existentes. Sem a tabela não há o que atualizar: o create_all a cria
+        já no formato atual.
+        """
+        table = NewsletterCampaign.__table__
+        engine = db.engine
+        inspector = inspect(engine)
+        if not inspector.has_table(table.name):
+            return
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        missing = [name for name in DELIVERY_COLUMNS if name not in columns]
+        if not missing:
+            return
+
+        if_not_exists = "IF NOT EXISTS " if engine.dialect.name == "postgresql" else ""
+        with engine.begin() as conn:
+            for name in missing:
+                column_type = table.c[name].type.compile(dialect = engine.dialect)
+                conn.execute(text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {if_not_exists}{name} {column_type}"
+                ))
+            conn.execute(text(f"UPDATE {table.name} SET total_failed = 0 WHERE total_failed IS NULL"))
+        logger.info(f"newsletter_campaigns atualizada para o envio (colunas adicionadas: {missing})")
+
+    def enqueue(self, campaign_id) -> None:
+        """Acorda o worker para uma campanha já marcada como "sending" """
+        self.start()
+        self._wakeup.set()
+
+    def start(self) -> None:
+        """Inicia o worker em background (uma vez por processo)"""
+        if self._app is None:
+            from flask import current_app
+            self._app = current_app._get_current_object()
+
+        with self._worker_lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(
+                target = self._worker_loop, name = "newsletter-delivery", daemon = True
+            )
+            self._worker.start()
+
+    def process_pending(self) -> int:
+        """Envia todas as campanhas disponíveis no contexto atual; retorna quantas rodaram"""
+        processed = 0
+        while True:
+            campaign_id = self._claim_next()
+            if campaign_id is None:
+                return processed
+            self._run_campaign(campaign_id)
+            processed += 1
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def _worker_loop(self) -> None:
+        with self._app.app_context():
+            while True:
+                try:
+                    self.process_pending()
+                except Exception as e:
+                    logger.error(f"Erro no worker de newsletter: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+                self._wakeup.wait(WORKER_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def _claim_next(self) -> Optional[uuid.UUID]:
+        """Reserva a próxima campanha (nova ou abandonada) com compare-and-set"""
+        now = datetime.utcnow()
+        candidate = (
+            NewsletterCampaign.query.filter(
+                NewsletterCampaign.status == "sending",
+                or_(
+                    NewsletterCampaign.delivery_heartbeat_at.is_(None),
+                    NewsletterCampaign.delivery_heartbeat_at < now - CAMPAIGN_STALE_AFTER,
+                ),
+            )
+            .order_by(NewsletterCampaign.sent_at)
+            .first()
+        )
+        if candidate is None:
+            return None
+
+        if candidate.delivery_heartbeat_at is None:
+            same_heartbeat = NewsletterCampaign.delivery_heartbeat_at.is_(None)
+        else:
+            same_heartbeat = NewsletterCampaign.delivery_heartbeat_at == candidate.delivery_heartbeat_at
+
+        result = db.session.execute(
+            update(NewsletterCampaign)
+            .where(
+                NewsletterCampaign.id == candidate.id,
+                NewsletterCampaign.status == "sending",
+                same_heartbeat,
+            )
+            .values(delivery_heartbeat_at = now)
+            .execution_options(synchronize_session = False)
+        )
+        db.session.commit()
+        if result.rowcount != 1:
+            # Outro worker reservou primeiro; tenta a próxima
+            return self._claim_next()
+        return candidate.id
+
+    def _run_campaign(self, campaign_id: uuid.UUID) -> None:
+        campaign = db.session.get(NewsletterCampaign, campaign_id)
+        db.session.refresh(campaign)
+
+        settings = self.smtp_settings or SMTPSettings.from_config(self._app.config)
+        renderer = self._compile(campaign, settings)
+        cursor = uuid.UUID(campaign.delivery_cursor) if campaign.delivery_cursor else None
+        db.session.commit()
+
+        pool = SMTPConnectionPool(settings, self.pool_size)
+        bucket = TokenBucket(self.rate_per_second)
+        executor = ThreadPoolExecutor(max_workers = self.pool_size, thread_name_prefix = "newsletter-smtp")
+
+        def send(recipient):
+            bucket.acquire()
+            try:
+                pool.send(renderer(recipient))
+                return True, False
+            except _RECIPIENT_ERRORS as e:
+                logger.warning(f"Envio recusado para {recipient.email}: {e}")
+                return False, False
+            except Exception as e:
+                logger.error(f"Erro ao enviar para {recipient.email}: {e}")
+                return False, True
+
+        try:
+            for chunk in self._recipient_chunks(cursor):
+                results = list(executor.map(send, chunk))
+                if all(connection_error for _, connection_error in results):
+                    raise SMTPUnavailable(f"Servidor SMTP indisponível ({settings.host}:{settings.port})")
+
+                sent_ids = [recipient.id for recipient, (ok, _) in zip(chunk, results) if ok]
+                if not self._checkpoint(campaign_id, chunk[-1].id, sent_ids, len(chunk) - len(sent_ids)):
+                    logger.info(f"Campanha {campaign_id} interrompida (status alterado)")
+                    return
+
+            db.session.execute(
+                update(NewsletterCampaign)
+                .where(NewsletterCampaign.id == campaign_id, NewsletterCampaign.status == "sending")
+                .values(status = "sent", delivery_heartbeat_at = None)
+                .execution_options(synchronize_session = False)
+            )
+            db.session.commit()
+
+            campaign = db.session.get(NewsletterCampaign, campaign_id)
+            db.session.refresh(campaign)
+            logger.info(
+                f"Campanha {campaign_id} enviada: {campaign.total_sent} sucesso, "
+                f"{campaign.total_failed} falhas, {pool.connections_opened} conexões SMTP"
+            )
+
+        except SMTPUnavailable as e:
+            # Continua "sending": retomada do checkpoint quando o heartbeat expirar
+            db.session.rollback()
+            logger.error(f"Campanha {campaign_id} pausada: {e}")
+
+        finally:
+            executor.shutdown(wait = True)
+            pool.close()
+
+    # ------------------------------------------------------------------
+    # Etapas
+    # ------------------------------------------------------------------
+
+    def _compile(self, campaign: NewsletterCampaign, settings: SMTPSettings):
+        """Compila assunto e corpos uma vez; devolve a função que monta cada mensagem"""
+        template = campaign.template
+        html_source = campaign.html_content or (template.html_content if template else "")
+        text_source = campaign.text_content or (template.text_content if template else None) or DEFAULT_TEXT
+        if "unsubscribe_link" not in _PLACEHOLDER.findall(text_source):
+            text_source += UNSUBSCRIBE_FOOTER
+
+        subject = CompiledTemplate(campaign.subject)
+        html_body = CompiledTemplate(html_source, escape = True)
+        text_body = CompiledTemplate(text_source)
+
+        base_url = (campaign.extra_data or {}).get("delivery_base_url") \
+            or self._app.config.get("PUBLIC_API_URL", "")
+        unsubscribe_url = f"{base_url.rstrip('/')}/api/newsletter/unsubscribe?email="
+        sender = formataddr((settings.sender_name, settings.sender_email))
+
+        def render(recipient) -> MIMEMultipart:
+            context = {
+                "name": recipient.name or DEFAULT_NAME,
+                "email": recipient.email,
+                "unsubscribe_link": unsubscribe_url + quote(recipient.email),
+            }
+            message = MIMEMultipart("alternative")
+            message["Subject"] = subject.render(context)
+            message["From"] = sender
+            message["To"] = recipient.email
+            message.attach(MIMEText(text_body.render(context), "plain", "utf-8"))
+            message.attach(MIMEText(html_body.render(context), "html", "utf-8"))
+            return message
+
+        return render
+
+    def _recipient_chunks(self, cursor: Optional[uuid.UUID]) -> Iterator[Sequence[Any]]:
+        """Assinantes ativos após o cursor, em ordem de id, em lotes de chunk_size"""
+        statement = (
+            select(NewsletterSubscriber.id, NewsletterSubscriber.email, NewsletterSubscriber.name)
+            .where(NewsletterSubscriber.status == "active")
+            .order_by(NewsletterSubscriber.id)
+        )
+
+        if db.engine.dialect.supports_server_side_cursors:
+            # Cursor no servidor, em conexão própria: os checkpoints commitam na sessão
+            if cursor is not None:
+                statement = statement.where(NewsletterSubscriber.id > cursor)
+            with db.engine.connect() as connection:
+                result = connection.execution_options(yield_per = self.chunk_size).execute(statement)
+                for partition in result.partitions():
+                    yield partition
+            return
+
+        # Sem cursor no servidor (SQLite): janelas por keyset
+        while True:
+            window = statement if cursor is None else statement.where(NewsletterSubscriber.id > cursor)
+            rows = db.session.execute(window.limit(self.chunk_size)).all()
+            if not rows:
+                return
+            yield rows
+            cursor = rows[-1].id
+
+    def _checkpoint(self, campaign_id: uuid.UUID, last_id: uuid.UUID,
+                    sent_ids: List[uuid.UUID], failed: int) -> bool:
+        """Incrementa contadores e grava o cursor; False se a campanha saiu de "sending" """
+        result = db.session.execute(
+            update(NewsletterCampaign)
+            .where(NewsletterCampaign.id == campaign_id, NewsletterCampaign.status == "sending")
+            .values(
+                total_sent = func.coalesce(NewsletterCampaign.total_sent, 0) + len(sent_ids),
+                total_failed = func.coalesce(NewsletterCampaign.total_failed, 0) + failed,
+                delivery_cursor = str(last_id),
+                delivery_heartbeat_at = datetime.utcnow(),
+            )
+            .execution_options(synchronize_session = False)
+        )
+        if result.rowcount != 1:
+            db.session.rollback()
+            return False
+
+        if sent_ids:
+            db.session.execute(
+                update(NewsletterSubscriber)
+                .where(NewsletterSubscriber.id.in_(sent_ids))
+                .values(emails_sent = func.coalesce(NewsletterSubscriber.emails_sent, 0) + 1)
+                .execution_options(synchronize_session = False)
+            )
+        db.session.commit()
+        return True
+
+
+# Instância global
+newsletter_delivery = NewsletterDelivery()
+
+
+def init_newsletter_delivery(app) -> None:
+    """Retoma campanhas que estavam em envio"""
+    newsletter_delivery.init_app(app)
@@ -0,0 +1,554 @@
+"""
+Emissão de NF-e em lote (enviNFe assíncrono)
+
+NF-e enfileiradas por FiscalService.enfileirar_nfe ficam com status "rascunho".
+Um worker em background agrupa as pendentes por empresa/série em lotes de até
+50 notas, assina em lote (pool de processos), envia com indSinc=0 e consulta o recibo
+(retConsReciNFe) até o lote ser processado. Um dia de pico passa a custar
+algumas idas à SEFAZ por lote em vez de uma por nota.
+
+Antes de entrar em um lote a nota é reservada no banco (compare-and-set para
+"em_lote"): dois workers nunca colocam a mesma nota em dois lotes. Quando a
+situação de uma nota enviada fica incerta (lote não localizado, nota sem
+protNFe, worker que caiu no meio do envio) ela é conferida na SEFAZ pela chave
+e só volta para a fila se não constar lá.
+
+Fluxo de status do documento:
+    rascunho / assinado -> em_lote -> enviado -> autorizado / rejeitado / denegado
+"""
+
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, inspect, or_, text, update
+
+from database import db
+from utils.cache import cache_manager
+
+logger = logging.getLogger(__name__)
+
+# Consulta do recibo: primeira após o tMed informado (mínimo abaixo), depois
+# com espera crescente; após o limite o lote fica em "erro" para consulta manual
+CONSULTA_ESPERA_MINIMA = 3
+CONSULTA_ESPERA_MAXIMA = 60
+CONSULTA_MAX_TENTATIVAS = int(os.environ.get("NFE_LOTE_MAX_CONSULTAS", 10))
+
+# Nota "em_lote" de um worker que caiu antes de gravar o envio: após este
+# prazo é conferida na SEFAZ e volta para a fila se não constar lá
+RESERVA_VENCIDA = timedelta(minutes=10)
+
+WORKER_POLL_INTERVAL = 15
+LOCK_NAME = "fiscal:nfe_lote"
+LOCK_TIMEOUT = 300
+
+
+class NFeLoteService:
+    """Monta, envia e acompanha lotes de NF-e"""
+
+    def __init__(self, tamanho_lote: Optional[int] = None):
+        from services.sefaz_service import LOTE_MAX_NFE
+
+        self.tamanho_lote = min(tamanho_lote or LOTE_MAX_NFE, LOTE_MAX_NFE)
+        self._app = None
+        self._wakeup = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+
+    def init_app(self, app) -> None:
+        """Cria a tabela de lotes e retoma notas/lotes pendentes"""
+        from models.fiscal import DocumentoFiscal, LoteNFe
+
+        self._app = app
+        with app.app_context():
+            LoteNFe.__table__.create(db.engine, checkfirst=True)
+            self._atualizar_restricao_status()
+            pendentes = DocumentoFiscal.query.filter(
+                DocumentoFiscal.modelo == "55",
+                DocumentoFiscal.status.in_(("rascunho", "assinado", "em_lote", "enviado")),
+            ).count()
+        if pendentes:
+            self.start()
+
+    def _atualizar_restricao_status(self) -> None:
+        """
+        Inclui "em_lote" na restrição de status de documentos_fiscais (idempotente)
+
+        O create_all não altera restrições de tabelas existentes; sem isso a
+        reserva das notas para o lote viola check_status_documento_fiscal.
+        Só o PostgreSQL é atualizado: o SQLite não altera restrições e os
+        bancos SQLite são criados já no formato atual.
+        """
+        from models.fiscal import DocumentoFiscal
+
+        table = DocumentoFiscal.__table__
+        engine = db.engine
+        if engine.dialect.name != "postgresql":
+            return
+        inspector = inspect(engine)
+        if not inspector.has_table(table.name):
+            return
+        atual = next(
+            (c for c in inspector.get_check_constraints(table.name)
+             if c["name"] == "check_status_documento_fiscal"),
+            None,
+        )
+        if atual is not None and "em_lote" in atual["sqltext"]:
+            return
+
+        restricao = next(c for c in table.constraints if c.name == "check_status_documento_fiscal")
+        with engine.begin() as conn:
+            conn.execute(text(
+                f"ALTER TABLE {table.name} DROP CONSTRAINT IF EXISTS check_status_documento_fiscal"
+            ))
+            conn.execute(text(
+                f"ALTER TABLE {table.name} ADD CONSTRAINT check_status_documento_fiscal "
+                f"CHECK ({restricao.sqltext})"
+            ))
+        logger.info("check_status_documento_fiscal atualizada com o status em_lote")
+
+    def notificar(self) -> None:
+        """Avisa o worker de que há notas novas na fila"""
+        self.start()
+        self._wakeup.set()
+
+    def get_lote(self, lote_id: str):
+        from models.fiscal import LoteNFe
+
+        try:
+            return db.session.get(LoteNFe, uuid.UUID(str(lote_id)))
+        except ValueError:
+            return None
+
+    def start(self) -> None:
+        """Inicia o worker em background (uma vez por processo)"""
+        if self._app is None:
+            from flask import current_app
+            self._app = current_app._get_current_object()
+
+        with self._worker_lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(
+                target=self._worker_loop, name="nfe-lote", daemon=True
+            )
+            self._worker.start()
+
+    def processar_pendentes(self) -> Dict[str, int]:
+        """
+        Envia as notas pendentes e consulta os recibos vencidos
+
+        O lock compartilhado só evita trabalho repetido entre workers; quem
+        garante que a mesma nota não vai em dois lotes é a reserva no banco.
+
+        Returns:
+            Dict com lotes enviados e consultados neste ciclo
+        """
+        token = cache_manager.acquire_lock(LOCK_NAME, timeout=LOCK_TIMEOUT)
+        if token is None:
+            return {"enviados": 0, "consultados": 0}
+
+        try:
+            return {
+                "enviados": self._enviar_pendentes(),
+                "consultados": self._consultar_recibos(),
+            }
+        finally:
+            cache_manager.release_lock(LOCK_NAME, token)
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def _worker_loop(self) -> None:
+        with self._app.app_context():
+            while True:
+                espera = WORKER_POLL_INTERVAL
+                try:
+                    self.processar_pendentes()
+                    espera = self._segundos_ate_proxima_consulta(espera)
+                except Exception as e:
+                    logger.error(f"Erro no worker de lotes NF-e: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+                self._wakeup.wait(espera)
+                self._wakeup.clear()
+
+    def _segundos_ate_proxima_consulta(self, padrao: int) -> float:
+        from models.fiscal import LoteNFe
+
+        proxima = db.session.query(db.func.min(LoteNFe.proxima_consulta_em)).filter(
+            LoteNFe.status == "enviado"
+        ).scalar()
+        if proxima is None:
+            return padrao
+        return max(1.0, min(padrao, (_naive(proxima) - datetime.utcnow()).total_seconds()))
+
+    # ------------------------------------------------------------------
+    # Envio
+    # ------------------------------------------------------------------
+
+    def _enviar_pendentes(self) -> int:
+        from models.fiscal import DocumentoFiscal
+
+        candidatos = (
+            db.session.query(
+                DocumentoFiscal.id, DocumentoFiscal.empresa_id, DocumentoFiscal.serie_fiscal_id,
+                DocumentoFiscal.status, DocumentoFiscal.atualizado_em
+            )
+            .filter(
+                DocumentoFiscal.modelo == "55",
+                or_(
+                    DocumentoFiscal.status.in_(("rascunho", "assinado")),
+                    and_(
+                        DocumentoFiscal.status == "em_lote",
+                        DocumentoFiscal.atualizado_em < datetime.utcnow() - RESERVA_VENCIDA,
+                    ),
+                ),
+            )
+            .order_by(DocumentoFiscal.empresa_id, DocumentoFiscal.serie_fiscal_id, DocumentoFiscal.numero)
+            .all()
+        )
+
+        enviados = 0
+        grupos = groupby(candidatos, key=lambda doc: (doc.empresa_id, doc.serie_fiscal_id))
+        for (empresa_id, serie_fiscal_id), grupo in grupos:
+            grupo = list(grupo)
+            for inicio in range(0, len(grupo), self.tamanho_lote):
+                reservados = self._reservar(grupo[inicio:inicio + self.tamanho_lote])
+                if not reservados:
+                    continue
+                if not self._enviar_lote(empresa_id, serie_fiscal_id, reservados):
+                    # SEFAZ indisponível para esta empresa: tenta no próximo ciclo
+                    break
+                enviados += 1
+
+        return enviados
+
+    def _reservar(self, candidatos: List) -> Dict[uuid.UUID, str]:
+        """
+        Move as notas para "em_lote" com compare-and-set (status e atualizado_em lidos)
+
+        Returns:
+            {id: status anterior} das notas reservadas por este worker
+        """
+        from models.fiscal import DocumentoFiscal
+
+        agora = datetime.utcnow()
+        reservados = {}
+        for candidato in candidatos:
+            inalterado = (
+                DocumentoFiscal.atualizado_em.is_(None) if candidato.atualizado_em is None
+                else DocumentoFiscal.atualizado_em == candidato.atualizado_em
+            )
+            result = db.session.execute(
+                update(DocumentoFiscal)
+                .where(
+                    DocumentoFiscal.id == candidato.id,
+                    DocumentoFiscal.status == candidato.status,
+                    inalterado,
+                )
+                .values(status="em_lote", atualizado_em=agora)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                reservados[candidato.id] = candidato.status
+            # Outro worker reservou primeiro; a nota vai no lote dele
+        db.session.commit()
+        return reservados
+
+    def _enviar_lote(self, empresa_id, serie_fiscal_id, reservados: Dict[uuid.UUID, str]) -> bool:
+        """
+        Assina e envia um lote com as notas reservadas
+
+        Returns:
+            False quando a comunicação falhou (notas voltam para a fila)
+        """
+        from models.fiscal import DocumentoFiscal, EmpresaEmissora, LoteNFe
+        from services.fiscal_service import get_fiscal_service
+
+        fiscal_service = get_fiscal_service()
+        empresa = db.session.get(EmpresaEmissora, empresa_id)
+        sefaz = fiscal_service.sefaz_factory.criar_servico(
+            uf=empresa.uf, ambiente=empresa.ambiente_atual, empresa_id=str(empresa.id)
+        )
+
+        docs = (
+            DocumentoFiscal.query.filter(DocumentoFiscal.id.in_(list(reservados)))
+            .order_by(DocumentoFiscal.numero)
+            .all()
+        )
+
+        # Reserva vencida: o worker anterior pode ter enviado o lote antes de cair
+        retomados = [doc for doc in docs if reservados[doc.id] == "em_lote"]
+        if retomados:
+            nao_constam = self._conferir_na_sefaz(
+                fiscal_service, sefaz, empresa.id, empresa.ambiente_atual, retomados
+            )
+            docs = [doc for doc in docs if reservados[doc.id] != "em_lote" or doc in nao_constam]
+
+        docs = self._assinar_documentos(fiscal_service, empresa, docs)
+        if not docs:
+            db.session.commit()
+            return True
+
+        id_lote = str(uuid.uuid4().int)[:15]
+        resultado = sefaz.autorizar_lote([doc.xml_assinado for doc in docs], id_lote)
+
+        agora = datetime.utcnow()
+        self._registrar_comunicacao(
+            empresa.id, empresa.ambiente_atual, "autorizacao_lote", "NfeAutorizacao", resultado
+        )
+
+        if resultado.codigo_status == 0:
+            logger.warning(f"Falha ao enviar lote NF-e da empresa {empresa.id}: {resultado.motivo}")
+            for doc in docs:
+                doc.status = "assinado"
+            db.session.commit()
+            return False
+
+        lote = LoteNFe(
+            empresa_id=empresa.id,
+            serie_fiscal_id=serie_fiscal_id,
+            id_lote=id_lote.zfill(15),
+            ambiente=empresa.ambiente_atual,
+            chaves_acesso=[doc.chave_acesso for doc in docs],
+            quantidade=len(docs),
+            codigo_status=resultado.codigo_status,
+            motivo=resultado.motivo,
+            enviado_em=agora
+        )
+        db.session.add(lote)
+
+        if resultado.sucesso:
+            lote.status = "enviado"
+            lote.numero_recibo = resultado.numero_recibo
+            lote.tempo_medio_s = resultado.tempo_medio_s
+            lote.tentativas_consulta = 0
+            lote.proxima_consulta_em = agora + timedelta(
+                seconds=max(CONSULTA_ESPERA_MINIMA, resultado.tempo_medio_s or 0)
+            )
+            for doc in docs:
+                doc.status = "enviado"
+        else:
+            # Lote recusado por inteiro (schema, emitente, etc.)
+            lote.status = "erro"
+            lote.processado_em = agora
+            for doc in docs:
+                doc.status = "rejeitado"
+                doc.motivo_autorizacao = f"Lote rejeitado - cStat {resultado.codigo_status}: {resultado.motivo}"
+
+        db.session.commit()
+        logger.info(f"Lote NF-e {lote.id_lote} enviado: {len(docs)} notas, cStat {resultado.codigo_status}")
+        return True
+
+    def _assinar_documentos(self, fiscal_service, empresa, docs: List) -> List:
+        """Assina em lote as notas reservadas ainda sem assinatura; retorna as prontas para envio"""
+        empresa_id = str(empresa.id)
+        para_assinar = [doc for doc in docs if not doc.xml_assinado]
+
+        if para_assinar:
+            resultados = fiscal_service.cert_manager.assinar_lote_empresa(
+                empresa_id, [doc.xml_original for doc in para_assinar], tipo="nfe"
+            )
+
+            for doc, resultado in zip(para_assinar, resultados):
+                if resultado.sucesso:
+                    doc.xml_assinado = resultado.xml_assinado
+                else:
+                    doc.status = "rejeitado"
+                    doc.motivo_autorizacao = f"Erro ao assinar XML: {resultado.erro}"
+
+        return [doc for doc in docs if doc.status == "em_lote"]
+
+    # ------------------------------------------------------------------
+    # Consulta do recibo
+    # ------------------------------------------------------------------
+
+    def _consultar_recibos(self) -> int:
+        from models.fiscal import LoteNFe
+
+        lotes = (
+            LoteNFe.query.filter(
+                LoteNFe.status == "enviado",
+                LoteNFe.proxima_consulta_em <= datetime.utcnow(),
+            )
+            .order_by(LoteNFe.proxima_consulta_em)
+            .all()
+        )
+        for lote in lotes:
+            self._consultar_lote(lote)
+        return len(lotes)
+
+    def _consultar_lote(self, lote) -> None:
+        from models.fiscal import DocumentoFiscal, EmpresaEmissora
+        from services.fiscal_service import get_fiscal_service
+        from services.sefaz_service import CSTAT_LOTE_EM_PROCESSAMENTO, CSTAT_LOTE_NAO_LOCALIZADO
+
+        fiscal_service = get_fiscal_service()
+        empresa = db.session.get(EmpresaEmissora, lote.empresa_id)
+        sefaz = fiscal_service.sefaz_factory.criar_servico(
+            uf=empresa.uf, ambiente=lote.ambiente, empresa_id=str(empresa.id)
+        )
+        resultado = sefaz.consultar_recibo(lote.numero_recibo)
+
+        agora = datetime.utcnow()
+        self._registrar_comunicacao(
+            lote.empresa_id, lote.ambiente, "consulta_recibo", "NfeRetAutorizacao", resultado
+        )
+
+        lote.tentativas_consulta = (lote.tentativas_consulta or 0) + 1
+        lote.codigo_status = resultado.codigo_status
+        lote.motivo = resultado.motivo
+
+        # Só as notas ainda sem situação final (consultas repetidas não reaplicam protocolos)
+        docs = DocumentoFiscal.query.filter(
+            DocumentoFiscal.chave_acesso.in_(lote.chaves_acesso or []),
+            DocumentoFiscal.status == "enviado",
+        ).all()
+
+        if resultado.sucesso or resultado.codigo_status == CSTAT_LOTE_NAO_LOCALIZADO:
+            if resultado.sucesso:
+                self._aplicar_protocolos(fiscal_service, docs, resultado.protocolos)
+
+            # Lote não localizado ou nota sem protNFe no retorno: a SEFAZ pode ter
+            # autorizado mesmo assim; só volta para a fila a nota que não consta lá
+            sem_retorno = [doc for doc in docs if doc.status == "enviado"]
+            for doc in self._conferir_na_sefaz(fiscal_service, sefaz, lote.empresa_id, lote.ambiente, sem_retorno):
+                doc.status = "assinado"
+
+            pendentes = [doc for doc in sem_retorno if doc.status == "enviado"]
+            if not pendentes:
+                lote.status = "processado" if resultado.sucesso else "erro"
+                lote.processado_em = agora
+            elif lote.tentativas_consulta >= CONSULTA_MAX_TENTATIVAS:
+                lote.status = "erro"
+                logger.warning(f"Lote NF-e {lote.id_lote}: {len(pendentes)} notas sem situação na SEFAZ")
+            else:
+                lote.proxima_consulta_em = agora + timedelta(seconds=_espera_consulta(lote))
+        elif lote.tentativas_consulta >= CONSULTA_MAX_TENTATIVAS:
+            # Notas ficam "enviado"; situação final via consultar_documento
+            lote.status = "erro"
+            logger.warning(f"Lote NF-e {lote.id_lote} sem retorno após {lote.tentativas_consulta} consultas")
+        else:
+            if resultado.codigo_status not in (0, CSTAT_LOTE_EM_PROCESSAMENTO):
+                logger.warning(f"Consulta do lote {lote.id_lote}: cStat {resultado.codigo_status} {resultado.motivo}")
+            lote.proxima_consulta_em = agora + timedelta(seconds=_espera_consulta(lote))
+
+        db.session.commit()
+
+    def _conferir_na_sefaz(self, fiscal_service, sefaz, empresa_id, ambiente, docs: List) -> List:
+        """
+        Consulta cada nota pela chave (consSitNFe) e aplica o protocolo encontrado
+
+        Returns:
+            Notas que não constam na SEFAZ (podem ser reenviadas). Sem resposta
+            conclusiva a nota fica como está e é conferida de novo depois.
+        """
+        from services.sefaz_service import CSTAT_NFE_NAO_CONSTA, ProtocoloNFe
+
+        nao_constam = []
+        for doc in docs:
+            resultado = sefaz.consultar_protocolo(doc.chave_acesso)
+            self._registrar_comunicacao(
+                empresa_id, ambiente, "consulta_protocolo", "NfeConsultaProtocolo", resultado
+            )
+
+            if resultado.codigo_status == CSTAT_NFE_NAO_CONSTA:
+                nao_constam.append(doc)
+                continue
+
+            prot = ProtocoloNFe(
+                chave_acesso=doc.chave_acesso,
+                codigo_status=resultado.codigo_status,
+                motivo=resultado.motivo,
+                protocolo=resultado.protocolo,
+                data_recebimento=resultado.data_recebimento,
+                xml_protocolo=resultado.xml_retorno
+            )
+            if prot.autorizado or prot.denegado:
+                self._aplicar_protocolos(fiscal_service, [doc], [prot])
+            else:
+                logger.warning(
+                    f"NF-e {doc.chave_acesso} sem situação na SEFAZ: cStat {resultado.codigo_status} {resultado.motivo}"
+                )
+
+        return nao_constam
+
+    @staticmethod
+    def _registrar_comunicacao(empresa_id, ambiente, tipo_operacao: str, webservice: str, resultado) -> None:
+        from models.fiscal import LogComunicacaoSefaz
+
+        agora = datetime.utcnow()
+        db.session.add(LogComunicacaoSefaz(
+            empresa_id=empresa_id,
+            tipo_operacao=tipo_operacao,
+            ambiente=ambiente,
+            webservice=webservice,
+            url="",
+            xml_envio=resultado.xml_enviado,
+            xml_retorno=resultado.xml_retorno,
+            data_envio=agora,
+            data_retorno=agora,
+            tempo_resposta_ms=resultado.tempo_resposta_ms,
+            sucesso=resultado.sucesso,
+            codigo_status=resultado.codigo_status,
+            motivo=resultado.motivo
+        ))
+
+    @staticmethod
+    def _aplicar_protocolos(fiscal_service, docs: List, protocolos: List) -> None:
+        por_chave = {doc.chave_acesso: doc for doc in docs}
+
+        for prot in protocolos:
+            doc = por_chave.get(prot.chave_acesso)
+            if doc is None:
+                continue
+
+            doc.motivo_autorizacao = prot.motivo
+            doc.xml_protocolo = prot.xml_protocolo
+
+            if prot.autorizado:
+                doc.status = "autorizado"
+                doc.protocolo_autorizacao = prot.protocolo
+                doc.data_autorizacao = prot.data_recebimento or datetime.utcnow()
+                fiscal_service._registrar_auditoria(
+                    entidade="documento_fiscal",
+                    entidade_id=doc.id,
+                    operacao="emissao_autorizada",
+                    dados_novos={'chave_acesso': doc.chave_acesso, 'protocolo': doc.protocolo_autorizacao}
+                )
+            elif prot.denegado:
+                doc.status = "denegado"
+                doc.protocolo_autorizacao = prot.protocolo
+            else:
+                doc.status = "rejeitado"
+
+
+def _espera_consulta(lote) -> int:
+    """Espera crescente entre as consultas do recibo"""
+    return min(CONSULTA_ESPERA_MAXIMA, CONSULTA_ESPERA_MINIMA * 2 ** lote.tentativas_consulta)
+
+
+def _naive(valor: datetime) -> datetime:
+    """Datas do banco podem vir com timezone (UTC); compara como UTC ingênuo"""
+    return valor.replace(tzinfo=None) if valor.tzinfo else valor
+
+
+# Instância global do serviço de lotes
+nfe_lote_service = NFeLoteService()
+
+
+def init_nfe_lote_service(app) -> None:
+    """Cria a tabela de lotes e retoma o envio de notas pendentes"""
+    nfe_lote_service.init_app(app)
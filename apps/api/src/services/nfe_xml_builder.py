@@ -34,13 +34,13 @@ Estrutura do XML NF-e:
 </NFe>
 """
 
+import copy
 import uuid
 import hashlib
 from datetime import datetime, date
 from decimal import Decimal, ROUND_HALF_UP
 from typing import Dict, List, Optional, Any
 from xml.etree import ElementTree as ET
-from xml.dom import minidom
 import re
 
 # Constantes de namespaces
@@ -50,6 +50,23 @@ NS_DS = "http://www.w3.org/2000/09/xmldsig#"
 # Versão do layout
 VERSAO_NFE = "4.00"
 
+DECLARACAO_XML = '<?xml version="1.0" encoding="UTF-8"?>'
+
+
+def serializar_xml(element: ET.Element, pretty: bool = False) -> str:
+    """
+    Serializa o elemento em uma única passada, com declaração UTF-8
+
+    O modo compacto (padrão) não insere espaços entre as tags, que a SEFAZ
+    rejeita e que invalidariam a assinatura; `pretty` indenta o XML para
+    depuração/visualização.
+    """
+    if pretty:
+        element = copy.deepcopy(element)
+        ET.indent(element, space="  ")
+        return DECLARACAO_XML + "\n" + ET.tostring(element, encoding="unicode")
+    return DECLARACAO_XML + ET.tostring(element, encoding="unicode")
+
 
 class NFeTags:
     """Constantes de tags do XML NF-e"""
@@ -173,16 +190,21 @@ class NFeXMLBuilder:
             return self._add_element(parent, tag, texto)
         return None
 
-    def build_nfe(self, doc_fiscal) -> str:
+    def build_nfe(self, doc_fiscal, pretty: bool = False) -> str:
         """
         Constrói XML completo da NF-e/NFC-e
 
         Args:
             doc_fiscal: Objeto DocumentoFiscal com todos os dados
+            pretty: Indenta o XML (apenas para visualização; não assinar)
 
         Returns:
-            XML string formatado
+            XML string compacto, pronto para assinatura
         """
+        return serializar_xml(self.build_nfe_element(doc_fiscal), pretty=pretty)
+
+    def build_nfe_element(self, doc_fiscal) -> ET.Element:
+        """Constrói a árvore <NFe> sem serializar (para compor lotes)"""
         self.erros = []
         self.avisos = []
 
@@ -190,10 +212,9 @@ class NFeXMLBuilder:
         nfe = ET.Element("NFe", xmlns=NS_NFE)
 
         # Cria infNFe
-        inf_nfe = self._build_inf_nfe(nfe, doc_fiscal)
+        self._build_inf_nfe(nfe, doc_fiscal)
 
-        # Gera XML formatado
-        return self._to_pretty_xml(nfe)
+        return nfe
 
     def _build_inf_nfe(self, nfe: ET.Element, doc) -> ET.Element:
         """Constrói grupo infNFe"""
@@ -878,16 +899,13 @@ class NFeXMLBuilder:
             return chave_acesso[35:43]
         return str(uuid.uuid4().int)[:8]
 
-    def _to_pretty_xml(self, element: ET.Element) -> str:
-        """Converte ElementTree para XML formatado"""
-        rough_string = ET.tostring(element, encoding='unicode')
-        reparsed = minidom.parseString(rough_string)
-        return reparsed.toprettyxml(indent="  ", encoding=None)
-
     def build_envio_lote(self, documentos: List, id_lote: str = None) -> str:
         """
         Constrói XML de envio de lote de NF-e
 
+        `documentos` aceita DocumentoFiscal ou árvores <NFe> já construídas
+        (build_nfe_element), que são anexadas sem reserializar.
+
         Estrutura enviNFe (v4.00):
         <enviNFe versao="4.00" xmlns="...">
             <idLote>NNNNNNNNNNNNNNN</idLote>
@@ -909,12 +927,11 @@ class NFeXMLBuilder:
 
         # Adiciona cada NF-e
         for doc in documentos:
-            nfe_xml = self.build_nfe(doc)
-            # Insere XML da NF-e
-            nfe_element = ET.fromstring(nfe_xml.replace('<?xml version="1.0" ?>', '').strip())
-            envi_nfe.append(nfe_element)
+            if not isinstance(doc, ET.Element):
+                doc = self.build_nfe_element(doc)
+            envi_nfe.append(doc)
 
-        return self._to_pretty_xml(envi_nfe)
+        return serializar_xml(envi_nfe)
 
 
 class NFeEventoBuilder:
@@ -995,10 +1012,7 @@ class NFeEventoBuilder:
         for key, value in detalhes.items():
             ET.SubElement(det_evento, key).text = str(value)
 
-        # Formata XML
-        rough_string = ET.tostring(evento, encoding='unicode')
-        reparsed = minidom.parseString(rough_string)
-        return reparsed.toprettyxml(indent="  ", encoding=None)
+        return serializar_xml(evento)
 
 
 class NFeInutilizacaoBuilder:
@@ -1031,9 +1045,7 @@ class NFeInutilizacaoBuilder:
         ET.SubElement(inf_inut, "nNFFin").text = str(numero_final)
         ET.SubElement(inf_inut, "xJust").text = justificativa[:255]
 
-        rough_string = ET.tostring(inut_nfe, encoding='unicode')
-        reparsed = minidom.parseString(rough_string)
-        return reparsed.toprettyxml(indent="  ", encoding=None)
+        return serializar_xml(inut_nfe)
 
 
 class NFeConsultaBuilder:
@@ -1047,9 +1059,7 @@ class NFeConsultaBuilder:
         ET.SubElement(cons_sit, "xServ").text = "CONSULTAR"
         ET.SubElement(cons_sit, "chNFe").text = chave_acesso
 
-        rough_string = ET.tostring(cons_sit, encoding='unicode')
-        reparsed = minidom.parseString(rough_string)
-        return reparsed.toprettyxml(indent="  ", encoding=None)
+        return serializar_xml(cons_sit)
 
     def build_status_servico(self, uf: str, ambiente: str = "2") -> str:
         """Constrói XML de consulta de status do serviço"""
@@ -1059,6 +1069,4 @@ class NFeConsultaBuilder:
         ET.SubElement(cons_stat, "cUF").text = uf
         ET.SubElement(cons_stat, "xServ").text = "STATUS"
 
-        rough_string = ET.tostring(cons_stat, encoding='unicode')
-        reparsed = minidom.parseString(rough_string)
-        return reparsed.toprettyxml(indent="  ", encoding=None)
+        return serializar_xml(cons_stat)
@@ -0,0 +1,456 @@
+"""
+Pipeline de envio de notificações em massa
+Broadcasts são gravados na tabela notification_jobs (fila durável) e
+processados em background: usuários lidos em lotes por keyset, envios
+externos distribuídos em pools de threads por canal e notificações in-app
+inseridas em lote. O custo por lote é constante em número de consultas.
+"""
+
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, func, insert, or_, update
+
+from database import db
+from models.notifications import (
+    Notification,
+    NotificationJob,
+    NotificationLog,
+)
+from services.notification_service import (
+    NotificationChannel,
+    NotificationType,
+    get_notification_service,
+)
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_CHUNK_SIZE = int(os.environ.get("NOTIFICATION_DISPATCH_CHUNK_SIZE", 500))
+
+# Workers por canal externo (in-app é inserido em lote, sem pool)
+CHANNEL_WORKERS = {
+    NotificationChannel.EMAIL: int(os.environ.get("NOTIFICATION_EMAIL_WORKERS", 4)),
+    NotificationChannel.SMS: int(os.environ.get("NOTIFICATION_SMS_WORKERS", 2)),
+    NotificationChannel.PUSH: int(os.environ.get("NOTIFICATION_PUSH_WORKERS", 4)),
+}
+
+# Jobs "running" sem heartbeat há mais tempo que isso são retomados do cursor
+JOB_STALE_AFTER = timedelta(minutes = 5)
+# Enquanto os envios de um lote terminam o heartbeat é renovado neste intervalo
+HEARTBEAT_INTERVAL = 30
+WORKER_POLL_INTERVAL = 30
+
+
+class _JobReclaimed(Exception):
+    """O heartbeat venceu e outro worker retomou o job"""
+
+
+class NotificationDispatcher:
+    """Fila de jobs de notificação e worker em background"""
+
+    def __init__(self, chunk_size: int = DISPATCH_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._app = None
+        self._wakeup = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self._pools: Dict[NotificationChannel, ThreadPoolExecutor] = {}
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+
+    def init_app(self, app) -> None:
+        """Registra o app e retoma jobs pendentes de execuções anteriores"""
+        self._app = app
+        with app.app_context():
+            NotificationJob.__table__.create(db.engine, checkfirst = True)
+            pending = NotificationJob.query.filter(
+                NotificationJob.status.in_(("queued", "running"))
+            ).count()
+        if pending:
+            self.start()
+
+    def enqueue_broadcast(
+        self,
+        notification_type: NotificationType,
+        data: Dict[str, Any],
+        channels: List[str],
+        created_by: Optional[str] = None,
+    ) -> NotificationJob:
+        """
+        Enfileira um broadcast para todos os usuários ativos
+
+        Returns:
+            NotificationJob: Job criado (status "queued")
+        """
+        job = NotificationJob(
+            kind = "broadcast",
+            notification_type = notification_type.value,
+            payload = data,
+            channels = channels or [NotificationChannel.IN_APP.value],
+            created_by = _as_uuid(created_by),
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        self.start()
+        self._wakeup.set()
+        return job
+
+    def get_job(self, job_id: str) -> Optional[NotificationJob]:
+        job_uuid = _as_uuid(job_id)
+        return db.session.get(NotificationJob, job_uuid) if job_uuid else None
+
+    def start(self) -> None:
+        """Inicia o worker em background (uma vez por processo)"""
+        if self._app is None:
+            from flask import current_app
+            self._app = current_app._get_current_object()
+
+        with self._worker_lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(
+                target = self._worker_loop, name = "notification-dispatcher", daemon = True
+            )
+            self._worker.start()
+
+    def process_pending(self) -> int:
+        """Processa todos os jobs disponíveis no contexto atual; retorna quantos rodaram"""
+        processed = 0
+        while True:
+            job_id = self._claim_next()
+            if job_id is None:
+                return processed
+            self._run_job(job_id)
+            processed += 1
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def _worker_loop(self) -> None:
+        with self._app.app_context():
+            while True:
+                try:
+                    self.process_pending()
+                except Exception as e:
+                    logger.error(f"Erro no worker de notificações: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+                self._wakeup.wait(WORKER_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def _claim_next(self) -> Optional[uuid.UUID]:
+        """Reserva o próximo job (queued ou abandonado) com compare-and-set"""
+        now = datetime.utcnow()
+        candidate = (
+            NotificationJob.query.filter(
+                or_(
+                    NotificationJob.status == "queued",
+                    and_(
+                        NotificationJob.status == "running",
+                        NotificationJob.heartbeat_at < now - JOB_STALE_AFTER,
+                    ),
+                )
+            )
+            .order_by(NotificationJob.created_at)
+            .first()
+        )
+        if candidate is None:
+            return None
+
+        if candidate.heartbeat_at is None:
+            same_heartbeat = NotificationJob.heartbeat_at.is_(None)
+        else:
+            same_heartbeat = NotificationJob.heartbeat_at == candidate.heartbeat_at
+
+        result = db.session.execute(
+            update(NotificationJob)
+            .where(
+                NotificationJob.id == candidate.id,
+                NotificationJob.status == candidate.status,
+                same_heartbeat,
+            )
+            .values(
+                status = "running",
+                heartbeat_at = now,
+                started_at = func.coalesce(NotificationJob.started_at, now),
+            )
+            .execution_options(synchronize_session = False)
+        )
+        db.session.commit()
+        if result.rowcount != 1:
+            # Outro worker reservou primeiro; tenta o próximo
+            return self._claim_next()
+        return candidate.id
+
+    def _run_job(self, job_id: uuid.UUID) -> None:
+        from models.auth import User
+
+        job = db.session.get(NotificationJob, job_id)
+        db.session.refresh(job)
+
+        try:
+            notification_type = NotificationType(job.notification_type)
+            channels = self._parse_channels(job.channels)
+            context = self._job_context(notification_type, channels)
+
+            active_users = User.query.filter(User.is_active.is_(True))
+            if not job.total_recipients:
+                job.total_recipients = active_users.count()
+                db.session.commit()
+
+            while True:
+                query = active_users.with_entities(User.id)
+                if job.cursor:
+                    query = query.filter(User.id > uuid.UUID(job.cursor))
+                user_ids = [row.id for row in query.order_by(User.id).limit(self.chunk_size)]
+                if not user_ids:
+                    break
+
+                sent, failed = self._dispatch_chunk(job, user_ids, notification_type, channels, context)
+
+                job.processed_count += len(user_ids)
+                job.sent_count += sent
+                job.failed_count += failed
+                job.cursor = str(user_ids[-1])
+                job.heartbeat_at = datetime.utcnow()
+                db.session.commit()
+                db.session.expunge_all()
+                job = db.session.get(NotificationJob, job_id)
+
+            job.status = "completed"
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            logger.info(
+                f"Broadcast {job.id} concluído: {job.sent_count} enviadas, {job.failed_count} falharam"
+            )
+
+        except _JobReclaimed:
+            # O job segue com o outro worker a partir do último cursor gravado
+            db.session.rollback()
+            logger.warning(f"Job de notificação {job_id} retomado por outro worker; lote interrompido")
+
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro no job de notificação {job_id}: {e}")
+            job = db.session.get(NotificationJob, job_id)
+            job.status = "failed"
+            job.error_message = str(e)
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+    # ------------------------------------------------------------------
+    # Processamento de um lote de usuários
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _parse_channels(channel_values: List[str]) -> List[NotificationChannel]:
+        channels = []
+        for value in channel_values or [NotificationChannel.IN_APP.value]:
+            try:
+                channels.append(NotificationChannel(value))
+            except ValueError:
+                logger.error(f"Canal inválido: {value}")
+        return channels
+
+    @staticmethod
+    def _job_context(notification_type: NotificationType, channels: List[NotificationChannel]) -> Dict[str, Any]:
+        """Templates compilados e serviço resolvidos uma única vez por job"""
+        service = get_notification_service()
+        templates = {}
+        for channel in channels:
+            if channel in (NotificationChannel.EMAIL, NotificationChannel.SMS):
+                template = service.get_template(notification_type, channel)
+                if template:
+                    templates[channel] = template
+        return {"service": service, "templates": templates}
+
+    def _dispatch_chunk(self, job, user_ids, notification_type, channels, context):
+        service = context["service"]
+        payload = job.payload or {}
+        metadata = payload.get("metadata") or {}
+
+        # Contato e preferências do lote: cache + no máximo duas consultas
+        recipients = service.load_recipients(user_ids)
+
+        in_app_rows = []
+        deliveries = []  # (user_id, channel, destinatário, future_or_result)
+
+        for user_id in user_ids:
+            user = recipients[str(user_id)]
+            for channel in channels:
+                if not user.channel_enabled(notification_type, channel):
+                    continue
+
+                if channel == NotificationChannel.IN_APP:
+                    in_app_rows.append(
+                        {
+                            "user_id": user_id,
+                            "type": notification_type.value,
+                            "title": payload.get("title", ""),
+                            "message": payload.get("content", ""),
+                            "data": metadata,
+                            "priority": payload.get("priority", "medium"),
+                            "read": False,
+                        }
+                    )
+                    deliveries.append((user_id, channel, None, True))
+                    continue
+
+                recipient, send = self._external_send(service, context["templates"], channel, user, payload)
+                if send is None:
+                    deliveries.append((user_id, channel, recipient, False))
+                else:
+                    deliveries.append((user_id, channel, recipient, self._submit(channel, send)))
+
+        self._wait_sends(job.id, job.heartbeat_at, [d[3] for d in deliveries if not isinstance(d[3], bool)])
+
+        results = []
+        for user_id, channel, recipient, outcome in deliveries:
+            if not isinstance(outcome, bool):
+                try:
+                    outcome = bool(outcome.result())
+                except Exception as e:
+                    logger.error(f"Erro ao enviar notificação via {channel.value}: {e}")
+                    outcome = False
+            results.append((user_id, channel, recipient, outcome))
+
+        log_rows = [
+            {
+                "user_id": user_id,
+                "notification_type": notification_type.value,
+                "channel": channel.value,
+                "recipient_email": recipient if channel == NotificationChannel.EMAIL else None,
+                "recipient_phone": recipient if channel == NotificationChannel.SMS else None,
+                "title": payload.get("title", ""),
+                "message": payload.get("content", ""),
+                "status": "sent" if success else "failed",
+                "error_message": None if success else "Falha no envio",
+                "meta_data": {**metadata, "job_id": str(job.id)},
+            }
+            for user_id, channel, recipient, success in results
+        ]
+
+        try:
+            if in_app_rows:
+                db.session.execute(insert(Notification), in_app_rows)
+            if log_rows:
+                db.session.execute(insert(NotificationLog), log_rows)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro ao gravar notificações do lote: {e}")
+            return 0, len(user_ids)
+
+        delivered = {user_id for user_id, _, _, success in results if success}
+        return len(delivered), len(user_ids) - len(delivered)
+
+    def _wait_sends(self, job_id, heartbeat_at, futures) -> None:
+        """
+        Aguarda os envios do lote renovando o heartbeat do job
+
+        Um lote lento não pode parecer abandonado: outro worker o retomaria do
+        cursor antigo e enviaria as mesmas notificações de novo.
+
+        Raises:
+            _JobReclaimed: o heartbeat não é mais o nosso (job retomado)
+        """
+        pending = set(futures)
+        while pending:
+            _, pending = futures_wait(pending, timeout = HEARTBEAT_INTERVAL)
+            if not pending:
+                return
+
+            now = datetime.utcnow()
+            result = db.session.execute(
+                update(NotificationJob)
+                .where(
+                    NotificationJob.id == job_id,
+                    NotificationJob.status == "running",
+                    NotificationJob.heartbeat_at == heartbeat_at,
+                )
+                .values(heartbeat_at = now)
+                .execution_options(synchronize_session = False)
+            )
+            db.session.commit()
+            if result.rowcount != 1:
+                raise _JobReclaimed(str(job_id))
+            heartbeat_at = now
+
+    @staticmethod
+    def _external_send(service, templates, channel, user, payload):
+        """Retorna (destinatário, função de envio) ou (destinatário, None) se impossível"""
+        if channel == NotificationChannel.EMAIL:
+            template = templates.get(channel)
+            if not template or not user.email or not service.email_provider:
+                return user.email, None
+            subject = template.render_subject(payload, default=payload.get("title", ""))
+            html_content = template.render(payload)
+            return user.email, lambda: service.email_provider.send_email(user.email, subject, html_content)
+
+        if channel == NotificationChannel.SMS:
+            phone = user.phone
+            if not phone or not service.sms_provider:
+                return phone, None
+            template = templates.get(channel)
+            if template:
+                message = template.render(payload)[:160]
+            else:
+                message = f"{payload.get('title', '')}: {payload.get('content', '')}"[:160]
+            return phone, lambda: service.sms_provider.send_sms(phone, message)
+
+        if channel == NotificationChannel.PUSH:
+            token = user.device_token
+            if not token or not service.push_provider:
+                return None, None
+            return None, lambda: service.push_provider.send_push(
+                device_token = token,
+                title = payload.get("title", ""),
+                body = payload.get("content", ""),
+                data = payload.get("metadata", {}),
+            )
+
+        return None, None
+
+    def _submit(self, channel: NotificationChannel, send):
+        pool = self._pools.get(channel)
+        if pool is None:
+            pool = self._pools[channel] = ThreadPoolExecutor(
+                max_workers = CHANNEL_WORKERS[channel],
+                thread_name_prefix = f"notify-{channel.value}",
+            )
+
+        app = self._app
+
+        def run():
+            with app.app_context():
+                return send()
+
+        return pool.submit(run)
+
+
+def _as_uuid(value) -> Optional[uuid.UUID]:
+    if value is None or isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+# Instância global do dispatcher
+notification_dispatcher = NotificationDispatcher()
+
+
+def init_notification_dispatcher(app) -> None:
+    """Cria a tabela da fila e retoma jobs pendentes"""
+    notification_dispatcher.init_app(app)
@@ -6,14 +6,23 @@ Sistema completo de notificações multi-canal (in-app, email, SMS, push)
 import logging
 import os
 import smtplib
-from datetime import datetime
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from enum import Enum
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional
 
 from database import db
 from flask import current_app
+from jinja2 import TemplateError
+from jinja2.sandbox import SandboxedEnvironment
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from utils.cache import cache_manager
+from models.auth import User
 from models.notifications import (
     Notification,
     NotificationLog,
@@ -24,6 +33,17 @@ from models.notifications import (
 # Configurar logger
 logger = logging.getLogger(__name__)
 
+# Cache de templates compilados e de destinatários
+TEMPLATE_CACHE_TAG = "notification_templates"
+TEMPLATE_CACHE_TIMEOUT = 3600
+RECIPIENT_CACHE_TIMEOUT = int(os.environ.get("NOTIFICATION_RECIPIENT_CACHE_TIMEOUT", 300))
+COMPILED_TEMPLATES_MAX = 256
+
+# Campos do usuário que compõem o destinatário em cache
+_RECIPIENT_USER_FIELDS = ("email", "phone", "is_active")
+# Usuários alterados na transação (cache descartado após o commit)
+_SESSION_RECIPIENTS = "notification_recipients_changed"
+
 
 class NotificationType(Enum):
     """Tipos de notificações disponíveis"""
@@ -60,6 +80,71 @@ class NotificationPriority(Enum):
     URGENT = "urgent"
 
 
+_template_env = SandboxedEnvironment(autoescape=False, keep_trailing_newline=True)
+
+
+class CompiledNotificationTemplate:
+    """Template de notificação já compilado (Jinja2 em sandbox)"""
+
+    def __init__(self, notification_type: str, channel: str, version: str,
+                 subject: Optional[str], content: str):
+        self.notification_type = notification_type
+        self.channel = channel
+        self.version = version
+        self.subject_source = subject
+        self.content_source = content
+        self._subject = self._compile(subject) if subject else None
+        self._content = self._compile(content)
+
+    def _compile(self, source: str):
+        try:
+            return _template_env.from_string(source)
+        except TemplateError as e:
+            logger.error(
+                f"Template {self.notification_type}/{self.channel} inválido: {str(e)}"
+            )
+            return None
+
+    @staticmethod
+    def _render(compiled, source: str, data: Dict) -> str:
+        if compiled is None:
+            return source
+        try:
+            return compiled.render(data)
+        except Exception as e:
+            logger.error(f"Erro ao renderizar template: {str(e)}")
+            return source
+
+    def render_subject(self, data: Dict, default: str = "") -> str:
+        """Assunto renderizado; usa o padrão se o template não tiver assunto"""
+        if not self.subject_source:
+            return default
+        return self._render(self._subject, self.subject_source, data)
+
+    def render(self, data: Dict) -> str:
+        """Conteúdo renderizado"""
+        return self._render(self._content, self.content_source, data)
+
+
+@dataclass(frozen=True)
+class NotificationRecipient:
+    """Contato e preferências de um usuário, prontos para envio"""
+    user_id: str
+    email: Optional[str] = None
+    phone: Optional[str] = None
+    device_token: Optional[str] = None
+    # notification_type -> {canal: habilitado}
+    preferences: Dict[str, Dict[str, bool]] = field(default_factory=dict)
+
+    def channel_enabled(self, notification_type: NotificationType, channel: NotificationChannel) -> bool:
+        """Verificar se canal está habilitado para o usuário"""
+        preferences = self.preferences.get(notification_type.value)
+        if preferences is None:
+            # Se não há preferências, assumir habilitado para in-app
+            return channel == NotificationChannel.IN_APP
+        return preferences.get(channel.value, True)
+
+
 class EmailProvider:
     """Provedor de email SMTP"""
     
@@ -451,6 +536,8 @@ class NotificationService:
         self.email_provider = None
         self.sms_provider = None
         self.push_provider = None
+        self._compiled_templates: "OrderedDict[tuple, CompiledNotificationTemplate]" = OrderedDict()
+        self._compiled_lock = threading.Lock()
         self._initialize_providers()
     
     def _initialize_providers(self):
@@ -490,15 +577,15 @@ class NotificationService:
             
             success_count = 0
             
-            # Verificar preferências do usuário
-            user_preferences = self._get_user_preferences(user_id, notification_type)
+            # Contato e preferências do usuário (cache)
+            recipient = self.get_recipient(user_id)
             
             for channel_str in channels:
                 try:
                     channel = NotificationChannel(channel_str)
                     
                     # Verificar se usuário permite este canal
-                    if not self._is_channel_enabled(user_preferences, channel):
+                    if not recipient.channel_enabled(notification_type, channel):
                         logger.info(f"Canal {channel.value} desabilitado para usuário {user_id}")
                         continue
                     
@@ -506,11 +593,11 @@ class NotificationService:
                     if channel == NotificationChannel.IN_APP:
                         success = self._send_in_app_notification(user_id, notification_type, data)
                     elif channel == NotificationChannel.EMAIL:
-                        success = self._send_email_notification(user_id, notification_type, data)
+                        success = self._send_email_notification(recipient, notification_type, data)
                     elif channel == NotificationChannel.SMS:
-                        success = self._send_sms_notification(user_id, notification_type, data)
+                        success = self._send_sms_notification(recipient, notification_type, data)
                     elif channel == NotificationChannel.PUSH:
-                        success = self._send_push_notification(user_id, notification_type, data)
+                        success = self._send_push_notification(recipient, notification_type, data)
                     else:
                         logger.warning(f"Canal não suportado: {channel.value}")
                         success = False
@@ -532,6 +619,14 @@ class NotificationService:
                 except Exception as e:
                     logger.error(f"Erro ao enviar notificação via {channel_str}: {str(e)}")
             
+            # Notificação in-app e logs gravados em uma única transação
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Erro ao gravar notificação: {str(e)}")
+                return False
+            
             return success_count > 0
             
         except Exception as e:
@@ -539,7 +634,7 @@ class NotificationService:
             return False
     
     def _send_in_app_notification(self, user_id: str, notification_type: NotificationType, data: Dict) -> bool:
-        """Enviar notificação in-app"""
+        """Enviar notificação in-app (gravada no commit de send_notification)"""
         try:
             notification = Notification(
                 user_id=user_id,
@@ -552,7 +647,6 @@ class NotificationService:
             )
             
             db.session.add(notification)
-            db.session.commit()
             
             logger.info(f"Notificação in-app criada para usuário {user_id}")
             return True
@@ -561,7 +655,12 @@ class NotificationService:
             logger.error(f"Erro ao criar notificação in-app: {str(e)}")
             return False
     
-    def _send_email_notification(self, user_id: str, notification_type: NotificationType, data: Dict) -> bool:
+    def _send_email_notification(
+        self,
+        recipient: NotificationRecipient,
+        notification_type: NotificationType,
+        data: Dict
+    ) -> bool:
         """Enviar notificação por email"""
         try:
             if not self.email_provider:
@@ -569,72 +668,68 @@ class NotificationService:
                 return False
             
             # Buscar template de email
-            template = self._get_template(notification_type, NotificationChannel.EMAIL)
+            template = self.get_template(notification_type, NotificationChannel.EMAIL)
             if not template:
                 logger.error(f"Template de email não encontrado para {notification_type.value}")
                 return False
             
-            # Renderizar template
-            subject = self._render_template(template.subject_template or data.get('title', ''), data)
-            html_content = self._render_template(template.template_content, data)
-            
-            # Buscar email do usuário
-            user_email = self._get_user_email(user_id)
-            if not user_email:
-                logger.error(f"Email não encontrado para usuário {user_id}")
+            if not recipient.email:
+                logger.error(f"Email não encontrado para usuário {recipient.user_id}")
                 return False
             
+            # Renderizar template
+            subject = template.render_subject(data, default=data.get('title', ''))
+            html_content = template.render(data)
+            
             # Enviar email
-            return self.email_provider.send_email(user_email, subject, html_content)
+            return self.email_provider.send_email(recipient.email, subject, html_content)
             
         except Exception as e:
             logger.error(f"Erro ao enviar email: {str(e)}")
             return False
     
-    def _send_sms_notification(self, user_id: str, notification_type: NotificationType, data: Dict) -> bool:
+    def _send_sms_notification(
+        self,
+        recipient: NotificationRecipient,
+        notification_type: NotificationType,
+        data: Dict
+    ) -> bool:
         """Enviar notificação por SMS"""
         try:
             if not self.sms_provider:
                 logger.error("Provedor de SMS não inicializado")
                 return False
             
-            # Buscar template de SMS
-            template = self._get_template(notification_type, NotificationChannel.SMS)
-            if not template:
-                # Usar conteúdo básico se não houver template
-                message = f"{data.get('title', '')}: {data.get('content', '')}"[:160]
-            else:
-                message = self._render_template(template.template_content, data)[:160]
-            
-            # Buscar telefone do usuário
-            user_phone = self._get_user_phone(user_id)
-            if not user_phone:
-                logger.error(f"Telefone não encontrado para usuário {user_id}")
+            if not recipient.phone:
+                logger.error(f"Telefone não encontrado para usuário {recipient.user_id}")
                 return False
             
             # Enviar SMS
-            return self.sms_provider.send_sms(user_phone, message)
+            return self.sms_provider.send_sms(recipient.phone, self.render_sms(notification_type, data))
             
         except Exception as e:
             logger.error(f"Erro ao enviar SMS: {str(e)}")
             return False
     
-    def _send_push_notification(self, user_id: str, notification_type: NotificationType, data: Dict) -> bool:
+    def _send_push_notification(
+        self,
+        recipient: NotificationRecipient,
+        notification_type: NotificationType,
+        data: Dict
+    ) -> bool:
         """Enviar push notification"""
         try:
             if not self.push_provider:
                 logger.error("Provedor de push não inicializado")
                 return False
             
-            # Buscar device token do usuário
-            device_token = self._get_user_device_token(user_id)
-            if not device_token:
-                logger.error(f"Device token não encontrado para usuário {user_id}")
+            if not recipient.device_token:
+                logger.error(f"Device token não encontrado para usuário {recipient.user_id}")
                 return False
             
             # Enviar push
             return self.push_provider.send_push(
-                device_token=device_token,
+                device_token=recipient.device_token,
                 title=data.get('title', ''),
                 body=data.get('content', ''),
                 data=data.get('metadata', {})
@@ -644,156 +739,179 @@ class NotificationService:
             logger.error(f"Erro ao enviar push notification: {str(e)}")
             return False
     
-    def _get_user_preferences(self, user_id: str, notification_type: NotificationType) -> List[NotificationSubscription]:
-        """Buscar preferências de notificação do usuário"""
-        return NotificationSubscription.query.filter_by(
-            user_id=user_id,
-            notification_type=notification_type.value
-        ).all()
+    def render_sms(self, notification_type: NotificationType, data: Dict) -> str:
+        """Mensagem de SMS a partir do template (ou título e conteúdo), até 160 caracteres"""
+        template = self.get_template(notification_type, NotificationChannel.SMS)
+        if not template:
+            # Usar conteúdo básico se não houver template
+            return f"{data.get('title', '')}: {data.get('content', '')}"[:160]
+        return template.render(data)[:160]
     
-    def _is_channel_enabled(self, preferences: List[NotificationSubscription], channel: NotificationChannel) -> bool:
-        """Verificar se canal está habilitado para o usuário"""
-        if not preferences:
-            # Se não há preferências, assumir habilitado para in-app
-            return channel == NotificationChannel.IN_APP
+    # ------------------------------------------------------------------
+    # Templates compilados
+    # ------------------------------------------------------------------
+    
+    @staticmethod
+    def _template_cache_key(notification_type: str, channel: str) -> str:
+        return f"notification_template:{notification_type}:{channel}"
+    
+    def get_template(
+        self,
+        notification_type: NotificationType,
+        channel: NotificationChannel
+    ) -> Optional[CompiledNotificationTemplate]:
+        """
+        Template ativo já compilado para (tipo, canal)
         
-        for pref in preferences:
-            if channel == NotificationChannel.EMAIL and hasattr(pref, 'email_enabled'):
-                return pref.email_enabled
-            elif channel == NotificationChannel.SMS and hasattr(pref, 'sms_enabled'):
-                return pref.sms_enabled  
-            elif channel == NotificationChannel.PUSH and hasattr(pref, 'push_enabled'):
-                return pref.push_enabled
-            elif channel == NotificationChannel.IN_APP and hasattr(pref, 'in_app_enabled'):
-                return pref.in_app_enabled
+        A versão vigente (id + updated_at) fica no cache em camadas; a
+        compilação é feita uma vez por (tipo, canal, versão) neste processo.
+        """
+        cache_key = self._template_cache_key(notification_type.value, channel.value)
+        descriptor = cache_manager.get_layered(cache_key)
         
-        return True  # Padrão: habilitado
-    
-    def _get_template(self, notification_type: NotificationType, channel: NotificationChannel) -> Optional[NotificationTemplate]:
-        """Buscar template de notificação"""
-        return NotificationTemplate.query.filter_by(
-            type=notification_type.value,
-            channel=channel.value,
-            active=True
-        ).first()
-    
-    def _render_template(self, template: str, data: Dict) -> str:
-        """Renderizar template com dados"""
-        try:
-            # Simples substituição de variáveis - pode ser melhorado com Jinja2
-            result = template
-            for key, value in data.items():
-                placeholder = f"{{{{{key}}}}}"
-                result = result.replace(placeholder, str(value))
-            return result
-        except Exception as e:
-            logger.error(f"Erro ao renderizar template: {str(e)}")
-            return template
-    
-    def _get_user_email(self, user_id: str) -> Optional[str]:
-        """Buscar email do usuário"""
-        try:
-            from models.auth import User
-
-            user = User.query.filter_by(id=user_id, is_active=True).first()
-
-            if not user:
-                logger.warning(f"Usuário {user_id} não encontrado ou inativo")
-                return None
-
-            if not user.email:
-                logger.warning(f"Usuário {user_id} não possui email cadastrado")
-                return None
-
-            # Verificar se email está verificado (se houver esse campo)
-            if hasattr(user, 'email_verified') and not user.email_verified:
-                logger.warning(f"Email do usuário {user_id} não está verificado")
-                # Pode optar por retornar None ou enviar mesmo assim
-                # return None
-
-            return user.email
-
-        except Exception as e:
-            logger.error(f"Erro ao buscar email do usuário {user_id}: {str(e)}")
-            return None
-
-    def _get_user_phone(self, user_id: str) -> Optional[str]:
-        """Buscar telefone do usuário"""
-        try:
-            from models.auth import User
-
-            user = User.query.filter_by(id=user_id, is_active=True).first()
-
-            if not user:
-                logger.warning(f"Usuário {user_id} não encontrado ou inativo")
-                return None
-
-            # Tentar buscar telefone em diferentes campos possíveis
-            phone = None
-            for field in ['phone', 'phone_number', 'mobile', 'mobile_phone']:
-                if hasattr(user, field):
-                    phone = getattr(user, field)
-                    if phone:
-                        break
-
-            if not phone:
-                logger.warning(f"Usuário {user_id} não possui telefone cadastrado")
-                return None
-
-            # Limpar e formatar telefone
-            phone = phone.replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
-
-            return phone
-
-        except Exception as e:
-            logger.error(f"Erro ao buscar telefone do usuário {user_id}: {str(e)}")
+        if descriptor is None:
+            template = NotificationTemplate.query.filter_by(
+                type=notification_type.value,
+                channel=channel.value,
+                active=True
+            ).first()
+            # Ausência também é cacheada para não consultar a cada envio
+            descriptor = {'version': None}
+            if template:
+                descriptor = {
+                    'version': f"{template.id}:{template.updated_at.isoformat() if template.updated_at else ''}",
+                    'subject': template.subject,
+                    'content': template.template_content,
+                }
+            cache_manager.set_layered(
+                cache_key, descriptor, TEMPLATE_CACHE_TIMEOUT, tags=[TEMPLATE_CACHE_TAG]
+            )
+        
+        if not descriptor.get('version'):
             return None
-
-    def _get_user_device_token(self, user_id: str) -> Optional[str]:
-        """Buscar device token do usuário para push notifications"""
+        
+        key = (notification_type.value, channel.value, descriptor['version'])
+        with self._compiled_lock:
+            compiled = self._compiled_templates.get(key)
+            if compiled is not None:
+                self._compiled_templates.move_to_end(key)
+                return compiled
+        
+        compiled = CompiledNotificationTemplate(
+            notification_type.value, channel.value, descriptor['version'],
+            descriptor.get('subject'), descriptor['content']
+        )
+        with self._compiled_lock:
+            self._compiled_templates[key] = compiled
+            while len(self._compiled_templates) > COMPILED_TEMPLATES_MAX:
+                self._compiled_templates.popitem(last=False)
+        return compiled
+    
+    def invalidate_template(self, notification_type: str = None, channel: str = None) -> None:
+        """Descartar template(s) em cache após edição; sem argumentos, descarta todos"""
+        if notification_type and channel:
+            cache_manager.delete(self._template_cache_key(notification_type, channel))
+        else:
+            cache_manager.invalidate_tags(TEMPLATE_CACHE_TAG)
+    
+    # ------------------------------------------------------------------
+    # Destinatários (contato + preferências)
+    # ------------------------------------------------------------------
+    
+    @staticmethod
+    def _recipient_id(user_id) -> str:
+        """Id canônico do usuário (UUID com hífens), o mesmo para leitura e invalidação"""
         try:
-            # Tentar buscar de um modelo DeviceToken se existir
+            return str(user_id if isinstance(user_id, uuid.UUID) else uuid.UUID(str(user_id)))
+        except ValueError:
+            return str(user_id)
+    
+    @classmethod
+    def _recipient_cache_key(cls, user_id) -> str:
+        return f"notification_recipient:{cls._recipient_id(user_id)}"
+    
+    def get_recipient(self, user_id) -> NotificationRecipient:
+        """Contato e preferências de um usuário"""
+        return self.load_recipients([user_id])[str(user_id)]
+    
+    def load_recipients(self, user_ids: Iterable) -> Dict[str, NotificationRecipient]:
+        """
+        Contato e preferências de vários usuários, indexados por str(user_id)
+        
+        Lidos do cache; os ausentes são carregados com duas consultas (usuários
+        e preferências) e gravados no cache. Usuários inexistentes ou inativos
+        retornam sem contato.
+        """
+        recipients: Dict[str, NotificationRecipient] = {}
+        missing: Dict[str, Optional[uuid.UUID]] = {}
+        for user_id in user_ids:
+            key = str(user_id)
+            cached = cache_manager.get_layered(self._recipient_cache_key(user_id))
+            if cached is not None:
+                recipients[key] = NotificationRecipient(**cached)
+                continue
             try:
-                from models.device_token import DeviceToken
-
-                # Buscar o device token mais recente e ativo do usuário
-                device = DeviceToken.query.filter_by(
-                    user_id=user_id,
-                    is_active=True
-                ).order_by(DeviceToken.last_used.desc()).first()
-
-                if device and device.token:
-                    logger.info(f"Device token encontrado para usuário {user_id}")
-                    return device.token
-
-            except ImportError:
-                # Modelo DeviceToken não existe, tentar buscar no próprio User
-                pass
-
-            # Fallback: buscar direto do modelo User se houver campo device_token
-            from models.auth import User
-
-            user = User.query.filter_by(id=user_id, is_active=True).first()
-
-            if not user:
-                logger.warning(f"Usuário {user_id} não encontrado")
-                return None
-
-            # Tentar buscar device_token em diferentes campos
-            for field in ['device_token', 'fcm_token', 'push_token']:
-                if hasattr(user, field):
-                    token = getattr(user, field)
-                    if token:
-                        logger.info(f"Device token encontrado no campo {field} para usuário {user_id}")
-                        return token
-
-            logger.warning(f"Nenhum device token encontrado para usuário {user_id}")
-            return None
-
-        except Exception as e:
-            logger.error(f"Erro ao buscar device token do usuário {user_id}: {str(e)}")
-            return None
+                missing[key] = user_id if isinstance(user_id, uuid.UUID) else uuid.UUID(key)
+            except ValueError:
+                missing[key] = None
+        
+        ids = [user_id for user_id in missing.values() if user_id is not None]
+        users = {}
+        preferences: Dict[str, Dict[str, Dict[str, bool]]] = {}
+        if ids:
+            users = {
+                str(user.id): user
+                for user in User.query.filter(User.id.in_(ids), User.is_active.is_(True))
+            }
+            for pref in NotificationSubscription.query.filter(NotificationSubscription.user_id.in_(ids)):
+                preferences.setdefault(str(pref.user_id), {})[pref.notification_type] = {
+                    NotificationChannel.EMAIL.value: pref.email_enabled,
+                    NotificationChannel.SMS.value: pref.sms_enabled,
+                    NotificationChannel.PUSH.value: pref.push_enabled,
+                    NotificationChannel.IN_APP.value: pref.in_app_enabled,
+                }
+        
+        for key in missing:
+            recipient_id = self._recipient_id(key)
+            user = users.get(recipient_id)
+            recipient = NotificationRecipient(
+                user_id=recipient_id,
+                email=user.email if user else None,
+                phone=self.phone_from_user(user) if user else None,
+                device_token=self.device_token_from_user(user) if user else None,
+                preferences=preferences.get(recipient_id, {}),
+            )
+            cache_manager.set_layered(
+                self._recipient_cache_key(key), asdict(recipient), RECIPIENT_CACHE_TIMEOUT
+            )
+            recipients[key] = recipient
+        
+        return recipients
+    
+    def invalidate_recipient(self, user_id) -> None:
+        """Descartar contato/preferências em cache após alteração"""
+        cache_manager.delete(self._recipient_cache_key(user_id))
     
+    @staticmethod
+    def phone_from_user(user) -> Optional[str]:
+        """Telefone normalizado a partir dos campos disponíveis no usuário"""
+        # Tentar buscar telefone em diferentes campos possíveis
+        for nome in ['phone', 'phone_number', 'mobile', 'mobile_phone']:
+            phone = getattr(user, nome, None)
+            if phone:
+                # Limpar e formatar telefone
+                return phone.replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
+        return None
+
+    @staticmethod
+    def device_token_from_user(user) -> Optional[str]:
+        """Device token de push armazenado diretamente no usuário, se houver"""
+        for nome in ['device_token', 'fcm_token', 'push_token']:
+            token = getattr(user, nome, None)
+            if token:
+                return token
+        return None
+
     def _log_notification(
         self,
         user_id: str,
@@ -816,7 +934,6 @@ class NotificationService:
             )
             
             db.session.add(log_entry)
-            db.session.commit()
             
         except Exception as e:
             logger.error(f"Erro ao registrar log de notificação: {str(e)}")
@@ -880,6 +997,7 @@ class NotificationService:
                     db.session.add(template)
             
             db.session.commit()
+            self.invalidate_template()
             logger.info("Templates padrão de notificação criados")
             
         except Exception as e:
@@ -904,4 +1022,27 @@ def get_notification_service():
             logger.error(f"Erro ao instanciar NotificationService: {str(e)}")
             raise
     
-    return _notification_service_instance
\ No newline at end of file
+    return _notification_service_instance
+
+
+def _track_recipient_update(mapper, connection, target):
+    """Usuário com email, telefone ou status alterado: destinatário em cache vence no commit"""
+    state = inspect(target)
+    if not any(state.attrs[nome].history.has_changes() for nome in _RECIPIENT_USER_FIELDS):
+        return
+    if state.session is not None:
+        state.session.info.setdefault(_SESSION_RECIPIENTS, set()).add(str(target.id))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_recipients_after_commit(session):
+    for user_id in session.info.pop(_SESSION_RECIPIENTS, ()):
+        cache_manager.delete(NotificationService._recipient_cache_key(user_id))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_recipients_after_rollback(session):
+    session.info.pop(_SESSION_RECIPIENTS, None)
+
+
+event.listen(User, "after_update", _track_recipient_update)
@@ -0,0 +1,407 @@
+"""
+Alocação da numeração fiscal (SerieFiscal)
+
+Cada reserva é um único UPDATE ... RETURNING em numero_atual, em transação
+própria e curta: o lock da linha dura só o UPDATE, não a emissão inteira, e
+vale entre workers e nós. Para o PDV (NFC-e) o processo reserva blocos de
+números e os consome em memória. Toda faixa reservada fica registrada em
+faixas_numeracao_fiscal; vencido o prazo de uso, os números sem documento
+(emissão que falhou, bloco não consumido) são registrados como inutilizações
+pendentes, para envio pela rota de inutilização.
+
+Blocos maiores poupam UPDATEs na linha da série durante picos do PDV, mas
+cada número que sobra quando o bloco vence vira uma inutilização (evento
+na SEFAZ e lacuna visível na série). Por isso o bloco é adaptativo: começa
+com 1 número, dobra enquanto o anterior se esgota rápido e encolhe para o
+que foi usado quando vence com sobras. Um PDV de pouco movimento reserva
+1 a 1 e não gera inutilizações.
+"""
+
+import bisect
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+
+from database import db
+from utils.cache import cache_manager
+
+logger = logging.getLogger(__name__)
+
+# Tamanho máximo do bloco adaptativo, por modelo (os demais modelos reservam 1 a 1)
+TAMANHO_BLOCO = {
+    "65": int(os.environ.get("NUMERACAO_BLOCO_NFCE", 20)),
+}
+
+# Bloco em memória não é usado depois disso; a conciliação espera uma margem a mais
+BLOCO_TTL = timedelta(seconds=int(os.environ.get("NUMERACAO_BLOCO_TTL", 600)))
+CONCILIACAO_ESPERA = BLOCO_TTL + timedelta(minutes=5)
+
+WORKER_POLL_INTERVAL = 300
+LOCK_NAME = "fiscal:numeracao_conciliacao"
+LOCK_TIMEOUT = 300
+
+JUSTIFICATIVA_LACUNA = "Numeracao reservada e nao utilizada por falha na emissao"
+
+
+class NumeracaoIndisponivel(Exception):
+    """Série inexistente, inativa, bloqueada ou com a numeração esgotada"""
+
+
+@dataclass
+class _Bloco:
+    inicial: int
+    proximo: int
+    final: int
+    reservado_em: datetime
+
+    @property
+    def expira_em(self) -> datetime:
+        return self.reservado_em + BLOCO_TTL
+
+
+def _tamanho_proximo_bloco(bloco: Optional[_Bloco], maximo: int, agora: datetime) -> int:
+    """
+    Tamanho do próximo bloco a partir do consumo do anterior
+
+    Bloco vencido com sobras: o próximo cobre só o que foi usado. Bloco
+    esgotado: o próximo deve durar cerca de meio BLOCO_TTL no ritmo
+    observado, crescendo no máximo para o dobro.
+    """
+    if bloco is None:
+        return 1
+    tamanho = bloco.final - bloco.inicial + 1
+    if bloco.proximo <= bloco.final:
+        return max(1, min(bloco.proximo - bloco.inicial, maximo))
+
+    decorrido = agora - bloco.reservado_em
+    if decorrido <= timedelta(0):
+        alvo = tamanho * 2
+    else:
+        alvo = int(tamanho * (BLOCO_TTL / 2) / decorrido)
+    return max(1, min(alvo, tamanho * 2, maximo))
+
+
+class NumeracaoFiscalService:
+    """Reserva números de séries fiscais e concilia os não utilizados"""
+
+    def __init__(self):
+        self.instancia = f"{socket.gethostname()}:{os.getpid()}"[:100]
+        self._blocos: Dict[uuid.UUID, _Bloco] = {}
+        self._lock = threading.Lock()
+        self._app = None
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+
+    def init_app(self, app) -> None:
+        """Cria a tabela de faixas e inicia a conciliação periódica"""
+        from models.fiscal import FaixaNumeracaoFiscal, InutilizacaoNumeracao
+
+        self._app = app
+        with app.app_context():
+            InutilizacaoNumeracao.__table__.create(db.engine, checkfirst=True)
+            FaixaNumeracaoFiscal.__table__.create(db.engine, checkfirst=True)
+        self.start()
+
+    def start(self) -> None:
+        """Inicia o worker de conciliação (uma vez por processo)"""
+        with self._worker_lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(
+                target=self._worker_loop, name="numeracao-fiscal", daemon=True
+            )
+            self._worker.start()
+
+    def proximo_numero(self, serie_fiscal) -> int:
+        """
+        Próximo número da série
+
+        Modelos com bloco configurado (NFC-e) consomem um bloco reservado em
+        memória, de tamanho adaptado ao ritmo de emissão (até TAMANHO_BLOCO);
+        os demais reservam um número por chamada.
+        """
+        if serie_fiscal.id is None:
+            raise NumeracaoIndisponivel("Série fiscal ainda não foi gravada")
+
+        maximo = TAMANHO_BLOCO.get(serie_fiscal.modelo, 1)
+        if maximo <= 1:
+            numero, _ = self.reservar_faixa(serie_fiscal.id, 1)
+            set_committed_value(serie_fiscal, "numero_atual", numero)
+            return numero
+
+        with self._lock:
+            agora = datetime.utcnow()
+            bloco = self._blocos.get(serie_fiscal.id)
+            if bloco is None or bloco.proximo > bloco.final or bloco.expira_em <= agora:
+                tamanho = _tamanho_proximo_bloco(bloco, maximo, agora)
+                inicial, final = self.reservar_faixa(serie_fiscal.id, tamanho)
+                bloco = self._blocos[serie_fiscal.id] = _Bloco(inicial, inicial, final, agora)
+            numero = bloco.proximo
+            bloco.proximo += 1
+            final = bloco.final
+
+        set_committed_value(serie_fiscal, "numero_atual", final)
+        return numero
+
+    def reservar_faixa(self, serie_fiscal_id, quantidade: int = 1) -> Tuple[int, int]:
+        """
+        Reserva `quantidade` números consecutivos da série
+
+        Returns:
+            Tuple (número inicial, número final)
+
+        Raises:
+            NumeracaoIndisponivel: série inativa, bloqueada ou sem números suficientes
+        """
+        from models.fiscal import FaixaNumeracaoFiscal, SerieFiscal
+
+        series = SerieFiscal.__table__
+        faixas = FaixaNumeracaoFiscal.__table__
+        agora = datetime.utcnow()
+
+        with db.engine.begin() as conn:
+            final = conn.execute(
+                update(series)
+                .where(
+                    series.c.id == serie_fiscal_id,
+                    series.c.is_active.is_(True),
+                    series.c.bloqueada_em.is_(None),
+                    series.c.numero_atual + quantidade <= series.c.numero_maximo,
+                )
+                .values(numero_atual=series.c.numero_atual + quantidade, atualizado_em=agora)
+                .returning(series.c.numero_atual)
+            ).scalar()
+
+            if final is None:
+                raise NumeracaoIndisponivel(
+                    f"Série fiscal {serie_fiscal_id} inativa, bloqueada ou sem numeração disponível"
+                )
+
+            inicial = final - quantidade + 1
+            conn.execute(insert(faixas).values(
+                id=uuid.uuid4(),
+                serie_fiscal_id=serie_fiscal_id,
+                numero_inicial=inicial,
+                numero_final=final,
+                instancia=self.instancia,
+                reservada_em=agora,
+            ))
+
+        return inicial, final
+
+    def garantir_serie_padrao(self, empresa_id, modelo: str, ambiente: str):
+        """
+        Série padrão ativa do modelo; cria a série 1 se ainda não existir
+
+        A criação é gravada na hora (transação própria) para que a numeração
+        possa ser reservada; duas criações simultâneas resolvem pela
+        constraint uq_serie_fiscal.
+
+        Raises:
+            NumeracaoIndisponivel: só existem séries inativas para o modelo
+        """
+        from models.fiscal import SerieFiscal
+
+        filtro = dict(empresa_id=empresa_id, modelo=modelo, ambiente=ambiente, is_active=True)
+        serie_fiscal = SerieFiscal.query.filter_by(is_default=True, **filtro).first()
+        if serie_fiscal:
+            return serie_fiscal
+
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(SerieFiscal.__table__).values(
+                    id=uuid.uuid4(),
+                    empresa_id=empresa_id,
+                    modelo=modelo,
+                    serie=1,
+                    ambiente=ambiente,
+                    numero_inicial=1,
+                    numero_atual=0,
+                    numero_maximo=999999999,
+                    is_active=True,
+                    is_default=True,
+                    criado_em=datetime.utcnow(),
+                    atualizado_em=datetime.utcnow(),
+                ))
+        except IntegrityError:
+            # Série 1 já existe (criada em paralelo ou desativada)
+            pass
+
+        serie_fiscal = (
+            SerieFiscal.query.filter_by(**filtro)
+            .order_by(SerieFiscal.is_default.desc(), SerieFiscal.serie)
+            .first()
+        )
+        if serie_fiscal is None:
+            raise NumeracaoIndisponivel(
+                f"Nenhuma série fiscal ativa para o modelo {modelo} (ambiente {ambiente})"
+            )
+        return serie_fiscal
+
+    def conciliar(self) -> Dict[str, int]:
+        """
+        Registra como inutilização pendente os números reservados e não usados
+
+        Só considera faixas reservadas há mais de CONCILIACAO_ESPERA (nenhum
+        bloco ou emissão em andamento ainda pode usá-las).
+
+        Returns:
+            Dict com faixas conciliadas e inutilizações registradas
+        """
+        token = cache_manager.acquire_lock(LOCK_NAME, timeout=LOCK_TIMEOUT)
+        if token is None:
+            return {"faixas": 0, "inutilizacoes": 0}
+
+        try:
+            return self._conciliar_faixas()
+        finally:
+            cache_manager.release_lock(LOCK_NAME, token)
+
+    # ------------------------------------------------------------------
+    # Conciliação
+    # ------------------------------------------------------------------
+
+    def _worker_loop(self) -> None:
+        with self._app.app_context():
+            while True:
+                try:
+                    resultado = self.conciliar()
+                    if resultado["inutilizacoes"]:
+                        logger.info(f"Numeração fiscal: {resultado['inutilizacoes']} faixa(s) a inutilizar")
+                except Exception as e:
+                    logger.error(f"Erro na conciliação da numeração fiscal: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+                time.sleep(WORKER_POLL_INTERVAL)
+
+    def _conciliar_faixas(self) -> Dict[str, int]:
+        from models.fiscal import FaixaNumeracaoFiscal, SerieFiscal
+
+        limite = datetime.utcnow() - CONCILIACAO_ESPERA
+        faixas = (
+            db.session.query(FaixaNumeracaoFiscal, SerieFiscal)
+            .join(SerieFiscal, SerieFiscal.id == FaixaNumeracaoFiscal.serie_fiscal_id)
+            .filter(
+                FaixaNumeracaoFiscal.conciliada_em.is_(None),
+                FaixaNumeracaoFiscal.reservada_em < limite,
+            )
+            .order_by(FaixaNumeracaoFiscal.serie_fiscal_id, FaixaNumeracaoFiscal.numero_inicial)
+            .all()
+        )
+
+        por_serie: Dict[uuid.UUID, List] = {}
+        for faixa, serie_fiscal in faixas:
+            por_serie.setdefault(serie_fiscal.id, []).append((faixa, serie_fiscal))
+
+        inutilizacoes = 0
+        agora = datetime.utcnow()
+        for faixas_serie in por_serie.values():
+            serie_fiscal = faixas_serie[0][1]
+            inicial = min(faixa.numero_inicial for faixa, _ in faixas_serie)
+            final = max(faixa.numero_final for faixa, _ in faixas_serie)
+            documentos, inutilizadas = self._ocupados(serie_fiscal, inicial, final)
+
+            for faixa, _ in faixas_serie:
+                for lacuna_inicial, lacuna_final in self._lacunas(
+                    faixa.numero_inicial, faixa.numero_final, documentos, inutilizadas
+                ):
+                    db.session.add(self._nova_inutilizacao(serie_fiscal, faixa, lacuna_inicial, lacuna_final))
+                    # Faixas sobrepostas não registram a mesma lacuna duas vezes
+                    inutilizadas.append((lacuna_inicial, lacuna_final))
+                    inutilizacoes += 1
+                faixa.conciliada_em = agora
+
+        db.session.commit()
+        return {"faixas": len(faixas), "inutilizacoes": inutilizacoes}
+
+    @staticmethod
+    def _ocupados(serie_fiscal, inicial: int, final: int) -> Tuple[List[int], List[Tuple[int, int]]]:
+        """
+        Números com documento (ordenados) e faixas inutilizadas da série em
+        [inicial, final], uma consulta cada para todas as faixas da série
+        """
+        from models.fiscal import DocumentoFiscal, InutilizacaoNumeracao
+
+        documentos = [
+            numero for (numero,) in db.session.query(DocumentoFiscal.numero).filter(
+                DocumentoFiscal.empresa_id == serie_fiscal.empresa_id,
+                DocumentoFiscal.modelo == serie_fiscal.modelo,
+                DocumentoFiscal.serie == serie_fiscal.serie,
+                DocumentoFiscal.ambiente == serie_fiscal.ambiente,
+                DocumentoFiscal.numero.between(inicial, final),
+            ).order_by(DocumentoFiscal.numero)
+        ]
+
+        inutilizadas = db.session.query(
+            InutilizacaoNumeracao.numero_inicial, InutilizacaoNumeracao.numero_final
+        ).filter(
+            InutilizacaoNumeracao.empresa_id == serie_fiscal.empresa_id,
+            InutilizacaoNumeracao.modelo == serie_fiscal.modelo,
+            InutilizacaoNumeracao.serie == serie_fiscal.serie,
+            InutilizacaoNumeracao.ambiente == serie_fiscal.ambiente,
+            InutilizacaoNumeracao.numero_inicial <= final,
+            InutilizacaoNumeracao.numero_final >= inicial,
+            InutilizacaoNumeracao.status != "rejeitado",
+        )
+        return documentos, [tuple(faixa) for faixa in inutilizadas]
+
+    @staticmethod
+    def _lacunas(
+        inicial: int, final: int, documentos: List[int], inutilizadas: List[Tuple[int, int]]
+    ) -> List[Tuple[int, int]]:
+        """Sub-faixas de [inicial, final] sem documento nem inutilização"""
+        usados = set(documentos[bisect.bisect_left(documentos, inicial):bisect.bisect_right(documentos, final)])
+        for inut_inicial, inut_final in inutilizadas:
+            if inut_inicial <= final and inut_final >= inicial:
+                usados.update(range(max(inut_inicial, inicial), min(inut_final, final) + 1))
+
+        lacunas: List[Tuple[int, int]] = []
+        for numero in range(inicial, final + 1):
+            if numero in usados:
+                continue
+            if lacunas and lacunas[-1][1] == numero - 1:
+                lacunas[-1] = (lacunas[-1][0], numero)
+            else:
+                lacunas.append((numero, numero))
+        return lacunas
+
+    @staticmethod
+    def _nova_inutilizacao(serie_fiscal, faixa, inicial: int, final: int):
+        from models.fiscal import InutilizacaoNumeracao
+
+        return InutilizacaoNumeracao(
+            empresa_id=serie_fiscal.empresa_id,
+            modelo=serie_fiscal.modelo,
+            serie=serie_fiscal.serie,
+            ambiente=serie_fiscal.ambiente,
+            ano=faixa.reservada_em.year,
+            numero_inicial=inicial,
+            numero_final=final,
+            justificativa=JUSTIFICATIVA_LACUNA,
+            status="pendente",
+        )
+
+
+# Instância global do alocador
+numeracao_fiscal = NumeracaoFiscalService()
+
+
+def init_numeracao_fiscal(app) -> None:
+    """Cria a tabela de faixas reservadas e inicia a conciliação de lacunas"""
+    numeracao_fiscal.init_app(app)
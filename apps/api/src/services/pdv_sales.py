@@ -0,0 +1,528 @@
+"""
+Registro de vendas do PDV
+Todos os produtos das vendas são lidos (e travados) em uma única consulta, os
+itens e vendas são inseridos em lote e o estoque e os contadores da sessão de
+caixa são alterados por UPDATEs atômicos no banco, nunca por aritmética em
+Python sobre valores lidos antes. O mesmo caminho registra uma venda do balcão
+ou um lote de vendas enfileiradas offline por um terminal.
+"""
+
+import logging
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import case, func, insert, inspect, select, text, update
+from sqlalchemy.exc import IntegrityError
+
+from database import db
+from models.pdv import CashMovement, CashSession, Sale, SaleItem
+from models.products import Product
+from services.stock_reservation import as_uuid
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_METHODS = ('cash', 'debit_card', 'credit_card', 'pix', 'mixed')
+
+# Contador da sessão acumulado por forma de pagamento ('mixed' só entra no total)
+SESSION_PAYMENT_COLUMNS = {
+    'cash': 'total_cash',
+    'debit_card': 'total_card',
+    'credit_card': 'total_card',
+    'pix': 'total_pix',
+}
+
+# Movimentação -> contador da sessão e sinal no saldo esperado
+MOVEMENT_COLUMNS = {
+    'withdrawal': ('withdrawals', -1),  # Sangria
+    'deposit': ('deposits', 1),  # Suprimento
+}
+
+MAX_BATCH_SIZE = 500
+# Tentativas de gravar o lote quando um envio concorrente grava as mesmas vendas
+RECORD_ATTEMPTS = 2
+CENTS = Decimal('0.01')
+
+
+class SaleValidationError(Exception):
+    """Venda rejeitada antes de qualquer escrita"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        self.message = message
+        self.status_code = status_code
+        super().__init__(message)
+
+
+@dataclass
+class SaleLine:
+    product_id: uuid.UUID
+    quantity: Decimal
+    unit_price: Optional[Decimal]
+    discount: Decimal
+
+
+@dataclass
+class SaleDraft:
+    """Venda validada, ainda não gravada"""
+
+    session_id: uuid.UUID
+    payment_method: str
+    lines: List[SaleLine]
+    discount: Decimal = Decimal('0')
+    amount_paid: Optional[Decimal] = None
+    change_amount: Decimal = Decimal('0')
+    customer_id: Optional[uuid.UUID] = None
+    client_reference: Optional[str] = None
+    created_at: Optional[datetime] = None
+    result: Dict[str, Any] = field(default_factory=dict)
+
+
+def _decimal(value, name: str, default=None) -> Optional[Decimal]:
+    if value is None:
+        return default
+    try:
+        number = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        raise SaleValidationError(f'Valor inválido para {name}')
+    if not number.is_finite() or number < 0:
+        raise SaleValidationError(f'Valor inválido para {name}')
+    return number
+
+
+def parse_sale(data: Dict[str, Any]) -> SaleDraft:
+    """Valida o payload de uma venda (formato do POST /sales)"""
+    if not isinstance(data, dict):
+        raise SaleValidationError('Venda inválida')
+
+    missing = [name for name in ('session_id', 'items', 'payment_method') if not data.get(name)]
+    if missing:
+        raise SaleValidationError(f'Campos obrigatórios ausentes: {", ".join(missing)}')
+
+    session_id = as_uuid(data['session_id'])
+    if session_id is None:
+        raise SaleValidationError('Sessão de caixa inválida ou fechada')
+
+    if data['payment_method'] not in PAYMENT_METHODS:
+        raise SaleValidationError(f'Forma de pagamento inválida: {data["payment_method"]}')
+
+    if not isinstance(data['items'], list):
+        raise SaleValidationError('Itens inválidos')
+
+    lines = []
+    for item in data['items']:
+        if not isinstance(item, dict):
+            raise SaleValidationError('Itens inválidos')
+        product_id = as_uuid(item.get('product_id'))
+        if product_id is None:
+            raise SaleValidationError(f'Produto {item.get("product_id")} não encontrado', 404)
+        quantity = _decimal(item.get('quantity'), 'quantity')
+        if not quantity:
+            raise SaleValidationError('Quantidade deve ser maior que zero')
+        lines.append(SaleLine(
+            product_id=product_id,
+            quantity=quantity,
+            unit_price=_decimal(item.get('unit_price'), 'unit_price'),
+            discount=_decimal(item.get('discount'), 'discount', Decimal('0')),
+        ))
+
+    created_at = None
+    if data.get('created_at'):
+        try:
+            created_at = datetime.fromisoformat(str(data['created_at']).replace('Z', '+00:00'))
+        except ValueError:
+            raise SaleValidationError('Data da venda inválida')
+
+    client_reference = data.get('client_reference')
+    return SaleDraft(
+        session_id=session_id,
+        payment_method=data['payment_method'],
+        lines=lines,
+        discount=_decimal(data.get('discount'), 'discount', Decimal('0')),
+        amount_paid=_decimal(data.get('amount_paid', data.get('payment_received')), 'amount_paid'),
+        change_amount=_decimal(data.get('change_amount'), 'change_amount', Decimal('0')),
+        customer_id=as_uuid(data['customer_id']) if data.get('customer_id') else None,
+        client_reference=str(client_reference)[:100] if client_reference else None,
+        created_at=created_at,
+    )
+
+
+def record_sale(data: Dict[str, Any], operator_id) -> Sale:
+    """
+    Registra uma venda do balcão e confirma a transação
+
+    Raises:
+        SaleValidationError: sessão fechada, produto inexistente ou dados inválidos
+    """
+    draft = parse_sale(data)
+    _record([draft], as_uuid(operator_id))
+    if draft.result['status'] == 'error':
+        raise SaleValidationError(draft.result['error'], draft.result.get('status_code', 400))
+    return db.session.get(Sale, uuid.UUID(draft.result['sale_id']))
+
+
+def record_sales(sales_data: List[Dict[str, Any]], operator_id) -> Dict[str, Any]:
+    """
+    Registra um lote de vendas enfileiradas offline por um terminal
+
+    Cada venda é validada isoladamente: as inválidas voltam com o erro e as
+    demais são gravadas juntas em uma transação. Vendas com client_reference
+    já registrado no caixa voltam como 'duplicate', então o terminal pode
+    reenviar o lote inteiro com segurança.
+
+    Returns:
+        Dict com 'results' (um por venda, na ordem recebida) e os totais
+    """
+    if not isinstance(sales_data, list) or not sales_data:
+        raise SaleValidationError('Lote de vendas vazio')
+    if len(sales_data) > MAX_BATCH_SIZE:
+        raise SaleValidationError(f'Lote excede o máximo de {MAX_BATCH_SIZE} vendas')
+
+    operator_uuid = as_uuid(operator_id)
+    results: List[Dict[str, Any]] = [{} for _ in sales_data]
+    drafts = []
+    for index, data in enumerate(sales_data):
+        try:
+            draft = parse_sale(data)
+        except SaleValidationError as e:
+            results[index] = {'status': 'error', 'error': e.message}
+            continue
+        draft.result = results[index]
+        drafts.append(draft)
+
+    for attempt in range(1, RECORD_ATTEMPTS + 1):
+        if not drafts:
+            break
+        try:
+            _record(drafts, operator_uuid)
+            break
+        except IntegrityError:
+            # Reenvio concorrente do mesmo lote: refaz e as já gravadas voltam
+            # como duplicadas
+            db.session.rollback()
+            if attempt == RECORD_ATTEMPTS:
+                # Nada do lote foi gravado; o terminal reenvia as que falharam
+                logger.warning('Lote do PDV em conflito com envio concorrente')
+                for draft in drafts:
+                    if draft.result.get('status') == 'created':
+                        draft.result.clear()
+                        draft.result.update({
+                            'status': 'error',
+                            'error': 'Conflito com envio concorrente; reenvie a venda',
+                        })
+            else:
+                for draft in drafts:
+                    draft.result.clear()
+
+    for index, data in enumerate(sales_data):
+        if isinstance(data, dict) and data.get('client_reference'):
+            results[index]['client_reference'] = data['client_reference']
+
+    summary = defaultdict(int)
+    for result in results:
+        result.pop('status_code', None)
+        summary[result['status']] += 1
+    return {
+        'results': results,
+        'created': summary['created'],
+        'duplicates': summary['duplicate'],
+        'failed': summary['error'],
+    }
+
+
+def _record(drafts: List[SaleDraft], operator_id: Optional[uuid.UUID]) -> None:
+    """Grava as vendas válidas em uma transação; preenche draft.result de cada uma"""
+
+    def reject(draft: SaleDraft, message: str, status_code: int = 400) -> None:
+        draft.result.update({'status': 'error', 'error': message, 'status_code': status_code})
+
+    # 1. Sessões travadas em ordem fixa (cancelamentos seguem a mesma ordem:
+    #    sessão antes de produtos)
+    sessions = {
+        row.id: row for row in db.session.execute(
+            select(CashSession.id, CashSession.cash_register_id, CashSession.status)
+            .where(CashSession.id.in_({draft.session_id for draft in drafts}))
+            .order_by(CashSession.id)
+            .with_for_update()
+        )
+    }
+    pending = []
+    for draft in drafts:
+        session = sessions.get(draft.session_id)
+        if session is None or session.status != 'open':
+            reject(draft, 'Sessão de caixa inválida ou fechada')
+        else:
+            pending.append(draft)
+
+    # 2. Vendas já registradas (reenvio de terminal offline)
+    references = {draft.client_reference for draft in pending if draft.client_reference}
+    if references:
+        existing = {
+            (row.cash_register_id, row.client_reference): row.id
+            for row in db.session.execute(
+                select(Sale.id, Sale.cash_register_id, Sale.client_reference)
+                .where(Sale.client_reference.in_(references))
+            )
+        }
+        seen = set()
+        remaining = []
+        for draft in pending:
+            key = (sessions[draft.session_id].cash_register_id, draft.client_reference)
+            if draft.client_reference and key in existing:
+                draft.result.update({'status': 'duplicate', 'sale_id': str(existing[key])})
+            elif draft.client_reference and key in seen:
+                reject(draft, 'client_reference repetido no lote')
+            else:
+                seen.add(key)
+                remaining.append(draft)
+        pending = remaining
+
+    # 3. Todos os produtos do lote em uma consulta, travados em ordem de ID
+    product_ids = {line.product_id for draft in pending for line in draft.lines}
+    products = {}
+    if product_ids:
+        products = {
+            row.id: row for row in db.session.execute(
+                select(Product.id, Product.name, Product.sku, Product.price)
+                .where(Product.id.in_(product_ids))
+                .order_by(Product.id)
+                .with_for_update()
+            )
+        }
+
+    now = datetime.utcnow()
+    sale_rows, item_rows = [], []
+    stock_delta: Dict[uuid.UUID, Decimal] = defaultdict(Decimal)
+    session_delta: Dict[uuid.UUID, Dict[str, Decimal]] = defaultdict(lambda: defaultdict(Decimal))
+
+    for draft in pending:
+        missing = next((line.product_id for line in draft.lines if line.product_id not in products), None)
+        if missing is not None:
+            reject(draft, f'Produto {missing} não encontrado', 404)
+            continue
+
+        sale_id = uuid.uuid4()
+        items = []
+        subtotal = Decimal('0')
+        for line in draft.lines:
+            product = products[line.product_id]
+            unit_price = line.unit_price if line.unit_price is not None else Decimal(product.price)
+            total = (line.quantity * unit_price - line.discount).quantize(CENTS, ROUND_HALF_UP)
+            subtotal += total
+            items.append({
+                'id': uuid.uuid4(),
+                'sale_id': sale_id,
+                'product_id': product.id,
+                'product_name': product.name,
+                'product_sku': product.sku,
+                'quantity': line.quantity,
+                'unit_price': unit_price,
+                'discount': line.discount,
+                'total': total,
+            })
+
+        total = subtotal - draft.discount
+        if total < 0:
+            reject(draft, 'Desconto maior que o valor da venda')
+            continue
+
+        session = sessions[draft.session_id]
+        sale_rows.append({
+            'id': sale_id,
+            'cash_register_id': session.cash_register_id,
+            'session_id': session.id,
+            'operator_id': operator_id,
+            'customer_id': draft.customer_id,
+            'subtotal': subtotal,
+            'discount': draft.discount,
+            'total': total,
+            'payment_method': draft.payment_method,
+            'amount_paid': draft.amount_paid if draft.amount_paid is not None else total,
+            'change_amount': draft.change_amount,
+            'client_reference': draft.client_reference,
+            'created_at': draft.created_at or now,
+        })
+        item_rows.extend(items)
+        for item in items:
+            stock_delta[item['product_id']] += item['quantity']
+
+        counters = session_delta[session.id]
+        counters['total_sales'] += total
+        column = SESSION_PAYMENT_COLUMNS.get(draft.payment_method)
+        if column:
+            counters[column] += total
+
+        draft.result.update({'status': 'created', 'sale_id': str(sale_id), 'total': float(total)})
+
+    if sale_rows:
+        # 4. Vendas e itens em lote
+        db.session.execute(insert(Sale), sale_rows)
+        db.session.execute(insert(SaleItem), item_rows)
+
+        # 5. Baixa de estoque em um único UPDATE (produtos sem controle de
+        #    estoque, com stock_quantity nulo, ficam como estão)
+        _apply_stock_delta({product_id: -quantity for product_id, quantity in stock_delta.items()})
+
+        # 6. Contadores da sessão incrementados no próprio banco
+        for session_id, counters in session_delta.items():
+            _apply_session_delta(session_id, counters, balance=counters['total_sales'])
+
+    db.session.commit()
+
+
+def _apply_stock_delta(delta: Dict[uuid.UUID, Decimal]) -> None:
+    if not delta:
+        return
+    delta_by_id = case(delta, value=Product.id)
+    db.session.execute(
+        update(Product)
+        .where(Product.id.in_(list(delta)), Product.stock_quantity.isnot(None))
+        .values(stock_quantity=Product.stock_quantity + delta_by_id)
+        .execution_options(synchronize_session=False)
+    )
+    # Objetos Product já carregados na sessão passam a refletir a alteração
+    for product_id in delta:
+        product = db.session.identity_map.get(db.session.identity_key(Product, product_id))
+        if product is not None:
+            db.session.expire(product, ['stock_quantity'])
+
+
+def _apply_session_delta(session_id: uuid.UUID, counters: Dict[str, Decimal], balance: Decimal) -> None:
+    values = {
+        getattr(CashSession, column): func.coalesce(getattr(CashSession, column), 0) + amount
+        for column, amount in counters.items()
+    }
+    values[CashSession.expected_balance] = func.coalesce(CashSession.expected_balance, 0) + balance
+    db.session.execute(
+        update(CashSession)
+        .where(CashSession.id == session_id)
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+    session = db.session.identity_map.get(db.session.identity_key(CashSession, session_id))
+    if session is not None:
+        db.session.expire(session)
+
+
+def cancel_sale(sale: Sale, reason: Optional[str] = None) -> Sale:
+    """Cancela uma venda: devolve o estoque e estorna os contadores da sessão"""
+    session_id = sale.session_id
+    db.session.execute(
+        select(CashSession.id).where(CashSession.id == session_id).with_for_update()
+    )
+
+    # Compare-and-set: dois cancelamentos simultâneos não estornam duas vezes
+    claimed = db.session.execute(
+        update(Sale)
+        .where(Sale.id == sale.id, Sale.status != 'cancelled')
+        .values(status='cancelled', cancelled_at=datetime.utcnow(), cancellation_reason=reason)
+        .execution_options(synchronize_session=False)
+    )
+    if claimed.rowcount != 1:
+        db.session.rollback()
+        raise SaleValidationError('Venda já está cancelada')
+
+    restock: Dict[uuid.UUID, Decimal] = defaultdict(Decimal)
+    for product_id, quantity in db.session.execute(
+        select(SaleItem.product_id, SaleItem.quantity).where(SaleItem.sale_id == sale.id)
+    ):
+        restock[product_id] += quantity
+    db.session.execute(
+        select(Product.id).where(Product.id.in_(list(restock))).order_by(Product.id).with_for_update()
+    )
+    _apply_stock_delta(dict(restock))
+
+    counters = {'total_sales': -sale.total}
+    column = SESSION_PAYMENT_COLUMNS.get(sale.payment_method)
+    if column:
+        counters[column] = -sale.total
+    _apply_session_delta(session_id, counters, balance=-sale.total)
+
+    db.session.commit()
+    db.session.refresh(sale)
+    return sale
+
+
+def record_movement(data: Dict[str, Any], user_id) -> CashMovement:
+    """
+    Registra sangria/suprimento e ajusta a sessão no banco
+
+    A sessão é travada antes da escrita (mesma ordem das vendas) e o saldo
+    esperado é alterado por UPDATE relativo: uma venda gravada em paralelo
+    não é sobrescrita.
+
+    Raises:
+        SaleValidationError: dados inválidos ou sessão fechada
+    """
+    if not isinstance(data, dict):
+        raise SaleValidationError('Movimentação inválida')
+
+    missing = [name for name in ('session_id', 'type', 'amount') if not data.get(name)]
+    if missing:
+        raise SaleValidationError(f'Campos obrigatórios ausentes: {", ".join(missing)}')
+
+    if data['type'] not in MOVEMENT_COLUMNS:
+        raise SaleValidationError(f'Tipo de movimentação inválido: {data["type"]}')
+
+    amount = _decimal(data['amount'], 'amount')
+    session_id = as_uuid(data['session_id'])
+    status = db.session.execute(
+        select(CashSession.status).where(CashSession.id == session_id).with_for_update()
+    ).scalar() if session_id else None
+    if status != 'open':
+        db.session.rollback()
+        raise SaleValidationError('Sessão de caixa inválida ou fechada')
+
+    movement = CashMovement(
+        id=uuid.uuid4(),
+        session_id=session_id,
+        type=data['type'],
+        amount=amount,
+        reason=data.get('reason', data.get('description')),
+        authorized_by=as_uuid(user_id),
+        created_at=datetime.utcnow(),
+    )
+    db.session.add(movement)
+
+    column, sign = MOVEMENT_COLUMNS[data['type']]
+    _apply_session_delta(session_id, {column: amount}, balance=sign * amount)
+
+    db.session.commit()
+    return movement
+
+
+def init_pdv_sales(app) -> None:
+    """
+    Atualiza uma tabela sales anterior ao registro em lote (idempotente)
+
+    Adiciona client_reference e o índice único (caixa, client_reference) que
+    torna o reenvio de um lote offline idempotente. Vendas antigas ficam com
+    client_reference nulo, que não conflita no índice.
+    """
+    with app.app_context():
+        table = Sale.__table__
+        engine = db.engine
+        inspector = inspect(engine)
+        if not inspector.has_table(table.name):
+            return
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        indexes.update(c['name'] for c in inspector.get_unique_constraints(table.name))
+        if 'client_reference' in columns and 'uq_sale_register_client_reference' in indexes:
+            return
+
+        if_not_exists = 'IF NOT EXISTS ' if engine.dialect.name == 'postgresql' else ''
+        with engine.begin() as conn:
+            if 'client_reference' not in columns:
+                column_type = table.c.client_reference.type.compile(dialect=engine.dialect)
+                conn.execute(text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {if_not_exists}client_reference {column_type}'
+                ))
+            if 'uq_sale_register_client_reference' not in indexes:
+                conn.execute(text(
+                    'CREATE UNIQUE INDEX IF NOT EXISTS uq_sale_register_client_reference '
+                    f'ON {table.name} (cash_register_id, client_reference)'
+                ))
+        logger.info('sales atualizada para o registro em lote do PDV')
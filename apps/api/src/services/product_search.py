@@ -0,0 +1,385 @@
+"""
+Índice de busca de produtos para Mestres do Café Enterprise API
+Busca sem acentos com ranking por relevância:
+- PostgreSQL: índice GIN de trigramas sobre unaccent(name/origin/description)
+- SQLite/desenvolvimento: índice invertido em memória
+Nos dois casos cada termo da busca casa o início de uma palavra do produto.
+"""
+
+import bisect
+import logging
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func, literal_column, text
+
+from database import db
+from models import Product
+
+logger = logging.getLogger(__name__)
+
+# Documento indexado no PostgreSQL. A expressão precisa ser idêntica à do índice
+# para que o planner consiga usá-lo. Remove acentos e caracteres especiais como
+# normalize_search_text, para que as duas buscas casem os mesmos termos.
+_PG_NORMALIZE_SQL = "regexp_replace(mc_unaccent(lower({})), '[^a-z0-9\\s]', '', 'g')"
+_PG_DOCUMENT_SQL = _PG_NORMALIZE_SQL.format(
+    "coalesce(products.name, '') || ' ' || "
+    "coalesce(products.origin, '') || ' ' || coalesce(products.description, '')"
+)
+_PG_NAME_SQL = _PG_NORMALIZE_SQL.format("coalesce(products.name, '')")
+
+_PG_SETUP_STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # unaccent() não é IMMUTABLE; o wrapper permite usá-lo em índices de expressão
+    """
+    CREATE OR REPLACE FUNCTION mc_unaccent(text) RETURNS text AS $$
+        SELECT public.unaccent('public.unaccent', $1)
+    $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    """,
+    f"CREATE INDEX IF NOT EXISTS idx_products_search_trgm ON products "
+    f"USING gin (({_PG_DOCUMENT_SQL}) gin_trgm_ops)",
+    f"CREATE INDEX IF NOT EXISTS idx_products_name_search_trgm ON products "
+    f"USING gin (({_PG_NAME_SQL}) gin_trgm_ops)",
+]
+
+# Pesos por campo no índice em memória
+FIELD_WEIGHTS = {"name": 3.0, "origin": 2.0, "description": 1.0}
+
+# Peso relativo de um termo que casa apenas por prefixo
+PREFIX_MATCH_FACTOR = 0.5
+
+# Tempo máximo (segundos) antes de reconstruir o índice em memória, para que
+# workers que não receberam o CRUD do admin também convirjam
+INDEX_MAX_AGE = 300
+
+
+def normalize_search_text(text):
+    """Normaliza texto para busca, removendo acentos e caracteres especiais"""
+    if not text:
+        return ""
+
+    # Normalizar caracteres Unicode (remover acentos)
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+
+    # Converter para minúscula e remover caracteres especiais
+    text = re.sub(r"[^a-zA-Z0-9\s]", "", text.lower())
+
+    return text.strip()
+
+
+def tokenize_search_text(text) -> List[str]:
+    """Quebra o texto normalizado em termos únicos, preservando a ordem"""
+    tokens = []
+    for token in normalize_search_text(text).split():
+        if token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def _product_key(product_id) -> Optional[str]:
+    """Normaliza o ID do produto para o formato hexadecimal usado no índice"""
+    try:
+        if isinstance(product_id, uuid.UUID):
+            return product_id.hex
+        return uuid.UUID(str(product_id)).hex
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+class InvertedProductIndex:
+    """
+    Índice invertido em memória: termo -> {produto: peso}
+    O vocabulário ordenado permite casar prefixos com busca binária, então o
+    custo de uma consulta depende dos termos casados e não do tamanho do catálogo.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._documents: Dict[str, Dict[str, float]] = {}
+        self._vocabulary: List[str] = []
+        self._lock = threading.RLock()
+        self.built_at: Optional[float] = None
+
+    def __len__(self):
+        return len(self._documents)
+
+    @staticmethod
+    def _document_terms(name, origin, description) -> Dict[str, float]:
+        terms: Dict[str, float] = {}
+        for field, value in (("name", name), ("origin", origin), ("description", description)):
+            for token in tokenize_search_text(value):
+                terms[token] = terms.get(token, 0.0) + FIELD_WEIGHTS[field]
+        return terms
+
+    def build(self, rows) -> None:
+        """Reconstrói o índice a partir de tuplas (id, name, origin, description)"""
+        postings: Dict[str, Dict[str, float]] = {}
+        documents: Dict[str, Dict[str, float]] = {}
+
+        for product_id, name, origin, description in rows:
+            key = _product_key(product_id)
+            if key is None:
+                continue
+            terms = self._document_terms(name, origin, description)
+            documents[key] = terms
+            for term, weight in terms.items():
+                postings.setdefault(term, {})[key] = weight
+
+        with self._lock:
+            self._postings = postings
+            self._documents = documents
+            self._vocabulary = sorted(postings)
+            self.built_at = time.monotonic()
+
+    def upsert(self, product_id, name, origin, description) -> None:
+        """Atualiza (ou insere) um único produto no índice"""
+        key = _product_key(product_id)
+        if key is None:
+            return
+
+        with self._lock:
+            self._remove_locked(key)
+            terms = self._document_terms(name, origin, description)
+            self._documents[key] = terms
+            for term, weight in terms.items():
+                if term not in self._postings:
+                    self._postings[term] = {}
+                    bisect.insort(self._vocabulary, term)
+                self._postings[term][key] = weight
+
+    def remove(self, product_id) -> None:
+        """Remove um produto do índice"""
+        key = _product_key(product_id)
+        if key is None:
+            return
+
+        with self._lock:
+            self._remove_locked(key)
+
+    def _remove_locked(self, key: str) -> None:
+        for term in self._documents.pop(key, {}):
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(key, None)
+            if not posting:
+                del self._postings[term]
+                position = bisect.bisect_left(self._vocabulary, term)
+                if position < len(self._vocabulary) and self._vocabulary[position] == term:
+                    self._vocabulary.pop(position)
+
+    def _matching_terms(self, token: str) -> List[str]:
+        vocabulary = self._vocabulary
+        position = bisect.bisect_left(vocabulary, token)
+        matches = []
+        while position < len(vocabulary) and vocabulary[position].startswith(token):
+            matches.append(vocabulary[position])
+            position += 1
+        return matches
+
+    def search(self, tokens: List[str]) -> List[Tuple[str, float]]:
+        """
+        Retorna [(product_key, score)] ordenado por relevância.
+        Todos os termos da busca precisam casar (AND), por termo exato ou prefixo.
+        """
+        if not tokens:
+            return []
+
+        with self._lock:
+            scores: Optional[Dict[str, float]] = None
+
+            for token in tokens:
+                token_scores: Dict[str, float] = {}
+                for term in self._matching_terms(token):
+                    factor = 1.0 if term == token else PREFIX_MATCH_FACTOR
+                    for key, weight in self._postings[term].items():
+                        token_scores[key] = max(token_scores.get(key, 0.0), weight * factor)
+
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {
+                        key: score + token_scores[key]
+                        for key, score in scores.items()
+                        if key in token_scores
+                    }
+
+                if not scores:
+                    return []
+
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+class ProductSearchService:
+    """
+    Serviço de busca de produtos
+    Usa trigramas no PostgreSQL e cai para o índice invertido em memória
+    quando a extensão não está disponível (SQLite, permissões, etc.)
+    """
+
+    def __init__(self, max_age: int = INDEX_MAX_AGE):
+        self.max_age = max_age
+        self.memory_index = InvertedProductIndex()
+        self._postgres_ready: Optional[bool] = None
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Backend
+    # ------------------------------------------------------------------
+
+    def setup(self) -> str:
+        """
+        Prepara o backend de busca (deve rodar dentro do app context)
+
+        Returns:
+            str: 'postgresql' ou 'memory'
+        """
+        if db.engine.dialect.name == "postgresql":
+            try:
+                for statement in _PG_SETUP_STATEMENTS:
+                    db.session.execute(text(statement))
+                db.session.commit()
+                self._postgres_ready = True
+                logger.info("✅ Índice de busca de produtos (pg_trgm/unaccent) pronto")
+                return "postgresql"
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"⚠️ Índice pg_trgm indisponível, usando índice em memória: {e}")
+
+        self._postgres_ready = False
+        self.rebuild()
+        return "memory"
+
+    @property
+    def uses_postgres(self) -> bool:
+        if self._postgres_ready is None:
+            self.setup()
+        return bool(self._postgres_ready)
+
+    def rebuild(self) -> int:
+        """
+        Reconstrói o índice em memória a partir de todos os produtos
+
+        Inativos também entram (listagens do admin buscam por eles); o filtro
+        de is_active fica na query, como no PostgreSQL.
+        """
+        rows = db.session.query(Product.id, Product.name, Product.origin, Product.description).all()
+        self.memory_index.build(rows)
+        logger.info(f"Índice de busca em memória reconstruído: {len(rows)} produtos")
+        return len(rows)
+
+    def _ensure_fresh(self) -> None:
+        built_at = self.memory_index.built_at
+        if built_at is None or time.monotonic() - built_at > self.max_age:
+            with self._lock:
+                built_at = self.memory_index.built_at
+                if built_at is None or time.monotonic() - built_at > self.max_age:
+                    self.rebuild()
+
+    # ------------------------------------------------------------------
+    # Manutenção (chamado pelo CRUD de produtos do admin)
+    # ------------------------------------------------------------------
+
+    def refresh_product(self, product_id) -> None:
+        """Reindexa um produto após criação/edição/ativação (excluídos saem do índice)"""
+        if self._postgres_ready is not False:
+            # PostgreSQL mantém o índice de expressão sozinho
+            return
+
+        key = _product_key(product_id)
+        if key is None:
+            return
+
+        try:
+            row = (
+                db.session.query(Product.id, Product.name, Product.origin, Product.description)
+                .filter(Product.id == uuid.UUID(key))
+                .first()
+            )
+            if row is None:
+                self.memory_index.remove(key)
+            else:
+                self.memory_index.upsert(*row)
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao reindexar produto {product_id}: {e}")
+            # Força reconstrução completa na próxima busca
+            self.memory_index.built_at = None
+
+    def remove_product(self, product_id) -> None:
+        """Remove um produto do índice em memória (exclusão)"""
+        if self._postgres_ready is False:
+            self.memory_index.remove(product_id)
+
+    # ------------------------------------------------------------------
+    # Busca
+    # ------------------------------------------------------------------
+
+    def filter_query(self, query, search_text: str, rank: bool = True):
+        """
+        Aplica a busca a uma query de Product
+
+        Args:
+            query: Query SQLAlchemy sobre Product (com filtros já aplicados)
+            search_text: Texto digitado pelo usuário
+            rank: Se True, ordena pelo score de relevância
+
+        Returns:
+            Query filtrada (e ordenada por relevância, se solicitado)
+        """
+        tokens = tokenize_search_text(search_text)
+        if not tokens:
+            return query
+
+        if self.uses_postgres:
+            return self._filter_postgres(query, tokens, rank)
+        return self._filter_memory(query, tokens, rank)
+
+    def _filter_postgres(self, query, tokens: List[str], rank: bool):
+        document = literal_column(_PG_DOCUMENT_SQL)
+
+        # Mesma semântica do índice em memória: cada termo casa o início de uma
+        # palavra (\m). Tokens já estão normalizados (somente [a-z0-9]), não há
+        # metacaracteres a escapar; o índice GIN de trigramas atende o operador ~.
+        for token in tokens:
+            query = query.filter(document.op("~")(f"\\m{token}"))
+
+        if rank:
+            phrase = " ".join(tokens)
+            relevance = (
+                func.word_similarity(phrase, document)
+                + 2 * func.similarity(literal_column(_PG_NAME_SQL), phrase)
+            )
+            query = query.order_by(relevance.desc(), Product.name.asc())
+
+        return query
+
+    def _filter_memory(self, query, tokens: List[str], rank: bool):
+        self._ensure_fresh()
+        results = self.memory_index.search(tokens)
+        if not results:
+            return query.filter(db.false())
+
+        ids = [uuid.UUID(key) for key, _ in results]
+        query = query.filter(Product.id.in_(ids))
+
+        if rank:
+            positions = {product_id: position for position, product_id in enumerate(ids)}
+            query = query.order_by(case(positions, value=Product.id))
+
+        return query
+
+
+# Instância global do serviço de busca
+product_search = ProductSearchService()
+
+
+def init_product_search(app) -> str:
+    """Inicializa o índice de busca de produtos"""
+    with app.app_context():
+        return product_search.setup()
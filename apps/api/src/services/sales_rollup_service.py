@@ -0,0 +1,545 @@
+"""
+Serviço de rollup diário de vendas
+Mantém agregados por dia (status/pagamento), por produto e por cliente para
+que os relatórios de analytics custem proporcionalmente ao número de dias,
+e não ao número de pedidos
+"""
+
+import logging
+import os
+import threading
+import uuid
+from datetime import date, datetime, timedelta
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import delete, event, func, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import db
+from models import (
+    Customer,
+    DailyCustomerSalesRollup,
+    DailyProductSalesRollup,
+    DailySalesRollup,
+    Order,
+    OrderItem,
+    SalesRollupPendingDay,
+)
+from services.dashboard_service import bucket_key, day_bucket
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_MODELS = (DailySalesRollup, DailyProductSalesRollup, DailyCustomerSalesRollup)
+
+# Campos de Order que alteram algum agregado
+_TRACKED_ORDER_FIELDS = ("status", "payment_status", "total_amount", "created_at", "customer_id")
+
+# Tamanho máximo (em dias) de cada lote no backfill
+BACKFILL_CHUNK_DAYS = 31
+
+# Intervalo (segundos) do worker que recalcula os dias marcados
+ROLLUP_INTERVAL = int(os.environ.get("SALES_ROLLUP_INTERVAL", 10))
+ROLLUP_BATCH_DAYS = 50
+
+_SESSION_ORDER_IDS = "sales_rollup_order_ids"
+_SESSION_DAYS = "sales_rollup_days"
+
+
+def _as_date(value) -> Optional[date]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(bucket_key(value))
+
+
+def _as_uuid(value) -> Optional[uuid.UUID]:
+    try:
+        return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+    except (ValueError, TypeError):
+        return None
+
+
+class SalesRollupService:
+    """
+    Rollup incremental de vendas
+    Cada alteração de pedido marca o seu dia em sales_rollup_pending_days,
+    dentro da transação do pedido (um INSERT que ignora dias já marcados). Um
+    worker em background recalcula os dias marcados a partir dos pedidos
+    daquele dia: recalcular o dia inteiro (em vez de aplicar deltas) mantém o
+    rollup idempotente, e um dia alterado durante o recálculo volta a ser
+    marcado, então o rollup converge para os pedidos gravados.
+    """
+
+    def __init__(self, interval: int = ROLLUP_INTERVAL):
+        self.interval = interval
+        self._app = None
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    # ------------------------------------------------------------------
+    # Manutenção
+    # ------------------------------------------------------------------
+
+    def ensure_tables(self) -> None:
+        """Cria as tabelas de rollup caso ainda não existam"""
+        for model in ROLLUP_MODELS + (SalesRollupPendingDay,):
+            model.__table__.create(db.engine, checkfirst = True)
+
+    def rebuild_range(self, start_day: date, end_day: date) -> int:
+        """
+        Recalcula todos os agregados entre start_day e end_day (inclusive)
+        Não faz commit; o chamador controla a transação.
+
+        Returns:
+            int: Quantidade de linhas de rollup gravadas
+        """
+        start_dt = datetime.combine(start_day, datetime.min.time())
+        end_dt = datetime.combine(end_day + timedelta(days = 1), datetime.min.time())
+        day = day_bucket(Order.created_at)
+        in_range = (Order.created_at >= start_dt, Order.created_at < end_dt)
+
+        for model in ROLLUP_MODELS:
+            db.session.query(model).filter(
+                model.day >= start_day, model.day <= end_day
+            ).delete(synchronize_session = False)
+
+        sales_rows = (
+            db.session.query(
+                day.label("day"),
+                Order.status,
+                Order.payment_status,
+                func.count(Order.id).label("orders_count"),
+                func.coalesce(func.sum(Order.total_amount), 0).label("total_amount"),
+            )
+            .filter(*in_range)
+            .group_by(day, Order.status, Order.payment_status)
+            .all()
+        )
+
+        product_rows = (
+            db.session.query(
+                day.label("day"),
+                OrderItem.product_id,
+                OrderItem.product_name,
+                func.coalesce(func.sum(OrderItem.quantity), 0).label("quantity"),
+                func.coalesce(func.sum(OrderItem.total_price), 0).label("revenue"),
+                func.count(OrderItem.id).label("order_lines"),
+            )
+            .join(Order, OrderItem.order_id == Order.id)
+            .filter(*in_range, Order.status == "completed")
+            .group_by(day, OrderItem.product_id, OrderItem.product_name)
+            .all()
+        )
+
+        customer_rows = (
+            db.session.query(
+                day.label("day"),
+                Order.customer_id,
+                func.count(Order.id).label("orders_count"),
+                func.coalesce(func.sum(Order.total_amount), 0).label("total_amount"),
+            )
+            .filter(*in_range, Order.customer_id.isnot(None))
+            .group_by(day, Order.customer_id)
+            .all()
+        )
+
+        rollups = [
+            DailySalesRollup(
+                day = _as_date(row.day),
+                status = row.status,
+                payment_status = row.payment_status,
+                orders_count = row.orders_count,
+                total_amount = row.total_amount,
+            )
+            for row in sales_rows
+        ]
+        rollups.extend(
+            DailyProductSalesRollup(
+                day = _as_date(row.day),
+                product_id = row.product_id,
+                product_name = row.product_name,
+                quantity = row.quantity,
+                revenue = row.revenue,
+                order_lines = row.order_lines,
+            )
+            for row in product_rows
+        )
+        rollups.extend(
+            DailyCustomerSalesRollup(
+                day = _as_date(row.day),
+                customer_id = row.customer_id,
+                orders_count = row.orders_count,
+                total_amount = row.total_amount,
+            )
+            for row in customer_rows
+        )
+
+        db.session.add_all(rollups)
+        return len(rollups)
+
+    def rebuild_days(self, days: Iterable[date]) -> int:
+        """Recalcula um conjunto (possivelmente esparso) de dias"""
+        total = 0
+        for day in sorted(set(days)):
+            total += self.rebuild_range(day, day)
+        return total
+
+    def backfill(self, start_day: Optional[date] = None, end_day: Optional[date] = None) -> Dict[str, Any]:
+        """
+        Reconstrói o histórico do rollup em lotes, com commit a cada lote
+
+        Args:
+            start_day: Primeiro dia (padrão: dia do pedido mais antigo)
+            end_day: Último dia (padrão: hoje)
+        """
+        self.ensure_tables()
+
+        if start_day is None:
+            first_order = db.session.query(func.min(Order.created_at)).scalar()
+            if first_order is None:
+                return {"days": 0, "rows": 0}
+            start_day = _as_date(first_order)
+        end_day = end_day or date.today()
+
+        days = rows = 0
+        chunk_start = start_day
+        while chunk_start <= end_day:
+            chunk_end = min(chunk_start + timedelta(days = BACKFILL_CHUNK_DAYS - 1), end_day)
+            rows += self.rebuild_range(chunk_start, chunk_end)
+            db.session.commit()
+            days += (chunk_end - chunk_start).days + 1
+            logger.info(f"Rollup de vendas reconstruído: {chunk_start} a {chunk_end}")
+            chunk_start = chunk_end + timedelta(days = 1)
+
+        return {"days": days, "rows": rows, "start_day": start_day.isoformat(), "end_day": end_day.isoformat()}
+
+    def init_app(self, app) -> None:
+        """Garante as tabelas e inicia o recálculo em background"""
+        self._app = app
+        with app.app_context():
+            self.ensure_tables()
+        self.start()
+
+    def start(self) -> None:
+        """Inicia o worker em background (uma vez por processo)"""
+        if self._app is None:
+            from flask import current_app
+            self._app = current_app._get_current_object()
+
+        with self._worker_lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(
+                target = self._worker_loop, name = "sales-rollup", daemon = True
+            )
+            self._worker.start()
+
+    def process_pending(self) -> int:
+        """Recalcula os dias marcados no contexto atual; retorna quantos foram recalculados"""
+        processed = 0
+        while True:
+            days = db.session.execute(
+                select(SalesRollupPendingDay.day)
+                .order_by(SalesRollupPendingDay.day)
+                .limit(ROLLUP_BATCH_DAYS)
+            ).scalars().all()
+            db.session.rollback()
+
+            claimed = sum(self._rebuild_claimed(day) for day in days)
+            processed += claimed
+            if len(days) < ROLLUP_BATCH_DAYS or not claimed:
+                return processed
+
+    def _rebuild_claimed(self, day: date) -> bool:
+        """Recalcula o dia se este worker removeu a marca (o DELETE trava a linha até o commit)"""
+        result = db.session.execute(
+            delete(SalesRollupPendingDay).where(SalesRollupPendingDay.day == day)
+        )
+        if result.rowcount != 1:
+            # Outro worker recalculou o dia
+            db.session.rollback()
+            return False
+
+        self.rebuild_range(day, day)
+        db.session.commit()
+        return True
+
+    def _worker_loop(self) -> None:
+        with self._app.app_context():
+            while True:
+                try:
+                    self.process_pending()
+                except Exception as e:
+                    logger.error(f"Erro ao recalcular rollup de vendas: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+
+    def mark_order_changed(self, order_id) -> None:
+        """
+        Marca um pedido alterado via SQL direto para recálculo no próximo commit
+        (alterações via ORM são detectadas automaticamente)
+        """
+        order_uuid = _as_uuid(order_id)
+        if order_uuid is not None:
+            db.session.info.setdefault(_SESSION_ORDER_IDS, set()).add(order_uuid)
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+
+    def sales_summary(self, start_day: date, end_day: date) -> Dict[str, Any]:
+        """Pedidos por status e por status de pagamento, e ticket médio"""
+        in_range = (DailySalesRollup.day >= start_day, DailySalesRollup.day <= end_day)
+
+        by_status = (
+            db.session.query(
+                DailySalesRollup.status,
+                func.sum(DailySalesRollup.orders_count).label("count"),
+                func.sum(DailySalesRollup.total_amount).label("total"),
+            )
+            .filter(*in_range)
+            .group_by(DailySalesRollup.status)
+            .all()
+        )
+
+        by_payment = (
+            db.session.query(
+                DailySalesRollup.payment_status,
+                func.sum(DailySalesRollup.orders_count).label("count"),
+            )
+            .filter(*in_range)
+            .group_by(DailySalesRollup.payment_status)
+            .all()
+        )
+
+        completed = next((row for row in by_status if row.status == "completed"), None)
+        completed_count = int(completed.count or 0) if completed else 0
+        completed_total = float(completed.total or 0) if completed else 0.0
+
+        return {
+            "sales_by_status": [
+                {
+                    "status": row.status,
+                    "count": int(row.count or 0),
+                    "total": float(row.total) if row.total else 0,
+                }
+                for row in by_status
+            ],
+            "payment_methods": [
+                {"method": row.payment_status, "count": int(row.count or 0)}
+                for row in by_payment
+            ],
+            "total_orders": sum(int(row.count or 0) for row in by_status),
+            "completed_orders": completed_count,
+            "total_revenue": completed_total,
+            "avg_order_value": (completed_total / completed_count) if completed_count else 0.0,
+        }
+
+    def top_products(
+        self, start_day: date, end_day: date, limit: int = 10, order_by: str = "revenue"
+    ) -> List[Dict[str, Any]]:
+        """Produtos mais vendidos (pedidos concluídos) no período"""
+        revenue = func.sum(DailyProductSalesRollup.revenue)
+        quantity = func.sum(DailyProductSalesRollup.quantity)
+
+        rows = (
+            db.session.query(
+                DailyProductSalesRollup.product_name,
+                revenue.label("total_revenue"),
+                quantity.label("total_quantity"),
+                func.sum(DailyProductSalesRollup.order_lines).label("orders_count"),
+            )
+            .filter(DailyProductSalesRollup.day >= start_day, DailyProductSalesRollup.day <= end_day)
+            .group_by(DailyProductSalesRollup.product_name)
+            .order_by((quantity if order_by == "quantity" else revenue).desc())
+            .limit(limit)
+            .all()
+        )
+
+        return [
+            {
+                "product_name": row.product_name,
+                "total_revenue": float(row.total_revenue or 0),
+                "total_quantity": int(row.total_quantity or 0),
+                "orders_count": int(row.orders_count or 0),
+            }
+            for row in rows
+        ]
+
+    def top_customers(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Clientes com mais pedidos (histórico completo)"""
+        totals = (
+            select(
+                DailyCustomerSalesRollup.customer_id,
+                func.sum(DailyCustomerSalesRollup.orders_count).label("orders_count"),
+                func.sum(DailyCustomerSalesRollup.total_amount).label("total_spent"),
+            )
+            .group_by(DailyCustomerSalesRollup.customer_id)
+            .subquery()
+        )
+        # Clientes sem pedidos também entram (com zero), como no outer join original
+        orders_count = func.coalesce(totals.c.orders_count, 0)
+
+        rows = (
+            db.session.query(
+                Customer.name,
+                Customer.email,
+                orders_count.label("orders_count"),
+                totals.c.total_spent,
+            )
+            .outerjoin(totals, totals.c.customer_id == Customer.id)
+            .order_by(orders_count.desc())
+            .limit(limit)
+            .all()
+        )
+
+        return [
+            {
+                "name": row.name,
+                "email": row.email,
+                "orders_count": int(row.orders_count or 0),
+                "total_spent": float(row.total_spent) if row.total_spent else 0,
+            }
+            for row in rows
+        ]
+
+    # ------------------------------------------------------------------
+    # Integração com a sessão
+    # ------------------------------------------------------------------
+
+    def _flush_pending(self, session: Session) -> None:
+        """Marca os dias dos pedidos alterados na transação atual (sem recalcular)"""
+        order_ids: Set[uuid.UUID] = session.info.pop(_SESSION_ORDER_IDS, set())
+        days: Set[date] = session.info.pop(_SESSION_DAYS, set())
+        if order_ids:
+            current = session.execute(
+                select(Order.created_at).where(Order.id.in_(order_ids))
+            ).scalars()
+            days.update(_as_date(created_at) for created_at in current if created_at)
+
+        days.discard(None)
+        if days:
+            self._mark_days(session, days)
+
+    @staticmethod
+    def _mark_days(session: Session, days: Set[date]) -> None:
+        """INSERT dos dias ignorando os já marcados"""
+        rows = [{"day": day, "marked_at": datetime.utcnow()} for day in sorted(days)]
+        dialect = session.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            session.execute(
+                insert(SalesRollupPendingDay).values(rows)
+                .on_conflict_do_nothing(index_elements = ["day"])
+            )
+            return
+
+        for row in rows:
+            try:
+                with session.begin_nested():
+                    session.add(SalesRollupPendingDay(**row))
+            except IntegrityError:
+                pass
+
+
+# Instância global do serviço de rollup
+sales_rollup = SalesRollupService()
+
+
+def init_sales_rollup(app) -> None:
+    """Garante as tabelas de rollup e inicia o recálculo dos dias marcados"""
+    sales_rollup.init_app(app)
+
+
+# ----------------------------------------------------------------------
+# Detecção de alterações via ORM
+# ----------------------------------------------------------------------
+
+def _known_days(state) -> Set[date]:
+    """Dias (antigo e novo) de um pedido, sem disparar carregamentos durante o flush"""
+    days = set()
+    history = state.attrs.created_at.history
+    for value in list(history.deleted or ()) + list(history.added or ()) + list(history.unchanged or ()):
+        if isinstance(value, (date, datetime)):
+            days.add(_as_date(value))
+    return days
+
+
+def _track_order(mapper, connection, target):
+    state = inspect(target)
+    session = state.session
+    if session is None:
+        return
+
+    days = _known_days(state)
+    session.info.setdefault(_SESSION_DAYS, set()).update(days)
+    # Sempre resolvemos o dia atual pelo ID, pois created_at pode ser um default do banco
+    order_uuid = _as_uuid(target.id)
+    if order_uuid is not None:
+        session.info.setdefault(_SESSION_ORDER_IDS, set()).add(order_uuid)
+
+
+def _track_order_update(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[field].history.has_changes() for field in _TRACKED_ORDER_FIELDS):
+        return
+
+    history = state.attrs.created_at.history
+    if history.added and not history.deleted and state.session is not None:
+        # Objeto expirado: o dia antigo só está no banco (roda antes do UPDATE)
+        previous = connection.execute(
+            select(Order.created_at).where(Order.id == target.id)
+        ).scalar()
+        if previous:
+            state.session.info.setdefault(_SESSION_DAYS, set()).add(_as_date(previous))
+    _track_order(mapper, connection, target)
+
+
+def _track_order_delete(mapper, connection, target):
+    state = inspect(target)
+    session = state.session
+    if session is None:
+        return
+
+    days = _known_days(state)
+    if not days:
+        created_at = connection.execute(
+            select(Order.created_at).where(Order.id == target.id)
+        ).scalar()
+        if created_at:
+            days.add(_as_date(created_at))
+    session.info.setdefault(_SESSION_DAYS, set()).update(days)
+
+
+@event.listens_for(Session, "before_commit")
+def _rebuild_before_commit(session):
+    # before_commit roda antes do flush final: pedidos pendentes precisam ser
+    # gravados agora para que os eventos do mapper marquem os seus dias
+    pending = chain(session.new, session.dirty, session.deleted)
+    if any(isinstance(obj, Order) for obj in pending):
+        session.flush()
+
+    if session.info.get(_SESSION_ORDER_IDS) or session.info.get(_SESSION_DAYS):
+        sales_rollup._flush_pending(session)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(_SESSION_ORDER_IDS, None)
+    session.info.pop(_SESSION_DAYS, None)
+
+
+event.listen(Order, "after_insert", _track_order)
+event.listen(Order, "before_update", _track_order_update)
+event.listen(Order, "before_delete", _track_order_delete)
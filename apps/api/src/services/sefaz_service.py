@@ -22,8 +22,13 @@ Ambientes:
 
 import os
 import re
+import ssl
+import time
 import uuid
+import hashlib
 import logging
+import tempfile
+import threading
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple, Any
 from dataclasses import dataclass
@@ -44,6 +49,13 @@ try:
 except ImportError:
     LXML_AVAILABLE = False
 
+try:
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    CRYPTO_AVAILABLE = True
+except ImportError:
+    CRYPTO_AVAILABLE = False
+
 
 logger = logging.getLogger(__name__)
 
@@ -62,9 +74,26 @@ NS_SOAP = "http://www.w3.org/2003/05/soap-envelope"
 # Timeout padrão para requests (segundos)
 TIMEOUT_PADRAO = 30
 
+# Pool HTTPS por (empresa, UF, ambiente): hosts distintos e conexões mantidas por host
+POOL_HOSTS = int(os.environ.get("SEFAZ_POOL_HOSTS", 4))
+POOL_CONEXOES_POR_HOST = int(os.environ.get("SEFAZ_POOL_MAXSIZE", 4))
+
 # Códigos de status de sucesso
 CODIGOS_SUCESSO = [100, 135, 136]  # 100=Autorizado, 135=Evento registrado, 136=Evento já registrado
 
+# Processamento assíncrono de lotes (enviNFe com indSinc=0)
+LOTE_MAX_NFE = 50  # Limite do leiaute enviNFe
+CSTAT_LOTE_RECEBIDO = 103
+CSTAT_LOTE_PROCESSADO = 104
+CSTAT_LOTE_EM_PROCESSAMENTO = 105
+CSTAT_LOTE_NAO_LOCALIZADO = 106
+
+# Consulta por chave (consSitNFe): NF-e não consta na base da SEFAZ
+CSTAT_NFE_NAO_CONSTA = 217
+
+# Uso denegado (protNFe)
+CODIGOS_DENEGACAO = [110, 301, 302, 303]
+
 
 class AmbienteSefaz(Enum):
     """Ambiente de operação"""
@@ -98,10 +127,33 @@ class ResultadoSefaz:
     numero_recibo: Optional[str] = None
     tempo_resposta_ms: Optional[int] = None
     erros: List[str] = None
+    tempo_medio_s: Optional[int] = None  # tMed do retEnviNFe
+    protocolos: List["ProtocoloNFe"] = None  # protNFe de um lote processado
 
     def __post_init__(self):
         if self.erros is None:
             self.erros = []
+        if self.protocolos is None:
+            self.protocolos = []
+
+
+@dataclass
+class ProtocoloNFe:
+    """Protocolo (protNFe) de uma NF-e dentro do retorno de um lote"""
+    chave_acesso: str
+    codigo_status: int
+    motivo: str
+    protocolo: Optional[str] = None
+    data_recebimento: Optional[datetime] = None
+    xml_protocolo: Optional[str] = None
+
+    @property
+    def autorizado(self) -> bool:
+        return self.codigo_status in (100, 150)
+
+    @property
+    def denegado(self) -> bool:
+        return self.codigo_status in CODIGOS_DENEGACAO
 
 
 @dataclass
@@ -212,6 +264,87 @@ WEBSERVICES_NFE = {
 ESTADOS_SVRS = ["AC", "AL", "AP", "DF", "ES", "PB", "PI", "RJ", "RN", "RO", "RR", "SC", "SE", "TO"]
 
 
+_REGEX_DECLARACAO_XML = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+
+def _tag_local(tag: str) -> str:
+    """Remove o namespace de uma tag ElementTree"""
+    return tag.split('}')[-1] if '}' in tag else tag
+
+
+def _parse_data(valor: Optional[str]) -> Optional[datetime]:
+    """Converte dhRecbto (ISO 8601) para datetime"""
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor.replace('Z', '+00:00'))
+    except Exception:
+        return None
+
+
+def criar_ssl_context(certificado, chave_privada, cadeia: List = None) -> ssl.SSLContext:
+    """
+    SSLContext com certificado cliente (mTLS) montado a partir dos objetos em memória
+
+    O módulo ssl só carrega certificado cliente a partir de um caminho; o PEM
+    é escrito num arquivo anônimo em RAM (memfd) e lido uma única vez, de modo
+    que a chave privada nunca é gravada em disco. Sem memfd (fora do Linux), usa
+    um arquivo temporário 0600 removido logo após a leitura.
+    """
+    pem = certificado.public_bytes(serialization.Encoding.PEM)
+    for intermediario in cadeia or []:
+        pem += intermediario.public_bytes(serialization.Encoding.PEM)
+    pem += chave_privada.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+
+    context = ssl.create_default_context()
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create("sefaz-mtls", os.MFD_CLOEXEC)
+        try:
+            os.write(fd, pem)
+            context.load_cert_chain(f"/proc/self/fd/{fd}")
+        finally:
+            os.close(fd)
+        return context
+
+    # mkstemp cria o arquivo com permissão 0600, visível só para o usuário do processo
+    fd, caminho = tempfile.mkstemp(prefix="sefaz-mtls-", suffix=".pem")
+    try:
+        with os.fdopen(fd, "wb") as arquivo:
+            arquivo.write(pem)
+        context.load_cert_chain(caminho)
+    finally:
+        os.unlink(caminho)
+    return context
+
+
+def impressao_certificado(certificado) -> str:
+    """SHA-256 do certificado (identifica quando o pool precisa ser recriado)"""
+    return certificado.fingerprint(hashes.SHA256()).hex()
+
+
+if REQUESTS_AVAILABLE:
+    class _SefazHTTPAdapter(HTTPAdapter):
+        """HTTPAdapter que usa o SSLContext (com certificado cliente) em todas as conexões"""
+
+        def __init__(self, ssl_context: Optional[ssl.SSLContext] = None, **kwargs):
+            self._ssl_context = ssl_context
+            super().__init__(**kwargs)
+
+        def init_poolmanager(self, *args, **kwargs):
+            if self._ssl_context is not None:
+                kwargs["ssl_context"] = self._ssl_context
+            return super().init_poolmanager(*args, **kwargs)
+
+        def proxy_manager_for(self, *args, **kwargs):
+            if self._ssl_context is not None:
+                kwargs["ssl_context"] = self._ssl_context
+            return super().proxy_manager_for(*args, **kwargs)
+
+
 class SefazService:
     """
     Serviço de comunicação com a SEFAZ
@@ -225,7 +358,9 @@ class SefazService:
         ambiente: str = "2",
         certificado_pfx: bytes = None,
         certificado_senha: str = None,
-        timeout: int = TIMEOUT_PADRAO
+        timeout: int = TIMEOUT_PADRAO,
+        ssl_context: ssl.SSLContext = None,
+        impressao: str = None
     ):
         """
         Inicializa o serviço SEFAZ
@@ -233,27 +368,44 @@ class SefazService:
         Args:
             uf: UF do emitente (SP, MG, RJ, etc.)
             ambiente: 1=Produção, 2=Homologação
-            certificado_pfx: Bytes do arquivo PFX
+            certificado_pfx: Bytes do arquivo PFX (decodificado uma única vez)
             certificado_senha: Senha do certificado
             timeout: Timeout em segundos
+            ssl_context: SSLContext com certificado cliente já montado
+            impressao: Identificador do certificado do ssl_context
         """
         self.uf = uf.upper()
         self.ambiente = ambiente
         self.timeout = timeout
 
-        # Certificado
-        self._cert_pfx = certificado_pfx
-        self._cert_senha = certificado_senha
-        self._cert_temp_path = None
+        # Certificado: SSLContext montado uma vez e compartilhado pelas conexões
+        self.impressao_certificado = impressao
+        if ssl_context is None and certificado_pfx:
+            ssl_context, self.impressao_certificado = self._ssl_context_do_pfx(
+                certificado_pfx, certificado_senha
+            )
+        self._ssl_context = ssl_context
+        # Certificado oferecido ao criar o serviço, mesmo se o SSLContext falhou
+        # (chave de reutilização na SefazServiceFactory)
+        self.impressao_origem = self.impressao_certificado
+
+        # Métricas de latência por webservice
+        self._metricas_lock = threading.Lock()
+        self._metricas: Dict[str, Dict[str, int]] = {}
 
-        # Session HTTP com retry
+        # Session HTTP com retry e conexões persistentes
         self._session = self._criar_session()
 
         # Obtém configuração de WebServices
         self._webservices = self._obter_webservices()
 
+    @property
+    def mtls(self) -> bool:
+        """Indica se as conexões apresentam certificado cliente"""
+        return self._ssl_context is not None
+
     def _criar_session(self) -> requests.Session:
-        """Cria session HTTP com configurações de retry"""
+        """Cria session HTTP com retry, pool de conexões keep-alive e mTLS"""
         if not REQUESTS_AVAILABLE:
             return None
 
@@ -265,12 +417,83 @@ class SefazService:
             backoff_factor=1,
             status_forcelist=[429, 500, 502, 503, 504]
         )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+        adapter = _SefazHTTPAdapter(
+            ssl_context=self._ssl_context,
+            max_retries=retry_strategy,
+            pool_connections=POOL_HOSTS,
+            pool_maxsize=POOL_CONEXOES_POR_HOST
+        )
         session.mount("https://", adapter)
         session.mount("http://", adapter)
 
         return session
 
+    @staticmethod
+    def _ssl_context_do_pfx(certificado_pfx: bytes, certificado_senha: str):
+        """Decodifica o PFX e monta o SSLContext; (None, None) se não for possível"""
+        if not CRYPTO_AVAILABLE:
+            logger.warning("cryptography não disponível para preparar certificado")
+            return None, None
+
+        try:
+            private_key, certificate, chain = pkcs12.load_key_and_certificates(
+                certificado_pfx,
+                certificado_senha.encode() if certificado_senha else None
+            )
+            return criar_ssl_context(certificate, private_key, chain), impressao_certificado(certificate)
+        except Exception as e:
+            logger.error(f"Erro ao preparar certificado: {str(e)}")
+            return None, None
+
+    def fechar(self) -> None:
+        """Fecha as conexões mantidas no pool"""
+        if self._session is not None:
+            self._session.close()
+
+    def _registrar_metrica(self, servico: str, tempo_ms: int, sucesso: bool) -> None:
+        with self._metricas_lock:
+            m = self._metricas.setdefault(
+                servico, {"requisicoes": 0, "falhas": 0, "tempo_total_ms": 0, "tempo_max_ms": 0}
+            )
+            m["requisicoes"] += 1
+            m["tempo_total_ms"] += tempo_ms
+            m["tempo_max_ms"] = max(m["tempo_max_ms"], tempo_ms)
+            if not sucesso:
+                m["falhas"] += 1
+
+    def metricas(self) -> Dict[str, Any]:
+        """
+        Latência por webservice e uso do pool de conexões
+
+        conexoes_criadas menor que requisicoes_http indica conexões reaproveitadas
+        (sem novo handshake TLS).
+        """
+        with self._metricas_lock:
+            por_servico = {
+                servico: dict(m, tempo_medio_ms=m["tempo_total_ms"] // m["requisicoes"])
+                for servico, m in self._metricas.items()
+            }
+
+        conexoes_criadas = 0
+        requisicoes_http = 0
+        adapter = self._session.get_adapter("https://") if self._session is not None else None
+        pools = adapter.poolmanager.pools if adapter is not None else {}
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                conexoes_criadas += pool.num_connections
+                requisicoes_http += pool.num_requests
+
+        return {
+            "uf": self.uf,
+            "ambiente": self.ambiente,
+            "mtls": self.mtls,
+            "hosts": len(pools),
+            "conexoes_criadas": conexoes_criadas,
+            "requisicoes_http": requisicoes_http,
+            "por_servico": por_servico,
+        }
+
     def _obter_webservices(self) -> Dict[str, str]:
         """Obtém URLs dos WebServices para a UF"""
         ws = WEBSERVICES_NFE.get(self.ambiente, {})
@@ -286,51 +509,6 @@ class SefazService:
         # Fallback para SVRS
         return ws.get("DEFAULT_SVRS", {})
 
-    def _preparar_certificado(self) -> Optional[str]:
-        """
-        Prepara certificado para uso em requests
-
-        Para requests com certificado cliente, precisamos de arquivos temporários
-        """
-        if not self._cert_pfx:
-            return None
-
-        try:
-            import tempfile
-            from cryptography.hazmat.primitives.serialization import pkcs12
-
-            # Carrega PFX
-            private_key, certificate, chain = pkcs12.load_key_and_certificates(
-                self._cert_pfx,
-                self._cert_senha.encode() if self._cert_senha else None
-            )
-
-            # Cria arquivo temporário com certificado + chave
-            cert_pem = certificate.public_bytes(
-                serialization.Encoding.PEM
-            )
-            key_pem = private_key.private_bytes(
-                serialization.Encoding.PEM,
-                serialization.PrivateFormat.PKCS8,
-                serialization.NoEncryption()
-            )
-
-            # Salva em arquivo temporário
-            fd, path = tempfile.mkstemp(suffix='.pem')
-            with os.fdopen(fd, 'wb') as f:
-                f.write(cert_pem)
-                f.write(key_pem)
-
-            self._cert_temp_path = path
-            return path
-
-        except ImportError:
-            logger.warning("cryptography não disponível para preparar certificado")
-            return None
-        except Exception as e:
-            logger.error(f"Erro ao preparar certificado: {str(e)}")
-            return None
-
     def _construir_envelope_soap(self, xml_dados: str, servico: str) -> str:
         """
         Constrói envelope SOAP para envio à SEFAZ
@@ -400,24 +578,22 @@ class SefazService:
             "SOAPAction": f'"{url}"'
         }
 
-        # Prepara certificado
-        cert_path = self._preparar_certificado()
+        inicio = time.perf_counter()
+        sucesso = False
 
         try:
-            inicio = datetime.now()
-
             response = self._session.post(
                 url,
                 data=envelope.encode('utf-8'),
                 headers=headers,
-                cert=cert_path if cert_path else None,
                 verify=True,
                 timeout=self.timeout
             )
 
-            tempo_ms = int((datetime.now() - inicio).total_seconds() * 1000)
+            tempo_ms = int((time.perf_counter() - inicio) * 1000)
 
             if response.status_code == 200:
+                sucesso = True
                 return True, response.text, tempo_ms
             else:
                 return False, f"HTTP {response.status_code}: {response.text}", tempo_ms
@@ -431,12 +607,7 @@ class SefazService:
         except Exception as e:
             return False, f"Erro: {str(e)}", 0
         finally:
-            # Remove arquivo temporário do certificado
-            if self._cert_temp_path and os.path.exists(self._cert_temp_path):
-                try:
-                    os.remove(self._cert_temp_path)
-                except Exception:
-                    pass
+            self._registrar_metrica(servico, int((time.perf_counter() - inicio) * 1000), sucesso)
 
     def _extrair_resposta_soap(self, xml_resposta: str) -> str:
         """Extrai conteúdo da resposta SOAP"""
@@ -473,6 +644,8 @@ class SefazService:
             protocolo = None
             chave = None
             data_rec = None
+            recibo = None
+            tempo_medio = None
 
             for elem in root.iter():
                 tag = elem.tag.split('}')[-1] if '}' in elem.tag else elem.tag
@@ -485,11 +658,12 @@ class SefazService:
                     protocolo = elem.text
                 elif tag == 'chNFe':
                     chave = elem.text
+                elif tag == 'nRec':
+                    recibo = elem.text
+                elif tag == 'tMed':
+                    tempo_medio = int(elem.text) if elem.text else None
                 elif tag == 'dhRecbto':
-                    try:
-                        data_rec = datetime.fromisoformat(elem.text.replace('Z', '+00:00'))
-                    except Exception:
-                        pass
+                    data_rec = _parse_data(elem.text)
 
             sucesso = cstat in CODIGOS_SUCESSO
 
@@ -500,7 +674,9 @@ class SefazService:
                 protocolo=protocolo,
                 chave_acesso=chave,
                 data_recebimento=data_rec,
-                xml_retorno=xml_retorno
+                xml_retorno=xml_retorno,
+                numero_recibo=recibo,
+                tempo_medio_s=tempo_medio
             )
 
         except Exception as e:
@@ -525,13 +701,7 @@ class SefazService:
         """
         # Monta lote
         id_lote = str(uuid.uuid4().int)[:15]
-        ind_sinc = "1" if sincrono else "0"
-
-        xml_lote = f"""<enviNFe xmlns="{NS_NFE}" versao="{VERSAO_NFE}">
-            <idLote>{id_lote}</idLote>
-            <indSinc>{ind_sinc}</indSinc>
-            {xml_nfe_assinado}
-        </enviNFe>"""
+        xml_lote = self._montar_envi_nfe([xml_nfe_assinado], id_lote, sincrono)
 
         # Envia
         sucesso, resposta, tempo = self._enviar_request("NfeAutorizacao", xml_lote)
@@ -552,10 +722,161 @@ class SefazService:
         resultado = self._parsear_retorno_autorizacao(xml_retorno)
         resultado.tempo_resposta_ms = tempo
         resultado.xml_enviado = xml_lote
-        resultado.numero_recibo = id_lote
+        resultado.numero_recibo = resultado.numero_recibo or id_lote
 
         return resultado
 
+    @staticmethod
+    def _montar_envi_nfe(xmls_assinados: List[str], id_lote: str, sincrono: bool) -> str:
+        """
+        Monta o enviNFe concatenando as NF-e já assinadas
+
+        As NF-e entram como texto: re-serializar o XML assinado invalidaria a
+        assinatura e custaria um parse por nota. Só a declaração XML é removida.
+        """
+        ind_sinc = "1" if sincrono else "0"
+        nfes = "".join(_REGEX_DECLARACAO_XML.sub("", xml, count=1).strip() for xml in xmls_assinados)
+
+        return (
+            f'<enviNFe xmlns="{NS_NFE}" versao="{VERSAO_NFE}">'
+            f'<idLote>{id_lote.zfill(15)}</idLote>'
+            f'<indSinc>{ind_sinc}</indSinc>'
+            f'{nfes}'
+            f'</enviNFe>'
+        )
+
+    def autorizar_lote(self, xmls_assinados: List[str], id_lote: str = None) -> ResultadoSefaz:
+        """
+        Envia lote de NF-e para autorização assíncrona (indSinc=0)
+
+        Args:
+            xmls_assinados: XMLs das NF-e já assinados (até 50)
+            id_lote: Identificador do lote (15 dígitos)
+
+        Returns:
+            ResultadoSefaz com cStat 103 e numero_recibo quando o lote foi recebido
+        """
+        if not xmls_assinados or len(xmls_assinados) > LOTE_MAX_NFE:
+            return ResultadoSefaz(
+                sucesso=False,
+                codigo_status=0,
+                motivo=f"Lote deve conter de 1 a {LOTE_MAX_NFE} NF-e"
+            )
+
+        if id_lote is None:
+            id_lote = str(uuid.uuid4().int)[:15]
+        xml_lote = self._montar_envi_nfe(xmls_assinados, id_lote, sincrono=False)
+
+        sucesso, resposta, tempo = self._enviar_request("NfeAutorizacao", xml_lote)
+
+        if not sucesso:
+            return ResultadoSefaz(
+                sucesso=False,
+                codigo_status=0,
+                motivo=resposta,
+                tempo_resposta_ms=tempo,
+                xml_enviado=xml_lote
+            )
+
+        xml_retorno = self._extrair_resposta_soap(resposta)
+        resultado = self._parsear_retorno_autorizacao(xml_retorno)
+        resultado.sucesso = resultado.codigo_status == CSTAT_LOTE_RECEBIDO
+        resultado.tempo_resposta_ms = tempo
+        resultado.xml_enviado = xml_lote
+
+        return resultado
+
+    def consultar_recibo(self, numero_recibo: str) -> ResultadoSefaz:
+        """
+        Consulta o processamento de um lote (consReciNFe / retConsReciNFe)
+
+        Args:
+            numero_recibo: nRec devolvido no envio do lote
+
+        Returns:
+            ResultadoSefaz com cStat do lote (104=processado, 105=em processamento)
+            e um ProtocoloNFe por nota em `protocolos`
+        """
+        xml_consulta = (
+            f'<consReciNFe xmlns="{NS_NFE}" versao="{VERSAO_NFE}">'
+            f'<tpAmb>{self.ambiente}</tpAmb>'
+            f'<nRec>{numero_recibo}</nRec>'
+            f'</consReciNFe>'
+        )
+
+        sucesso, resposta, tempo = self._enviar_request("NfeRetAutorizacao", xml_consulta)
+
+        if not sucesso:
+            return ResultadoSefaz(
+                sucesso=False,
+                codigo_status=0,
+                motivo=resposta,
+                tempo_resposta_ms=tempo,
+                xml_enviado=xml_consulta
+            )
+
+        xml_retorno = self._extrair_resposta_soap(resposta)
+        resultado = self._parsear_retorno_recibo(xml_retorno)
+        resultado.tempo_resposta_ms = tempo
+        resultado.xml_enviado = xml_consulta
+        resultado.numero_recibo = numero_recibo
+
+        return resultado
+
+    def _parsear_retorno_recibo(self, xml_retorno: str) -> ResultadoSefaz:
+        """Parseia retConsReciNFe: status do lote + protNFe de cada nota"""
+        try:
+            root = ET.fromstring(xml_retorno)
+
+            ret = root if _tag_local(root.tag) == 'retConsReciNFe' else None
+            if ret is None:
+                ret = next((e for e in root.iter() if _tag_local(e.tag) == 'retConsReciNFe'), root)
+
+            cstat = 0
+            xmotivo = ''
+            protocolos = []
+
+            for elem in ret:
+                tag = _tag_local(elem.tag)
+                if tag == 'cStat':
+                    cstat = int(elem.text) if elem.text else 0
+                elif tag == 'xMotivo':
+                    xmotivo = elem.text or ''
+                elif tag == 'protNFe':
+                    protocolos.append(self._parsear_prot_nfe(elem))
+
+            return ResultadoSefaz(
+                sucesso=cstat == CSTAT_LOTE_PROCESSADO,
+                codigo_status=cstat,
+                motivo=xmotivo,
+                xml_retorno=xml_retorno,
+                protocolos=protocolos
+            )
+
+        except Exception as e:
+            logger.error(f"Erro ao parsear retorno do recibo: {str(e)}")
+            return ResultadoSefaz(
+                sucesso=False,
+                codigo_status=0,
+                motivo=f"Erro ao parsear resposta: {str(e)}",
+                xml_retorno=xml_retorno
+            )
+
+    @staticmethod
+    def _parsear_prot_nfe(prot_nfe: ET.Element) -> ProtocoloNFe:
+        campos = {}
+        for elem in prot_nfe.iter():
+            campos[_tag_local(elem.tag)] = elem.text
+
+        return ProtocoloNFe(
+            chave_acesso=campos.get('chNFe') or '',
+            codigo_status=int(campos.get('cStat') or 0),
+            motivo=campos.get('xMotivo') or '',
+            protocolo=campos.get('nProt'),
+            data_recebimento=_parse_data(campos.get('dhRecbto')),
+            xml_protocolo=ET.tostring(prot_nfe, encoding='unicode')
+        )
+
     def consultar_protocolo(self, chave_acesso: str) -> ResultadoSefaz:
         """
         Consulta situação de NF-e pela chave de acesso
@@ -722,18 +1043,23 @@ class SefazService:
         return resultado
 
     def __del__(self):
-        """Limpa recursos"""
-        if self._cert_temp_path and os.path.exists(self._cert_temp_path):
-            try:
-                os.remove(self._cert_temp_path)
-            except Exception:
-                pass
+        """Fecha o pool quando a última referência ao serviço é liberada"""
+        try:
+            self.fechar()
+        except Exception:
+            pass
 
 
 class SefazServiceFactory:
-    """Factory para criar instâncias do serviço SEFAZ"""
+    """
+    Factory para criar instâncias do serviço SEFAZ
+
+    Mantém um serviço (e seu pool HTTPS) por (empresa, UF, ambiente); o pool
+    só é recriado quando o certificado muda.
+    """
 
     _instances: Dict[str, SefazService] = {}
+    _lock = threading.Lock()
 
     @classmethod
     def criar_servico(
@@ -741,7 +1067,8 @@ class SefazServiceFactory:
         uf: str,
         ambiente: str = "2",
         certificado_pfx: bytes = None,
-        certificado_senha: str = None
+        certificado_senha: str = None,
+        empresa_id: str = None
     ) -> SefazService:
         """
         Cria ou reutiliza instância do serviço SEFAZ
@@ -751,23 +1078,77 @@ class SefazServiceFactory:
             ambiente: 1=Produção, 2=Homologação
             certificado_pfx: Bytes do certificado
             certificado_senha: Senha
+            empresa_id: Empresa cujo certificado (CertificateManager) autentica a conexão
 
         Returns:
             SefazService configurado
         """
-        key = f"{uf}_{ambiente}"
-
-        if key not in cls._instances or certificado_pfx:
-            cls._instances[key] = SefazService(
-                uf=uf,
-                ambiente=ambiente,
-                certificado_pfx=certificado_pfx,
-                certificado_senha=certificado_senha
-            )
+        key = f"{empresa_id or '-'}_{uf.upper()}_{ambiente}"
+
+        with cls._lock:
+            atual = cls._instances.get(key)
+
+            if certificado_pfx:
+                impressao = hashlib.sha256(certificado_pfx).hexdigest()
+                if atual is not None and atual.impressao_origem == impressao:
+                    return atual
+                novo = SefazService(
+                    uf=uf,
+                    ambiente=ambiente,
+                    certificado_pfx=certificado_pfx,
+                    certificado_senha=certificado_senha
+                )
+                novo.impressao_certificado = impressao if novo.mtls else None
+                novo.impressao_origem = impressao
+            else:
+                credenciais = cls._credenciais_empresa(empresa_id)
+                impressao = impressao_certificado(credenciais[0]) if credenciais else None
+                if atual is not None and (impressao is None or atual.impressao_origem == impressao):
+                    return atual
+                ssl_context = None
+                if credenciais:
+                    try:
+                        ssl_context = criar_ssl_context(*credenciais)
+                    except Exception as e:
+                        logger.error(f"Erro ao preparar certificado da empresa {empresa_id}: {str(e)}")
+                novo = SefazService(
+                    uf=uf,
+                    ambiente=ambiente,
+                    ssl_context=ssl_context,
+                    impressao=impressao if ssl_context is not None else None
+                )
+                # Falha no SSLContext (ex.: sem os.memfd_create) também fica em
+                # cache para este certificado: não recria serviço e pool a cada chamada
+                novo.impressao_origem = impressao
+
+            # O serviço anterior não é fechado aqui: requisições em andamento
+            # ainda o usam. Suas conexões são fechadas quando a última
+            # referência é liberada (__del__)
+            cls._instances[key] = novo
+            return novo
+
+    @staticmethod
+    def _credenciais_empresa(empresa_id: Optional[str]):
+        if not empresa_id or not CRYPTO_AVAILABLE:
+            return None
+        try:
+            from services.certificate_service import get_certificate_manager
+        except ImportError:
+            return None
+        cert_service = get_certificate_manager().obter_servico(str(empresa_id))
+        return cert_service.obter_credenciais_tls() if cert_service else None
 
-        return cls._instances[key]
+    @classmethod
+    def metricas(cls) -> Dict[str, Dict[str, Any]]:
+        """Métricas de latência e pool de cada serviço ativo"""
+        with cls._lock:
+            servicos = dict(cls._instances)
+        return {key: servico.metricas() for key, servico in servicos.items()}
 
     @classmethod
     def limpar_cache(cls):
-        """Limpa cache de instâncias"""
-        cls._instances.clear()
+        """Fecha os pools e limpa cache de instâncias"""
+        with cls._lock:
+            for servico in cls._instances.values():
+                servico.fechar()
+            cls._instances.clear()
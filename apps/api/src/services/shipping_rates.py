@@ -0,0 +1,139 @@
+"""
+Tabela de fretes por faixa de CEP
+Faixas de CEP por UF e zonas de entrega local ficam em data/shipping_rates.json
+e são carregadas uma vez em arrays ordenados; cada consulta é uma busca binária.
+As regras de preço (base por UF, serviços, frete grátis local) vêm do mesmo
+arquivo e alimentam o frete simulado do checkout e o fallback do Melhor Envio.
+"""
+
+import json
+import os
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+DATA_FILE = os.path.join(os.path.dirname(__file__), "data", "shipping_rates.json")
+
+
+def normalize_cep(cep) -> Optional[int]:
+    """CEP como inteiro de 8 dígitos; None se inválido"""
+    digits = "".join(ch for ch in str(cep or "") if ch.isdigit())
+    return int(digits) if len(digits) == 8 else None
+
+
+class CepRangeIndex:
+    """Faixas de CEP disjuntas com busca binária pelo início da faixa"""
+
+    def __init__(self, ranges: Iterable[Tuple[int, int, Any]]):
+        ordered = sorted(ranges, key=lambda item: item[0])
+        for (_, previous_end, previous), (start, _, value) in zip(ordered, ordered[1:]):
+            if start <= previous_end:
+                raise ValueError(f"Faixas de CEP sobrepostas: {previous} e {value}")
+        self._starts = [start for start, _, _ in ordered]
+        self._ends = [end for _, end, _ in ordered]
+        self._values = [value for _, _, value in ordered]
+
+    def __len__(self):
+        return len(self._starts)
+
+    def get(self, cep: int) -> Any:
+        position = bisect_right(self._starts, cep) - 1
+        if position >= 0 and cep <= self._ends[position]:
+            return self._values[position]
+        return None
+
+
+@dataclass(frozen=True)
+class CepInfo:
+    """Localização de um CEP"""
+
+    uf: str
+    region: str
+    zone: Optional[str] = None
+
+
+class ShippingRates:
+    """Consulta de UF/região/zona local e cálculo do frete tabelado"""
+
+    def __init__(self, data: Dict[str, Any]):
+        region_by_uf = {uf: region for region, ufs in data["regions"].items() for uf in ufs}
+        # Um CepInfo por UF, compartilhado por todas as faixas do estado
+        infos = {uf: CepInfo(uf, region) for uf, region in region_by_uf.items()}
+        self._states = CepRangeIndex(
+            (int(start), int(end), infos[uf]) for start, end, uf in data["states"]
+        )
+
+        self._zones = {zone["code"]: zone for zone in data.get("local_zones", [])}
+        self._zone_index = CepRangeIndex(
+            (int(zone["start"]), int(zone["end"]), zone["code"]) for zone in self._zones.values()
+        )
+        self._zone_infos: Dict[Tuple[str, str], CepInfo] = {}
+
+        pricing = data["pricing"]
+        self.default_base_price = float(pricing["default_base_price"])
+        self.base_price_by_state = {uf: float(price) for uf, price in pricing["base_price_by_state"].items()}
+        self.minimum_weight = float(pricing["minimum_weight_kg"])
+        self.weight_step = float(pricing["weight_step_kg"])
+        self.services = pricing["services"]
+
+    @classmethod
+    def load(cls, path: str = DATA_FILE) -> "ShippingRates":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def lookup(self, cep) -> Optional[CepInfo]:
+        """UF, região e zona local do CEP; None se o CEP for inválido"""
+        number = normalize_cep(cep)
+        if number is None:
+            return None
+
+        info = self._states.get(number)
+        if info is None:
+            return None
+
+        zone = self._zone_index.get(number)
+        if zone is None:
+            return info
+        key = (info.uf, zone)
+        if key not in self._zone_infos:
+            self._zone_infos[key] = CepInfo(info.uf, info.region, zone)
+        return self._zone_infos[key]
+
+    def base_price(self, uf: Optional[str]) -> float:
+        return self.base_price_by_state.get(uf, self.default_base_price)
+
+    def quote(self, destination_cep, weight_kg: float = 0.0, subtotal: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        Opções de frete tabeladas para o CEP
+
+        Returns:
+            Lista de opções (carrier_name, service_name, service_code, price,
+            delivery_time, description, is_free)
+        """
+        info = self.lookup(destination_cep)
+        zone = self._zones.get(info.zone) if info and info.zone else None
+
+        if zone and zone.get("free_shipping_minimum") is not None and subtotal >= zone["free_shipping_minimum"]:
+            return [dict(zone["free_service"], price=0.00, is_free=True)]
+
+        base_price = self.base_price(info.uf if info else None)
+        weight = max(float(weight_kg or 0), self.minimum_weight)
+        weight_multiplier = max(1.0, weight / self.weight_step)
+
+        services = self.services + (zone["services"] if zone else [])
+        return [
+            {
+                "carrier_name": service["carrier_name"],
+                "service_name": service["service_name"],
+                "service_code": service["service_code"],
+                "price": round(base_price * service["multiplier"] * weight_multiplier, 2),
+                "delivery_time": service["delivery_time"],
+                "description": service["description"],
+                "is_free": False,
+            }
+            for service in services
+        ]
+
+
+# Tabela global (carregada uma vez por processo)
+shipping_rates = ShippingRates.load()
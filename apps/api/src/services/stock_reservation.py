@@ -0,0 +1,134 @@
+"""
+Reserva de estoque em lote para finalização de pedidos
+Todos os produtos do carrinho são travados em uma única consulta ordenada por
+ID (ordem de lock fixa: dois checkouts concorrentes não entram em deadlock) e o
+estoque é baixado por um único UPDATE condicional. O número de consultas não
+cresce com o tamanho do carrinho.
+"""
+
+import logging
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import case, func, select, update
+
+from database import db
+from models.products import Product
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStockError(Exception):
+    """Estoque insuficiente para um ou mais produtos"""
+
+    def __init__(self, product_name: str, available: int):
+        self.product_name = product_name
+        self.available = available
+        super().__init__(f"Estoque insuficiente para {product_name}. Disponível: {available}")
+
+
+@dataclass
+class ReservedProduct:
+    """Produto reservado (dados lidos sob lock, antes da baixa)"""
+
+    id: uuid.UUID
+    name: str
+    sku: Optional[str]
+    quantity: int
+    stock_before: int
+
+
+def as_uuid(value) -> Optional[uuid.UUID]:
+    """Converte o ID recebido na requisição; None se inválido"""
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def aggregate_quantities(lines: Iterable[Tuple[object, int]]) -> Dict[uuid.UUID, int]:
+    """Soma quantidades por produto (linhas repetidas do mesmo produto)"""
+    totals: Dict[uuid.UUID, int] = {}
+    for product_id, quantity in lines:
+        product_uuid = as_uuid(product_id)
+        if product_uuid is None:
+            continue
+        totals[product_uuid] = totals.get(product_uuid, 0) + int(quantity)
+    return totals
+
+
+def reserve_stock(lines: Iterable[Tuple[object, int]]) -> Dict[uuid.UUID, ReservedProduct]:
+    """
+    Baixa o estoque de todos os produtos na transação atual
+
+    Deve ser chamada dentro da transação do pedido: os locks são liberados no
+    commit/rollback. Produtos inexistentes são ignorados (não aparecem no
+    retorno).
+
+    Args:
+        lines: Pares (product_id, quantidade)
+
+    Returns:
+        Dict product_id -> ReservedProduct
+
+    Raises:
+        InsufficientStockError: algum produto sem estoque (desfaça a transação)
+        ValueError: quantidade menor ou igual a zero
+    """
+    quantities = aggregate_quantities(lines)
+    if not quantities:
+        return {}
+    if any(quantity <= 0 for quantity in quantities.values()):
+        raise ValueError("Quantidade deve ser maior que zero")
+
+    # 1. Lock de todos os produtos em uma consulta, sempre na mesma ordem
+    rows = db.session.execute(
+        select(Product.id, Product.name, Product.sku, Product.stock_quantity)
+        .where(Product.id.in_(list(quantities)))
+        .order_by(Product.id)
+        .with_for_update()
+    ).all()
+
+    reserved: Dict[uuid.UUID, ReservedProduct] = {}
+    for row in rows:
+        stock = row.stock_quantity or 0
+        quantity = quantities[row.id]
+        if stock < quantity:
+            raise InsufficientStockError(row.name, stock)
+        reserved[row.id] = ReservedProduct(row.id, row.name, row.sku, quantity, stock)
+
+    if not reserved:
+        return reserved
+
+    # 2. Baixa condicional em um único UPDATE; a condição garante que não há
+    #    venda acima do estoque mesmo em bancos sem FOR UPDATE
+    quantity_by_id = case({product_id: item.quantity for product_id, item in reserved.items()}, value=Product.id)
+    result = db.session.execute(
+        update(Product)
+        .where(
+            Product.id.in_(list(reserved)),
+            func.coalesce(Product.stock_quantity, 0) >= quantity_by_id,
+        )
+        .values(stock_quantity=Product.stock_quantity - quantity_by_id)
+        .execution_options(synchronize_session=False)
+    )
+
+    if result.rowcount != len(reserved):
+        # Outro pedido baixou o estoque entre a leitura e o UPDATE (banco sem
+        # FOR UPDATE): parte das linhas pode ter sido baixada
+        current = dict(db.session.execute(
+            select(Product.id, Product.stock_quantity).where(Product.id.in_(list(reserved)))
+        ).all())
+        short = min(reserved.values(), key=lambda item: (current.get(item.id) or 0) - item.quantity)
+        raise InsufficientStockError(short.name, max(0, current.get(short.id) or 0))
+
+    # Objetos Product já carregados na sessão passam a refletir a baixa
+    for product_id in reserved:
+        product = db.session.identity_map.get(db.session.identity_key(Product, product_id))
+        if product is not None:
+            db.session.expire(product, ["stock_quantity"])
+
+    return reserved
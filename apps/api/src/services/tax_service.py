@@ -4,11 +4,15 @@ Implementa compliance fiscal completa para e-commerce usando bibliotecas gratuit
 """
 import json
 import logging
+import threading
+import time
+import uuid
 from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from sqlalchemy.orm import Session
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload
 from sqlalchemy.sql import func
 
 # Bibliotecas para validação fiscal brasileira
@@ -19,10 +23,10 @@ try:
 except ImportError:
     VALIDATION_LIBS_AVAILABLE = False
 
-from src.models.customers import Customer
-from src.models.orders import Order, OrderItem
-from src.models.products import Product
-from src.models.tax import (
+from models.customers import Customer
+from models.orders import Order, OrderItem
+from models.products import Product
+from models.tax import (
     CFOPCode,
     ICMSRate,
     NCMCode,
@@ -30,9 +34,14 @@ from src.models.tax import (
     TaxCalculation,
     TaxExemption
 )
+from utils.cache import cache_get, cache_set
 
 logger = logging.getLogger(__name__)
 
+# Versão compartilhada da tabela ICMS (alterada a cada commit que muda ICMSRate)
+ICMS_TABLE_VERSION_KEY = "tax:icms_rates:version"
+ICMS_TABLE_MAX_AGE = 300  # segundos; recarrega mesmo sem mudança de versão
+
 
 class BrazilianTaxCalculator:
     """
@@ -59,6 +68,12 @@ class BrazilianTaxCalculator:
     PIS_RATE_DEFAULT = Decimal('1.65')
     COFINS_RATE_DEFAULT = Decimal('7.60')
     
+    # CFOPs de venda usados pelo cálculo (criados se não existirem)
+    SALE_CFOP_CODES = {
+        '5102': 'Venda de mercadoria adquirida ou recebida de terceiros',
+        '6102': 'Venda de mercadoria adquirida ou recebida de terceiros (interestadual)'
+    }
+
     # NCM codes comuns para café
     COFFEE_NCM_CODES = {
         '09011100': {
@@ -82,6 +97,58 @@ class BrazilianTaxCalculator:
     }
 
 
+class ICMSRateTable:
+    """
+    Matriz de alíquotas ICMS (origem, destino) pré-carregada em memória
+
+    Carrega todas as alíquotas ativas em uma consulta e reutiliza a matriz
+    enquanto a versão compartilhada no cache não mudar (commits que alteram
+    ICMSRate publicam uma nova versão), com expiração de segurança.
+    """
+
+    def __init__(self, max_age: int = ICMS_TABLE_MAX_AGE):
+        self.max_age = max_age
+        self._rates: Optional[Dict[Tuple[str, str], Decimal]] = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def rates(self, db_session: Session) -> Dict[Tuple[str, str], Decimal]:
+        version = cache_get(ICMS_TABLE_VERSION_KEY)
+        with self._lock:
+            if (
+                self._rates is not None
+                and version == self._version
+                and time.monotonic() - self._loaded_at < self.max_age
+            ):
+                return self._rates
+
+        rows = db_session.query(
+            ICMSRate.origin_state, ICMSRate.destination_state, ICMSRate.rate
+        ).filter(ICMSRate.is_active == True).all()
+
+        rates: Dict[Tuple[str, str], Decimal] = {}
+        for origin_state, destination_state, rate in rows:
+            # Mantém a primeira linha por par, como o .first() da consulta individual
+            rates.setdefault((origin_state, destination_state), rate)
+
+        with self._lock:
+            self._rates = rates
+            self._version = version
+            self._loaded_at = time.monotonic()
+        return rates
+
+    def invalidate(self) -> None:
+        """Descarta a matriz local e publica nova versão para os demais workers"""
+        with self._lock:
+            self._rates = None
+        cache_set(ICMS_TABLE_VERSION_KEY, uuid.uuid4().hex, timeout = 30 * 86400)
+
+
+# Instância global da matriz ICMS
+icms_rate_table = ICMSRateTable()
+
+
 class TaxCalculationService:
     """
     Serviço completo de cálculo de impostos brasileiros
@@ -93,6 +160,7 @@ class TaxCalculationService:
         self.calculator = BrazilianTaxCalculator()
         self.cpf_validator = CPF() if VALIDATION_LIBS_AVAILABLE else None
         self.cnpj_validator = CNPJ() if VALIDATION_LIBS_AVAILABLE else None
+        self._cfops: Dict[str, CFOPCode] = {}
         
     def calculate_order_taxes(
         self,
@@ -115,23 +183,24 @@ class TaxCalculationService:
                 # Usar estado do cliente se não especificado
                 if not destination_state and customer:
                     destination_state = self._extract_customer_state(customer)
-                else:
-                    destination_state = destination_state or "SP"
+            destination_state = destination_state or "SP"
             
-            # Calcular impostos por item
-            total_taxes = Decimal('0')
-            order_calculations = []
+            # Recalcular substitui os cálculos anteriores do pedido
+            self.db.query(TaxCalculation).filter(
+                TaxCalculation.order_id == order.id
+            ).delete(synchronize_session=False)
             
-            for item in order.items:
-                item_calc = self.calculate_item_taxes(
-                    item=item,
-                    customer=customer,
-                    origin_state=origin_state,
-                    destination_state=destination_state
-                )
-                if item_calc:
-                    order_calculations.append(item_calc)
-                    total_taxes += item_calc.total_tax_amount
+            # Calcular impostos de todos os itens com dados carregados em lote
+            order_calculations = self.calculate_items_taxes_batch(
+                items=list(order.items),
+                customer=customer,
+                origin_state=origin_state,
+                destination_state=destination_state
+            )
+            total_taxes = sum(
+                (calc.total_tax_amount for calc in order_calculations),
+                Decimal('0')
+            )
             
             # Atualizar total do pedido
             order.tax_amount = total_taxes
@@ -186,11 +255,6 @@ class TaxCalculationService:
                 # Criar configuração padrão se não existir
                 product_tax = self._create_default_product_tax(product)
             
-            # Determinar CFOP
-            cfop_code = self._determine_cfop(
-                origin_state, destination_state, customer
-            )
-            
             # Verificar isenções do cliente
             customer_exemptions = []
             if customer:
@@ -198,58 +262,15 @@ class TaxCalculationService:
                     customer, destination_state
                 )
             
-            # Valor base para cálculo
-            base_value = item.price * item.quantity
-            
-            # Criar cálculo de impostos
-            calculation = TaxCalculation(
-                order_item_id=item.id,
-                product_id=product.id,
-                customer_id=customer.id if customer else None,
-                base_value=item.price,
-                quantity=item.quantity,
-                total_value=base_value,
-                origin_state=origin_state,
-                destination_state=destination_state,
-                cfop_code=cfop_code,
-                calculated_at=datetime.utcnow()
+            calculation = self._build_item_calculation(
+                item, product, product_tax, customer,
+                origin_state, destination_state, customer_exemptions,
+                self._get_icms_rate(origin_state, destination_state),
+                self._get_cfop(self._determine_cfop(
+                    origin_state, destination_state, customer
+                ))
             )
             
-            # Calcular cada imposto
-            self._calculate_icms(
-                calculation, product_tax, base_value, 
-                origin_state, destination_state, customer_exemptions
-            )
-            self._calculate_pis(
-                calculation, product_tax, base_value, customer_exemptions
-            )
-            self._calculate_cofins(
-                calculation, product_tax, base_value, customer_exemptions
-            )
-            self._calculate_ipi(
-                calculation, product_tax, base_value, customer_exemptions
-            )
-            
-            # Total de impostos
-            calculation.total_tax_amount = (
-                calculation.icms_amount + calculation.pis_amount +
-                calculation.cofins_amount + calculation.ipi_amount
-            )
-            
-            # Metadados do cálculo
-            calculation.calculation_data = json.dumps({
-                'product_name': product.name,
-                'product_sku': product.sku,
-                'ncm_code': (product_tax.ncm.code 
-                            if product_tax.ncm else None),
-                'cfop_code': cfop_code,
-                'customer_type': (customer.customer_type 
-                                 if customer else 'individual'),
-                'exemptions_applied': [ex.tax_type for ex in customer_exemptions],
-                'calculation_method': 'brazilian_tax_libs',
-                'timestamp': calculation.calculated_at.isoformat()
-            })
-            
             self.db.add(calculation)
             self.db.flush()
             
@@ -259,13 +280,148 @@ class TaxCalculationService:
             logger.error(f"Erro no cálculo de impostos do item {item.id}: {e}")
             return None
     
+    def calculate_items_taxes_batch(
+        self,
+        items: List[OrderItem],
+        customer: Optional[Customer] = None,
+        origin_state: str = "SP",
+        destination_state: str = "SP"
+    ) -> List[TaxCalculation]:
+        """
+        Calcula impostos de vários itens (de um mesmo pedido) em lote
+
+        Produtos, configurações fiscais (com NCM), isenções e a alíquota ICMS
+        são carregados uma única vez; o cálculo por item é feito em memória
+        com as mesmas regras de calculate_item_taxes e um único flush no fim.
+        """
+        if not items:
+            return []
+
+        product_ids = {item.product_id for item in items}
+        products = {
+            product.id: product
+            for product in self.db.query(Product).filter(
+                Product.id.in_(product_ids)
+            )
+        }
+
+        product_taxes: Dict[Any, ProductTax] = {}
+        for product_tax in self.db.query(ProductTax).options(
+            joinedload(ProductTax.ncm)
+        ).filter(
+            ProductTax.product_id.in_(product_ids),
+            ProductTax.is_active == True
+        ):
+            product_taxes.setdefault(product_tax.product_id, product_tax)
+
+        customer_exemptions = []
+        if customer:
+            customer_exemptions = self._get_customer_exemptions(
+                customer, destination_state
+            )
+
+        icms_rate = self._get_icms_rate(origin_state, destination_state)
+        cfop = self._get_cfop(
+            self._determine_cfop(origin_state, destination_state, customer)
+        )
+
+        calculations = []
+        for item in items:
+            try:
+                product = products.get(item.product_id)
+                if not product:
+                    raise ValueError(f"Produto {item.product_id} não encontrado")
+
+                product_tax = product_taxes.get(product.id)
+                if not product_tax:
+                    # Criar configuração padrão se não existir
+                    product_tax = self._create_default_product_tax(product)
+                    product_taxes[product.id] = product_tax
+
+                calculations.append(self._build_item_calculation(
+                    item, product, product_tax, customer,
+                    origin_state, destination_state, customer_exemptions,
+                    icms_rate, cfop
+                ))
+            except Exception as e:
+                logger.error(f"Erro no cálculo de impostos do item {item.id}: {e}")
+
+        self.db.add_all(calculations)
+        self.db.flush()
+        return calculations
+    
+    def _build_item_calculation(
+        self,
+        item: OrderItem,
+        product: Product,
+        product_tax: ProductTax,
+        customer: Optional[Customer],
+        origin_state: str,
+        destination_state: str,
+        customer_exemptions: List[TaxExemption],
+        icms_rate: Decimal,
+        cfop: CFOPCode
+    ) -> TaxCalculation:
+        """Monta o TaxCalculation de um item sem acessar o banco"""
+        # Valor base para cálculo
+        base_value = item.unit_price * item.quantity
+        
+        # Criar cálculo de impostos
+        calculation = TaxCalculation(
+            order_id=item.order_id,
+            order_item_id=item.id,
+            product_id=product.id,
+            cfop_id=cfop.id,
+            base_value=item.unit_price,
+            quantity=item.quantity,
+            origin_state=origin_state,
+            destination_state=destination_state,
+            calculated_at=datetime.utcnow()
+        )
+        
+        # Calcular cada imposto
+        self._calculate_icms(
+            calculation, product_tax, base_value, 
+            icms_rate, customer_exemptions
+        )
+        self._calculate_pis(
+            calculation, product_tax, base_value, customer_exemptions
+        )
+        self._calculate_cofins(
+            calculation, product_tax, base_value, customer_exemptions
+        )
+        self._calculate_ipi(
+            calculation, product_tax, base_value, customer_exemptions
+        )
+        
+        # Total de impostos
+        calculation.total_tax_amount = (
+            calculation.icms_amount + calculation.pis_amount +
+            calculation.cofins_amount + calculation.ipi_amount
+        )
+        
+        # Metadados do cálculo
+        calculation.calculation_data = json.dumps({
+            'product_name': product.name,
+            'product_sku': product.sku,
+            'ncm_code': (product_tax.ncm.code 
+                        if product_tax.ncm else None),
+            'cfop_code': cfop.code,
+            'customer_type': (customer.customer_type 
+                             if customer else 'individual'),
+            'exemptions_applied': [ex.tax_type for ex in customer_exemptions],
+            'calculation_method': 'brazilian_tax_libs',
+            'timestamp': calculation.calculated_at.isoformat()
+        })
+        
+        return calculation
+    
     def _calculate_icms(
         self,
         calculation: TaxCalculation,
         product_tax: ProductTax,
         base_value: Decimal,
-        origin_state: str,
-        destination_state: str,
+        icms_rate: Decimal,
         exemptions: List[TaxExemption]
     ):
         """Calcula ICMS baseado nas regras brasileiras"""
@@ -279,9 +435,6 @@ class TaxCalculationService:
             calculation.icms_amount = Decimal('0')
             return
         
-        # Obter alíquota ICMS
-        icms_rate = self._get_icms_rate(origin_state, destination_state)
-        
         if icms_exemption and icms_exemption.exemption_type == 'reduced_rate':
             icms_rate = icms_exemption.reduced_rate or Decimal('0.00')
         
@@ -419,15 +572,10 @@ class TaxCalculationService:
         destination_state: str
     ) -> Decimal:
         """Obtém alíquota ICMS baseada nos estados"""
-        # Buscar alíquota na tabela ICMS
-        icms_rate_obj = self.db.query(ICMSRate).filter(
-            ICMSRate.origin_state == origin_state,
-            ICMSRate.destination_state == destination_state,
-            ICMSRate.is_active == True
-        ).first()
-        
-        if icms_rate_obj:
-            return icms_rate_obj.rate
+        # Buscar alíquota na matriz ICMS (tabela do banco pré-carregada)
+        rate = icms_rate_table.rates(self.db).get((origin_state, destination_state))
+        if rate is not None:
+            return rate
         
         # Usar alíquotas padrão da calculadora
         state_pair = (origin_state, destination_state)
@@ -455,6 +603,25 @@ class TaxCalculationService:
         
         return cfop_code
     
+    def _get_cfop(self, code: str) -> CFOPCode:
+        """Obtém o CFOP pelo código, criando os CFOPs de venda se não existirem"""
+        cfop = self._cfops.get(code)
+        if cfop is not None:
+            return cfop
+        
+        cfop = self.db.query(CFOPCode).filter(CFOPCode.code == code).first()
+        if not cfop:
+            cfop = CFOPCode(
+                code=code,
+                description=self.calculator.SALE_CFOP_CODES[code],
+                state_operation=code.startswith('5')
+            )
+            self.db.add(cfop)
+            self.db.flush()
+        
+        self._cfops[code] = cfop
+        return cfop
+    
     def _get_customer_exemptions(
         self,
         customer: Customer,
@@ -486,8 +653,10 @@ class TaxCalculationService:
     
     def _extract_customer_state(self, customer: Customer) -> str:
         """Extrai estado do endereço do cliente"""
+        if customer.address_state:
+            return customer.address_state
         try:
-            if customer.address:
+            if getattr(customer, 'address', None):
                 address_data = json.loads(customer.address)
                 return address_data.get("state", "SP")
         except (json.JSONDecodeError, KeyError):
@@ -608,4 +777,34 @@ class TaxCalculationService:
                 return {'valid': False, 'error': 'Documento deve ter 11 ou 14 dígitos'}
                 
         except Exception as e:
-            return {'valid': False, 'error': f'Erro na validação: {str(e)}'}
\ No newline at end of file
+            return {'valid': False, 'error': f'Erro na validação: {str(e)}'}
+
+
+# ----------------------------------------------------------------------
+# Invalidação da matriz ICMS
+# Alterações em ICMSRate via ORM publicam nova versão após o commit.
+# ----------------------------------------------------------------------
+
+def _mark_icms_rates_changed(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info["icms_rates_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_icms_after_commit(session):
+    if session.info.pop("icms_rates_changed", False):
+        try:
+            icms_rate_table.invalidate()
+        except Exception as e:
+            logger.warning(f"Falha ao invalidar matriz ICMS: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_icms_after_rollback(session):
+    session.info.pop("icms_rates_changed", None)
+
+
+event.listen(ICMSRate, "after_insert", _mark_icms_rates_changed)
+event.listen(ICMSRate, "after_update", _mark_icms_rates_changed)
+event.listen(ICMSRate, "after_delete", _mark_icms_rates_changed)
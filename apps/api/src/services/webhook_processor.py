@@ -1,17 +1,62 @@
 """
 Processador de webhooks para Mestres do Café Enterprise API
-Gerencia webhooks do Mercado Pago e outros serviços
+Webhooks do Mercado Pago e do Melhor Envio são gravados na tabela
+payment_webhooks (caixa de entrada durável, idempotente pelo id do evento no
+provedor) e a requisição é respondida em seguida. Um pool de workers esvazia a
+fila com concorrência limitada, novas tentativas com backoff exponencial e
+dead-letter (status "dead") depois de WEBHOOK_MAX_ATTEMPTS falhas.
+
+A entrega aos handlers é "pelo menos uma vez": um evento cujo worker morreu no
+meio do processamento é retomado, então os handlers devem ser idempotentes.
 """
 
+import hashlib
 import json
 import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
 from enum import Enum
-from typing import Dict, Any, Tuple, Optional
-from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, inspect, or_, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from database import db
+from models.payments import PaymentWebhook
 
 # Logger básico
 logger = logging.getLogger('webhook_processor')
 
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 4))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 6))
+
+RETRY_BASE_DELAY = timedelta(seconds=30)
+RETRY_MAX_DELAY = timedelta(hours=1)
+# Eventos "processing" sem conclusão há mais tempo que isso são retomados
+PROCESSING_STALE_AFTER = timedelta(minutes=5)
+WORKER_POLL_INTERVAL = 5
+THROUGHPUT_WINDOW = 60  # segundos
+
+# Colunas da fila que tabelas payment_webhooks criadas antes dela não têm
+QUEUE_COLUMNS = ('event_id', 'status', 'attempts', 'next_attempt_at', 'locked_at')
+# Preenchimento das linhas antigas: eventos já processados ficam "processed" e
+# os que falharam no processamento síncrono vão para o dead-letter, em vez de
+# rodar de novo nos handlers atuais
+QUEUE_BACKFILL = (
+    "UPDATE payment_webhooks SET event_id = 'legacy:' || CAST(id AS VARCHAR(36)) "
+    "WHERE event_id IS NULL",
+    "UPDATE payment_webhooks SET status = CASE WHEN processed THEN 'processed' ELSE 'dead' END "
+    "WHERE status IS NULL",
+    "UPDATE payment_webhooks SET attempts = 0 WHERE attempts IS NULL",
+    "UPDATE payment_webhooks SET next_attempt_at = COALESCE(created_at, CURRENT_TIMESTAMP) "
+    "WHERE next_attempt_at IS NULL",
+)
+
 
 class WebhookProvider(Enum):
     """
@@ -21,31 +66,439 @@ class WebhookProvider(Enum):
     MELHOR_ENVIO = "melhor_envio"
 
 
-class WebhookProcessor:
+# Prefixo das chaves que identificam o recurso e não a notificação (IPN legado)
+RESOURCE_KEY_PREFIX = 'mp-ipn:'
+
+
+def _ipn_resource(data: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+    """(tópico, id do recurso) de uma notificação IPN legada do Mercado Pago"""
+    topic = data.get('topic') or data.get('type')
+    resource = data.get('resource') or data.get('id')
+    if not topic or resource is None or isinstance(resource, (dict, list)):
+        return None
+    # "resource" pode ser a URL do recurso (".../v1/payments/123")
+    return str(topic), str(resource).rstrip('/').rsplit('/', 1)[-1]
+
+
+def webhook_event_id(
+    provider: WebhookProvider,
+    data: Dict[str, Any],
+    delivery_id: Optional[str] = None,
+) -> str:
     """
-    Processador robusto de webhooks
-    Versão simplificada funcional para desenvolvimento
+    Chave de idempotência do evento
+
+    Notificações do Mercado Pago (v2) trazem o id da notificação, repetido nas
+    reentregas; sem ele vale o id da entrega enviado pelo provedor
+    (x-request-id). O IPN legado sem esse id repete o mesmo corpo a cada
+    mudança de status do pagamento, então é chaveado por tópico + recurso e
+    reprocessado a cada nova notificação (ver WebhookProcessor.enqueue). Nos
+    demais casos (Melhor Envio) usa o hash do payload canônico.
     """
+    if provider == WebhookProvider.MERCADO_PAGO and data.get('id') is not None \
+            and isinstance(data.get('data'), dict):
+        return f"mp:{data['id']}"
+
+    if delivery_id:
+        return f"delivery:{delivery_id}"[:150]
+
+    if provider == WebhookProvider.MERCADO_PAGO:
+        resource = _ipn_resource(data)
+        if resource is not None:
+            return f"{RESOURCE_KEY_PREFIX}{resource[0]}:{resource[1]}"[:150]
+
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return f"sha256:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Backoff exponencial a partir de RETRY_BASE_DELAY, limitado a RETRY_MAX_DELAY"""
+    return min(RETRY_BASE_DELAY * (2 ** max(attempts - 1, 0)), RETRY_MAX_DELAY)
+
+
+class WebhookMetrics:
+    """Contadores e vazão por provedor (em memória, por processo)"""
+
+    OUTCOMES = ('received', 'duplicates', 'processed', 'failed', 'dead')
+
+    def __init__(self, window: int = THROUGHPUT_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._processing_seconds: Dict[str, float] = {}
+        self._recent: deque = deque()  # (monotonic, provider) dos eventos concluídos
+
+    def record(self, provider: str, outcome: str, elapsed: Optional[float] = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            counters = self._counters.setdefault(provider, dict.fromkeys(self.OUTCOMES, 0))
+            counters[outcome] += 1
+            if elapsed is not None:
+                self._processing_seconds[provider] = self._processing_seconds.get(provider, 0.0) + elapsed
+            if outcome == 'processed':
+                self._recent.append((now, provider))
+            self._trim(now)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            recent: Dict[str, int] = {}
+            for _, provider in self._recent:
+                recent[provider] = recent.get(provider, 0) + 1
+
+            result = {}
+            for provider, counters in self._counters.items():
+                handled = counters['processed'] + counters['failed'] + counters['dead']
+                seconds = self._processing_seconds.get(provider, 0.0)
+                result[provider] = dict(
+                    counters,
+                    processed_last_minute=round(recent.get(provider, 0) * 60 / self.window, 2),
+                    avg_processing_ms=round(seconds * 1000 / handled, 2) if handled else None,
+                )
+            return result
+
+    def _trim(self, now: float) -> None:
+        while self._recent and self._recent[0][0] < now - self.window:
+            self._recent.popleft()
+
+
+class WebhookProcessor:
+    """Caixa de entrada de webhooks e pool de workers em background"""
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS, max_attempts: int = WEBHOOK_MAX_ATTEMPTS):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.metrics = WebhookMetrics()
+        self._app = None
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._worker_lock = threading.Lock()
 
-    def __init__(self):
-        self.webhook_stats = {
-            'total_processed': 0,
-            'successful': 0,
-            'failed': 0
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+
+    def init_app(self, app) -> None:
+        """Registra o app e retoma eventos pendentes de execuções anteriores"""
+        self._app = app
+        with app.app_context():
+            PaymentWebhook.__table__.create(db.engine, checkfirst=True)
+            self._upgrade_schema()
+            pending = PaymentWebhook.query.filter(
+                PaymentWebhook.status.in_(('received', 'processing', 'failed'))
+            ).count()
+        if pending:
+            self.start()
+
+    def _upgrade_schema(self) -> None:
+        """
+        Atualiza uma tabela payment_webhooks anterior à fila (idempotente)
+
+        Adiciona as colunas da fila como anuláveis, preenche as linhas
+        existentes e, no PostgreSQL, aplica o NOT NULL do modelo. A restrição
+        única (provider, event_id) e o índice da fila viram índices criados
+        com IF NOT EXISTS.
+        """
+        table = PaymentWebhook.__table__
+        engine = db.engine
+        postgres = engine.dialect.name == 'postgresql'
+        inspector = inspect(engine)
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        missing = [name for name in QUEUE_COLUMNS if name not in columns]
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        indexes.update(c['name'] for c in inspector.get_unique_constraints(table.name))
+        if not missing and {'uq_payment_webhooks_provider_event',
+                            'idx_payment_webhooks_status_next'} <= indexes:
+            return
+
+        if_not_exists = 'IF NOT EXISTS ' if postgres else ''
+        with engine.begin() as conn:
+            for name in missing:
+                column_type = table.c[name].type.compile(dialect=engine.dialect)
+                conn.execute(text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {if_not_exists}{name} {column_type}'
+                ))
+            if missing:
+                for statement in QUEUE_BACKFILL:
+                    conn.execute(text(statement))
+            if postgres:
+                # O SQLite não altera a nulidade de uma coluna existente
+                for name in missing:
+                    if not table.c[name].nullable:
+                        conn.execute(text(f'ALTER TABLE {table.name} ALTER COLUMN {name} SET NOT NULL'))
+            if 'uq_payment_webhooks_provider_event' not in indexes:
+                conn.execute(text(
+                    'CREATE UNIQUE INDEX IF NOT EXISTS uq_payment_webhooks_provider_event '
+                    'ON payment_webhooks (provider, event_id)'
+                ))
+            if 'idx_payment_webhooks_status_next' not in indexes:
+                conn.execute(text(
+                    'CREATE INDEX IF NOT EXISTS idx_payment_webhooks_status_next '
+                    'ON payment_webhooks (status, next_attempt_at)'
+                ))
+        logger.info(f"payment_webhooks atualizada para a fila (colunas adicionadas: {missing})")
+
+    def enqueue(
+        self,
+        provider: WebhookProvider,
+        event_type: str,
+        data: Dict[str, Any],
+        delivery_id: Optional[str] = None,
+    ) -> Tuple[uuid.UUID, bool]:
+        """
+        Grava o webhook na caixa de entrada (uma única inserção)
+
+        Uma notificação IPN legada de um recurso já processado volta para a
+        fila com o payload novo: o handler consulta o status atual do recurso.
+
+        Args:
+            delivery_id: Id da entrega enviado pelo provedor (x-request-id)
+
+        Returns:
+            (id do registro, True se é novo / False se é reentrega já recebida)
+        """
+        event_id = webhook_event_id(provider, data, delivery_id)
+        now = datetime.utcnow()
+        row = {
+            'id': uuid.uuid4(),
+            'provider': provider.value,
+            'event_type': (event_type or 'unknown')[:100],
+            'event_id': event_id,
+            'payload': json.dumps(data, default=str),
+            'status': 'received',
+            'attempts': 0,
+            'next_attempt_at': now,
+            'processed': False,
+            'created_at': now,
         }
-        logger.info("Processador de webhooks inicializado")
 
-    def start_processor(self) -> bool:
+        inserted = self._insert_once(row)
+        created = inserted or (event_id.startswith(RESOURCE_KEY_PREFIX) and self._rearm(row))
+        db.session.commit()
+
+        if inserted:
+            webhook_id = row['id']
+        else:
+            webhook_id = db.session.query(PaymentWebhook.id).filter_by(
+                provider=provider.value, event_id=event_id
+            ).scalar()
+
+        if created:
+            self.metrics.record(provider.value, 'received')
+            self.start()
+            self._wakeup.set()
+        else:
+            self.metrics.record(provider.value, 'duplicates')
+            logger.info(f"Webhook {provider.value} duplicado ignorado: {event_id}")
+
+        return webhook_id, created
+
+    def _rearm(self, row: Dict[str, Any]) -> bool:
         """
-        Inicia o processador de webhooks
+        Devolve à fila o evento já concluído de um recurso (IPN legado)
+
+        Eventos ainda na fila não mudam: o handler ainda vai consultar o
+        recurso e verá o status novo.
         """
+        result = db.session.execute(
+            update(PaymentWebhook)
+            .where(
+                PaymentWebhook.provider == row['provider'],
+                PaymentWebhook.event_id == row['event_id'],
+                PaymentWebhook.status.in_(('processed', 'dead')),
+            )
+            .values(
+                status='received', attempts=0, next_attempt_at=row['next_attempt_at'],
+                processed=False, locked_at=None, event_type=row['event_type'], payload=row['payload'],
+            )
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    def requeue(self, webhook_id) -> bool:
+        """Devolve à fila um evento em dead-letter ou aguardando nova tentativa"""
+        result = db.session.execute(
+            update(PaymentWebhook)
+            .where(
+                PaymentWebhook.id == _as_uuid(webhook_id),
+                PaymentWebhook.status.in_(('dead', 'failed')),
+            )
+            .values(status='received', attempts=0, next_attempt_at=datetime.utcnow(), locked_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if result.rowcount != 1:
+            return False
+        self.start()
+        self._wakeup.set()
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Métricas do processo e profundidade da fila por provedor e status"""
+        queue: Dict[str, Dict[str, int]] = {}
+        for provider, status, count in (
+            db.session.query(PaymentWebhook.provider, PaymentWebhook.status, func.count(PaymentWebhook.id))
+            .filter(PaymentWebhook.status.in_(('received', 'processing', 'failed', 'dead')))
+            .group_by(PaymentWebhook.provider, PaymentWebhook.status)
+        ):
+            queue.setdefault(provider, {})[status] = count
+
+        return {
+            'workers': self.workers,
+            'max_attempts': self.max_attempts,
+            'queue': queue,
+            'providers': self.metrics.snapshot(),
+        }
+
+    def start(self) -> None:
+        """Inicia o pool de workers (uma vez por processo)"""
+        if self._app is None:
+            from flask import current_app
+            self._app = current_app._get_current_object()
+
+        with self._worker_lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for index in range(len(self._threads), self.workers):
+                thread = threading.Thread(
+                    target=self._worker_loop, name=f"webhook-worker-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def process_pending(self) -> int:
+        """Processa todos os eventos disponíveis no contexto atual; retorna quantos rodaram"""
+        processed = 0
+        while True:
+            webhook_id = self._claim_next()
+            if webhook_id is None:
+                return processed
+            self._process(webhook_id)
+            processed += 1
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def _worker_loop(self) -> None:
+        with self._app.app_context():
+            while True:
+                try:
+                    self.process_pending()
+                except Exception as e:
+                    logger.error(f"Erro no worker de webhooks: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+                self._wakeup.wait(WORKER_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def _insert_once(self, row: Dict[str, Any]) -> bool:
+        """INSERT ignorando conflito em (provider, event_id); True se inseriu"""
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            result = db.session.execute(
+                insert(PaymentWebhook).values(**row)
+                .on_conflict_do_nothing(index_elements=['provider', 'event_id'])
+            )
+            return result.rowcount == 1
+
         try:
-            logger.info("Processador de webhooks iniciado")
+            with db.session.begin_nested():
+                db.session.add(PaymentWebhook(**row))
             return True
-        except Exception as e:
-            logger.error(f"Erro ao iniciar processador: {str(e)}")
+        except IntegrityError:
             return False
 
+    def _claim_next(self) -> Optional[uuid.UUID]:
+        """Reserva o próximo evento disponível com compare-and-set"""
+        now = datetime.utcnow()
+        candidates = (
+            db.session.query(PaymentWebhook.id, PaymentWebhook.status, PaymentWebhook.attempts)
+            .filter(
+                or_(
+                    and_(
+                        PaymentWebhook.status.in_(('received', 'failed')),
+                        PaymentWebhook.next_attempt_at <= now,
+                    ),
+                    and_(
+                        PaymentWebhook.status == 'processing',
+                        PaymentWebhook.locked_at < now - PROCESSING_STALE_AFTER,
+                    ),
+                )
+            )
+            .order_by(PaymentWebhook.next_attempt_at)
+            .limit(self.workers)
+            .all()
+        )
+
+        for candidate in candidates:
+            result = db.session.execute(
+                update(PaymentWebhook)
+                .where(
+                    PaymentWebhook.id == candidate.id,
+                    PaymentWebhook.status == candidate.status,
+                    PaymentWebhook.attempts == candidate.attempts,
+                )
+                .values(status='processing', locked_at=now, attempts=candidate.attempts + 1)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            if result.rowcount == 1:
+                return candidate.id
+            # Outro worker reservou primeiro; tenta o próximo candidato
+        return None
+
+    def _process(self, webhook_id: uuid.UUID) -> None:
+        webhook = db.session.get(PaymentWebhook, webhook_id)
+        db.session.refresh(webhook)
+        provider_value = webhook.provider
+        started = time.monotonic()
+
+        try:
+            handler = WEBHOOK_HANDLERS.get(WebhookProvider(provider_value))
+            if handler is None:
+                result = {'success': False, 'error': f'Provedor {provider_value} não implementado'}
+            else:
+                result = handler(webhook.event_type, json.loads(webhook.payload), str(webhook.id))
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro no processamento do webhook {webhook_id}: {str(e)}")
+            result = {'success': False, 'error': f"Erro interno: {str(e)}"}
+
+        webhook = db.session.get(PaymentWebhook, webhook_id)
+        now = datetime.utcnow()
+        webhook.locked_at = None
+
+        if result.get('success'):
+            outcome = 'processed'
+            webhook.status = 'processed'
+            webhook.processed = True
+            webhook.processed_at = now
+            webhook.processing_error = None
+        elif webhook.attempts >= self.max_attempts:
+            outcome = 'dead'
+            webhook.status = 'dead'
+            webhook.processing_error = result.get('error')
+            logger.error(
+                f"Webhook {webhook_id} ({provider_value}) movido para dead-letter "
+                f"após {webhook.attempts} tentativas: {result.get('error')}"
+            )
+        else:
+            outcome = 'failed'
+            webhook.status = 'failed'
+            webhook.next_attempt_at = now + retry_delay(webhook.attempts)
+            webhook.processing_error = result.get('error')
+            logger.warning(
+                f"Webhook {webhook_id} ({provider_value}) falhou na tentativa "
+                f"{webhook.attempts}: {result.get('error')}"
+            )
+
+        db.session.commit()
+        self.metrics.record(provider_value, outcome, time.monotonic() - started)
+
 
 def validate_webhook_request(
     provider: WebhookProvider,
@@ -60,68 +513,30 @@ def validate_webhook_request(
         # Validação básica de IP
         if not client_ip:
             return False, "IP do cliente não fornecido"
-        
+
         # Validação de payload
         if not raw_payload:
             return False, "Payload vazio"
-        
+
         # Para Mercado Pago, validar assinatura
         if provider == WebhookProvider.MERCADO_PAGO:
             if not signature:
                 logger.warning("Webhook Mercado Pago sem assinatura")
-            
+
             # Verificar se é JSON válido
             try:
                 json.loads(raw_payload)
             except json.JSONDecodeError:
                 return False, "Payload não é JSON válido"
-        
+
         logger.info(f"Webhook de {provider.value} validado")
         return True, None
-        
+
     except Exception as e:
         logger.error(f"Erro na validação do webhook: {str(e)}")
         return False, f"Erro de validação: {str(e)}"
 
 
-def process_webhook_robust(
-    provider: WebhookProvider,
-    event_type: str,
-    notification_data: Dict[str, Any],
-    signature: str
-) -> Dict[str, Any]:
-    """
-    Processa webhook de forma robusta
-    """
-    try:
-        webhook_id = f"wh_{datetime.now().timestamp():.0f}"
-        
-        logger.info(f"Processando webhook {webhook_id}: "
-                   f"{provider.value} - {event_type}")
-        
-        # Processar baseado no provedor
-        if provider == WebhookProvider.MERCADO_PAGO:
-            result = _process_mercado_pago_webhook(
-                event_type, notification_data, webhook_id
-            )
-        else:
-            result = {
-                'success': False,
-                'error': f'Provedor {provider.value} não implementado'
-            }
-        
-        webhook_processor.webhook_stats['total_processed'] += 1
-        
-        return result
-        
-    except Exception as e:
-        logger.error(f"Erro no processamento robusto: {str(e)}")
-        return {
-            'success': False,
-            'error': f"Erro interno: {str(e)}"
-        }
-
-
 def _process_mercado_pago_webhook(
     event_type: str,
     data: Dict[str, Any],
@@ -134,16 +549,16 @@ def _process_mercado_pago_webhook(
         # Extrair informações do webhook
         topic = data.get('topic', data.get('type', 'unknown'))
         resource_id = data.get('id', data.get('data', {}).get('id'))
-        
+
         logger.info(f"Webhook MP {webhook_id}: "
                    f"Topic: {topic}, Resource: {resource_id}")
-        
+
         return {
             'success': True,
             'message': f'Webhook {topic} processado',
             'webhook_id': webhook_id
         }
-        
+
     except Exception as e:
         logger.error(f"Erro no processamento do webhook MP: {str(e)}")
         return {
@@ -152,5 +567,38 @@ def _process_mercado_pago_webhook(
         }
 
 
+def _process_melhor_envio_webhook(
+    event_type: str,
+    data: Dict[str, Any],
+    webhook_id: str
+) -> Dict[str, Any]:
+    """
+    Processa webhook de atualização de envio do Melhor Envio
+    """
+    from services.melhor_envio_service import MelhorEnvioService
+
+    return MelhorEnvioService().process_webhook(data)
+
+
+WEBHOOK_HANDLERS: Dict[WebhookProvider, Callable[[str, Dict[str, Any], str], Dict[str, Any]]] = {
+    WebhookProvider.MERCADO_PAGO: _process_mercado_pago_webhook,
+    WebhookProvider.MELHOR_ENVIO: _process_melhor_envio_webhook,
+}
+
+
+def _as_uuid(value) -> Optional[uuid.UUID]:
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
 # Instância global do processador
-webhook_processor = WebhookProcessor()
\ No newline at end of file
+webhook_processor = WebhookProcessor()
+
+
+def init_webhook_processor(app) -> None:
+    """Registra o app no processador de webhooks"""
+    webhook_processor.init_app(app)
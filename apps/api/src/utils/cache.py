@@ -1,10 +1,17 @@
 import json
+import os
 import pickle
 import hashlib
-from datetime import datetime, timedelta
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
 from functools import wraps
 from flask import current_app
-from typing import Any, Optional, Union, Dict, List
+from typing import Any, Callable, Optional, Union, Dict, List, Set
+import uuid
 
 # Optional Redis import - fallback to in-memory cache if not available
 try:
@@ -14,13 +21,290 @@ except ImportError:
     redis = None
     REDIS_AVAILABLE = False
 
+# Limites padrão do cache local (podem ser sobrescritos por variáveis de ambiente)
+LOCAL_CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_LOCAL_MAX_ENTRIES', 10000))
+LOCAL_CACHE_MAX_BYTES = int(os.environ.get('CACHE_LOCAL_MAX_BYTES', 64 * 1024 * 1024))
+LOCAL_CACHE_SWEEP_INTERVAL = int(os.environ.get('CACHE_LOCAL_SWEEP_INTERVAL', 60))
+
+# Near-cache (L1) do processo usado pelo decorator @cached
+NEAR_CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_NEAR_MAX_ENTRIES', 2000))
+NEAR_CACHE_MAX_BYTES = int(os.environ.get('CACHE_NEAR_MAX_BYTES', 16 * 1024 * 1024))
+NEAR_CACHE_TIMEOUT = 5  # segundos; limita a defasagem entre workers
+
+# Intervalo mínimo entre tentativas de reconexão ao Redis
+REDIS_RETRY_INTERVAL = 30
+
+# Invalidação por tags: cada entrada registra sua chave em conjuntos "tag:<nome>"
+TAG_SET_TTL = 86400  # os conjuntos vivem pelo menos tanto quanto suas entradas
+INVALIDATION_BATCH_SIZE = 500  # chaves por pipeline/SCAN
+LOCAL_TAG_PRUNE_THRESHOLD = 1000  # poda membros expirados das tags em memória
+
+_GLOB_CHARS = '*?['
+
+
+class LocalCache:
+    """
+    Cache local em memória com LRU + TTL
+    Limitado por quantidade de entradas e por bytes; entradas expiradas são
+    removidas por um sweeper em background. Um índice por prefixo (segmentos
+    separados por ':') permite invalidar padrões como 'product:123:*' em O(matches).
+    """
+
+    def __init__(self, max_entries: int = LOCAL_CACHE_MAX_ENTRIES,
+                 max_bytes: int = LOCAL_CACHE_MAX_BYTES,
+                 sweep_interval: int = LOCAL_CACHE_SWEEP_INTERVAL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+
+        # key -> (value, expires_at monotonic, size)
+        self._data: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._prefix_index: Dict[str, Set[str]] = {}
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+        self._sweeper: Optional[threading.Thread] = None
+        self._sweeper_pid: Optional[int] = None
+        self._stop_event = threading.Event()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: str):
+        return self.exists(key)
+
+    @staticmethod
+    def _estimate_size(key: str, value: Any) -> int:
+        if isinstance(value, (str, bytes)):
+            return len(key) + len(value)
+        return len(key) + sys.getsizeof(value)
+
+    @staticmethod
+    def _key_prefixes(key: str) -> List[str]:
+        """'mc:product:1:details' -> ['mc:', 'mc:product:', 'mc:product:1:']"""
+        prefixes = []
+        position = key.find(':')
+        while position != -1:
+            prefixes.append(key[:position + 1])
+            position = key.find(':', position + 1)
+        return prefixes
+
+    def _index_add(self, key: str) -> None:
+        for prefix in self._key_prefixes(key):
+            self._prefix_index.setdefault(prefix, set()).add(key)
+
+    def _index_remove(self, key: str) -> None:
+        for prefix in self._key_prefixes(key):
+            members = self._prefix_index.get(prefix)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self._prefix_index[prefix]
+
+    def _remove_locked(self, key: str) -> bool:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= entry[2]
+        self._index_remove(key)
+        return True
+
+    def _evict_locked(self) -> None:
+        while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+            oldest_key = next(iter(self._data))
+            self._remove_locked(oldest_key)
+            self.evictions += 1
+
+    def get(self, key: str) -> Any:
+        """Obtém valor (None se ausente ou expirado) e o marca como recente"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[1] <= time.monotonic():
+                self._remove_locked(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value: Any, timeout: int = 300, size: Optional[int] = None) -> bool:
+        """
+        Define valor com TTL em segundos
+
+        Args:
+            size: Bytes ocupados pela entrada. Sem ele, objetos que não são
+                str/bytes são medidos de forma rasa (sys.getsizeof), o que não
+                conta o conteúdo de dicts e listas
+        """
+        entry_size = size if size is not None else self._estimate_size(key, value)
+        if entry_size > self.max_bytes:
+            return False
+
+        with self._lock:
+            self._remove_locked(key)
+            self._index_add(key)
+            self._data[key] = (value, time.monotonic() + timeout, entry_size)
+            self._bytes += entry_size
+            self._evict_locked()
+
+        self._ensure_sweeper()
+        return True
+
+    def add(self, key: str, value: Any, timeout: int = 300) -> bool:
+        """Define valor somente se a chave não existir (equivalente a SET NX)"""
+        with self._lock:
+            if self.exists(key):
+                return False
+            return self.set(key, value, timeout)
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._remove_locked(key)
+
+    def compare_and_delete(self, key: str, expected: Any) -> bool:
+        """Remove a chave somente se o valor atual for o esperado"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] != expected:
+                return False
+            return self._remove_locked(key)
+
+    def exists(self, key: str) -> bool:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False
+            if entry[1] <= time.monotonic():
+                self._remove_locked(key)
+                self.expirations += 1
+                return False
+            return True
+
+    def keys_matching(self, pattern: str) -> List[str]:
+        """Chaves que casam com um padrão glob (estilo Redis KEYS)"""
+        with self._lock:
+            wildcard = min((pattern.find(c) for c in _GLOB_CHARS if c in pattern), default=-1)
+            if wildcard == -1:
+                return [pattern] if pattern in self._data else []
+
+            literal = pattern[:wildcard]
+            boundary = literal[:literal.rfind(':') + 1]
+            candidates = self._prefix_index.get(boundary, set()) if boundary else self._data.keys()
+
+            if pattern == literal + '*':
+                if literal == boundary:
+                    return list(candidates)
+                return [key for key in candidates if key.startswith(literal)]
+            return [key for key in candidates if fnmatchcase(key, pattern)]
+
+    def delete_pattern(self, pattern: str) -> int:
+        """Remove as chaves que casam com o padrão glob"""
+        with self._lock:
+            keys = self.keys_matching(pattern)
+            for key in keys:
+                self._remove_locked(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._prefix_index.clear()
+            self._bytes = 0
+
+    def sweep(self) -> int:
+        """Remove entradas expiradas"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self._data.items() if entry[1] <= now]
+            for key in expired:
+                self._remove_locked(key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    def _ensure_sweeper(self) -> None:
+        """Inicia o sweeper sob demanda (e novamente após fork do worker)"""
+        if self.sweep_interval <= 0:
+            return
+        if self._sweeper is not None and self._sweeper_pid == os.getpid() and self._sweeper.is_alive():
+            return
+
+        with self._lock:
+            if self._sweeper is not None and self._sweeper_pid == os.getpid() and self._sweeper.is_alive():
+                return
+            self._stop_event = threading.Event()
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='local-cache-sweeper', daemon=True)
+            self._sweeper_pid = os.getpid()
+            self._sweeper.start()
+
+    def _sweep_loop(self) -> None:
+        stop_event = self._stop_event
+        while not stop_event.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception:
+                pass
+
+    def stop_sweeper(self) -> None:
+        self._stop_event.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'keys_count': len(self._data),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups * 100, 2) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _log_cache_error(message: str) -> None:
+    """Loga erros do cache quando houver app context"""
+    try:
+        if current_app:
+            current_app.logger.error(message)
+    except RuntimeError:
+        pass
+
+
 class CacheManager:
     """Gerenciador de cache com Redis"""
 
     def __init__(self, redis_url: str = None):
         self.redis_url = redis_url or 'redis://localhost:6379'
         self._redis_client = None
-        self._fallback_cache = {}  # Cache em memória como fallback
+        self._redis_retry_at = 0.0
+        self._fallback_cache = LocalCache()  # Cache em memória como fallback
+        self._near_cache = LocalCache(  # L1 do processo para @cached
+            max_entries = NEAR_CACHE_MAX_ENTRIES,
+            max_bytes = NEAR_CACHE_MAX_BYTES
+        )
+        self._local_tags: Dict[str, Set[str]] = {}  # Tags do cache em memória
+        self._tags_lock = threading.Lock()
+        self._invalidation_stats: Dict[str, Dict[str, float]] = {}
+        self._stats_lock = threading.Lock()
 
     @property
     def redis_client(self):
@@ -29,6 +313,9 @@ class CacheManager:
             return None
 
         if self._redis_client is None:
+            # Evita tentar reconectar (com timeout de conexão) a cada chamada
+            if time.monotonic() < self._redis_retry_at:
+                return None
             try:
                 # Try to get the Redis URL from app config if available
                 redis_url = self.redis_url
@@ -58,6 +345,7 @@ class CacheManager:
                     # No application context, just continue with fallback
                     pass
                 self._redis_client = None
+                self._redis_retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
         return self._redis_client
 
     def _generate_key(self, key: str, prefix: str = "mc") -> str:
@@ -85,14 +373,34 @@ class CacheManager:
             except Exception:
                 return value
 
-    def set(self, key: str, value: Any, timeout: int = 300) -> bool:
-        """Define valor no cache"""
+    def _tag_key(self, tag: str) -> str:
+        return self._generate_key(f"tag:{tag}")
+
+    def set(self, key: str, value: Any, timeout: int = 300, tags: Optional[List[str]] = None) -> bool:
+        """
+        Define valor no cache
+
+        Args:
+            tags: Tags da entrada (ex.: "product:<id>"); invalidate_tags remove
+                todas as entradas registradas em uma tag sem varrer o keyspace
+        """
         cache_key = self._generate_key(key)
-        serialized_value = self._serialize_value(value)
+        return self._set_serialized(cache_key, self._serialize_value(value), timeout, tags)
 
+    def _set_serialized(self, cache_key: str, serialized_value: str, timeout: int,
+                        tags: Optional[List[str]]) -> bool:
         if self.redis_client:
             try:
-                return self.redis_client.setex(cache_key, timeout, serialized_value)
+                if not tags:
+                    return self.redis_client.setex(cache_key, timeout, serialized_value)
+
+                pipe = self.redis_client.pipeline(transaction = False)
+                pipe.setex(cache_key, timeout, serialized_value)
+                for tag in tags:
+                    tag_key = self._tag_key(tag)
+                    pipe.sadd(tag_key, cache_key)
+                    pipe.expire(tag_key, max(timeout, TAG_SET_TTL))
+                return bool(pipe.execute()[0])
             except Exception as e:
                 try:
                     from flask import current_app
@@ -102,21 +410,34 @@ class CacheManager:
                     pass
 
         # Fallback para cache em memória
-        self._fallback_cache[cache_key] = {
-            'value': serialized_value,
-            'expires_at': datetime.now() + timedelta(seconds = timeout)
-        }
-        return True
+        if tags:
+            self._add_local_tags(cache_key, tags)
+        return self._fallback_cache.set(cache_key, serialized_value, timeout)
+
+    def _add_local_tags(self, cache_key: str, tags: List[str]) -> None:
+        with self._tags_lock:
+            for tag in tags:
+                members = self._local_tags.setdefault(tag, set())
+                members.add(cache_key)
+                if len(members) > LOCAL_TAG_PRUNE_THRESHOLD:
+                    members.intersection_update(
+                        [member for member in members if member in self._fallback_cache]
+                    )
 
     def get(self, key: str) -> Any:
         """Obtém valor do cache"""
-        cache_key = self._generate_key(key)
+        value = self._get_serialized(self._generate_key(key))
+        if value is not None:
+            return self._deserialize_value(value)
+
+        return None
 
+    def _get_serialized(self, cache_key: str) -> Optional[str]:
         if self.redis_client:
             try:
                 value = self.redis_client.get(cache_key)
                 if value is not None:
-                    return self._deserialize_value(value)
+                    return value
             except Exception as e:
                 try:
                     from flask import current_app
@@ -126,18 +447,12 @@ class CacheManager:
                     pass
 
         # Fallback para cache em memória
-        if cache_key in self._fallback_cache:
-            cache_item = self._fallback_cache[cache_key]
-            if datetime.now() < cache_item['expires_at']:
-                return self._deserialize_value(cache_item['value'])
-            else:
-                del self._fallback_cache[cache_key]
-
-        return None
+        return self._fallback_cache.get(cache_key)
 
     def delete(self, key: str) -> bool:
         """Remove valor do cache"""
         cache_key = self._generate_key(key)
+        self._near_cache.delete(cache_key)
 
         if self.redis_client:
             try:
@@ -151,10 +466,7 @@ class CacheManager:
                     pass
 
         # Fallback para cache em memória
-        if cache_key in self._fallback_cache:
-            del self._fallback_cache[cache_key]
-            return True
-        return False
+        return self._fallback_cache.delete(cache_key)
 
     def exists(self, key: str) -> bool:
         """Verifica se chave existe no cache"""
@@ -172,22 +484,96 @@ class CacheManager:
                     pass
 
         # Fallback para cache em memória
-        if cache_key in self._fallback_cache:
-            cache_item = self._fallback_cache[cache_key]
-            if datetime.now() < cache_item['expires_at']:
-                return True
-            else:
-                del self._fallback_cache[cache_key]
+        return self._fallback_cache.exists(cache_key)
+
+    def _unlink_batches(self, keys) -> int:
+        """Remove chaves do Redis em lotes pipelined (UNLINK não bloqueia o servidor)"""
+        deleted = 0
+        batch = []
+        for key in keys:
+            batch.append(key)
+            if len(batch) >= INVALIDATION_BATCH_SIZE:
+                deleted += self._unlink_batch(batch)
+                batch = []
+        if batch:
+            deleted += self._unlink_batch(batch)
+        return deleted
+
+    def _unlink_batch(self, batch: List[Any]) -> int:
+        pipe = self.redis_client.pipeline(transaction = False)
+        for key in batch:
+            pipe.unlink(key)
+            self._near_cache.delete(key.decode() if isinstance(key, bytes) else key)
+        return sum(pipe.execute())
+
+    def _record_invalidation(self, kind: str, started: float, keys: int) -> None:
+        """Registra duração da invalidação (exposta em get_stats)"""
+        duration_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            stats = self._invalidation_stats.setdefault(
+                kind, {'count': 0, 'keys': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0}
+            )
+            stats['count'] += 1
+            stats['keys'] += keys
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            stats['last_ms'] = duration_ms
+
+    def invalidation_stats(self) -> Dict[str, Dict[str, float]]:
+        """Métricas de duração das invalidações por tipo (tags/pattern)"""
+        with self._stats_lock:
+            return {
+                kind: dict(stats, avg_ms = stats['total_ms'] / stats['count'] if stats['count'] else 0.0)
+                for kind, stats in self._invalidation_stats.items()
+            }
+
+    def invalidate_tags(self, *tags: str) -> int:
+        """Remove todas as entradas registradas nas tags informadas"""
+        started = time.perf_counter()
+        deleted = 0
+
+        if self.redis_client:
+            try:
+                for tag in tags:
+                    tag_key = self._tag_key(tag)
+                    members = self.redis_client.sscan_iter(tag_key, count = INVALIDATION_BATCH_SIZE)
+                    deleted += self._unlink_batches(members)
+                    self.redis_client.unlink(tag_key)
+                self._record_invalidation('tags', started, deleted)
+                return deleted
+            except Exception as e:
+                _log_cache_error(f"Redis invalidate_tags error: {e}")
+
+        # Fallback para cache em memória
+        with self._tags_lock:
+            members = set()
+            for tag in tags:
+                members.update(self._local_tags.pop(tag, ()))
+        for cache_key in members:
+            self._near_cache.delete(cache_key)
+            deleted += int(self._fallback_cache.delete(cache_key))
 
-        return False
+        self._record_invalidation('tags', started, deleted)
+        return deleted
 
     def clear_pattern(self, pattern: str) -> int:
-        """Remove todas as chaves que correspondem ao padrão"""
+        """
+        Remove todas as chaves que correspondem ao padrão
+
+        Usa SCAN incremental (nunca KEYS) para padrões legados; prefira
+        invalidate_tags para entradas registradas com tags.
+        """
+        started = time.perf_counter()
+        self._near_cache.delete_pattern(self._generate_key(pattern))
+
         if self.redis_client:
             try:
-                keys = self.redis_client.keys(self._generate_key(pattern))
-                if keys:
-                    return self.redis_client.delete(*keys)
+                keys = self.redis_client.scan_iter(
+                    match = self._generate_key(pattern), count = INVALIDATION_BATCH_SIZE
+                )
+                deleted = self._unlink_batches(keys)
+                self._record_invalidation('pattern', started, deleted)
+                return deleted
             except Exception as e:
                 try:
                     from flask import current_app
@@ -197,17 +583,71 @@ class CacheManager:
                     pass
 
         # Fallback para cache em memória
-        count = 0
-        keys_to_delete = []
-        for key in self._fallback_cache:
-            if pattern in key:
-                keys_to_delete.append(key)
+        deleted = self._fallback_cache.delete_pattern(self._generate_key(pattern))
+        self._record_invalidation('pattern', started, deleted)
+        return deleted
 
-        for key in keys_to_delete:
-            del self._fallback_cache[key]
-            count += 1
+    def add(self, key: str, value: Any, timeout: int = 300) -> bool:
+        """Define valor somente se a chave não existir (SET NX)"""
+        cache_key = self._generate_key(key)
+        serialized_value = self._serialize_value(value)
+
+        if self.redis_client:
+            try:
+                return bool(self.redis_client.set(cache_key, serialized_value, ex = timeout, nx = True))
+            except Exception as e:
+                _log_cache_error(f"Redis add error: {e}")
 
-        return count
+        return self._fallback_cache.add(cache_key, serialized_value, timeout)
+
+    def acquire_lock(self, name: str, timeout: int = 10) -> Optional[str]:
+        """
+        Adquire um lock compartilhado entre workers
+
+        Returns:
+            str: Token do lock (para liberar) ou None se outro processo o detém
+        """
+        token = uuid.uuid4().hex
+        return token if self.add(f"lock:{name}", token, timeout) else None
+
+    def release_lock(self, name: str, token: str) -> None:
+        """Libera o lock somente se ainda pertencer ao token informado"""
+        cache_key = self._generate_key(f"lock:{name}")
+        serialized_token = self._serialize_value(token)
+
+        if self.redis_client:
+            try:
+                self.redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, cache_key, serialized_token)
+                return
+            except Exception as e:
+                _log_cache_error(f"Redis release_lock error: {e}")
+
+        self._fallback_cache.compare_and_delete(cache_key, serialized_token)
+
+    def get_layered(self, key: str) -> Any:
+        """Lê primeiro do near-cache (L1) e depois do cache compartilhado (L2)"""
+        cache_key = self._generate_key(key)
+        value = self._near_cache.get(cache_key)
+        if value is not None:
+            return value
+
+        serialized_value = self._get_serialized(cache_key)
+        if serialized_value is None:
+            return None
+        value = self._deserialize_value(serialized_value)
+        # O tamanho serializado é o que limita o near-cache (NEAR_CACHE_MAX_BYTES)
+        self._near_cache.set(cache_key, value, NEAR_CACHE_TIMEOUT,
+                             size = len(cache_key) + len(serialized_value))
+        return value
+
+    def set_layered(self, key: str, value: Any, timeout: int = 300,
+                    near_timeout: int = NEAR_CACHE_TIMEOUT, tags: Optional[List[str]] = None) -> bool:
+        """Grava no cache compartilhado (L2) e no near-cache (L1)"""
+        cache_key = self._generate_key(key)
+        serialized_value = self._serialize_value(value)
+        self._near_cache.set(cache_key, value, min(near_timeout, timeout),
+                             size = len(cache_key) + len(serialized_value))
+        return self._set_serialized(cache_key, serialized_value, timeout, tags)
 
     def get_stats(self) -> Dict[str, Any]:
         """Obtém estatísticas do cache"""
@@ -220,7 +660,9 @@ class CacheManager:
                     'used_memory': info.get('used_memory_human', 'N/A'),
                     'keyspace_hits': info.get('keyspace_hits', 0),
                     'keyspace_misses': info.get('keyspace_misses', 0),
-                    'keys_count': self.redis_client.dbsize()
+                    'keys_count': self.redis_client.dbsize(),
+                    'near': self._near_cache.get_stats(),
+                    'invalidation': self.invalidation_stats()
                 }
             except Exception as e:
                 try:
@@ -230,79 +672,284 @@ class CacheManager:
                 except RuntimeError:
                     pass
 
+        local_stats = self._fallback_cache.get_stats()
         return {
             'type': 'memory',
-            'keys_count': len(self._fallback_cache),
-            'memory_usage': 'N/A'
+            'keys_count': local_stats['keys_count'],
+            'memory_usage': local_stats['bytes'],
+            'local': local_stats,
+            'near': self._near_cache.get_stats(),
+            'invalidation': self.invalidation_stats()
         }
 
+
 # Instância global do cache
 cache_manager = CacheManager()
 
-def cache_set(key: str, value: Any, timeout: int = 300) -> bool:
+
+def cache_set(key: str, value: Any, timeout: int = 300, tags: Optional[List[str]] = None) -> bool:
     """Função utilitária para definir cache"""
-    return cache_manager.set(key, value, timeout)
+    return cache_manager.set(key, value, timeout, tags = tags)
+
 
 def cache_get(key: str) -> Any:
     """Função utilitária para obter cache"""
     return cache_manager.get(key)
 
+
 def cache_delete(key: str) -> bool:
     """Função utilitária para deletar cache"""
     return cache_manager.delete(key)
 
+
 def cache_exists(key: str) -> bool:
     """Função utilitária para verificar existência"""
     return cache_manager.exists(key)
 
+
 def cache_clear_pattern(pattern: str) -> int:
     """Função utilitária para limpar padrão"""
     return cache_manager.clear_pattern(pattern)
 
-def cached(timeout: int = 300, key_prefix: str = ""):
-    """Decorator para cache automático de funções"""
+
+def cache_invalidate_tags(*tags: str) -> int:
+    """Função utilitária para invalidar entradas por tag"""
+    return cache_manager.invalidate_tags(*tags)
+
+
+class _SingleFlight:
+    """Garante que apenas uma thread do processo recalcule cada chave"""
+
+    class _Call:
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, '_SingleFlight._Call'] = {}
+
+    def do(self, key: str, fn: Callable[[], Any], wait_timeout: float = 30) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            if call.event.wait(wait_timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            return fn()
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+
+_single_flight = _SingleFlight()
+
+# Tempo máximo que um worker espera outro terminar de recalcular a mesma chave
+CACHED_LOCK_WAIT = 5.0
+CACHED_LOCK_POLL = 0.05
+
+
+def make_cache_key(func: Callable, args: tuple, kwargs: dict, key_prefix: str = "") -> str:
+    """Gera chave estável para uma chamada de função"""
+    try:
+        payload = json.dumps([args, kwargs], sort_keys = True, default = repr)
+    except (TypeError, ValueError):
+        payload = repr((args, sorted(kwargs.items())))
+    digest = hashlib.blake2b(payload.encode(), digest_size = 16).hexdigest()
+    return f"{key_prefix}:{func.__module__}.{func.__qualname__}:{digest}"
+
+
+def cached(timeout: int = 300, key_prefix: str = "", stale_ttl: Optional[int] = None,
+           jitter: float = 0.1, near_timeout: int = NEAR_CACHE_TIMEOUT,
+           tags: Union[List[str], Callable[..., List[str]], None] = None,
+           key_args: Optional[Callable[..., Any]] = None):
+    """
+    Decorator para cache automático de funções em dois níveis
+
+    - L1: near-cache do processo (near_timeout segundos)
+    - L2: Redis (ou cache local quando Redis indisponível)
+    - Single-flight: apenas uma thread por processo, e um worker por chave
+      (lock no L2), recalcula um valor ausente
+    - Stale-while-revalidate: após `timeout`, o valor antigo continua sendo
+      servido por até `stale_ttl` segundos enquanto um único worker o recalcula
+    - Jitter: o TTL é reduzido aleatoriamente em até `jitter` para evitar que
+      muitas chaves expirem ao mesmo tempo
+    - Tags: lista fixa ou função que recebe os argumentos da chamada; as
+      entradas podem ser removidas com cache_invalidate_tags
+    - key_args: função que recebe os argumentos da chamada e devolve o que
+      identifica a entrada (padrão: todos os argumentos); chamadas com a
+      mesma identidade compartilham o resultado
+    """
+    stale_seconds = stale_ttl if stale_ttl is not None else max(30, timeout // 2)
+
     def decorator(func):
+        def call_key(args, kwargs) -> str:
+            if key_args is None:
+                return make_cache_key(func, args, kwargs, key_prefix)
+            return make_cache_key(func, (key_args(*args, **kwargs),), {}, key_prefix)
+
+        def store(cache_key: str, result: Any, entry_tags: Optional[List[str]]) -> None:
+            ttl = max(1, int(timeout * (1 - random.random() * jitter)))
+            envelope = {'value': result, 'fresh_until': time.time() + ttl}
+            cache_manager.set_layered(cache_key, envelope, ttl + stale_seconds, near_timeout, tags = entry_tags)
+
+        def compute_and_store(cache_key: str, args, kwargs) -> Any:
+            result = func(*args, **kwargs)
+            entry_tags = tags(*args, **kwargs) if callable(tags) else tags
+            store(cache_key, result, list(entry_tags) if entry_tags else None)
+            return result
+
+        def load(cache_key: str, args, kwargs) -> Any:
+            # Outra thread pode ter preenchido o cache enquanto esperávamos
+            envelope = cache_manager.get_layered(cache_key)
+            if isinstance(envelope, dict) and 'fresh_until' in envelope:
+                return envelope['value']
+
+            token = cache_manager.acquire_lock(cache_key, timeout = int(CACHED_LOCK_WAIT) + 1)
+            if token is None:
+                # Outro worker está calculando: aguardar o resultado no L2
+                deadline = time.monotonic() + CACHED_LOCK_WAIT
+                while time.monotonic() < deadline:
+                    time.sleep(CACHED_LOCK_POLL)
+                    envelope = cache_manager.get(cache_key)
+                    if isinstance(envelope, dict) and 'fresh_until' in envelope:
+                        return envelope['value']
+                return compute_and_store(cache_key, args, kwargs)
+
+            try:
+                return compute_and_store(cache_key, args, kwargs)
+            finally:
+                cache_manager.release_lock(cache_key, token)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # Gerar chave única baseada na função e argumentos
-            func_signature = f"{func.__module__}.{func.__name__}"
-            args_signature = hashlib.md5(str(args).encode()).hexdigest()
-            kwargs_signature = hashlib.md5(str(sorted(kwargs.items())).encode()).hexdigest()
+            cache_key = call_key(args, kwargs)
 
-            cache_key = f"{key_prefix}:{func_signature}:{args_signature}:{kwargs_signature}"
+            envelope = cache_manager.get_layered(cache_key)
+            if isinstance(envelope, dict) and 'fresh_until' in envelope:
+                if envelope['fresh_until'] > time.time():
+                    return envelope['value']
 
-            # Tentar obter do cache
-            cached_result = cache_get(cache_key)
-            if cached_result is not None:
-                return cached_result
+                # Valor vencido: apenas quem obtiver o lock recalcula, os demais servem o antigo
+                token = cache_manager.acquire_lock(cache_key, timeout = int(CACHED_LOCK_WAIT) + 1)
+                if token is None:
+                    return envelope['value']
+                try:
+                    return compute_and_store(cache_key, args, kwargs)
+                except Exception as e:
+                    _log_cache_error(f"Cache refresh error for {cache_key}: {e}")
+                    return envelope['value']
+                finally:
+                    cache_manager.release_lock(cache_key, token)
 
-            # Executar função e cachear resultado
-            result = func(*args, **kwargs)
-            cache_set(cache_key, result, timeout)
+            return _single_flight.do(cache_key, lambda: load(cache_key, args, kwargs))
 
-            return result
+        def invalidate(*args, **kwargs) -> bool:
+            """Remove do cache o resultado de uma chamada específica"""
+            return cache_delete(call_key(args, kwargs))
+
+        def refresh(*args, **kwargs) -> Any:
+            """Recalcula a entrada antes de vencer (pré-aquecimento); None se outro worker já o faz"""
+            cache_key = call_key(args, kwargs)
+            token = cache_manager.acquire_lock(cache_key, timeout = int(CACHED_LOCK_WAIT) + 1)
+            if token is None:
+                return None
+            try:
+                return compute_and_store(cache_key, args, kwargs)
+            finally:
+                cache_manager.release_lock(cache_key, token)
+
+        wrapper.invalidate = invalidate
+        wrapper.refresh = refresh
         return wrapper
     return decorator
 
+
 def cache_key_for_user(user_id: Union[int, str], key: str) -> str:
     """Gera chave de cache específica para usuário"""
     return f"user:{user_id}:{key}"
 
+
 def cache_key_for_session(session_id: str, key: str) -> str:
     """Gera chave de cache específica para sessão"""
     return f"session:{session_id}:{key}"
 
+
 def cache_key_for_product(product_id: Union[int, str], key: str) -> str:
     """Gera chave de cache específica para produto"""
     return f"product:{product_id}:{key}"
 
+
+def _entity_id(entity_id: Union[int, str]) -> str:
+    """Normaliza ids UUID (com ou sem hífens) para que as tags coincidam"""
+    try:
+        return uuid.UUID(str(entity_id)).hex
+    except ValueError:
+        return str(entity_id)
+
+
+def user_tag(user_id: Union[int, str]) -> str:
+    """Tag das entradas de cache de um usuário"""
+    return f"user:{_entity_id(user_id)}"
+
+
+def product_tag(product_id: Union[int, str]) -> str:
+    """Tag das entradas de cache de um produto"""
+    return f"product:{_entity_id(product_id)}"
+
+
+CATALOG_TAG = "catalog"
+
+
+def _entity_id_forms(entity_id: Union[int, str]) -> List[str]:
+    """Formas do id que podem aparecer em chaves gravadas sem tag"""
+    forms = [str(entity_id)]
+    try:
+        parsed = uuid.UUID(str(entity_id))
+    except ValueError:
+        return forms
+    for form in (str(parsed), parsed.hex):
+        if form not in forms:
+            forms.append(form)
+    return forms
+
+
+def _invalidate_entity_cache(prefix: str, tag: str, entity_id: Union[int, str]) -> int:
+    # Chaves gravadas sem tag (cache_set direto) só saem pelo padrão
+    removed = cache_invalidate_tags(tag)
+    for form in _entity_id_forms(entity_id):
+        removed += cache_clear_pattern(f"{prefix}:{form}:*")
+    return removed
+
+
 def invalidate_user_cache(user_id: Union[int, str]) -> int:
     """Invalida todo o cache de um usuário"""
-    return cache_clear_pattern(f"user:{user_id}:*")
+    return _invalidate_entity_cache("user", user_tag(user_id), user_id)
+
 
 def invalidate_product_cache(product_id: Union[int, str]) -> int:
     """Invalida todo o cache de um produto"""
-    return cache_clear_pattern(f"product:{product_id}:*")
+    return _invalidate_entity_cache("product", product_tag(product_id), product_id)
+
+
+def invalidate_catalog_cache() -> int:
+    """Invalida listagens do catálogo (categorias, destaques) cacheadas com @cached"""
+    return cache_invalidate_tags(CATALOG_TAG)
+
 
 class CacheWarmup:
     """Classe para pré-aquecer cache com dados frequentemente acessados"""
@@ -318,7 +965,7 @@ class CacheWarmup:
 
             for product in popular_products:
                 cache_key = cache_key_for_product(product.id, "details")
-                cache_set(cache_key, product.to_dict(), timeout = 3600)  # 1 hora
+                cache_set(cache_key, product.to_dict(), timeout = 3600, tags = [product_tag(product.id)])  # 1 hora
 
             current_app.logger.info(f"Cached {len(popular_products)} popular products")
 
@@ -378,6 +1025,7 @@ class CacheWarmup:
             except RuntimeError:
                 pass
 
+
 def init_cache_warmup():
     """Inicializa pré-aquecimento do cache"""
     warmup = CacheWarmup()
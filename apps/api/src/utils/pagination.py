@@ -1,5 +1,11 @@
+import base64
+import json
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
 from flask import request, url_for
 from typing import Any, Dict, List, Optional, Union
+from sqlalchemy import text, tuple_
 from sqlalchemy.orm import Query
 from math import ceil
 
@@ -231,6 +237,205 @@ def create_pagination_response(pagination_result: PaginationResult,
 
     return temp_result.to_dict(endpoint = endpoint, **kwargs)
 
+
+class InvalidCursor(ValueError):
+    """Token de cursor malformado ou de outra ordenação"""
+
+
+def _encode_value(value: Any) -> List[Any]:
+    if isinstance(value, datetime):
+        return ['dt', value.isoformat()]
+    if isinstance(value, date):
+        return ['d', value.isoformat()]
+    if isinstance(value, uuid.UUID):
+        return ['u', str(value)]
+    if isinstance(value, Decimal):
+        return ['n', str(value)]
+    return ['v', value]
+
+
+def _decode_value(encoded: List[Any]) -> Any:
+    kind, value = encoded
+    if kind == 'dt':
+        return datetime.fromisoformat(value)
+    if kind == 'd':
+        return date.fromisoformat(value)
+    if kind == 'u':
+        return uuid.UUID(value)
+    if kind == 'n':
+        return Decimal(value)
+    return value
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """Token opaco com os valores da chave de ordenação (sort_key, id)"""
+    payload = json.dumps([_encode_value(value) for value in values], separators = (',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str, size: int = 2) -> List[Any]:
+    """
+    Decodifica um token gerado por encode_cursor
+
+    Raises:
+        InvalidCursor: token inválido
+    """
+    try:
+        payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = [_decode_value(item) for item in json.loads(payload)]
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Cursor inválido: {e}")
+    if len(values) != size:
+        raise InvalidCursor("Cursor inválido: chave de ordenação diferente")
+    return values
+
+
+class CursorPaginationResult:
+    """Resultado de paginação por cursor (keyset)"""
+
+    def __init__(self, items: List[Any], per_page: int, has_next: bool, has_prev: bool,
+                 next_cursor: Optional[str] = None, prev_cursor: Optional[str] = None,
+                 estimated_total: Optional[int] = None):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.estimated_total = estimated_total
+
+    def pagination_dict(self) -> Dict[str, Any]:
+        """Bloco "pagination" da resposta"""
+        return {
+            'mode': 'cursor',
+            'per_page': self.per_page,
+            'has_next': self.has_next,
+            'has_prev': self.has_prev,
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+            'estimated_total': self.estimated_total
+        }
+
+    def to_dict(self, serializer_func: Optional[callable] = None) -> Dict[str, Any]:
+        """Converte resultado para dicionário"""
+        items = [serializer_func(item) for item in self.items] if serializer_func else self.items
+        return {'items': items, 'pagination': self.pagination_dict()}
+
+
+def estimate_count(query: Query) -> Optional[int]:
+    """
+    Total estimado pelo planejador do PostgreSQL (EXPLAIN), sem COUNT(*)
+
+    Returns:
+        int ou None quando não há estatísticas (outros bancos ou erro)
+    """
+    session = query.session
+    bind = session.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return None
+    try:
+        compiled = query.order_by(None).statement.compile(
+            dialect = bind.dialect, compile_kwargs = {'literal_binds': True}
+        )
+        # Savepoint: um EXPLAIN com erro (timeout, tipo sem literal) não pode
+        # abortar a transação da requisição
+        with session.begin_nested():
+            plan = session.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    except Exception:
+        return None
+
+
+def paginate_keyset(query: Query, sort_column, id_column, descending: bool = True,
+                    after: str = None, before: str = None, per_page: int = None,
+                    max_per_page: int = 100, default_per_page: int = 20,
+                    with_estimate: bool = False) -> CursorPaginationResult:
+    """
+    Pagina uma query por cursor sobre (sort_column, id_column)
+
+    Cada página é um range scan no índice de (sort_column, id): não há OFFSET
+    nem COUNT(*), então páginas profundas custam o mesmo que a primeira. A
+    query não deve ter ORDER BY próprio e sort_column não deve ser nulo.
+
+    Args:
+        query: Query SQLAlchemy (com filtros, sem ordenação)
+        sort_column: Coluna de ordenação (ex.: Order.created_at)
+        id_column: Desempate único (ex.: Order.id)
+        descending: Mais recentes primeiro
+        after: Token da página seguinte (next_cursor)
+        before: Token da página anterior (prev_cursor)
+        per_page: Itens por página
+        with_estimate: Incluir total estimado pelo planejador
+
+    Returns:
+        CursorPaginationResult
+
+    Raises:
+        InvalidCursor: token inválido
+    """
+    if per_page is None:
+        per_page = request.args.get('per_page', default_per_page, type = int)
+    per_page = min(max(1, per_page), max_per_page)
+
+    # Paginando para trás a ordenação é invertida e a página é desvirada no fim
+    backwards = before is not None and after is None
+    reverse = descending != backwards
+    key = tuple_(sort_column, id_column)
+
+    page_query = query
+    token = before if backwards else after
+    if token:
+        cursor = tuple_(*decode_cursor(token))
+        page_query = page_query.filter(key < cursor if reverse else key > cursor)
+
+    if reverse:
+        page_query = page_query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        page_query = page_query.order_by(sort_column.asc(), id_column.asc())
+
+    rows = page_query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    if backwards:
+        items.reverse()
+
+    def cursor_for(item) -> str:
+        return encode_cursor([getattr(item, sort_column.key), getattr(item, id_column.key)])
+
+    has_next = has_more if not backwards else True
+    has_prev = bool(after) if not backwards else has_more
+
+    return CursorPaginationResult(
+        items = items,
+        per_page = per_page,
+        has_next = has_next and bool(items),
+        has_prev = has_prev and bool(items),
+        next_cursor = cursor_for(items[-1]) if has_next and items else None,
+        prev_cursor = cursor_for(items[0]) if has_prev and items else None,
+        estimated_total = estimate_count(query) if with_estimate else None
+    )
+
+
+def get_cursor_params() -> Dict[str, Any]:
+    """
+    Parâmetros de paginação por cursor da requisição
+
+    Returns:
+        Dict com after, before e with_estimate; vazio se a requisição usa páginas
+    """
+    after = request.args.get('after')
+    before = request.args.get('before')
+    if not after and not before and request.args.get('pagination') != 'cursor':
+        return {}
+    return {
+        'after': after or None,
+        'before': before or None,
+        'with_estimate': request.args.get('estimate', 'false').lower() == 'true'
+    }
+
+
 class PaginationHelper:
     """Classe helper para paginação com configurações personalizadas"""
 
@@ -258,6 +463,23 @@ class PaginationHelper:
             default_per_page = self.default_per_page
         )
 
+    def paginate_keyset(self, query: Query, sort_column, id_column, descending: bool = True,
+                        after: str = None, before: str = None, per_page: int = None,
+                        with_estimate: bool = False) -> CursorPaginationResult:
+        """Pagina query por cursor com configurações da instância"""
+        return paginate_keyset(
+            query = query,
+            sort_column = sort_column,
+            id_column = id_column,
+            descending = descending,
+            after = after,
+            before = before,
+            per_page = per_page,
+            max_per_page = self.max_per_page,
+            default_per_page = self.default_per_page,
+            with_estimate = with_estimate
+        )
+
     def get_pagination_params(self) -> Dict[str, int]:
         """Obtém parâmetros com configurações da instância"""
         return get_pagination_params(
@@ -0,0 +1,51 @@
+"""
+Apoio aos testes que rodam em SQLite
+App Flask mínima com apenas as tabelas usadas pelo teste; o JSONB do Postgres
+é compilado como JSON
+"""
+
+import contextlib
+import os
+import tempfile
+
+from flask import Flask
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+
+from database import db
+import models  # noqa: F401 - registra todos os mappers
+import models.melhor_envio  # noqa: F401 - Order referencia estes modelos por nome
+
+
+@compiles(JSONB, 'sqlite')
+def _jsonb_sqlite(type_, compiler, **kw):
+    return 'JSON'
+
+
+@contextlib.contextmanager
+def sqlite_app(tabelas, em_arquivo=False, engine_options=None):
+    """
+    App com as `tabelas` criadas, dentro de um app_context
+
+    Use `em_arquivo` quando várias conexões (threads, pools) precisam enxergar
+    os mesmos dados; o banco em memória é por conexão.
+    """
+    db_fd, db_path = tempfile.mkstemp() if em_arquivo else (None, None)
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}' if em_arquivo else 'sqlite://'
+    if engine_options:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+    db.init_app(app)
+
+    try:
+        with app.app_context():
+            db.metadata.create_all(db.engine, tables=tabelas)
+            try:
+                yield app
+            finally:
+                db.session.remove()
+                db.metadata.drop_all(db.engine, tables=tabelas)
+    finally:
+        if em_arquivo:
+            os.close(db_fd)
+            os.unlink(db_path)
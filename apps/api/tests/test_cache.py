@@ -0,0 +1,236 @@
+"""
+Testes do cache em dois níveis
+@cached serve do near-cache (L1) e do cache compartilhado (L2), recalcula
+cada chave uma vez por vez e serve o valor vencido enquanto outro recalcula;
+invalidações por tag e por padrão, com e sem Redis; o cache local é
+limitado por entradas e bytes (LRU), com TTL e índice por prefixo
+"""
+
+import threading
+import time
+import uuid
+from fnmatch import fnmatchcase
+
+import pytest
+
+import utils.cache
+from utils.cache import (
+    CATALOG_TAG, CacheManager, LocalCache, cache_clear_pattern, cache_get, cache_key_for_product, cache_set, cached,
+    invalidate_catalog_cache, invalidate_product_cache, make_cache_key, product_tag,
+)
+
+
+class CacheFalso(CacheManager):
+    """Sem Redis, o L2 é o cache em memória do processo"""
+
+    def __init__(self, redis=None):
+        super().__init__()
+        self.redis = redis
+
+    @property
+    def redis_client(self):
+        return self.redis
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = CacheFalso()
+    monkeypatch.setattr(utils.cache, 'cache_manager', cache)
+    return cache
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    """time.time controlado pelo teste (validade das entradas de @cached)"""
+    agora = [time.time()]
+    monkeypatch.setattr(utils.cache.time, 'time', lambda: agora[0])
+    return agora
+
+
+def contador(atraso=0, **opcoes):
+    """Função cacheada que conta quantas vezes foi executada"""
+    chamadas = []
+
+    @cached(jitter=0, **opcoes)
+    def funcao(valor):
+        chamadas.append(valor)
+        time.sleep(atraso)
+        return {'valor': valor, 'execucao': len(chamadas)}
+
+    return funcao, chamadas
+
+
+def chave(funcao, *args):
+    return utils.cache.cache_manager._generate_key(make_cache_key(funcao.__wrapped__, args, {}))
+
+
+def test_l1_e_l2(cache):
+    funcao, chamadas = contador(timeout=60)
+    assert funcao(1) == funcao(1) == {'valor': 1, 'execucao': 1}
+    assert funcao(2)['execucao'] == 2
+
+    # Sem o L2 o valor continua no L1 do processo
+    cache._fallback_cache.delete(chave(funcao, 1))
+    assert funcao(1)['execucao'] == 1
+
+    # Sem o L1 o valor volta do L2 e repovoa o L1
+    funcao(3)
+    cache._near_cache.delete(chave(funcao, 3))
+    assert funcao(3)['execucao'] == 3 and chave(funcao, 3) in cache._near_cache
+    assert len(chamadas) == 3
+
+    # invalidate remove dos dois níveis
+    funcao.invalidate(3)
+    assert funcao(3)['execucao'] == 4
+
+
+def test_chamadas_simultaneas_calculam_uma_vez(cache):
+    funcao, chamadas = contador(atraso=0.2, timeout=60)
+    resultados = []
+    threads = [threading.Thread(target=lambda: resultados.append(funcao(1))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(chamadas) == 1
+    assert resultados == [{'valor': 1, 'execucao': 1}] * 8
+
+
+def test_valor_vencido_servido_durante_recalculo(cache, relogio):
+    funcao, chamadas = contador(timeout=60, stale_ttl=120)
+    funcao(1)
+
+    # Vencido com outro worker recalculando: serve o valor antigo
+    relogio[0] += 61
+    token = cache.acquire_lock(make_cache_key(funcao.__wrapped__, (1,), {}))
+    assert funcao(1)['execucao'] == 1 and len(chamadas) == 1
+
+    # Com o lock livre, quem encontra o valor vencido recalcula
+    cache.release_lock(make_cache_key(funcao.__wrapped__, (1,), {}), token)
+    assert funcao(1)['execucao'] == 2
+    assert funcao(1)['execucao'] == 2
+
+    # refresh recalcula antes de vencer
+    assert funcao.refresh(1)['execucao'] == 3
+
+
+class RedisFalso:
+    """Comandos usados pela gravação com tags e pelas invalidações"""
+
+    def __init__(self):
+        self.valores = {}
+        self.conjuntos = {}
+        self.comandos = []
+
+    def get(self, chave):
+        return self.valores.get(chave)
+
+    def setex(self, chave, ttl, valor):
+        self.valores[chave] = valor
+        return True
+
+    def sadd(self, chave, membro):
+        self.conjuntos.setdefault(chave, set()).add(membro)
+
+    def expire(self, chave, ttl):
+        return True
+
+    def unlink(self, chave):
+        self.comandos.append('unlink')
+        removido = self.valores.pop(chave, None) is not None or self.conjuntos.pop(chave, None) is not None
+        return int(removido)
+
+    def sscan_iter(self, chave, count):
+        self.comandos.append('sscan')
+        return iter(list(self.conjuntos.get(chave, ())))
+
+    def scan_iter(self, match, count):
+        self.comandos.append('scan')
+        return iter([chave for chave in list(self.valores) if fnmatchcase(chave, match)])
+
+    def keys(self, padrao):
+        raise AssertionError('KEYS bloqueia o Redis')
+
+    def pipeline(self, transaction=True):
+        return PipelineFalso(self)
+
+
+class PipelineFalso:
+    def __init__(self, redis):
+        self.redis = redis
+        self.pendentes = []
+
+    def __getattr__(self, comando):
+        return lambda *args: self.pendentes.append((getattr(self.redis, comando), args))
+
+    def execute(self):
+        return [comando(*args) for comando, args in self.pendentes]
+
+
+@pytest.mark.parametrize('com_redis', [False, True], ids=['memoria', 'redis'])
+def test_invalidacao_por_tag_e_padrao(cache, com_redis):
+    redis = cache.redis = RedisFalso() if com_redis else None
+    produto = uuid.uuid4()
+    cache_set(cache_key_for_product(produto, 'details'), {'nome': 'Café'}, tags=[product_tag(produto)])
+    cache_set(cache_key_for_product(produto, 'reviews'), [], tags=[product_tag(produto), CATALOG_TAG])
+    cache_set('product:outro:details', {'nome': 'Moedor'})
+    cache_set('categories:all', [], tags=[CATALOG_TAG])
+    # Gravada sem tag: só o padrão product:{id}:* a remove
+    cache_set(f'product:{produto}:stock', 5)
+
+    # Ids com e sem hífens dão a mesma tag
+    assert invalidate_product_cache(produto.hex.upper()) == 3
+    assert cache_get(cache_key_for_product(produto, 'details')) is None
+    assert cache_get(f'product:{produto}:stock') is None
+    assert cache_get('product:outro:details') == {'nome': 'Moedor'}
+
+    # A entrada já removida não conta de novo
+    assert invalidate_catalog_cache() == 1
+    assert cache_get('categories:all') is None
+
+    assert cache_clear_pattern('product:*') == 1
+    assert cache_get('product:outro:details') is None
+    assert cache.invalidation_stats()['tags']['count'] == 2
+    if com_redis:
+        # Um scan por forma do id (como recebido, com hífens, hex) e um do padrão explícito
+        assert redis.comandos.count('scan') == 4 and not redis.conjuntos
+
+
+def test_cache_local_lru_ttl_e_contadores():
+    local = LocalCache(max_entries=3, max_bytes=1000, sweep_interval=0)
+    for i in range(3):
+        local.set(f'mc:product:{i}:details', 'x' * 10)
+    assert local.get('mc:product:0:details') == 'x' * 10
+
+    # A menos usada recentemente sai primeiro
+    local.set('mc:product:3:details', 'x' * 10)
+    assert 'mc:product:1:details' not in local and 'mc:product:0:details' in local
+
+    # Limite de bytes: uma entrada grande expulsa as antigas; maior que o limite não entra
+    assert local.set('mc:grande', 'x' * 980)
+    assert len(local) == 1 and local.get_stats()['bytes'] <= 1000
+    assert not local.set('mc:enorme', 'x' * 2000)
+
+    # TTL vencido sai na leitura e na varredura
+    local.set('mc:vencida', 1, timeout=0)
+    local.set('mc:outra', 1, timeout=0)
+    assert local.get('mc:vencida') is None
+    assert local.sweep() == 1
+
+    estatisticas = local.get_stats()
+    assert (estatisticas['hits'], estatisticas['misses']) == (1, 1)
+    assert (estatisticas['evictions'], estatisticas['expirations']) == (5, 2)
+
+
+def test_cache_local_remove_por_padrao():
+    local = LocalCache(sweep_interval=0)
+    for chave in ('mc:user:1:perfil', 'mc:user:1:pedidos', 'mc:user:12:perfil', 'mc:product:1:details'):
+        local.set(chave, 'valor')
+
+    assert sorted(local.keys_matching('mc:user:1:*')) == ['mc:user:1:pedidos', 'mc:user:1:perfil']
+    assert sorted(local.keys_matching('mc:user:1*:perfil')) == ['mc:user:12:perfil', 'mc:user:1:perfil']
+    assert local.delete_pattern('mc:user:1:*') == 2
+    assert sorted(local._data) == ['mc:product:1:details', 'mc:user:12:perfil']
+    assert local.delete_pattern('mc:user:1:*') == 0
+    assert local._prefix_index['mc:user:'] == {'mc:user:12:perfil'}
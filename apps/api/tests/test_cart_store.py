@@ -0,0 +1,146 @@
+"""
+Testes do flush do carrinho antes do checkout
+Lock por carrinho (sem esperar o lote do worker) e falha explícita quando o
+carrinho do Redis não pode ser gravado no banco
+"""
+
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from flask_jwt_extended import JWTManager, create_access_token
+
+from database import db
+from models.auth import User
+from models.orders import Cart, CartItem
+from services import cart_store as modulo
+from services.cart_store import LOCK_NAME, CartFlushError, CartLine, CartStore
+from tests.sqlite_app import sqlite_app
+
+
+class ClienteFalso:
+    def __init__(self, sujos):
+        self.sujos = sujos
+
+    def srem(self, key, member):
+        self.sujos.discard(member)
+
+
+class BackendFalso:
+    """Carrinhos "no Redis": snapshot e conjunto de alterados"""
+
+    def __init__(self):
+        self.carrinhos = {}
+        self.sujos = set()
+        self.client = ClienteFalso(self.sujos)
+
+    def snapshot(self, user_id):
+        return self.carrinhos.get(user_id)
+
+    def pop_dirty(self, limit):
+        lote = sorted(self.sujos)[:limit]
+        self.sujos.difference_update(lote)
+        return lote
+
+    def mark_dirty(self, user_ids):
+        self.sujos.update(user_ids)
+
+
+@pytest.fixture
+def carrinho_app():
+    with sqlite_app([User.__table__, Cart.__table__, CartItem.__table__]) as app:
+        yield app
+
+
+@pytest.fixture
+def backend():
+    return BackendFalso()
+
+
+@pytest.fixture
+def loja(carrinho_app, backend, monkeypatch):
+    loja = CartStore()
+    monkeypatch.setattr(loja, '_backend', lambda: backend)
+    monkeypatch.setattr(modulo, 'LOCK_WAIT', 0.2)
+    return loja
+
+
+def linhas_no_banco(user_id):
+    return [
+        item.quantity for item in
+        CartItem.query.join(Cart, Cart.id == CartItem.cart_id).filter(Cart.user_id == user_id)
+    ]
+
+
+def test_flush_do_usuario_nao_espera_o_lote_do_worker(loja, backend):
+    usuario = uuid.uuid4()
+    backend.carrinhos[str(usuario)] = [CartLine(product_id=str(uuid.uuid4()), quantity=3)]
+    backend.sujos.add(str(usuario))
+
+    lote = modulo.cache_manager.acquire_lock(LOCK_NAME, timeout=60)
+    try:
+        assert loja.flush(usuario) == 1
+    finally:
+        modulo.cache_manager.release_lock(LOCK_NAME, lote)
+
+    assert linhas_no_banco(usuario) == [3]
+    assert str(usuario) not in backend.sujos
+
+
+def test_flush_do_usuario_falha_se_o_carrinho_estiver_ocupado(loja, backend):
+    usuario = str(uuid.uuid4())
+    backend.carrinhos[usuario] = [CartLine(product_id=str(uuid.uuid4()), quantity=1)]
+
+    ocupado = modulo.cache_manager.acquire_lock(f"{LOCK_NAME}:{usuario}", timeout=60)
+    try:
+        with pytest.raises(CartFlushError):
+            loja.flush(usuario)
+    finally:
+        modulo.cache_manager.release_lock(f"{LOCK_NAME}:{usuario}", ocupado)
+
+    # Continua marcado para o worker gravar depois
+    assert usuario in backend.sujos
+
+
+def test_erro_ao_gravar_e_propagado_e_o_lote_segue(loja, backend):
+    com_erro, ok = str(uuid.uuid4()), str(uuid.uuid4())
+    backend.carrinhos[ok] = [CartLine(product_id=str(uuid.uuid4()), quantity=2)]
+    backend.carrinhos[com_erro] = [CartLine(product_id='não é uuid', quantity=1)]
+
+    with pytest.raises(CartFlushError):
+        loja.flush(com_erro)
+    assert com_erro in backend.sujos
+
+    backend.sujos.add(ok)
+    assert loja.flush() == 1
+    assert linhas_no_banco(uuid.UUID(ok)) == [2]
+    assert backend.sujos == {com_erro}
+
+
+def test_checkout_recusa_carrinho_que_nao_foi_gravado(carrinho_app, monkeypatch):
+    from controllers.routes import checkout
+
+    carrinho_app.config['JWT_SECRET_KEY'] = 'teste'
+    JWTManager(carrinho_app)
+    carrinho_app.register_blueprint(checkout.checkout_bp)
+
+    usuario = User(id=uuid.uuid4(), email='cliente@example.com', name='Cliente')
+    db.session.add(usuario)
+    db.session.commit()
+
+    def flush_com_falha(user_id=None):
+        raise CartFlushError('ocupado')
+
+    monkeypatch.setattr(checkout.cart_store, 'flush', flush_com_falha)
+    # A rota busca o usuário pelo id em texto, que o tipo UUID do SQLite não aceita
+    monkeypatch.setattr(checkout, 'User', SimpleNamespace(
+        query=SimpleNamespace(get=lambda user_id: db.session.get(User, uuid.UUID(user_id)))
+    ))
+    token = create_access_token(identity=str(usuario.id))
+    resposta = carrinho_app.test_client().post(
+        '/api/checkout/start', json={'user_id': str(usuario.id)},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert resposta.status_code == 503
+    assert db.session.query(Cart).count() == 0
@@ -0,0 +1,105 @@
+"""
+Testes da assinatura em lote de documentos fiscais
+Cada XML do lote volta assinado com o certificado carregado, em processos
+dedicados ou no processo atual quando o pool não pode ser usado
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('signxml')
+
+from cryptography import x509  # noqa: E402
+from cryptography.hazmat.primitives import hashes, serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+from cryptography.hazmat.primitives.serialization import pkcs12  # noqa: E402
+from cryptography.x509.oid import NameOID  # noqa: E402
+from signxml import XMLVerifier  # noqa: E402
+
+from services import certificate_service  # noqa: E402
+from services.certificate_service import CertificateService  # noqa: E402
+
+NS_NFE = 'http://www.portalfiscal.inf.br/nfe'
+SENHA = b'senha-de-teste'
+
+
+def gerar_pfx():
+    """Certificado autoassinado, no formato PFX"""
+    chave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nome = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'EMPRESA TESTE:12345678000190')])
+    agora = datetime.utcnow()
+    certificado = (
+        x509.CertificateBuilder()
+        .subject_name(nome)
+        .issuer_name(nome)
+        .public_key(chave.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(agora - timedelta(days=1))
+        .not_valid_after(agora + timedelta(days=30))
+        .sign(chave, hashes.SHA256())
+    )
+    return pkcs12.serialize_key_and_certificates(
+        b'teste', chave, certificado, None, serialization.BestAvailableEncryption(SENHA)
+    )
+
+
+def nfe(numero):
+    chave = f'3524011234567800019055001{numero:09d}1000000000'
+    return (
+        f'<NFe xmlns="{NS_NFE}"><infNFe Id="NFe{chave}" versao="4.00">'
+        f'<ide><nNF>{numero}</nNF></ide></infNFe></NFe>'
+    )
+
+
+@pytest.fixture
+def servico(tmp_path):
+    servico = CertificateService(certificados_path=str(tmp_path))
+    servico.carregar_certificado_a1(gerar_pfx(), SENHA)
+    yield servico
+    servico.limpar_certificado()
+
+
+def verificar_assinaturas(servico, resultados, quantidade):
+    certificado = servico.exportar_certificado_pem()
+    assert len(resultados) == quantidade
+    for numero, resultado in enumerate(resultados, 1):
+        assert resultado.sucesso, resultado.erro
+        assert resultado.certificado_usado == servico._contexto_assinatura.thumbprint
+        verificado = XMLVerifier().verify(resultado.xml_assinado.encode(), x509_cert=certificado)
+        assert verificado.signed_xml.findtext(f'.//{{{NS_NFE}}}nNF') == str(numero)
+
+
+def test_lote_pequeno_assinado_no_processo(servico):
+    xmls = [nfe(numero) for numero in range(1, 4)]
+    verificar_assinaturas(servico, servico.assinar_lote(xmls), 3)
+
+
+def test_lote_assinado_no_pool(servico, monkeypatch):
+    monkeypatch.setattr(certificate_service, 'ASSINATURA_LOTE_MINIMO', 2)
+    xmls = [nfe(numero) for numero in range(1, 5)]
+    verificar_assinaturas(servico, servico.assinar_lote(xmls, max_processos=2), 4)
+    assert len(certificate_service.pools_assinatura) == 1
+
+    # Outra instância com o mesmo certificado usa o mesmo pool
+    outro = CertificateService(certificados_path=servico.certificados_path)
+    outro._certificado_atual = servico._certificado_atual
+    outro._chave_privada_atual = servico._chave_privada_atual
+    verificar_assinaturas(servico, outro.assinar_lote(xmls, max_processos=2), 4)
+    assert len(certificate_service.pools_assinatura) == 1
+
+    # Limpar o certificado encerra o pool ocioso
+    servico.limpar_certificado()
+    assert len(certificate_service.pools_assinatura) == 0
+
+
+def test_pool_encerrado_durante_o_lote_assina_no_processo(servico, monkeypatch):
+    # Recarregar o certificado encerra o pool em uso: submit levanta RuntimeError
+    encerrado = ProcessPoolExecutor(max_workers=1)
+    encerrado.shutdown()
+    monkeypatch.setattr(certificate_service, 'ASSINATURA_LOTE_MINIMO', 2)
+    monkeypatch.setattr(certificate_service.pools_assinatura, 'obter', lambda contexto, processos: encerrado)
+
+    xmls = [nfe(numero) for numero in range(1, 5)]
+    verificar_assinaturas(servico, servico.assinar_lote(xmls, max_processos=2), 4)
@@ -0,0 +1,167 @@
+"""
+Testes dos contadores de uso de cupons
+Reserva e devolução no Redis e reconciliação dos contadores (global e por
+cliente) com o CouponUsage
+"""
+
+import fnmatch
+import uuid
+from decimal import Decimal
+
+import pytest
+
+from database import db
+from models.coupons import Coupon, CouponUsage
+from services import coupon_service as modulo
+from services.coupon_service import COUNTER_PREFIX, CouponError, CouponService
+from tests.sqlite_app import sqlite_app
+
+
+class RedisFalso:
+    """Subconjunto do Redis usado pelo serviço; os scripts Lua viram funções"""
+
+    def __init__(self):
+        self.dados = {}
+
+    def exists(self, key):
+        return int(key in self.dados)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.dados:
+            return None
+        self.dados[key] = str(value)
+        return True
+
+    def mget(self, keys):
+        return [self.dados.get(key) for key in keys]
+
+    def scan_iter(self, match='*', count=None):
+        return [key for key in list(self.dados) if fnmatch.fnmatchcase(key, match)]
+
+    def register_script(self, source):
+        scripts = {
+            modulo._RESERVE_SCRIPT: self._reserve,
+            modulo._RELEASE_SCRIPT: self._release,
+            modulo._COMPARE_AND_SET_SCRIPT: self._compare_and_set,
+        }
+        return scripts[source]
+
+    def _reserve(self, keys, args):
+        if any(key not in self.dados for key in keys):
+            return modulo._NOT_LOADED
+        limit, customer_limit = int(args[0]), int(args[1])
+        if limit >= 0 and int(self.dados[keys[0]]) >= limit:
+            return modulo._GLOBAL_LIMIT
+        if len(keys) > 1 and customer_limit >= 0 and int(self.dados[keys[1]]) >= customer_limit:
+            return modulo._CUSTOMER_LIMIT
+        for key in keys:
+            self.dados[key] = str(int(self.dados[key]) + 1)
+        return 1
+
+    def _release(self, keys, args):
+        for key in keys:
+            if int(self.dados.get(key, '0')) > 0:
+                self.dados[key] = str(int(self.dados[key]) - 1)
+        return 1
+
+    def _compare_and_set(self, keys, args):
+        if self.dados.get(keys[0]) == str(args[0]):
+            self.dados[keys[0]] = str(args[1])
+            return 1
+        return 0
+
+
+@pytest.fixture
+def cupom_app():
+    with sqlite_app([Coupon.__table__, CouponUsage.__table__]) as app:
+        yield app
+
+
+@pytest.fixture
+def redis_falso():
+    return RedisFalso()
+
+
+@pytest.fixture
+def servico(cupom_app, redis_falso, monkeypatch):
+    servico = CouponService()
+    monkeypatch.setattr(modulo.cache_manager, 'get_layered', lambda key: None)
+    monkeypatch.setattr(modulo.cache_manager, 'set_layered', lambda *args, **kwargs: True)
+    monkeypatch.setattr(servico, '_redis', lambda: redis_falso)
+    servico._scripts = {
+        nome: redis_falso.register_script(source) for nome, source in (
+            ('reserve', modulo._RESERVE_SCRIPT),
+            ('release', modulo._RELEASE_SCRIPT),
+            ('compare_and_set', modulo._COMPARE_AND_SET_SCRIPT),
+        )
+    }
+    return servico
+
+
+@pytest.fixture
+def cupom(cupom_app):
+    cupom = Coupon(id=uuid.uuid4(), code='CAFE10', type='percentage', value=Decimal('10'),
+                   usage_limit=10, usage_limit_per_customer=1)
+    db.session.add(cupom)
+    db.session.commit()
+    return str(cupom.id)
+
+
+def chaves(cupom_id, cliente):
+    return f'{COUNTER_PREFIX}:{cupom_id}', f'{COUNTER_PREFIX}:{cupom_id}:{cliente}'
+
+
+def test_reserva_respeita_limite_por_cliente(servico, redis_falso, cupom):
+    cliente = uuid.uuid4()
+    servico.redeem('CAFE10', 100, cliente, uuid.uuid4())
+
+    with pytest.raises(CouponError, match='por cliente'):
+        servico.redeem('CAFE10', 100, cliente, uuid.uuid4())
+
+    global_, do_cliente = chaves(cupom, cliente)
+    assert (redis_falso.dados[global_], redis_falso.dados[do_cliente]) == ('1', '1')
+    assert db.session.query(CouponUsage).count() == 1
+
+
+def test_falha_ao_gravar_devolve_a_reserva(servico, redis_falso, cupom, monkeypatch):
+    cliente = uuid.uuid4()
+
+    def commit_com_falha():
+        raise RuntimeError('banco fora')
+
+    monkeypatch.setattr(modulo.db.session, 'commit', commit_com_falha)
+    with pytest.raises(RuntimeError):
+        servico.redeem('CAFE10', 100, cliente, uuid.uuid4())
+    monkeypatch.undo()
+
+    global_, do_cliente = chaves(cupom, cliente)
+    assert (redis_falso.dados[global_], redis_falso.dados[do_cliente]) == ('0', '0')
+
+
+def test_reconciliacao_desce_contador_por_cliente_de_reserva_perdida(servico, redis_falso, cupom):
+    cliente = uuid.uuid4()
+    global_, do_cliente = chaves(cupom, cliente)
+    # Processo caiu entre a reserva e a gravação do CouponUsage
+    redis_falso.dados.update({global_: '1', do_cliente: '1'})
+
+    with pytest.raises(CouponError, match='por cliente'):
+        servico.redeem('CAFE10', 100, cliente, uuid.uuid4())
+
+    # Primeira passada só marca como suspeito (pode ser um pedido em andamento)
+    assert servico.reconcile()['counters'] == 0
+    assert redis_falso.dados[do_cliente] == '1'
+
+    assert servico.reconcile()['counters'] == 2
+    assert (redis_falso.dados[global_], redis_falso.dados[do_cliente]) == ('0', '0')
+    servico.redeem('CAFE10', 100, cliente, uuid.uuid4())
+
+
+def test_reconciliacao_sobe_contador_por_cliente_abaixo_do_banco(servico, redis_falso, cupom):
+    cliente = uuid.uuid4()
+    db.session.add(CouponUsage(coupon_id=uuid.UUID(cupom), user_id=cliente, discount_amount=Decimal('1')))
+    db.session.commit()
+    global_, do_cliente = chaves(cupom, cliente)
+    redis_falso.dados.update({global_: '1', do_cliente: '0'})
+
+    assert servico.reconcile()['counters'] == 1
+    assert redis_falso.dados[do_cliente] == '1'
@@ -0,0 +1,121 @@
+"""
+Testes do dashboard administrativo
+As métricas de pedidos saem de uma consulta agrupada por dia, com o mesmo
+formato de resposta, e o cache cai quando um pedido muda
+"""
+
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+
+import utils.cache
+from database import db
+from models import CartItem, Customer, Lead, Order, OrderItem, Product, SalesRollupPendingDay, User
+from services.dashboard_service import DASHBOARD_CACHE_KEY, DashboardService
+from tests.sqlite_app import sqlite_app
+from utils.cache import CacheManager, cache_get
+
+
+class CacheFalso(CacheManager):
+    @property
+    def redis_client(self):
+        return None
+
+
+@pytest.fixture
+def dashboard_app(monkeypatch):
+    monkeypatch.setattr(utils.cache, 'cache_manager', CacheFalso())
+    tabelas = [Order.__table__, OrderItem.__table__, Customer.__table__, Lead.__table__,
+               CartItem.__table__, Product.__table__, User.__table__,
+               # Pedidos gravados marcam o dia para o rollup de vendas
+               SalesRollupPendingDay.__table__]
+    with sqlite_app(tabelas) as app:
+        yield app
+
+
+def novo_pedido(total, status, dias_atras):
+    criado = datetime.now() - timedelta(days=dias_atras, seconds=1)
+    return Order(id=uuid.uuid4(), order_number=f'MC-{uuid.uuid4().hex[:8]}', status=status,
+                 subtotal=total, total_amount=total, created_at=criado)
+
+
+@pytest.fixture
+def pedidos(dashboard_app):
+    hoje = novo_pedido(Decimal('100'), 'completed', 0)
+    pedidos = [
+        hoje,
+        novo_pedido(Decimal('50'), 'completed', 0),
+        novo_pedido(Decimal('30'), 'pending', 0),
+        novo_pedido(Decimal('70'), 'completed', 2),
+        novo_pedido(Decimal('999'), 'cancelled', 2),
+        # Fora do período de 30 dias
+        novo_pedido(Decimal('500'), 'completed', 40),
+    ]
+    itens = [
+        OrderItem(order_id=hoje.id, product_name='Café Bourbon', quantity=3,
+                  unit_price=Decimal('20'), total_price=Decimal('60')),
+        OrderItem(order_id=pedidos[3].id, product_name='Café Bourbon', quantity=1,
+                  unit_price=Decimal('20'), total_price=Decimal('20')),
+        OrderItem(order_id=pedidos[1].id, product_name='Moedor', quantity=1,
+                  unit_price=Decimal('50'), total_price=Decimal('50')),
+        # Pedido pendente não entra nos mais vendidos
+        OrderItem(order_id=pedidos[2].id, product_name='Moedor', quantity=9,
+                  unit_price=Decimal('30'), total_price=Decimal('30')),
+    ]
+    db.session.add_all([*pedidos, *itens])
+    db.session.commit()
+    return pedidos
+
+
+def test_metricas_em_uma_consulta_agrupada(pedidos):
+    comandos = []
+    event.listen(db.engine, 'before_cursor_execute', lambda _c, _cur, sql, *a: comandos.append(sql))
+    dados = DashboardService().build_dashboard()
+
+    assert len(comandos) == 3
+    assert dados['sales'] == {
+        'total_orders': 5,
+        'completed_orders': 3,
+        'pending_orders': 1,
+        'total_revenue': 220.0,
+        'avg_order_value': 220.0 / 3,
+        'conversion_rate': 60.0,
+    }
+
+    diario = dados['analytics']['daily_sales']
+    assert len(diario) == 7
+    assert diario[0] == {'date': datetime.now().strftime('%Y-%m-%d'), 'orders': 2, 'revenue': 150.0}
+    assert (diario[2]['orders'], diario[2]['revenue']) == (1, 70.0)
+    assert sum(dia['orders'] for dia in diario) == 3
+
+    assert dados['products']['top_products'] == [
+        {'name': 'Café Bourbon', 'quantity': 4, 'revenue': 80.0},
+        {'name': 'Moedor', 'quantity': 1, 'revenue': 50.0},
+    ]
+    assert dados['customers']['conversion_rate'] == 0
+    assert set(dados) == {'period', 'sales', 'customers', 'products', 'users', 'analytics'}
+
+
+def test_cache_invalidado_quando_pedido_muda(pedidos):
+    servico = DashboardService()
+    assert servico.get_dashboard()['sales']['pending_orders'] == 1
+    assert cache_get(DASHBOARD_CACHE_KEY) is not None
+
+    # Campos que não entram nas métricas mantêm o cache
+    pedidos[2].notes = 'Entregar pela manhã'
+    db.session.commit()
+    assert cache_get(DASHBOARD_CACHE_KEY) is not None
+
+    # Mudança desfeita não invalida
+    pedidos[2].status = 'completed'
+    db.session.flush()
+    db.session.rollback()
+    assert cache_get(DASHBOARD_CACHE_KEY) is not None
+
+    pedidos[2].status = 'completed'
+    db.session.commit()
+    assert cache_get(DASHBOARD_CACHE_KEY) is None
+    assert servico.get_dashboard()['sales']['pending_orders'] == 0
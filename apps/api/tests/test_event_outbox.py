@@ -0,0 +1,109 @@
+"""
+Testes da entrega transacional de eventos
+O evento segue a transação de quem emitiu (entregue só após o commit) e cada
+linha do outbox roda uma única vez nos handlers, mesmo com vários processos
+"""
+
+import uuid
+from datetime import datetime
+
+import pytest
+
+from database import db
+from models.products import Product
+from models.system import EventOutbox
+from services import event_system as modulo
+from services.event_system import EventSystem, EventType, _EventOutbox
+from tests.sqlite_app import sqlite_app
+
+
+@pytest.fixture
+def eventos_app():
+    with sqlite_app([Product.__table__, EventOutbox.__table__]) as app:
+        yield app
+
+
+def novo_sistema(app, recebidos, outbox=True):
+    """Sistema de eventos de um "processo", sem a thread do consumidor"""
+    sistema = EventSystem()
+    sistema._app = app
+    if outbox:
+        sistema._outbox = _EventOutbox(sistema, app)
+    sistema.subscribe(None, lambda evento: recebidos.append((sistema.origin, evento.data)), name='registro')
+    return sistema
+
+
+def novo_produto():
+    return Product(id=uuid.uuid4(), name='Café', slug=f'cafe-{uuid.uuid4().hex[:6]}',
+                   sku=uuid.uuid4().hex[:8], price=10, stock_quantity=5)
+
+
+def test_rollback_descarta_o_evento_do_outbox(eventos_app):
+    recebidos = []
+    sistema = novo_sistema(eventos_app, recebidos)
+
+    db.session.add(novo_produto())
+    sistema.emit(EventType.PRODUCT_CREATED, data={'n': 1})
+    db.session.rollback()
+
+    assert EventOutbox.query.count() == 0
+    assert sistema._outbox.process_pending() == 0
+    assert recebidos == []
+
+
+def test_evento_confirmado_roda_uma_vez_entre_processos(eventos_app):
+    recebidos = []
+    processo_a = novo_sistema(eventos_app, recebidos)
+    processo_b = novo_sistema(eventos_app, recebidos)
+
+    db.session.add(novo_produto())
+    processo_a.emit(EventType.PRODUCT_CREATED, data={'n': 1})
+    # Segundo evento da mesma transação
+    processo_a.emit(EventType.PRODUCT_STOCK_LOW, data={'n': 2})
+    db.session.commit()
+
+    assert processo_b._outbox.process_pending() == 2
+    assert processo_a._outbox.process_pending() == 0
+    assert recebidos == [(processo_b.origin, {'n': 1}), (processo_b.origin, {'n': 2})]
+    assert EventOutbox.query.filter(EventOutbox.processed_at.is_(None)).count() == 0
+
+
+def test_reserva_vencida_e_retomada_por_outro_processo(eventos_app):
+    recebidos = []
+    processo_a = novo_sistema(eventos_app, recebidos)
+    processo_b = novo_sistema(eventos_app, recebidos)
+
+    processo_a.emit(EventType.ORDER_CREATED, data={'n': 1})
+    # Processo A reservou a linha e caiu antes de rodar os handlers
+    linha = EventOutbox.query.one()
+    linha.claimed_by = processo_a.origin
+    linha.claimed_at = datetime.utcnow()
+    db.session.commit()
+
+    assert processo_b._outbox.process_pending() == 0
+
+    linha.claimed_at = datetime.utcnow() - modulo.OUTBOX_CLAIM_TIMEOUT * 2
+    db.session.commit()
+
+    assert processo_b._outbox.process_pending() == 1
+    assert recebidos == [(processo_b.origin, {'n': 1})]
+    assert processo_b._outbox.metrics()['reclaimed'] == 1
+
+
+def test_sem_outbox_a_entrega_espera_o_commit(eventos_app):
+    recebidos = []
+    sistema = novo_sistema(eventos_app, recebidos, outbox=False)
+
+    db.session.add(novo_produto())
+    sistema.emit(EventType.PRODUCT_CREATED, data={'n': 1})
+    assert sistema.wait_idle() and recebidos == []
+
+    db.session.rollback()
+    assert sistema.wait_idle() and recebidos == []
+
+    db.session.add(novo_produto())
+    sistema.emit(EventType.PRODUCT_CREATED, data={'n': 2})
+    db.session.commit()
+
+    assert sistema.wait_idle()
+    assert recebidos == [(sistema.origin, {'n': 2})]
@@ -0,0 +1,183 @@
+"""
+Testes do envio de campanhas de newsletter
+Servidor SMTP local mínimo: conexões reaproveitadas, personalização, recusa de
+destinatário e retomada a partir do checkpoint
+"""
+
+import email
+import socketserver
+import threading
+import uuid
+from email.header import decode_header, make_header
+
+import pytest
+from sqlalchemy import inspect, text
+
+from database import db
+from models.newsletter import NewsletterCampaign, NewsletterSubscriber, NewsletterTemplate
+from services.newsletter_delivery import CompiledTemplate, NewsletterDelivery, SMTPSettings
+from tests.sqlite_app import sqlite_app
+
+ASSINANTES = 25
+
+
+class ServidorSMTP(socketserver.ThreadingTCPServer):
+    """Servidor SMTP local que guarda as mensagens recebidas"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, recusados=()):
+        super().__init__(('127.0.0.1', 0), SessaoSMTP)
+        self.recusados = set(recusados)
+        self.mensagens = []
+        self.conexoes = 0
+        self.lock = threading.Lock()
+
+
+class SessaoSMTP(socketserver.StreamRequestHandler):
+    def responder(self, linha):
+        self.wfile.write(f'{linha}\r\n'.encode())
+
+    def handle(self):
+        servidor = self.server
+        with servidor.lock:
+            servidor.conexoes += 1
+        self.responder('220 localhost ESMTP')
+        while True:
+            linha = self.rfile.readline().decode().strip()
+            comando = linha.upper()
+            if not linha or comando == 'QUIT':
+                self.responder('221 Bye')
+                return
+            if comando.startswith('EHLO'):
+                self.responder('250-localhost')
+                self.responder('250 8BITMIME')
+            elif comando.startswith('RCPT TO:'):
+                destinatario = linha[8:].strip('<> ')
+                self.responder('550 Recusado' if destinatario in servidor.recusados else '250 OK')
+            elif comando == 'DATA':
+                self.responder('354 Fim com .')
+                dados = []
+                while True:
+                    parte = self.rfile.readline()
+                    if parte in (b'.\r\n', b''):
+                        break
+                    dados.append(parte)
+                with servidor.lock:
+                    servidor.mensagens.append(email.message_from_bytes(b''.join(dados)))
+                self.responder('250 OK')
+            else:  # HELO, MAIL FROM, RSET, NOOP
+                self.responder('250 OK')
+
+
+@pytest.fixture
+def smtp():
+    servidor = ServidorSMTP(recusados={'recusado@example.com'})
+    thread = threading.Thread(target=servidor.serve_forever, daemon=True)
+    thread.start()
+    yield servidor
+    servidor.shutdown()
+    servidor.server_close()
+
+
+@pytest.fixture
+def newsletter_app():
+    tabelas = [NewsletterSubscriber.__table__, NewsletterTemplate.__table__, NewsletterCampaign.__table__]
+    with sqlite_app(tabelas, em_arquivo=True) as app:
+        yield app
+
+
+def criar_campanha(recusado=False):
+    for i in range(ASSINANTES):
+        db.session.add(NewsletterSubscriber(
+            id=uuid.uuid4(), email=f'cliente{i}@example.com', name=f'Cliente {i}' if i % 2 else None
+        ))
+    if recusado:
+        db.session.add(NewsletterSubscriber(id=uuid.uuid4(), email='recusado@example.com'))
+    db.session.add(NewsletterSubscriber(id=uuid.uuid4(), email='saiu@example.com', status='unsubscribed'))
+
+    campanha = NewsletterCampaign(
+        id=uuid.uuid4(), name='Safra nova', subject='Olá {{name}}, café novo!',
+        html_content='<p>Oi {{ name }}</p><a href="{{unsubscribe_link}}">sair</a>',
+        status='sending', extra_data={'delivery_base_url': 'https://loja.example/'}
+    )
+    db.session.add(campanha)
+    db.session.commit()
+    return campanha.id
+
+
+def entrega(servidor):
+    envio = NewsletterDelivery(chunk_size=10, pool_size=2, rate_per_second=0)
+    envio.smtp_settings = SMTPSettings(host='127.0.0.1', port=servidor.server_address[1], use_tls=False)
+    return envio
+
+
+def assunto(mensagem):
+    return str(make_header(decode_header(mensagem['Subject'])))
+
+
+class TestCompiledTemplate:
+    def test_render_escapa_html_e_mantem_desconhecidas(self):
+        template = CompiledTemplate('<b>{{name}}</b> {{ outro }}', escape=True)
+        assert template.variables == {'name', 'outro'}
+        assert template.render({'name': '<Ana>'}) == '<b>&lt;Ana&gt;</b> {{ outro }}'
+
+
+class TestEnvioCampanha:
+    def test_envia_para_assinantes_ativos_reaproveitando_conexoes(self, newsletter_app, smtp):
+        campanha_id = criar_campanha(recusado=True)
+
+        assert entrega(smtp).process_pending() == 1
+
+        campanha = db.session.get(NewsletterCampaign, campanha_id)
+        assert campanha.status == 'sent'
+        assert (campanha.total_sent, campanha.total_failed) == (ASSINANTES, 1)
+        assert len(smtp.mensagens) == ASSINANTES
+        assert smtp.conexoes <= 2
+
+        por_destinatario = {m['To']: m for m in smtp.mensagens}
+        mensagem = por_destinatario['cliente1@example.com']
+        assert assunto(mensagem) == 'Olá Cliente 1, café novo!'
+        corpo_html = mensagem.get_payload()[1].get_payload(decode=True).decode()
+        assert 'Oi Cliente 1' in corpo_html
+        assert 'https://loja.example/api/newsletter/unsubscribe?email=cliente1%40example.com' in corpo_html
+        assert assunto(por_destinatario['cliente0@example.com']).startswith('Olá Cliente,')
+        assert 'saiu@example.com' not in por_destinatario
+
+    def test_retoma_do_checkpoint(self, newsletter_app, smtp):
+        campanha_id = criar_campanha()
+        ids = sorted(
+            s.id for s in NewsletterSubscriber.query.filter_by(status='active')
+        )
+        campanha = db.session.get(NewsletterCampaign, campanha_id)
+        campanha.delivery_cursor = str(ids[9])
+        campanha.total_sent = 10
+        db.session.commit()
+
+        entrega(smtp).process_pending()
+
+        db.session.refresh(campanha)
+        assert campanha.total_sent == ASSINANTES
+        assert len(smtp.mensagens) == ASSINANTES - 10
+
+
+def test_tabela_anterior_ao_envio_e_atualizada(newsletter_app):
+    campanha = NewsletterCampaign(id=uuid.uuid4(), name='Antiga', subject='Oi', status='sent', total_sent=3)
+    db.session.add(campanha)
+    db.session.commit()
+    campanha_id = campanha.id
+    db.session.expunge_all()
+    # Formato de newsletter_campaigns antes do envio em lotes
+    with db.engine.begin() as conn:
+        for coluna in ('total_failed', 'delivery_cursor', 'delivery_heartbeat_at'):
+            conn.execute(text(f'ALTER TABLE newsletter_campaigns DROP COLUMN {coluna}'))
+
+    envio = NewsletterDelivery()
+    envio.init_app(newsletter_app)
+    envio.init_app(newsletter_app)
+
+    colunas = {coluna['name'] for coluna in inspect(db.engine).get_columns('newsletter_campaigns')}
+    assert {'total_failed', 'delivery_cursor', 'delivery_heartbeat_at'} <= colunas
+    antiga = db.session.get(NewsletterCampaign, campanha_id)
+    assert (antiga.total_sent, antiga.total_failed, antiga.delivery_cursor) == (3, 0, None)
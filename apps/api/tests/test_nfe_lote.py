@@ -0,0 +1,173 @@
+"""
+Testes do envio de NF-e em lote
+Reserva das notas no banco antes de montar o lote e conferência na SEFAZ,
+pela chave, antes de reenviar uma nota de situação incerta
+"""
+
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from database import db
+from models.fiscal import DocumentoFiscal, EmpresaEmissora, LogComunicacaoSefaz, LoteNFe
+from services import fiscal_service
+from services.nfe_lote_service import RESERVA_VENCIDA, NFeLoteService
+from services.sefaz_service import ResultadoSefaz, ProtocoloNFe
+from tests.sqlite_app import sqlite_app
+
+
+class SefazFalsa:
+    """Lotes recebidos, retorno do recibo e situação de cada chave"""
+
+    def __init__(self):
+        self.lotes = []
+        self.recibo = None
+        self.situacoes = {}
+
+    def autorizar_lote(self, xmls, id_lote):
+        self.lotes.append(xmls)
+        return ResultadoSefaz(sucesso=True, codigo_status=103, motivo='Lote recebido',
+                              numero_recibo=str(len(self.lotes)), tempo_medio_s=1)
+
+    def consultar_recibo(self, numero_recibo):
+        return self.recibo
+
+    def consultar_protocolo(self, chave_acesso):
+        cstat = self.situacoes.get(chave_acesso, 217)
+        return ResultadoSefaz(sucesso=cstat == 100, codigo_status=cstat, motivo=f'cStat {cstat}',
+                              protocolo='135260000000001' if cstat == 100 else None)
+
+
+@pytest.fixture
+def lote_app():
+    tabelas = [EmpresaEmissora.__table__, DocumentoFiscal.__table__,
+               LoteNFe.__table__, LogComunicacaoSefaz.__table__]
+    with sqlite_app(tabelas) as app:
+        yield app
+
+
+@pytest.fixture
+def sefaz(lote_app, monkeypatch):
+    sefaz = SefazFalsa()
+    assinador = SimpleNamespace(assinar_lote_empresa=lambda empresa_id, xmls, tipo: [
+        SimpleNamespace(sucesso=True, xml_assinado=f'{xml}<Signature/>') for xml in xmls
+    ])
+    servico_fiscal = SimpleNamespace(
+        sefaz_factory=SimpleNamespace(criar_servico=lambda **kwargs: sefaz),
+        cert_manager=assinador,
+        _registrar_auditoria=lambda **kwargs: None,
+    )
+    monkeypatch.setattr(fiscal_service, 'get_fiscal_service', lambda: servico_fiscal)
+    return sefaz
+
+
+@pytest.fixture
+def empresa(lote_app):
+    empresa = EmpresaEmissora(
+        id=uuid.uuid4(), razao_social='Mestres do Café', cnpj='12345678000199',
+        cnae_principal='4721102', regime_tributario='1', logradouro='Rua A', numero='1',
+        bairro='Centro', cep='01001000', municipio='São Paulo', codigo_municipio_ibge='3550308',
+        uf='SP', codigo_uf_ibge='35', ambiente_atual='2',
+    )
+    db.session.add(empresa)
+    db.session.commit()
+    return empresa.id
+
+
+def criar_notas(empresa_id, quantidade, status='assinado', **kwargs):
+    serie_id = uuid.uuid4()
+    notas = [
+        DocumentoFiscal(
+            id=uuid.uuid4(), empresa_id=empresa_id, serie_fiscal_id=serie_id, modelo='55',
+            serie=1, numero=numero, tipo_operacao='1', ambiente='2', status=status,
+            chave_acesso=f'{numero:044d}', xml_original=f'<NFe n="{numero}"/>',
+            xml_assinado=f'<NFe n="{numero}"/><Signature/>', **kwargs
+        )
+        for numero in range(1, quantidade + 1)
+    ]
+    db.session.add_all(notas)
+    db.session.commit()
+    return [nota.chave_acesso for nota in notas]
+
+
+def situacao(chave):
+    db.session.expire_all()
+    return DocumentoFiscal.query.filter_by(chave_acesso=chave).one().status
+
+
+def lote_enviado(empresa_id, chaves):
+    lote = LoteNFe(empresa_id=empresa_id, id_lote='1', ambiente='2', status='enviado',
+                   chaves_acesso=chaves, quantidade=len(chaves), numero_recibo='1',
+                   tentativas_consulta=0, proxima_consulta_em=datetime.utcnow() - timedelta(seconds=1))
+    db.session.add(lote)
+    db.session.commit()
+    return lote.id
+
+
+def test_nota_reservada_por_outro_worker_nao_vai_no_lote(sefaz, empresa):
+    chaves = criar_notas(empresa, 3)
+    servico = NFeLoteService()
+
+    # Outro worker leu a mesma nota e a reservou primeiro
+    nota = DocumentoFiscal.query.filter_by(chave_acesso=chaves[0]).one()
+    candidato = SimpleNamespace(id=nota.id, status=nota.status, atualizado_em=nota.atualizado_em)
+    assert list(NFeLoteService()._reservar([candidato])) == [nota.id]
+    assert servico._reservar([candidato]) == {}
+
+    assert servico._enviar_pendentes() == 1
+    assert [len(xmls) for xmls in sefaz.lotes] == [2]
+    assert [situacao(chave) for chave in chaves] == ['em_lote', 'enviado', 'enviado']
+
+
+def test_lote_nao_localizado_so_reenvia_nota_que_nao_consta(sefaz, empresa):
+    autorizada, desconhecida = criar_notas(empresa, 2, status='enviado')
+    lote_id = lote_enviado(empresa, [autorizada, desconhecida])
+    sefaz.recibo = ResultadoSefaz(sucesso=False, codigo_status=106, motivo='Lote não localizado')
+    sefaz.situacoes[autorizada] = 100
+    servico = NFeLoteService()
+
+    assert servico._consultar_recibos() == 1
+    assert (situacao(autorizada), situacao(desconhecida)) == ('autorizado', 'assinado')
+    assert db.session.get(LoteNFe, lote_id).status == 'erro'
+
+    servico._enviar_pendentes()
+    assert sefaz.lotes == [['<NFe n="2"/><Signature/>']]
+
+
+def test_nota_sem_protocolo_no_lote_processado_e_conferida(sefaz, empresa):
+    com_protocolo, sem_protocolo = criar_notas(empresa, 2, status='enviado')
+    lote_id = lote_enviado(empresa, [com_protocolo, sem_protocolo])
+    sefaz.recibo = ResultadoSefaz(
+        sucesso=True, codigo_status=104, motivo='Lote processado',
+        protocolos=[ProtocoloNFe(chave_acesso=com_protocolo, codigo_status=100,
+                                 motivo='Autorizado', protocolo='135260000000002')],
+    )
+    # Consulta por chave sem resposta: a nota continua "enviado" e o lote é consultado de novo
+    sefaz.situacoes[sem_protocolo] = 0
+    servico = NFeLoteService()
+
+    servico._consultar_recibos()
+    lote = db.session.get(LoteNFe, lote_id)
+    assert (situacao(com_protocolo), situacao(sem_protocolo)) == ('autorizado', 'enviado')
+    assert lote.status == 'enviado'
+
+    sefaz.situacoes[sem_protocolo] = 100
+    lote.proxima_consulta_em = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    servico._consultar_recibos()
+
+    assert situacao(sem_protocolo) == 'autorizado'
+    assert db.session.get(LoteNFe, lote_id).status == 'processado'
+    assert sefaz.lotes == []
+
+
+def test_reserva_vencida_e_conferida_antes_de_reenviar(sefaz, empresa):
+    vencida = datetime.utcnow() - RESERVA_VENCIDA * 2
+    ja_enviada, nao_enviada = criar_notas(empresa, 2, status='em_lote', atualizado_em=vencida)
+    sefaz.situacoes[ja_enviada] = 100
+
+    assert NFeLoteService()._enviar_pendentes() == 1
+    assert (situacao(ja_enviada), situacao(nao_enviada)) == ('autorizado', 'enviado')
+    assert sefaz.lotes == [['<NFe n="2"/><Signature/>']]
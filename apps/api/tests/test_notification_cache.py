@@ -0,0 +1,124 @@
+"""
+Testes do cache de templates e destinatários de notificação
+Renderização Jinja2, envio sem leituras com cache quente e invalidação após edição
+"""
+
+import uuid
+
+import pytest
+from sqlalchemy import event
+
+from database import db
+from models.auth import User
+from models.notifications import (
+    Notification,
+    NotificationLog,
+    NotificationSubscription,
+    NotificationTemplate,
+)
+from services.notification_service import (
+    CompiledNotificationTemplate,
+    NotificationService,
+    NotificationType,
+)
+from tests.sqlite_app import sqlite_app
+
+
+class EmailFalso:
+    def __init__(self):
+        self.enviados = []
+
+    def send_email(self, to_email, subject, html_content):
+        self.enviados.append((to_email, subject, html_content))
+        return True
+
+
+@pytest.fixture
+def notificacoes_app():
+    tabelas = [
+        User.__table__, Notification.__table__, NotificationLog.__table__,
+        NotificationTemplate.__table__, NotificationSubscription.__table__,
+    ]
+    with sqlite_app(tabelas) as app:
+        yield app
+
+
+@pytest.fixture
+def cenario(notificacoes_app):
+    tipo = NotificationType.ORDER_CREATED
+    user_id = uuid.uuid4()
+    db.session.add(User(id=user_id, email='ana@example.com', password_hash='x', name='Ana'))
+    template = NotificationTemplate(
+        id=uuid.uuid4(), type=tipo.value, channel='email', active=True,
+        subject='Pedido #{{ order_id }}', template_content='Olá {{ customer_name }}',
+    )
+    db.session.add(template)
+    db.session.add(NotificationSubscription(
+        id=uuid.uuid4(), user_id=user_id, notification_type=tipo.value, email_enabled=True
+    ))
+    db.session.commit()
+
+    service = NotificationService()
+    service.email_provider = EmailFalso()
+    yield service, user_id, template, tipo
+    service.invalidate_template()
+    service.invalidate_recipient(user_id)
+
+
+def test_template_compilado_renderiza_e_usa_assunto_padrao():
+    template = CompiledNotificationTemplate('order_created', 'sms', 'v1', None, '{{ title }}: {{ metadata.codigo }}')
+    dados = {'title': 'Enviado', 'metadata': {'codigo': 'BR123'}}
+    assert template.render(dados) == 'Enviado: BR123'
+    assert template.render_subject(dados, default='Padrão') == 'Padrão'
+
+
+def test_envio_com_cache_quente_nao_le_do_banco_e_respeita_edicao(cenario):
+    service, user_id, template, tipo = cenario
+    dados = {'title': 'Novo pedido', 'content': 'ok', 'order_id': 42, 'customer_name': 'Ana'}
+
+    assert service.send_notification(user_id, tipo, dados, ['in_app', 'email'])
+
+    comandos = []
+    event.listen(db.engine, 'before_cursor_execute', lambda _c, _cur, sql, *a: comandos.append(sql))
+    assert service.send_notification(user_id, tipo, dados, ['in_app', 'email'])
+    assert service.email_provider.enviados[-1] == ('ana@example.com', 'Pedido #42', 'Olá Ana')
+    assert comandos and all(sql.lstrip().upper().startswith('INSERT') for sql in comandos)
+
+    template.template_content = 'Oi de novo, {{ customer_name }}'
+    db.session.commit()
+    service.invalidate_template(template.type, template.channel)
+
+    service.send_notification(user_id, tipo, dados, ['email'])
+    assert service.email_provider.enviados[-1][2] == 'Oi de novo, Ana'
+    assert NotificationLog.query.count() == 5
+
+
+def test_alteracao_de_contato_descarta_destinatario_em_cache(cenario):
+    service, user_id, template, tipo = cenario
+    assert service.get_recipient(user_id).email == 'ana@example.com'
+
+    usuario = db.session.get(User, user_id)
+    usuario.email = 'ana.nova@example.com'
+    db.session.flush()
+    # Antes do commit o cache continua valendo (a alteração pode ser desfeita)
+    assert service.get_recipient(user_id).email == 'ana@example.com'
+    db.session.commit()
+
+    assert service.get_recipient(user_id).email == 'ana.nova@example.com'
+
+
+def test_destinatario_lido_por_id_sem_hifens_e_invalidado(cenario):
+    service, user_id, template, tipo = cenario
+    assert service.get_recipient(user_id.hex).email == 'ana@example.com'
+
+    # Invalidação explícita (id com hífens) alcança a entrada lida pelo hex
+    db.session.execute(User.__table__.update().values(email='ana.sql@example.com'))
+    db.session.commit()
+    assert service.get_recipient(user_id.hex).email == 'ana@example.com'
+    service.invalidate_recipient(user_id)
+    assert service.load_recipients([user_id.hex])[user_id.hex].email == 'ana.sql@example.com'
+
+    # Alteração pelo ORM também
+    db.session.get(User, user_id).email = 'ana.orm@example.com'
+    db.session.commit()
+    assert service.get_recipient(user_id.hex).email == 'ana.orm@example.com'
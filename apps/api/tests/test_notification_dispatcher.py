@@ -0,0 +1,63 @@
+"""
+Testes do heartbeat dos jobs de notificação
+Um lote lento renova o heartbeat enquanto os envios terminam e para se o job
+foi retomado por outro worker
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import db
+from models.notifications import NotificationJob
+from services import notification_dispatcher as modulo
+from services.notification_dispatcher import NotificationDispatcher
+from tests.sqlite_app import sqlite_app
+
+
+@pytest.fixture
+def job_app(monkeypatch):
+    monkeypatch.setattr(modulo, 'HEARTBEAT_INTERVAL', 0.05)
+    with sqlite_app([NotificationJob.__table__]) as app:
+        yield app
+
+
+@pytest.fixture
+def job(job_app):
+    job = NotificationJob(notification_type='promotion', status='running',
+                          heartbeat_at=datetime.utcnow() - timedelta(minutes=1))
+    db.session.add(job)
+    db.session.commit()
+    return job.id, job.heartbeat_at
+
+
+def envio_lento(liberar):
+    pool = ThreadPoolExecutor(max_workers=1)
+    return pool.submit(liberar.wait, 5)
+
+
+def test_envio_lento_renova_o_heartbeat(job):
+    job_id, heartbeat_at = job
+    liberar = threading.Event()
+    threading.Timer(0.2, liberar.set).start()
+
+    NotificationDispatcher()._wait_sends(job_id, heartbeat_at, [envio_lento(liberar)])
+
+    db.session.expire_all()
+    assert db.session.get(NotificationJob, job_id).heartbeat_at > heartbeat_at
+
+
+def test_job_retomado_interrompe_o_lote(job):
+    job_id, heartbeat_at = job
+    liberar = threading.Event()
+    # Outro worker retomou o job com um heartbeat novo
+    db.session.get(NotificationJob, job_id).heartbeat_at = datetime.utcnow()
+    db.session.commit()
+
+    try:
+        with pytest.raises(modulo._JobReclaimed):
+            NotificationDispatcher()._wait_sends(job_id, heartbeat_at, [envio_lento(liberar)])
+    finally:
+        liberar.set()
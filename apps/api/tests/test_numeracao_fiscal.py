@@ -0,0 +1,279 @@
+"""
+Testes do alocador de numeração fiscal
+Reserva atômica concorrente, blocos adaptativos do PDV e conciliação de
+números não usados
+"""
+
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from database import db
+from models.fiscal import DocumentoFiscal, FaixaNumeracaoFiscal, InutilizacaoNumeracao, SerieFiscal
+from services import numeracao_fiscal_service
+from services.numeracao_fiscal_service import (
+    CONCILIACAO_ESPERA,
+    NumeracaoFiscalService,
+    NumeracaoIndisponivel,
+)
+from tests.sqlite_app import sqlite_app
+
+THREADS = 16
+RESERVAS_POR_THREAD = 25
+
+
+@pytest.fixture
+def fiscal_app():
+    """App mínima com as tabelas de numeração em um SQLite em arquivo"""
+    tabelas = [SerieFiscal.__table__, FaixaNumeracaoFiscal.__table__,
+               DocumentoFiscal.__table__, InutilizacaoNumeracao.__table__]
+    # Cada thread usa a conexão da sessão e uma do alocador
+    engine_options = {'connect_args': {'timeout': 30}, 'pool_size': THREADS * 2}
+    with sqlite_app(tabelas, em_arquivo=True, engine_options=engine_options) as app:
+        yield app
+
+
+def criar_serie(modelo='55', **kwargs):
+    serie = SerieFiscal(
+        id=uuid.uuid4(), empresa_id=uuid.uuid4(), modelo=modelo, serie=1,
+        ambiente='2', numero_atual=0, numero_maximo=999999999, is_active=True, **kwargs
+    )
+    db.session.add(serie)
+    db.session.commit()
+    return serie.id
+
+
+def martelar(app, trabalho):
+    """Executa `trabalho` em THREADS threads ao mesmo tempo; devolve os números obtidos"""
+    numeros, erros = [], []
+    barreira = threading.Barrier(THREADS)
+    lock = threading.Lock()
+
+    def executar():
+        with app.app_context():
+            barreira.wait()
+            try:
+                obtidos = [trabalho() for _ in range(RESERVAS_POR_THREAD)]
+                with lock:
+                    numeros.extend(obtidos)
+            except Exception as e:
+                erros.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=executar) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not erros
+    return numeros
+
+
+class TestReservaConcorrente:
+    """Nenhum número repetido ou pulado sob concorrência"""
+
+    def test_reservas_concorrentes_sao_unicas_e_sequenciais(self, fiscal_app):
+        serie_id = criar_serie()
+        alocador = NumeracaoFiscalService()
+
+        numeros = martelar(fiscal_app, lambda: alocador.reservar_faixa(serie_id)[0])
+
+        total = THREADS * RESERVAS_POR_THREAD
+        assert sorted(numeros) == list(range(1, total + 1))
+        assert db.session.get(SerieFiscal, serie_id).numero_atual == total
+        assert FaixaNumeracaoFiscal.query.count() == total
+
+    def test_blocos_do_pdv_entre_processos(self, fiscal_app):
+        """Dois alocadores (processos distintos) reservando blocos da mesma série de NFC-e"""
+        serie_id = criar_serie(modelo='65')
+        alocadores = [NumeracaoFiscalService(), NumeracaoFiscalService()]
+        contador = iter(range(10 ** 6))
+
+        def trabalho():
+            alocador = alocadores[next(contador) % 2]
+            return alocador.proximo_numero(db.session.get(SerieFiscal, serie_id))
+
+        numeros = martelar(fiscal_app, trabalho)
+
+        assert len(numeros) == len(set(numeros)) == THREADS * RESERVAS_POR_THREAD
+        faixas = FaixaNumeracaoFiscal.query.order_by(FaixaNumeracaoFiscal.numero_inicial).all()
+        assert faixas[0].numero_inicial == 1
+        for anterior, seguinte in zip(faixas, faixas[1:]):
+            assert seguinte.numero_inicial == anterior.numero_final + 1
+
+    def test_serie_bloqueada_nao_reserva(self, fiscal_app):
+        serie_id = criar_serie(bloqueada_em=datetime.utcnow())
+
+        with pytest.raises(NumeracaoIndisponivel):
+            NumeracaoFiscalService().reservar_faixa(serie_id)
+
+    def test_numeracao_esgotada(self, fiscal_app):
+        serie_id = criar_serie()
+        db.session.get(SerieFiscal, serie_id).numero_maximo = 2
+        db.session.commit()
+        alocador = NumeracaoFiscalService()
+
+        assert alocador.reservar_faixa(serie_id, 2) == (1, 2)
+        with pytest.raises(NumeracaoIndisponivel):
+            alocador.reservar_faixa(serie_id)
+
+
+class TestBlocoAdaptativo:
+    """O bloco do PDV acompanha o ritmo de emissão"""
+
+    @pytest.fixture
+    def relogio(self, monkeypatch):
+        agora = [datetime(2026, 5, 4, 10)]
+
+        class Relogio(datetime):
+            @classmethod
+            def utcnow(cls):
+                return agora[0]
+
+        monkeypatch.setattr(numeracao_fiscal_service, 'datetime', Relogio)
+        monkeypatch.setitem(numeracao_fiscal_service.TAMANHO_BLOCO, '65', 8)
+        return agora
+
+    @staticmethod
+    def emitir(alocador, serie_id):
+        """Reserva o número e grava o documento emitido com ele"""
+        serie = db.session.get(SerieFiscal, serie_id)
+        numero = alocador.proximo_numero(serie)
+        db.session.add(DocumentoFiscal(
+            empresa_id=serie.empresa_id, serie_fiscal_id=serie_id, modelo='65', serie=1,
+            numero=numero, tipo_operacao='1', ambiente='2'
+        ))
+        db.session.commit()
+        return numero
+
+    @staticmethod
+    def tamanhos():
+        faixas = FaixaNumeracaoFiscal.query.order_by(FaixaNumeracaoFiscal.numero_inicial)
+        return [faixa.numero_final - faixa.numero_inicial + 1 for faixa in faixas]
+
+    def test_pouco_movimento_reserva_um_a_um(self, fiscal_app, relogio):
+        serie_id = criar_serie(modelo='65')
+        alocador = NumeracaoFiscalService()
+
+        for _ in range(4):
+            self.emitir(alocador, serie_id)
+            relogio[0] += timedelta(minutes=6)
+
+        assert self.tamanhos() == [1, 1, 1, 1]
+        relogio[0] += CONCILIACAO_ESPERA
+        assert alocador.conciliar() == {'faixas': 4, 'inutilizacoes': 0}
+
+    def test_pico_cresce_e_queda_encolhe(self, fiscal_app, relogio):
+        serie_id = criar_serie(modelo='65')
+        alocador = NumeracaoFiscalService()
+
+        # Pico: cada bloco se esgota na hora e o seguinte dobra até o máximo
+        assert [self.emitir(alocador, serie_id) for _ in range(20)] == list(range(1, 21))
+        assert self.tamanhos() == [1, 2, 4, 8, 8]
+
+        # Ritmo menor: o bloco esgotado em 11 minutos dá lugar a um menor
+        for _ in range(3):
+            self.emitir(alocador, serie_id)
+        relogio[0] += timedelta(minutes=11)
+        self.emitir(alocador, serie_id)
+        assert self.tamanhos()[-1] == 3
+
+        # Bloco vencido com sobras: o próximo cobre só o que foi usado
+        relogio[0] += timedelta(minutes=11)
+        self.emitir(alocador, serie_id)
+        assert self.tamanhos()[-1] == 1
+
+        relogio[0] += CONCILIACAO_ESPERA
+        alocador.conciliar()
+        pendentes = InutilizacaoNumeracao.query.all()
+        assert [(i.numero_inicial, i.numero_final) for i in pendentes] == [(25, 26)]
+
+
+class TestConciliacao:
+    """Números reservados sem documento viram inutilização pendente"""
+
+    def test_lacunas_registradas_para_inutilizacao(self, fiscal_app):
+        serie_id = criar_serie()
+        serie = db.session.get(SerieFiscal, serie_id)
+        alocador = NumeracaoFiscalService()
+        alocador.reservar_faixa(serie_id, 6)
+
+        for numero in (1, 2, 4):
+            db.session.add(DocumentoFiscal(
+                empresa_id=serie.empresa_id, serie_fiscal_id=serie_id, modelo='55', serie=1,
+                numero=numero, tipo_operacao='1', ambiente='2'
+            ))
+        FaixaNumeracaoFiscal.query.update(
+            {'reservada_em': datetime.utcnow() - CONCILIACAO_ESPERA - timedelta(minutes=1)}
+        )
+        db.session.commit()
+
+        assert alocador.conciliar() == {'faixas': 1, 'inutilizacoes': 2}
+
+        pendentes = InutilizacaoNumeracao.query.order_by(InutilizacaoNumeracao.numero_inicial).all()
+        assert [(i.numero_inicial, i.numero_final, i.status) for i in pendentes] == [
+            (3, 3, 'pendente'), (5, 6, 'pendente')
+        ]
+        # Já conciliada: não registra de novo
+        assert alocador.conciliar() == {'faixas': 0, 'inutilizacoes': 0}
+
+    def test_lacunas_de_varias_faixas_em_duas_consultas_por_serie(self, fiscal_app):
+        alocador = NumeracaoFiscalService()
+        series = [criar_serie(), criar_serie(modelo='65')]
+        for serie_id in series:
+            for _ in range(3):
+                alocador.reservar_faixa(serie_id, 4)
+        for serie_id in series:
+            serie = db.session.get(SerieFiscal, serie_id)
+            for numero in (2, 5, 6, 12):
+                db.session.add(DocumentoFiscal(
+                    empresa_id=serie.empresa_id, serie_fiscal_id=serie_id, modelo=serie.modelo, serie=1,
+                    numero=numero, tipo_operacao='1', ambiente='2'
+                ))
+        FaixaNumeracaoFiscal.query.update(
+            {'reservada_em': datetime.utcnow() - CONCILIACAO_ESPERA - timedelta(minutes=1)}
+        )
+        db.session.commit()
+
+        consultas = []
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda _c, _cur, sql, *a: sql.lstrip().upper().startswith('SELECT') and consultas.append(sql))
+        assert alocador.conciliar() == {'faixas': 6, 'inutilizacoes': 8}
+
+        # Faixas pendentes, depois documentos e inutilizações de cada série
+        assert len(consultas) == 1 + 2 * len(series)
+        for modelo in ('55', '65'):
+            pendentes = (InutilizacaoNumeracao.query.filter_by(modelo=modelo)
+                         .order_by(InutilizacaoNumeracao.numero_inicial).all())
+            assert [(i.numero_inicial, i.numero_final) for i in pendentes] == [(1, 1), (3, 4), (7, 8), (9, 11)]
+
+    def test_faixa_recente_nao_e_conciliada(self, fiscal_app):
+        serie_id = criar_serie()
+        alocador = NumeracaoFiscalService()
+        alocador.reservar_faixa(serie_id, 3)
+
+        assert alocador.conciliar() == {'faixas': 0, 'inutilizacoes': 0}
+        assert InutilizacaoNumeracao.query.count() == 0
+
+
+class TestSeriePadrao:
+    def test_cria_serie_padrao_quando_nao_existe(self, fiscal_app):
+        empresa_id = uuid.uuid4()
+
+        serie = NumeracaoFiscalService().garantir_serie_padrao(empresa_id, '55', '2')
+
+        assert (serie.serie, serie.is_active, serie.is_default) == (1, True, True)
+
+    def test_serie_inativa_nao_e_usada(self, fiscal_app):
+        serie_id = criar_serie(is_default=True)
+        serie = db.session.get(SerieFiscal, serie_id)
+        serie.is_active = False
+        db.session.commit()
+
+        with pytest.raises(NumeracaoIndisponivel):
+            NumeracaoFiscalService().garantir_serie_padrao(serie.empresa_id, '55', '2')
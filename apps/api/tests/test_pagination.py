@@ -0,0 +1,84 @@
+"""
+Testes da paginação por cursor (keyset)
+Codificação do cursor e navegação completa com empates na coluna de ordenação
+"""
+
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from flask import Flask
+from sqlalchemy import Column, DateTime, Integer
+
+from database import db
+from utils.pagination import InvalidCursor, decode_cursor, encode_cursor, paginate_keyset
+
+
+class Evento(db.Model):
+    __tablename__ = 'test_pagination_eventos'
+
+    id = Column(Integer, primary_key=True)
+    criado_em = Column(DateTime, nullable=False)
+
+
+@pytest.fixture
+def eventos_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+
+    with app.app_context():
+        db.metadata.create_all(db.engine, tables=[Evento.__table__])
+        inicio = datetime(2026, 1, 1)
+        # Três eventos por minuto: empates resolvidos pelo id
+        db.session.add_all(
+            Evento(id=i, criado_em=inicio + timedelta(minutes=i // 3)) for i in range(1, 48)
+        )
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.metadata.drop_all(db.engine, tables=[Evento.__table__])
+
+
+def ordem_esperada():
+    return [e.id for e in Evento.query.order_by(Evento.criado_em.desc(), Evento.id.desc())]
+
+
+class TestCursor:
+    def test_ida_e_volta(self):
+        valores = [datetime(2026, 5, 1, 12, 30), uuid.uuid4(), Decimal('10.50'), 7]
+        assert decode_cursor(encode_cursor(valores), size=4) == valores
+
+    @pytest.mark.parametrize('token', ['lixo', encode_cursor([1]), ''])
+    def test_cursor_invalido(self, token):
+        with pytest.raises(InvalidCursor):
+            decode_cursor(token)
+
+
+class TestPaginateKeyset:
+    def test_avanca_todas_as_paginas(self, eventos_app):
+        vistos, cursor = [], None
+        while True:
+            pagina = paginate_keyset(Evento.query, Evento.criado_em, Evento.id, per_page=10, after=cursor)
+            vistos += [e.id for e in pagina.items]
+            if not pagina.has_next:
+                break
+            cursor = pagina.next_cursor
+
+        assert vistos == ordem_esperada()
+        assert pagina.has_prev and pagina.next_cursor is None
+
+    def test_volta_para_pagina_anterior(self, eventos_app):
+        esperado = ordem_esperada()
+        segunda = paginate_keyset(
+            Evento.query, Evento.criado_em, Evento.id, per_page=10,
+            after=encode_cursor([db.session.get(Evento, esperado[9]).criado_em, esperado[9]])
+        )
+        assert [e.id for e in segunda.items] == esperado[10:20]
+
+        primeira = paginate_keyset(
+            Evento.query, Evento.criado_em, Evento.id, per_page=10, before=segunda.prev_cursor
+        )
+        assert [e.id for e in primeira.items] == esperado[:10]
+        assert primeira.has_next and not primeira.has_prev
@@ -0,0 +1,173 @@
+"""
+Testes do registro de vendas do PDV
+Venda de balcão com baixa de estoque e contadores da sessão no banco, lote
+offline com reenvio idempotente, cancelamento e sangria/suprimento
+"""
+
+import uuid
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import Column, MetaData, Table, event, inspect
+from sqlalchemy.exc import IntegrityError
+
+from database import db
+from models.pdv import CashMovement, CashRegister, CashSession, Sale, SaleItem
+from models.products import Product
+from services import pdv_sales
+from tests.sqlite_app import sqlite_app
+
+
+@pytest.fixture
+def pdv_app():
+    tabelas = [Product.__table__, CashRegister.__table__, CashSession.__table__,
+               CashMovement.__table__, Sale.__table__, SaleItem.__table__]
+    with sqlite_app(tabelas) as app:
+        yield app
+
+
+@pytest.fixture
+def caixa(pdv_app):
+    caixa = CashRegister(id=uuid.uuid4(), name='Balcão', code='BAL-1')
+    sessao = CashSession(
+        id=uuid.uuid4(), cash_register_id=caixa.id, operator_id=uuid.uuid4(),
+        opening_balance=Decimal('100'), expected_balance=Decimal('100'),
+    )
+    produtos = [
+        Product(id=uuid.uuid4(), name=f'Café {i}', slug=f'cafe-{i}', sku=f'CF{i}',
+                price=Decimal('10.50'), stock_quantity=10)
+        for i in range(3)
+    ]
+    db.session.add_all([caixa, sessao, *produtos])
+    db.session.commit()
+    return sessao.id, sessao.operator_id, [p.id for p in produtos]
+
+
+def estoque(produto_ids):
+    db.session.expire_all()
+    return [db.session.get(Product, produto_id).stock_quantity for produto_id in produto_ids]
+
+
+def test_venda_com_consultas_constantes_e_contadores_atomicos(caixa):
+    sessao_id, operador_id, produto_ids = caixa
+    itens = [{'product_id': str(p), 'quantity': 2} for p in produto_ids]
+    itens.append({'product_id': str(produto_ids[0]), 'quantity': 1, 'discount': '0.50'})
+
+    comandos = []
+    event.listen(db.engine, 'before_cursor_execute', lambda _c, _cur, sql, *a: comandos.append(sql))
+    venda = pdv_sales.record_sale(
+        {'session_id': str(sessao_id), 'payment_method': 'cash', 'items': itens, 'discount': 1},
+        str(operador_id),
+    )
+    updates_produtos = [sql for sql in comandos if sql.startswith('UPDATE products')]
+
+    assert venda.total == Decimal('72.00')
+    assert len(venda.items) == 4
+    assert len(updates_produtos) == 1
+    assert estoque(produto_ids) == [7, 8, 8]
+
+    sessao = db.session.get(CashSession, sessao_id)
+    assert (sessao.total_sales, sessao.total_cash, sessao.expected_balance) == (72, 72, 172)
+
+    with pytest.raises(pdv_sales.SaleValidationError):
+        pdv_sales.record_sale(
+            {'session_id': str(sessao_id), 'payment_method': 'cash',
+             'items': [{'product_id': str(uuid.uuid4()), 'quantity': 1}]},
+            str(operador_id),
+        )
+
+
+def test_lote_offline_idempotente_e_cancelamento(caixa):
+    sessao_id, operador_id, produto_ids = caixa
+    lote = [
+        {'session_id': str(sessao_id), 'payment_method': 'pix', 'client_reference': f'BAL-1:{i}',
+         'created_at': '2026-05-01T12:00:00', 'items': [{'product_id': str(produto_ids[1]), 'quantity': 1}]}
+        for i in range(3)
+    ]
+    lote.append({'session_id': str(sessao_id), 'payment_method': 'cheque', 'items': lote[0]['items']})
+
+    resultado = pdv_sales.record_sales(lote, str(operador_id))
+    assert (resultado['created'], resultado['duplicates'], resultado['failed']) == (3, 0, 1)
+
+    reenvio = pdv_sales.record_sales(lote[:3], str(operador_id))
+    assert (reenvio['created'], reenvio['duplicates']) == (0, 3)
+    assert estoque(produto_ids) == [10, 7, 10]
+    assert db.session.get(CashSession, sessao_id).total_pix == Decimal('31.50')
+
+    venda = db.session.get(Sale, uuid.UUID(resultado['results'][0]['sale_id']))
+    pdv_sales.cancel_sale(venda, 'Cliente desistiu')
+    assert venda.status == 'cancelled'
+    assert estoque(produto_ids) == [10, 8, 10]
+    assert db.session.get(CashSession, sessao_id).total_sales == Decimal('21.00')
+
+    with pytest.raises(pdv_sales.SaleValidationError):
+        pdv_sales.cancel_sale(venda, 'De novo')
+
+
+def test_sangria_nao_sobrescreve_venda_gravada_em_paralelo(caixa):
+    sessao_id, operador_id, produto_ids = caixa
+    # Sessão lida antes da venda, como na rota antiga
+    sessao = db.session.get(CashSession, sessao_id)
+    assert sessao.expected_balance == Decimal('100')
+
+    pdv_sales.record_sale(
+        {'session_id': str(sessao_id), 'payment_method': 'cash',
+         'items': [{'product_id': str(produto_ids[0]), 'quantity': 2}]},
+        str(operador_id),
+    )
+    movimento = pdv_sales.record_movement(
+        {'session_id': str(sessao_id), 'type': 'withdrawal', 'amount': '30', 'reason': 'Sangria'},
+        str(operador_id),
+    )
+
+    db.session.expire_all()
+    sessao = db.session.get(CashSession, sessao_id)
+    assert movimento.to_dict()['amount'] == 30.0
+    assert (sessao.expected_balance, sessao.withdrawals) == (Decimal('91.00'), Decimal('30.00'))
+
+    with pytest.raises(pdv_sales.SaleValidationError):
+        pdv_sales.record_movement(
+            {'session_id': str(sessao_id), 'type': 'ajuste', 'amount': '1'}, str(operador_id)
+        )
+
+
+def test_lote_em_conflito_persistente_volta_com_erro(caixa, monkeypatch):
+    sessao_id, operador_id, produto_ids = caixa
+
+    def conflito(drafts, operator_id):
+        for draft in drafts:
+            draft.result.update({'status': 'created', 'sale_id': str(uuid.uuid4())})
+        raise IntegrityError('INSERT INTO sales', {}, Exception('uq_sale_register_client_reference'))
+
+    monkeypatch.setattr(pdv_sales, '_record', conflito)
+    lote = [
+        {'session_id': str(sessao_id), 'payment_method': 'pix', 'client_reference': 'BAL-1:1',
+         'items': [{'product_id': str(produto_ids[0]), 'quantity': 1}]},
+        {'session_id': str(sessao_id), 'payment_method': 'cheque', 'items': []},
+    ]
+
+    resultado = pdv_sales.record_sales(lote, str(operador_id))
+
+    assert (resultado['created'], resultado['failed']) == (0, 2)
+    assert resultado['results'][0]['client_reference'] == 'BAL-1:1'
+    assert 'sale_id' not in resultado['results'][0]
+    assert estoque(produto_ids) == [10, 10, 10]
+
+
+def test_tabela_sales_anterior_ao_lote_e_atualizada():
+    # Formato de sales antes de client_reference
+    antiga = Table('sales', MetaData(), *(
+        Column(coluna.name, coluna.type, primary_key=coluna.primary_key)
+        for coluna in Sale.__table__.columns if coluna.name != 'client_reference'
+    ))
+    with sqlite_app([]) as app:
+        antiga.create(db.engine)
+
+        pdv_sales.init_pdv_sales(app)
+        pdv_sales.init_pdv_sales(app)
+
+        inspetor = inspect(db.engine)
+        assert 'client_reference' in {coluna['name'] for coluna in inspetor.get_columns('sales')}
+        indice = next(i for i in inspetor.get_indexes('sales') if i['name'] == 'uq_sale_register_client_reference')
+        assert indice['unique'] and indice['column_names'] == ['cash_register_id', 'client_reference']
+        antiga.drop(db.engine)
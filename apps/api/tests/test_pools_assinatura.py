@@ -0,0 +1,64 @@
+"""
+Testes do registro de pools de assinatura em lote
+Um pool por certificado, compartilhado e encerrado quando fica ocioso
+"""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from services import certificate_service
+from services.certificate_service import PoolsAssinatura
+
+
+def contexto(thumbprint):
+    # O pool só inicia processos no primeiro submit; o contexto não é usado aqui
+    return SimpleNamespace(thumbprint=thumbprint, chave_pem=lambda: b'', certificado_pem='')
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    monkeypatch.setattr(certificate_service, 'ASSINATURA_POOL_OCIOSO', 0.05)
+    monkeypatch.setattr(certificate_service, 'ASSINATURA_PROCESSOS', 4)
+    pools = PoolsAssinatura()
+    yield pools
+    pools.encerrar_todos()
+
+
+def test_pool_compartilhado_por_certificado(pools):
+    pool = pools.obter(contexto('a'), 2)
+    assert pools.obter(contexto('a'), 8) is pool
+    assert pool._max_workers == 2
+    # ASSINATURA_PROCESSOS limita o tamanho do pool
+    assert pools.obter(contexto('c'), 16)._max_workers == 4
+    assert pools.obter(contexto('b'), 2) is not pool
+    assert len(pools) == 3
+
+
+def test_pool_ocioso_encerrado(pools):
+    pool = pools.obter(contexto('a'), 2)
+    pools.obter(contexto('a'), 2)
+
+    # Com um lote ainda em andamento o pool não é encerrado
+    pools.liberar('a', pool)
+    assert not pools.encerrar_ocioso('a')
+    time.sleep(0.2)
+    assert len(pools) == 1
+
+    pools.liberar('a', pool)
+    time.sleep(0.2)
+    assert len(pools) == 0 and pool._shutdown_thread
+
+    # Um novo lote cria outro pool
+    assert pools.obter(contexto('a'), 2) is not pool
+
+
+def test_pool_descartado_nao_derruba_o_novo(pools):
+    quebrado = pools.obter(contexto('a'), 2)
+    pools.descartar('a', quebrado)
+    novo = pools.obter(contexto('a'), 2)
+
+    pools.descartar('a', quebrado)
+    pools.liberar('a', quebrado)
+    assert pools.obter(contexto('a'), 2) is novo
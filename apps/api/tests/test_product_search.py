@@ -0,0 +1,63 @@
+"""
+Testes do índice de busca em memória (fallback sem PostgreSQL)
+O índice cobre todos os produtos; is_active é filtrado na query
+"""
+
+import uuid
+
+import pytest
+
+from database import db
+from models.products import Product
+from services.product_search import ProductSearchService
+from tests.sqlite_app import sqlite_app
+
+
+@pytest.fixture
+def busca():
+    with sqlite_app([Product.__table__]):
+        servico = ProductSearchService()
+        assert servico.setup() == "memory"
+        yield servico
+
+
+def novo_produto(nome, ativo=True):
+    produto = Product(id=uuid.uuid4(), name=nome, slug=f'p-{uuid.uuid4().hex[:8]}',
+                      sku=uuid.uuid4().hex[:8], price=10, stock_quantity=1, is_active=ativo)
+    db.session.add(produto)
+    db.session.commit()
+    return produto.id
+
+
+def nomes(query):
+    return sorted(produto.name for produto in query)
+
+
+def test_busca_filtra_ativos_e_inativos_na_query(busca):
+    novo_produto('Café Especial')
+    inativo = novo_produto('Café Arábica', ativo=False)
+    busca.rebuild()
+
+    assert nomes(busca.filter_query(Product.query.filter_by(is_active=True), 'cafe')) == ['Café Especial']
+    assert nomes(busca.filter_query(Product.query.filter_by(is_active=False), 'cafe')) == ['Café Arábica']
+
+    # Desativar (soft delete do admin) mantém o produto buscável como inativo
+    db.session.get(Product, inativo).name = 'Café Arábica Torra Média'
+    db.session.commit()
+    busca.refresh_product(inativo)
+    assert nomes(busca.filter_query(Product.query.filter_by(is_active=False), 'torra')) == [
+        'Café Arábica Torra Média'
+    ]
+
+
+def test_busca_casa_inicio_de_palavra_e_nao_substring(busca):
+    novo_produto('Café Torrado')
+    novo_produto('Bolo de Cenoura')
+    novo_produto('Cafeteira Italiana')
+    busca.rebuild()
+
+    ativos = Product.query.filter_by(is_active=True)
+    assert nomes(busca.filter_query(ativos, 'caf')) == ['Cafeteira Italiana', 'Café Torrado']
+    # "orra" aparece dentro de "torrado", mas não inicia nenhuma palavra
+    assert nomes(busca.filter_query(ativos, 'orra')) == []
+    assert nomes(busca.filter_query(ativos, 'cafe tor')) == ['Café Torrado']
@@ -318,6 +318,55 @@ class TestProductSearch:
         assert response.status_code in [200, 404]
 
 
+class TestProductSearchIndex:
+    """Testes para o índice invertido de busca em memória"""
+
+    def _build_index(self):
+        from services.product_search import InvertedProductIndex
+
+        index = InvertedProductIndex()
+        index.build([
+            (uuid.UUID(int=1), 'Café Arábica Especial', 'Sul de Minas', 'Notas de chocolate'),
+            (uuid.UUID(int=2), 'Blend da Casa', 'Cerrado', 'Café encorpado'),
+            (uuid.UUID(int=3), 'Chá Mate', 'Paraná', None),
+        ])
+        return index
+
+    def test_search_ignores_accents_and_case(self):
+        """Busca sem acento deve encontrar termos acentuados"""
+        index = self._build_index()
+
+        keys = [key for key, _ in index.search(['cafe'])]
+
+        assert keys == [uuid.UUID(int=1).hex, uuid.UUID(int=2).hex]
+
+    def test_search_ranks_name_above_description(self):
+        """Termo no nome deve pesar mais que na descrição"""
+        index = self._build_index()
+
+        results = index.search(['cafe'])
+
+        assert results[0][1] > results[1][1]
+
+    def test_search_requires_all_terms(self):
+        """Todos os termos devem casar (exato ou prefixo)"""
+        index = self._build_index()
+
+        assert [key for key, _ in index.search(['cafe', 'arab'])] == [uuid.UUID(int=1).hex]
+        assert index.search(['cafe', 'inexistente']) == []
+
+    def test_upsert_and_remove_keep_index_updated(self):
+        """Atualizações do admin devem refletir no índice"""
+        index = self._build_index()
+
+        index.upsert(uuid.UUID(int=3), 'Chá Mate Orgânico', 'Paraná', None)
+        assert [key for key, _ in index.search(['organico'])] == [uuid.UUID(int=3).hex]
+
+        index.remove(uuid.UUID(int=3))
+        assert index.search(['organico']) == []
+        assert len(index) == 2
+
+
 class TestProductCategories:
     """Testes para categorias de produtos"""
 
@@ -0,0 +1,131 @@
+"""
+Testes do armazenamento de rate limiting
+Janela deslizante no backend em memória, bloqueio, fallback quando o Redis
+falha e cabeçalhos X-RateLimit-* das respostas
+"""
+
+import time
+
+import pytest
+from flask import Flask, jsonify
+
+from middleware import rate_limit_store as modulo
+from middleware.rate_limit_store import MemoryRateLimitBackend, RateLimitStore, RequestRateLimiter
+
+JANELA = 60
+INICIO = 1_800_000_000  # múltiplo de JANELA
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    """time.time controlado pelo teste"""
+    agora = [float(INICIO)]
+    monkeypatch.setattr(modulo.time, 'time', lambda: agora[0])
+    return agora
+
+
+def test_limite_na_janela(relogio):
+    backend = MemoryRateLimitBackend()
+    resultados = [backend.hit('ip:1', 3, JANELA) for _ in range(4)]
+
+    assert [r.allowed for r in resultados] == [True, True, True, False]
+    assert [r.remaining for r in resultados[:3]] == [2, 1, 0]
+    bloqueado = resultados[-1]
+    assert (bloqueado.retry_after, bloqueado.reset_after, bloqueado.reset_at) == (60, 60, INICIO + JANELA)
+    # Outro identificador tem seu próprio contador
+    assert backend.hit('ip:2', 3, JANELA).allowed
+
+
+def test_janela_deslizante_e_reset(relogio):
+    backend = MemoryRateLimitBackend()
+    for _ in range(4):
+        backend.hit('ip:1', 4, JANELA)
+    assert not backend.hit('ip:1', 4, JANELA).allowed
+
+    # Meia janela depois: a anterior ainda pesa 50% (2 de 4)
+    relogio[0] = INICIO + JANELA * 1.5
+    resultado = backend.hit('ip:1', 4, JANELA)
+    assert resultado.allowed and resultado.count == 3
+    assert resultado.reset_at == INICIO + 2 * JANELA
+
+    # Duas janelas sem requisições zeram a contagem
+    relogio[0] = INICIO + JANELA * 3
+    assert backend.hit('ip:1', 4, JANELA).count == 1
+
+
+def test_bloqueio_apos_exceder(relogio):
+    backend = MemoryRateLimitBackend()
+    backend.hit('ip:1', 1, JANELA, block_duration=300)
+    resultado = backend.hit('ip:1', 1, JANELA, block_duration=300)
+    assert (resultado.allowed, resultado.retry_after) == (False, 300)
+
+    relogio[0] += 120
+    assert backend.blocked_for('ip:1') == 180
+    relogio[0] += 181
+    assert backend.hit('ip:1', 1, JANELA).allowed
+
+
+def test_memoria_limitada_e_purga(relogio):
+    backend = MemoryRateLimitBackend(max_keys=2)
+    for ip in range(5):
+        backend.hit(f'ip:{ip}', 10, JANELA)
+    assert len(backend) == 2
+
+    relogio[0] += 3 * JANELA
+    assert backend.purge() == 2 and len(backend) == 0
+
+
+class RedisQuebrado:
+    def register_script(self, script):
+        def executar(keys, args):
+            raise ConnectionError('Redis fora do ar')
+        return executar
+
+
+class CacheFalso:
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+
+def test_fallback_para_memoria(monkeypatch, relogio):
+    armazenamento = RateLimitStore()
+
+    # Sem Redis: memória do processo
+    monkeypatch.setattr(modulo, 'cache_manager', CacheFalso(None))
+    assert armazenamento.hit('ip:1', 2, JANELA).count == 1
+
+    # Redis com erro: a requisição conta na memória em vez de falhar
+    monkeypatch.setattr(modulo, 'cache_manager', CacheFalso(RedisQuebrado()))
+    assert armazenamento.hit('ip:1', 2, JANELA).count == 2
+    assert not armazenamento.hit('ip:1', 2, JANELA).allowed
+
+
+def test_cabecalhos_reset_em_epoch(monkeypatch):
+    monkeypatch.setattr(modulo, 'cache_manager', CacheFalso(None))
+    limitador = RequestRateLimiter(
+        limits={'default': {'requests': 1, 'window': JANELA}},
+        identify=lambda: 'cliente',
+        limited_response=lambda result, limit_type: (jsonify({'error': 'limite'}), 429),
+        default_limit='default',
+        scope='teste',
+        store=RateLimitStore(),
+    )
+    app = Flask(__name__)
+
+    @app.route('/')
+    @limitador.limit('default')
+    def index():
+        return jsonify({'ok': True})
+
+    cliente = app.test_client()
+    antes = time.time()
+    primeira = cliente.get('/')
+    segunda = cliente.get('/')
+
+    assert primeira.status_code == 200 and segunda.status_code == 429
+    reset = int(primeira.headers['X-RateLimit-Reset'])
+    reset_after = int(primeira.headers['X-RateLimit-Reset-After'])
+    assert reset % JANELA == 0 and antes < reset <= antes + JANELA
+    assert 0 < reset_after <= JANELA
+    assert primeira.headers['X-RateLimit-Remaining'] == '0'
+    assert 0 < int(segunda.headers['Retry-After']) <= JANELA
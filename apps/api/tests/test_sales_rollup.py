@@ -0,0 +1,111 @@
+"""
+Testes do rollup diário de vendas
+O commit do pedido só marca o dia; o worker recalcula os dias marcados a
+partir dos pedidos, sem deriva entre commits do mesmo dia
+"""
+
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from database import db
+from models import (
+    Customer,
+    DailyCustomerSalesRollup,
+    DailyProductSalesRollup,
+    DailySalesRollup,
+    Order,
+    OrderItem,
+    SalesRollupPendingDay,
+)
+from services.sales_rollup_service import sales_rollup
+from tests.sqlite_app import sqlite_app
+
+DIA = date(2026, 5, 4)
+
+
+@pytest.fixture
+def rollup_app():
+    tabelas = [Order.__table__, OrderItem.__table__, DailySalesRollup.__table__,
+               DailyProductSalesRollup.__table__, DailyCustomerSalesRollup.__table__,
+               SalesRollupPendingDay.__table__]
+    with sqlite_app(tabelas) as app:
+        yield app
+
+
+def novo_pedido(total, status='completed', created_at=datetime(2026, 5, 4, 10)):
+    return Order(order_number=f'MC-{uuid.uuid4().hex[:8]}', status=status, payment_status='paid',
+                 subtotal=total, total_amount=total, created_at=created_at)
+
+
+def resumo(dia=DIA):
+    return {
+        (row.status, row.orders_count, row.total_amount)
+        for row in DailySalesRollup.query.filter_by(day=dia)
+    }
+
+
+def test_commit_marca_o_dia_e_o_worker_recalcula(rollup_app):
+    db.session.add(novo_pedido(Decimal('10')))
+    db.session.commit()
+    db.session.add(novo_pedido(Decimal('15')))
+    db.session.commit()
+
+    # Nada é recalculado no caminho da requisição
+    assert DailySalesRollup.query.count() == 0
+    assert [row.day for row in SalesRollupPendingDay.query] == [DIA]
+
+    assert sales_rollup.process_pending() == 1
+    assert resumo() == {('completed', 2, Decimal('25'))}
+    assert SalesRollupPendingDay.query.count() == 0
+
+
+def test_mudanca_de_status_e_de_dia_recalcula_os_dois_dias(rollup_app):
+    pedido = novo_pedido(Decimal('10'), status='pending')
+    db.session.add(pedido)
+    db.session.commit()
+    sales_rollup.process_pending()
+
+    pedido.status = 'completed'
+    pedido.created_at = datetime(2026, 5, 5, 9)
+    db.session.commit()
+
+    assert {row.day for row in SalesRollupPendingDay.query} == {DIA, date(2026, 5, 5)}
+    assert sales_rollup.process_pending() == 2
+    assert resumo() == set()
+    assert resumo(date(2026, 5, 5)) == {('completed', 1, Decimal('10'))}
+
+
+def test_dia_ja_reclamado_por_outro_worker_nao_e_recalculado(rollup_app):
+    db.session.add(novo_pedido(Decimal('10')))
+    db.session.commit()
+    SalesRollupPendingDay.query.delete()
+    db.session.commit()
+
+    assert sales_rollup._rebuild_claimed(DIA) is False
+    assert DailySalesRollup.query.count() == 0
+
+
+def test_top_clientes_inclui_clientes_sem_pedidos():
+    tabelas = [Customer.__table__, Order.__table__, OrderItem.__table__, DailySalesRollup.__table__,
+               DailyProductSalesRollup.__table__, DailyCustomerSalesRollup.__table__,
+               SalesRollupPendingDay.__table__]
+    with sqlite_app(tabelas):
+        clientes = [Customer(id=uuid.uuid4(), name=nome, email=f'{nome.lower()}@example.com')
+                    for nome in ('Ana', 'Bia', 'Caio')]
+        db.session.add_all(clientes)
+        for total in (Decimal('10'), Decimal('30')):
+            pedido = novo_pedido(total)
+            pedido.customer_id = clientes[1].id
+            db.session.add(pedido)
+        db.session.commit()
+        sales_rollup.process_pending()
+
+        top = sales_rollup.top_customers(limit=3)
+
+        assert top[0] == {'name': 'Bia', 'email': 'bia@example.com', 'orders_count': 2, 'total_spent': 40.0}
+        assert sorted((c['name'], c['orders_count'], c['total_spent']) for c in top[1:]) == [
+            ('Ana', 0, 0), ('Caio', 0, 0)]
+        assert len(sales_rollup.top_customers(limit=2)) == 2
@@ -0,0 +1,146 @@
+"""
+Testes do pool mTLS da SEFAZ
+O SSLContext é montado em memória (memfd), ou num arquivo temporário removido
+logo após a leitura, e apresenta o certificado cliente;
+a factory mantém um serviço por (empresa, UF, ambiente) e só o recria quando
+o certificado muda, sem fechar o anterior enquanto ainda está em uso
+"""
+
+import gc
+import os
+import socket
+import ssl
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from services import sefaz_service
+from services.sefaz_service import SefazServiceFactory
+
+
+def gerar_certificado(nome_comum, dns=None):
+    """Certificado autoassinado e sua chave (objetos cryptography)"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    chave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nome = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, nome_comum)])
+    agora = datetime.utcnow()
+    construtor = (
+        x509.CertificateBuilder()
+        .subject_name(nome)
+        .issuer_name(nome)
+        .public_key(chave.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(agora - timedelta(days=1))
+        .not_valid_after(agora + timedelta(days=30))
+    )
+    if dns:
+        construtor = construtor.add_extension(x509.SubjectAlternativeName([x509.DNSName(dns)]), critical=False)
+    return construtor.sign(chave, hashes.SHA256()), chave
+
+
+@pytest.mark.parametrize('memfd', [True, False], ids=['memfd', 'arquivo_temporario'])
+def test_contexto_mtls_apresenta_certificado_cliente(tmp_path, monkeypatch, memfd):
+    pytest.importorskip('cryptography')
+    if memfd and not hasattr(os, 'memfd_create'):
+        pytest.skip('memfd_create indisponível')
+    if not memfd:
+        monkeypatch.delattr(os, 'memfd_create', raising=False)
+        temporarios = tmp_path / 'temporarios'
+        temporarios.mkdir()
+        monkeypatch.setattr(sefaz_service.tempfile, 'tempdir', str(temporarios))
+    from cryptography.hazmat.primitives import serialization
+
+    cliente, chave_cliente = gerar_certificado('EMPRESA TESTE:12345678000190')
+    servidor, chave_servidor = gerar_certificado('localhost', dns='localhost')
+    pem_servidor = servidor.public_bytes(serialization.Encoding.PEM)
+    arquivo_servidor = tmp_path / 'servidor.pem'
+    arquivo_servidor.write_bytes(pem_servidor + chave_servidor.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+
+    descritores = len(os.listdir('/proc/self/fd'))
+    contexto = sefaz_service.criar_ssl_context(cliente, chave_cliente, [])
+    assert len(os.listdir('/proc/self/fd')) == descritores
+    if not memfd:
+        assert not any(temporarios.iterdir())
+    contexto.load_verify_locations(cadata=pem_servidor.decode())
+
+    contexto_servidor = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    contexto_servidor.load_cert_chain(str(arquivo_servidor))
+    contexto_servidor.verify_mode = ssl.CERT_REQUIRED
+    contexto_servidor.load_verify_locations(cadata=cliente.public_bytes(serialization.Encoding.PEM).decode())
+
+    lado_cliente, lado_servidor = socket.socketpair()
+    recebido = {}
+
+    def aceitar():
+        with contexto_servidor.wrap_socket(lado_servidor, server_side=True) as conexao:
+            recebido.update(conexao.getpeercert())
+
+    thread = threading.Thread(target=aceitar)
+    thread.start()
+    with contexto.wrap_socket(lado_cliente, server_hostname='localhost') as conexao:
+        conexao.do_handshake()
+    thread.join(5)
+
+    assert recebido['subject'] == ((('commonName', 'EMPRESA TESTE:12345678000190'),),)
+
+
+@pytest.fixture
+def fabrica(monkeypatch):
+    """Credenciais da empresa trocáveis pelo teste, sem decodificar certificados"""
+    credenciais = {'atual': SimpleNamespace(impressao='cert-1')}
+    contextos = []
+
+    def criar_contexto(certificado, chave, cadeia=None):
+        contexto = ssl.create_default_context()
+        contextos.append((certificado.impressao, contexto))
+        return contexto
+
+    monkeypatch.setattr(SefazServiceFactory, '_credenciais_empresa',
+                        staticmethod(lambda empresa_id: (credenciais['atual'], 'chave', [])))
+    monkeypatch.setattr(sefaz_service, 'impressao_certificado', lambda certificado: certificado.impressao)
+    monkeypatch.setattr(sefaz_service, 'criar_ssl_context', criar_contexto)
+    SefazServiceFactory.limpar_cache()
+    yield credenciais, contextos
+    SefazServiceFactory.limpar_cache()
+
+
+def test_servico_recriado_quando_o_certificado_muda(fabrica):
+    credenciais, contextos = fabrica
+    servico = SefazServiceFactory.criar_servico(uf='sp', ambiente='2', empresa_id='empresa-1')
+    assert SefazServiceFactory.criar_servico(uf='SP', ambiente='2', empresa_id='empresa-1') is servico
+    assert servico.mtls and servico.impressao_certificado == 'cert-1'
+    assert len(contextos) == 1
+
+    # Outra UF é outro pool
+    assert SefazServiceFactory.criar_servico(uf='MG', ambiente='2', empresa_id='empresa-1') is not servico
+
+    credenciais['atual'] = SimpleNamespace(impressao='cert-2')
+    novo = SefazServiceFactory.criar_servico(uf='SP', ambiente='2', empresa_id='empresa-1')
+    assert novo is not servico and novo.impressao_certificado == 'cert-2'
+    assert novo._ssl_context is contextos[-1][1] and contextos[-1][0] == 'cert-2'
+    assert SefazServiceFactory.criar_servico(uf='SP', ambiente='2', empresa_id='empresa-1') is novo
+
+
+def test_servico_substituido_fecha_so_sem_referencias(fabrica):
+    credenciais, _ = fabrica
+    em_uso = SefazServiceFactory.criar_servico(uf='SP', ambiente='2', empresa_id='empresa-1')
+    fechamentos = []
+    em_uso._session.close = lambda: fechamentos.append('cert-1')
+
+    credenciais['atual'] = SimpleNamespace(impressao='cert-2')
+    SefazServiceFactory.criar_servico(uf='SP', ambiente='2', empresa_id='empresa-1')
+
+    # Uma requisição ainda segura o serviço antigo: o pool continua aberto
+    assert fechamentos == []
+
+    del em_uso
+    gc.collect()
+    assert fechamentos == ['cert-1']
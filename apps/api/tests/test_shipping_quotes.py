@@ -0,0 +1,199 @@
+"""
+Testes do cache de cotações do Melhor Envio
+Chave por origem, região do destino e volumes em faixas; chamadas iguais
+simultâneas fazem uma só requisição e o pré-aquecimento cota as mais pedidas
+"""
+
+import threading
+import time
+
+import pytest
+
+import utils.cache
+from services import melhor_envio_service
+from services.melhor_envio_service import MelhorEnvioService, ShippingQuoteWarmer, _round_up
+from utils.cache import CacheManager
+
+
+class RedisFalso:
+    """Só os comandos usados pelo cache e pela demanda de fretes"""
+
+    def __init__(self):
+        self.valores = {}
+        self.ranking = {}
+
+    def get(self, chave):
+        return self.valores.get(chave)
+
+    def setex(self, chave, ttl, valor):
+        self.valores[chave] = valor
+        return True
+
+    def set(self, chave, valor, ex=None, nx=False):
+        if nx and chave in self.valores:
+            return None
+        self.valores[chave] = valor
+        return True
+
+    def delete(self, chave):
+        return int(self.valores.pop(chave, None) is not None)
+
+    def eval(self, script, numkeys, chave, token):
+        # _RELEASE_LOCK_SCRIPT: apaga só se o token for o mesmo
+        if self.valores.get(chave) == token:
+            return self.delete(chave)
+        return 0
+
+    def zincrby(self, chave, quantidade, membro):
+        ranking = self.ranking.setdefault(chave, {})
+        ranking[membro] = ranking.get(membro, 0) + quantidade
+        return ranking[membro]
+
+    def _ordenados(self, chave):
+        return sorted(self.ranking.get(chave, {}).items(), key=lambda item: item[1])
+
+    def zrevrange(self, chave, inicio, fim):
+        membros = [membro for membro, _ in reversed(self._ordenados(chave))]
+        return membros[inicio:None if fim == -1 else fim + 1]
+
+    def zremrangebyrank(self, chave, inicio, fim):
+        ordenados = self._ordenados(chave)
+        fim = len(ordenados) + fim if fim < 0 else fim
+        for membro, _ in ordenados[inicio:fim + 1]:
+            del self.ranking[chave][membro]
+
+
+class CacheFalso(CacheManager):
+    def __init__(self, redis=None):
+        super().__init__()
+        self.redis = redis
+
+    @property
+    def redis_client(self):
+        return self.redis
+
+
+class RespostaFalsa:
+    status_code = 200
+
+    def json(self):
+        return [{'id': 1, 'name': 'PAC', 'price': '21.90', 'delivery_time': 6, 'company': {'name': 'Correios'}}]
+
+
+class ApiFalsa:
+    """Melhor Envio: guarda o corpo de cada cotação pedida"""
+
+    def __init__(self, atraso=0):
+        self.atraso = atraso
+        self.pedidos = []
+        self.lock = threading.Lock()
+
+    def post(self, url, headers, json, timeout):
+        with self.lock:
+            self.pedidos.append(json)
+        time.sleep(self.atraso)
+        return RespostaFalsa()
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = CacheFalso()
+    monkeypatch.setattr(utils.cache, 'cache_manager', cache)
+    monkeypatch.setattr(melhor_envio_service, 'cache_manager', cache)
+    return cache
+
+
+@pytest.fixture
+def api(monkeypatch, cache):
+    api = ApiFalsa()
+    monkeypatch.setattr(melhor_envio_service, 'http_session', api)
+    return api
+
+
+@pytest.fixture
+def servico(monkeypatch):
+    monkeypatch.setenv('MELHOR_ENVIO_API_KEY', 'token-de-teste')
+    return MelhorEnvioService()
+
+
+CAFE = {'id': 'cafe', 'weight': 0.5, 'width': 12, 'height': 6, 'length': 16, 'price': 39.9, 'quantity': 2}
+MOEDOR = {'id': 'moedor', 'weight': 1.1, 'width': 20, 'height': 20, 'length': 30, 'price': 180, 'quantity': 1}
+
+
+def test_chave_normaliza_cep_e_ordem_dos_itens(servico, api):
+    primeira = servico.calculate_shipping('01310-100', '20040-020', [CAFE, MOEDOR])
+    segunda = servico.calculate_shipping('01310100', '20040-999', [MOEDOR, CAFE])
+
+    assert primeira == segunda and not primeira['fallback']
+    assert len(api.pedidos) == 1
+    assert api.pedidos[0]['from'] == {'postal_code': '01310100'}
+
+    # Outra região de destino é outra cotação
+    servico.calculate_shipping('01310-100', '30140-071', [CAFE, MOEDOR])
+    assert len(api.pedidos) == 2
+
+
+@pytest.mark.parametrize('valor, passo', [
+    (0.3, 0.25), (0.5, 0.25), (0.51, 0.25), (1.1, 0.25), (2.999, 0.25),
+    (10, 5), (11, 5), (15.01, 5), (39.9, 50), (50, 50), (180, 50),
+])
+def test_faixa_arredonda_para_cima(valor, passo):
+    faixa = _round_up(valor, passo)
+    assert valor <= faixa < valor + passo
+
+
+def test_volume_cotado_nunca_menor_que_o_real(servico, api):
+    produtos = [
+        {'weight': 0.31, 'width': 10.5, 'height': 5, 'length': 15.2, 'price': 39.9, 'quantity': 1},
+        {'weight': 0.75, 'width': 11, 'height': 7, 'length': 21, 'price': 50.01, 'quantity': 3},
+    ]
+    servico.calculate_shipping('01310-100', '20040-020', produtos)
+
+    cotados = sorted(api.pedidos[0]['products'], key=lambda p: p['weight'])
+    reais = sorted(servico._format_products(produtos), key=lambda p: p['weight'])
+    for cotado, real in zip(cotados, reais):
+        for campo in ('width', 'height', 'length', 'weight', 'insurance_value', 'quantity'):
+            assert cotado[campo] >= real[campo], campo
+    assert [p['weight'] for p in cotados] == [0.5, 0.75]
+
+
+def test_chamadas_simultaneas_fazem_uma_requisicao(servico, monkeypatch, cache):
+    api = ApiFalsa(atraso=0.2)
+    monkeypatch.setattr(melhor_envio_service, 'http_session', api)
+    resultados = []
+
+    def cotar(cep):
+        resultados.append(servico.calculate_shipping('01310-100', cep, [CAFE]))
+
+    threads = [threading.Thread(target=cotar, args=(f'20040-{i:03d}',)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(api.pedidos) == 1
+    assert len(resultados) == 8 and all(r == resultados[0] for r in resultados)
+
+
+def test_pre_aquecimento_cota_as_regioes_mais_pedidas(servico, api, cache):
+    cache.redis = RedisFalso()
+    for _ in range(3):
+        servico.calculate_shipping('01310-100', '20040-020', [CAFE])
+    for _ in range(2):
+        servico.calculate_shipping('01310-100', '30140-071', [CAFE])
+    servico.calculate_shipping('01310-100', '90010-000', [MOEDOR])
+    assert len(api.pedidos) == 3
+    api.pedidos.clear()
+
+    assert servico.warm_quotes(limit=2) == 2
+
+    # As duas identidades mais pedidas, cotadas pelo CEP da região
+    assert [p['to']['postal_code'] for p in api.pedidos] == ['20040000', '30140000']
+    servico.calculate_shipping('01310-100', '20040-555', [CAFE])
+    assert len(api.pedidos) == 2
+
+    # Um worker por vez: com o lock ocupado a passada não faz nada
+    token = cache.acquire_lock(melhor_envio_service.WARM_LOCK, timeout=60)
+    assert ShippingQuoteWarmer().warm() == 0
+    cache.release_lock(melhor_envio_service.WARM_LOCK, token)
+    assert ShippingQuoteWarmer().warm() == 3
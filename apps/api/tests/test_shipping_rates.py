@@ -0,0 +1,67 @@
+"""
+Testes da tabela de fretes por faixa de CEP
+"""
+
+import pytest
+
+from services.shipping_rates import CepRangeIndex, ShippingRates, normalize_cep, shipping_rates
+
+
+class TestLookup:
+    """CEP → UF, região e zona local"""
+
+    @pytest.mark.parametrize("cep, uf, region", [
+        ("01310-100", "SP", "sudeste"),
+        ("19999-999", "SP", "sudeste"),
+        ("20040-020", "RJ", "sudeste"),
+        ("69300000", "RR", "norte"),
+        ("69400000", "AM", "norte"),
+        ("72800-000", "GO", "centro-oeste"),
+        ("73000-000", "DF", "centro-oeste"),
+        ("76800-000", "RO", "norte"),
+        ("90010-000", "RS", "sul"),
+    ])
+    def test_uf_e_regiao(self, cep, uf, region):
+        info = shipping_rates.lookup(cep)
+        assert (info.uf, info.region, info.zone) == (uf, region, None)
+
+    def test_zona_local(self):
+        assert shipping_rates.lookup("97010-000").zone == "santa_maria"
+        assert shipping_rates.lookup("97199-999").zone == "santa_maria"
+        assert shipping_rates.lookup("97200-000").zone is None
+
+    @pytest.mark.parametrize("cep", ["", None, "1234", "00999-999", "abc"])
+    def test_cep_invalido_ou_fora_das_faixas(self, cep):
+        assert shipping_rates.lookup(cep) is None
+
+    def test_faixas_sobrepostas_sao_rejeitadas(self):
+        with pytest.raises(ValueError):
+            CepRangeIndex([(1, 10, "A"), (10, 20, "B")])
+
+    def test_normalize_cep(self):
+        assert normalize_cep("97.010-000") == 97010000
+        assert normalize_cep("9701000") is None
+
+
+class TestQuote:
+    """Preços tabelados"""
+
+    def test_preco_por_uf_e_peso(self):
+        pac, sedex = shipping_rates.quote("20040-020", weight_kg=2)
+        assert (pac["service_name"], pac["price"]) == ("PAC", 28.8)
+        assert (sedex["service_name"], sedex["price"]) == ("SEDEX", 54.0)
+
+    def test_uf_sem_preco_usa_padrao(self):
+        pac, _ = shipping_rates.quote("69900-000")
+        assert pac["price"] == 24.0
+
+    def test_entrega_local_e_frete_gratis(self):
+        options = shipping_rates.quote("97010-000", weight_kg=1, subtotal=100)
+        assert [o["service_code"] for o in options] == ["04510", "04014", "LOCAL"]
+        assert options[-1]["price"] == 14.0
+
+        free = shipping_rates.quote("97010-000", weight_kg=1, subtotal=200)
+        assert len(free) == 1 and free[0]["is_free"] and free[0]["price"] == 0
+
+    def test_tabela_recarregada_do_arquivo(self):
+        assert ShippingRates.load().quote("01310-100") == shipping_rates.quote("01310-100")
@@ -0,0 +1,84 @@
+"""
+Testes da reserva de estoque em lote
+Reserva além do disponível, baixa condicional sob concorrência e devolução do
+estoque quando a transação do pedido é desfeita
+"""
+
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from database import db
+from models.products import Product
+from services import stock_reservation
+from services.stock_reservation import InsufficientStockError, reserve_stock
+from tests.sqlite_app import sqlite_app
+
+
+@pytest.fixture
+def estoque_app():
+    with sqlite_app([Product.__table__]) as app:
+        yield app
+
+
+@pytest.fixture
+def produtos(estoque_app):
+    produtos = [
+        Product(id=uuid.uuid4(), name=f'Café {i}', slug=f'cafe-{i}', sku=f'CF{i}',
+                price=10, stock_quantity=5)
+        for i in range(2)
+    ]
+    db.session.add_all(produtos)
+    db.session.commit()
+    return [p.id for p in produtos]
+
+
+def estoque(produto_ids):
+    db.session.expire_all()
+    return [db.session.get(Product, produto_id).stock_quantity for produto_id in produto_ids]
+
+
+def test_reserva_soma_linhas_e_baixa_em_um_update(produtos):
+    reservados = reserve_stock([(produtos[0], 2), (str(produtos[0]), 3), (produtos[1], 1)])
+    db.session.commit()
+
+    assert reservados[produtos[0]].quantity == 5
+    assert estoque(produtos) == [0, 4]
+
+
+def test_reserva_acima_do_disponivel_e_rejeitada(produtos):
+    with pytest.raises(InsufficientStockError) as erro:
+        reserve_stock([(produtos[0], 1), (produtos[1], 6)])
+    db.session.rollback()
+
+    assert erro.value.available == 5
+    assert estoque(produtos) == [5, 5]
+
+
+def test_update_condicional_barra_venda_concorrente(produtos, monkeypatch):
+    """Outro pedido baixa o estoque entre a leitura e o UPDATE (banco sem FOR UPDATE)"""
+    execute = db.session.execute
+
+    def execute_com_concorrente(statement, *args, **kwargs):
+        if getattr(statement, 'is_update', False):
+            execute(text('UPDATE products SET stock_quantity = stock_quantity - 4 WHERE id = :id'),
+                    {'id': produtos[1].hex})
+        return execute(statement, *args, **kwargs)
+
+    monkeypatch.setattr(stock_reservation.db.session, 'execute', execute_com_concorrente)
+    with pytest.raises(InsufficientStockError) as erro:
+        reserve_stock([(produtos[0], 2), (produtos[1], 3)])
+    monkeypatch.undo()
+
+    assert erro.value.product_name == 'Café 1'
+    assert erro.value.available == 1
+
+
+def test_rollback_do_pedido_devolve_o_estoque(produtos):
+    reserve_stock([(produtos[0], 5), (produtos[1], 5)])
+    assert estoque(produtos) == [0, 0]
+
+    db.session.rollback()
+
+    assert estoque(produtos) == [5, 5]
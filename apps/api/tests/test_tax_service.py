@@ -0,0 +1,143 @@
+"""
+Testes do cálculo de impostos do pedido
+O caminho em lote gera os mesmos TaxCalculation do cálculo item a item, e
+alterações em ICMSRate invalidam a matriz ICMS em memória
+"""
+
+import uuid
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+
+from database import db
+from models.customers import Customer
+from models.orders import Order, OrderItem
+from models.products import Product
+from models.sales_rollup import SalesRollupPendingDay
+from models.tax import CFOPCode, ICMSRate, NCMCode, ProductTax, TaxCalculation, TaxExemption
+from services.tax_service import ICMS_TABLE_VERSION_KEY, TaxCalculationService, icms_rate_table
+from tests.sqlite_app import sqlite_app
+from utils.cache import cache_get
+
+CAMPOS = (
+    'product_id', 'base_value', 'quantity',
+    'icms_base', 'icms_rate', 'icms_amount', 'icms_situation',
+    'pis_base', 'pis_rate', 'pis_amount', 'pis_situation',
+    'cofins_base', 'cofins_rate', 'cofins_amount', 'cofins_situation',
+    'ipi_base', 'ipi_rate', 'ipi_amount', 'ipi_situation',
+    'total_tax_amount', 'origin_state', 'destination_state',
+)
+
+
+@pytest.fixture
+def tax_app():
+    tabelas = [Product.__table__, Customer.__table__, Order.__table__, OrderItem.__table__,
+               NCMCode.__table__, CFOPCode.__table__, ICMSRate.__table__, ProductTax.__table__,
+               TaxExemption.__table__, TaxCalculation.__table__,
+               # Pedidos gravados marcam o dia para o rollup de vendas
+               SalesRollupPendingDay.__table__]
+    with sqlite_app(tabelas) as app:
+        icms_rate_table.invalidate()
+        yield app
+
+
+@pytest.fixture
+def pedido(tax_app):
+    """Pedido com um item de cada configuração fiscal, para cliente com isenções"""
+    ncm = NCMCode(id=uuid.uuid4(), code='09012100', description='Café torrado',
+                  pis_rate=Decimal('1.65'), cofins_rate=Decimal('7.60'), ipi_rate=Decimal('0'))
+    produtos = [
+        Product(id=uuid.uuid4(), name=f'Café {i}', slug=f'cafe-{i}', sku=f'CF{i}', price=Decimal('39.90'))
+        for i in range(3)
+    ]
+    configuracoes = [
+        # Redução de base de ICMS e IPI próprio
+        ProductTax(product_id=produtos[0].id, ncm_id=ncm.id, icms_reduced_base=Decimal('33.33'),
+                   ipi_rate=Decimal('5.00'), ipi_situation='50'),
+        # Alíquotas do NCM
+        ProductTax(product_id=produtos[1].id, ncm_id=ncm.id),
+        # produtos[2] sem ProductTax: recebe a configuração padrão
+    ]
+    cliente = Customer(id=uuid.uuid4(), name='Empório', email='emporio@example.com',
+                       customer_type='business', address_state='RJ')
+    isencoes = [
+        TaxExemption(customer_id=cliente.id, tax_type='pis', exemption_type='reduced_rate',
+                     reduced_rate=Decimal('0.65'), applicable_states='["RJ"]'),
+        TaxExemption(customer_id=cliente.id, tax_type='ipi', exemption_type='total'),
+        # Não vale para o RJ
+        TaxExemption(customer_id=cliente.id, tax_type='icms', exemption_type='total',
+                     applicable_states='["MG"]'),
+    ]
+    pedido = Order(id=uuid.uuid4(), order_number='MC-1', customer_id=cliente.id,
+                   subtotal=Decimal('239.40'), shipping_cost=Decimal('20'), total_amount=Decimal('259.40'))
+    itens = [
+        OrderItem(id=uuid.uuid4(), order_id=pedido.id, product_id=produto.id, product_name=produto.name,
+                  quantity=quantidade, unit_price=Decimal('39.90'), total_price=Decimal('39.90') * quantidade)
+        for produto, quantidade in zip(produtos, (3, 1, 2))
+    ]
+    db.session.add_all([ncm, *produtos, *configuracoes, cliente, *isencoes, pedido, *itens])
+    db.session.add(ICMSRate(origin_state='SP', destination_state='RJ', rate=Decimal('12.00')))
+    db.session.commit()
+    return pedido.id
+
+
+def valores(calculo):
+    return {campo: getattr(calculo, campo) for campo in CAMPOS}
+
+
+def test_lote_igual_ao_calculo_item_a_item(pedido):
+    servico = TaxCalculationService(db.session)
+    ordem = db.session.get(Order, pedido)
+    cliente = db.session.get(Customer, ordem.customer_id)
+    itens = list(ordem.items)
+
+    em_lote = [valores(c) for c in servico.calculate_items_taxes_batch(itens, cliente, 'SP', 'RJ')]
+    db.session.rollback()
+
+    servico = TaxCalculationService(db.session)
+    item_a_item = [valores(servico.calculate_item_taxes(item, cliente, 'SP', 'RJ')) for item in itens]
+
+    assert em_lote == item_a_item
+    por_produto = {c['product_id']: c for c in em_lote}
+    reduzido, ncm, padrao = (por_produto[item.product_id] for item in itens)
+    assert (reduzido['icms_situation'], reduzido['icms_base'], reduzido['icms_amount']) == (
+        '20', Decimal('79.80'), Decimal('9.58'))
+    assert (reduzido['ipi_situation'], reduzido['ipi_amount']) == ('02', Decimal('0'))
+    assert (ncm['icms_rate'], ncm['pis_rate'], ncm['cofins_rate']) == (
+        Decimal('12.00'), Decimal('0.65'), Decimal('7.60'))
+    assert (padrao['pis_situation'], padrao['ipi_situation']) == ('01', '53')
+    assert ProductTax.query.filter_by(product_id=itens[2].product_id).count() == 1
+
+
+def test_pedido_calculado_em_consultas_constantes(pedido):
+    comandos = []
+    event.listen(db.engine, 'before_cursor_execute', lambda _c, _cur, sql, *a: comandos.append(sql))
+    resultado = TaxCalculationService(db.session).calculate_order_taxes(db.session.get(Order, pedido))
+
+    assert resultado['success'], resultado
+    assert len(resultado['calculations']) == 3
+    assert sum(1 for sql in comandos if sql.startswith('SELECT products.')) == 1
+    assert sum(1 for sql in comandos if 'FROM product_tax' in sql) == 1
+
+    calculos = TaxCalculation.query.filter_by(order_id=pedido).all()
+    ordem = db.session.get(Order, pedido)
+    assert ordem.tax_amount == sum(c.total_tax_amount for c in calculos)
+    assert {c.cfop.code for c in calculos} == {'6102'}
+
+    # Recalcular substitui os cálculos anteriores
+    TaxCalculationService(db.session).calculate_order_taxes(db.session.get(Order, pedido))
+    assert TaxCalculation.query.filter_by(order_id=pedido).count() == 3
+
+
+def test_alteracao_de_icms_invalida_a_matriz(pedido):
+    servico = TaxCalculationService(db.session)
+    assert servico._get_icms_rate('SP', 'RJ') == Decimal('12.00')
+    versao = cache_get(ICMS_TABLE_VERSION_KEY)
+
+    aliquota = ICMSRate.query.filter_by(origin_state='SP', destination_state='RJ').one()
+    aliquota.rate = Decimal('7.00')
+    db.session.commit()
+
+    assert cache_get(ICMS_TABLE_VERSION_KEY) != versao
+    assert servico._get_icms_rate('SP', 'RJ') == Decimal('7.00')
@@ -0,0 +1,109 @@
+"""
+Testes da caixa de entrada de webhooks
+Chave de idempotência por provedor e reprocessamento do IPN legado do
+Mercado Pago, cujo corpo se repete a cada mudança de status do pagamento
+"""
+
+import pytest
+from sqlalchemy import inspect, text
+
+from database import db
+from models.payments import PaymentWebhook
+from services import webhook_processor as modulo
+from services.webhook_processor import WebhookProcessor, WebhookProvider, webhook_event_id
+from tests.sqlite_app import sqlite_app
+
+MP = WebhookProvider.MERCADO_PAGO
+IPN = {'resource': 'https://api.mercadopago.com/v1/payments/123', 'topic': 'payment'}
+
+
+@pytest.fixture
+def webhook_app():
+    with sqlite_app([PaymentWebhook.__table__]) as app:
+        yield app
+
+
+@pytest.fixture
+def processador(webhook_app, monkeypatch):
+    processador = WebhookProcessor()
+    monkeypatch.setattr(processador, 'start', lambda: None)
+    return processador
+
+
+@pytest.fixture
+def chamadas(monkeypatch):
+    chamadas = []
+
+    def handler(event_type, data, webhook_id):
+        chamadas.append(data)
+        return {'success': True}
+
+    monkeypatch.setitem(modulo.WEBHOOK_HANDLERS, MP, handler)
+    return chamadas
+
+
+def test_chave_de_idempotencia():
+    assert webhook_event_id(MP, {'id': 9, 'type': 'payment', 'data': {'id': '123'}}) == 'mp:9'
+    assert webhook_event_id(MP, IPN, delivery_id='req-1') == 'delivery:req-1'
+    assert webhook_event_id(MP, IPN) == 'mp-ipn:payment:123'
+    assert webhook_event_id(MP, {'id': '123', 'topic': 'payment'}) == 'mp-ipn:payment:123'
+    assert webhook_event_id(WebhookProvider.MELHOR_ENVIO, {'event': 'x'}).startswith('sha256:')
+
+
+def test_ipn_legado_reprocessa_nova_notificacao_do_mesmo_pagamento(processador, chamadas):
+    primeiro, criado = processador.enqueue(MP, 'payment', dict(IPN))
+    assert criado
+    # Reentrega antes do processamento colapsa no evento pendente
+    assert processador.enqueue(MP, 'payment', dict(IPN)) == (primeiro, False)
+    assert processador.process_pending() == 1
+
+    # Pagamento aprovado: mesmo corpo, nova notificação
+    segundo, criado = processador.enqueue(MP, 'payment', dict(IPN))
+    assert (segundo, criado) == (primeiro, True)
+    assert processador.process_pending() == 1
+    assert len(chamadas) == 2
+
+    webhook = db.session.get(PaymentWebhook, primeiro)
+    assert (webhook.status, webhook.attempts, webhook.processed) == ('processed', 1, True)
+
+
+def test_id_da_entrega_separa_notificacoes_com_mesmo_corpo(processador, chamadas):
+    primeiro, _ = processador.enqueue(MP, 'payment', dict(IPN), delivery_id='req-1')
+    segundo, criado = processador.enqueue(MP, 'payment', dict(IPN), delivery_id='req-2')
+    assert criado and segundo != primeiro
+
+    assert processador.enqueue(MP, 'payment', dict(IPN), delivery_id='req-1') == (primeiro, False)
+    assert processador.process_pending() == 2
+
+
+def test_tabela_anterior_a_fila_e_atualizada(monkeypatch, chamadas):
+    with sqlite_app([]) as app:
+        # Formato de payment_webhooks antes da fila
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                'CREATE TABLE payment_webhooks (id CHAR(32) PRIMARY KEY, provider VARCHAR(50) NOT NULL, '
+                'event_type VARCHAR(100) NOT NULL, payload TEXT NOT NULL, processed BOOLEAN, '
+                'processing_error TEXT, created_at DATETIME, processed_at DATETIME)'
+            ))
+            conn.execute(text(
+                "INSERT INTO payment_webhooks VALUES ('a1', 'mercado_pago', 'payment', '{}', 1, NULL, "
+                "'2026-01-01 00:00:00', NULL), ('b2', 'mercado_pago', 'payment', '{}', 0, 'erro', "
+                "'2026-01-02 00:00:00', NULL)"
+            ))
+
+        processador = WebhookProcessor()
+        monkeypatch.setattr(processador, 'start', lambda: None)
+        processador.init_app(app)
+        processador.init_app(app)
+
+        with db.engine.connect() as conn:
+            antigos = conn.execute(text(
+                'SELECT id, event_id, status, attempts FROM payment_webhooks ORDER BY id'
+            )).all()
+        assert antigos == [('a1', 'legacy:a1', 'processed', 0), ('b2', 'legacy:b2', 'dead', 0)]
+        indices = {indice['name'] for indice in inspect(db.engine).get_indexes('payment_webhooks')}
+        assert {'uq_payment_webhooks_provider_event', 'idx_payment_webhooks_status_next'} <= indices
+
+        primeiro, criado = processador.enqueue(MP, 'payment', dict(IPN))
+        assert criado and processador.enqueue(MP, 'payment', dict(IPN)) == (primeiro, False)
+        assert processador.process_pending() == 1 and len(chamadas) == 1
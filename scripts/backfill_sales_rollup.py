@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Script de backfill do rollup diário de vendas
+
+Reconstrói as tabelas daily_sales_rollup, daily_product_sales_rollup e
+daily_customer_sales_rollup a partir do histórico de pedidos. Pode ser
+executado novamente a qualquer momento: cada dia é recalculado do zero.
+
+Uso:
+    python scripts/backfill_sales_rollup.py
+    python scripts/backfill_sales_rollup.py --start 2024-01-01 --end 2024-12-31
+"""
+
+import argparse
+import logging
+import os
+import sys
+from datetime import date
+
+# Adiciona o diretório src ao path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'apps', 'api', 'src'))
+
+# Configurar logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Backfill do rollup diário de vendas')
+    parser.add_argument('--start', type=date.fromisoformat,
+                        help='Primeiro dia (YYYY-MM-DD); padrão: pedido mais antigo')
+    parser.add_argument('--end', type=date.fromisoformat, help='Último dia (YYYY-MM-DD); padrão: hoje')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    from database import db
+    from init_database import create_app_for_db
+    from services.sales_rollup_service import sales_rollup
+
+    # Order referencia modelos do Melhor Envio por nome
+    try:
+        import models.melhor_envio  # noqa: F401
+    except ImportError as e:
+        logger.warning(f"⚠️ Modelos Melhor Envio não encontrados: {e}")
+
+    app = create_app_for_db()
+
+    with app.app_context():
+        db.init_app(app)
+
+        logger.info("🔄 Reconstruindo rollup diário de vendas...")
+        result = sales_rollup.backfill(args.start, args.end)
+        logger.info(f"✅ Rollup reconstruído: {result}")
+
+
+if __name__ == '__main__':
+    main()
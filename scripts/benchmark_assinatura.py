@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Benchmark da assinatura XMLDSig de documentos fiscais
+
+Mede a vazão (documentos/s) de CertificateService.assinar_xml_nfe,
+assinar_xml_evento e assinar_lote com um certificado autoassinado gerado em
+memória. O modo "sem contexto" descarta o contexto de assinatura (certificado
+em PEM, thumbprint e assinador) a cada documento, como era feito por
+chamada antes do contexto em cache.
+
+Uso:
+    python scripts/benchmark_assinatura.py
+    python scripts/benchmark_assinatura.py --documentos 500 --processos 4
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Adiciona o diretório src ao path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'apps', 'api', 'src'))
+
+# Configurar logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark da assinatura de NF-e/eventos')
+    parser.add_argument('--documentos', type=int, default=200, help='Documentos por cenário (padrão: 200)')
+    parser.add_argument('--itens', type=int, default=10, help='Itens por NF-e (padrão: 10)')
+    parser.add_argument('--processos', type=int, default=None, help='Processos do assinar_lote (padrão: CPUs)')
+    return parser.parse_args()
+
+
+def gerar_pfx(senha: bytes) -> bytes:
+    """Certificado RSA 2048 autoassinado, no formato PFX"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    from cryptography.x509.oid import NameOID
+
+    chave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nome = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "EMPRESA BENCHMARK:12345678000190")])
+    agora = datetime.utcnow()
+    certificado = (
+        x509.CertificateBuilder()
+        .subject_name(nome)
+        .issuer_name(nome)
+        .public_key(chave.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(agora - timedelta(days=1))
+        .not_valid_after(agora + timedelta(days=30))
+        .sign(chave, hashes.SHA256())
+    )
+    return pkcs12.serialize_key_and_certificates(
+        b"benchmark", chave, certificado, None, serialization.BestAvailableEncryption(senha)
+    )
+
+
+def xml_nfe(numero: int, itens: int) -> str:
+    chave = f"3524101234567800019055001{numero:09d}1{numero % 10 ** 8:08d}0"[:44]
+    detalhes = "".join(
+        f'<det nItem="{i}"><prod><cProd>P{i:04d}</cProd><xProd>PRODUTO {i}</xProd>'
+        f'<NCM>09012100</NCM><CFOP>5102</CFOP><uCom>UN</uCom><qCom>1.0000</qCom>'
+        f'<vUnCom>10.00</vUnCom><vProd>10.00</vProd></prod></det>'
+        for i in range(1, itens + 1)
+    )
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><NFe xmlns="{NS_NFE}">'
+        f'<infNFe versao="4.00" Id="NFe{chave}"><ide><cUF>35</cUF><nNF>{numero}</nNF></ide>'
+        f'<emit><CNPJ>12345678000190</CNPJ><xNome>EMPRESA BENCHMARK</xNome></emit>'
+        f'{detalhes}<total><ICMSTot><vNF>{itens * 10}.00</vNF></ICMSTot></total></infNFe></NFe>'
+    )
+
+
+def xml_evento(numero: int) -> str:
+    chave = f"3524101234567800019055001{numero:09d}1{numero % 10 ** 8:08d}0"[:44]
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><evento xmlns="{NS_NFE}" versao="1.00">'
+        f'<infEvento Id="ID110111{chave}01"><cOrgao>35</cOrgao><tpAmb>2</tpAmb>'
+        f'<chNFe>{chave}</chNFe><tpEvento>110111</tpEvento><nSeqEvento>1</nSeqEvento>'
+        f'<detEvento versao="1.00"><descEvento>Cancelamento</descEvento>'
+        f'<xJust>Cancelamento para benchmark de assinatura</xJust></detEvento></infEvento></evento>'
+    )
+
+
+def medir(nome: str, total: int, executar) -> float:
+    inicio = time.perf_counter()
+    falhas = executar()
+    duracao = time.perf_counter() - inicio
+    vazao = total / duracao if duracao else 0.0
+    logger.info(f"{nome:<32} {total:>6} docs  {duracao:8.2f}s  {vazao:9.1f} docs/s  falhas={falhas}")
+    return vazao
+
+
+def main():
+    args = parse_args()
+
+    from services.certificate_service import CertificateService, SIGNXML_AVAILABLE, CRYPTO_AVAILABLE
+
+    if not (SIGNXML_AVAILABLE and CRYPTO_AVAILABLE):
+        logger.error("❌ signxml, lxml e cryptography são necessários para o benchmark")
+        sys.exit(1)
+
+    service = CertificateService()
+    ok, info = service.carregar_certificado_a1(gerar_pfx(b"1234"), "1234")
+    if not ok:
+        logger.error(f"❌ Certificado de teste não carregado: {info.erro}")
+        sys.exit(1)
+
+    nfes = [xml_nfe(n, args.itens) for n in range(1, args.documentos + 1)]
+    eventos = [xml_evento(n) for n in range(1, args.documentos + 1)]
+
+    def sequencial(metodo, xmls, sem_contexto=False):
+        def executar():
+            falhas = 0
+            for xml in xmls:
+                if sem_contexto:
+                    service._contexto_assinatura = None
+                falhas += not metodo(xml).sucesso
+            return falhas
+        return executar
+
+    def lote(xmls, tipo):
+        def executar():
+            return sum(not r.sucesso for r in service.assinar_lote(xmls, tipo=tipo, max_processos=args.processos))
+        return executar
+
+    logger.info(f"🔄 Assinando {args.documentos} documentos por cenário (NF-e com {args.itens} itens)")
+
+    # Aquece o pool de processos fora da medição
+    service.assinar_lote(nfes[:32], tipo="nfe", max_processos=args.processos)
+
+    base = medir("assinar_xml_nfe (sem contexto)", len(nfes), sequencial(service.assinar_xml_nfe, nfes, True))
+    nfe = medir("assinar_xml_nfe", len(nfes), sequencial(service.assinar_xml_nfe, nfes))
+    medir("assinar_xml_evento (sem contexto)", len(eventos), sequencial(service.assinar_xml_evento, eventos, True))
+    medir("assinar_xml_evento", len(eventos), sequencial(service.assinar_xml_evento, eventos))
+    lote_nfe = medir("assinar_lote (nfe)", len(nfes), lote(nfes, "nfe"))
+    medir("assinar_lote (evento)", len(eventos), lote(eventos, "evento"))
+
+    logger.info(f"✅ Contexto: {nfe / base:.2f}x  |  Lote: {lote_nfe / base:.2f}x sobre assinatura sem contexto")
+    service.limpar_certificado()
+
+
+if __name__ == '__main__':
+    main()
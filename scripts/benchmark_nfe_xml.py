@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Benchmark da geração de XML de NF-e
+
+Compara a serialização compacta em uma passada (NFeXMLBuilder.build_nfe /
+build_envio_lote) com o caminho anterior, que reparseava o XML com
+xml.dom.minidom para indentar e parseava cada NF-e de novo ao montar o lote.
+Usa documentos em memória (sem banco) com 1 a 500 itens.
+
+Uso:
+    python scripts/benchmark_nfe_xml.py
+    python scripts/benchmark_nfe_xml.py --itens 1 50 500 --repeticoes 20
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+from xml.dom import minidom
+from xml.etree import ElementTree as ET
+
+# Adiciona o diretório src ao path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'apps', 'api', 'src'))
+
+# Configurar logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark da geração de XML de NF-e')
+    parser.add_argument('--itens', type=int, nargs='+', default=[1, 10, 100, 500],
+                        help='Quantidades de itens por NF-e (padrão: 1 10 100 500)')
+    parser.add_argument('--repeticoes', type=int, default=10, help='Execuções por cenário (padrão: 10)')
+    parser.add_argument('--lote', type=int, default=50, help='NF-e por enviNFe (padrão: 50)')
+    return parser.parse_args()
+
+
+class Dados(SimpleNamespace):
+    """Atributos não informados valem None, como colunas opcionais vazias"""
+
+    def __getattr__(self, nome):
+        return None
+
+
+def documento(numero: int, itens: int) -> Dados:
+    empresa = Dados(
+        cnpj="12345678000190", razao_social="EMPRESA BENCHMARK LTDA", nome_fantasia="BENCHMARK",
+        inscricao_estadual="123456789012", regime_tributario="1", codigo_uf_ibge="35",
+        codigo_municipio_ibge="3550308", municipio="SAO PAULO", uf="SP", cep="01001000",
+        logradouro="RUA DO BENCHMARK", numero="100", bairro="CENTRO",
+        codigo_pais="1058", pais="BRASIL", telefone_principal="1133334444",
+    )
+    detalhes = [
+        Dados(
+            numero_item=i, codigo_produto=f"P{i:05d}", descricao=f"PRODUTO DE TESTE {i} & CIA",
+            ncm="09012100", cfop="5102", unidade_comercial="UN", unidade_tributavel="UN",
+            quantidade_comercial=Decimal("2"), quantidade_tributavel=Decimal("2"),
+            valor_unitario_comercial=Decimal("10.50"), valor_unitario_tributavel=Decimal("10.50"),
+            valor_total_bruto=Decimal("21.00"), ind_total="1",
+            icms_origem="0", icms_cst="102", pis_cst="07", cofins_cst="07",
+        )
+        for i in range(1, itens + 1)
+    ]
+    return Dados(
+        empresa=empresa, itens=detalhes, pagamentos=[Dados(forma_pagamento="01", valor=Decimal(21 * itens))],
+        chave_acesso=f"35241012345678000190550010{numero:08d}1{numero:08d}"[:43] + "0",
+        modelo="55", serie=1, numero=numero, tipo_emissao="1", tipo_operacao="1",
+        finalidade="1", ambiente="2", indicador_presenca="1", data_emissao=datetime(2024, 10, 1, 12),
+        dest_cnpj="98765432000110", dest_nome="CLIENTE BENCHMARK", dest_uf="SP",
+        dest_logradouro="AV CLIENTE", dest_numero="1", dest_bairro="CENTRO",
+        dest_codigo_municipio_ibge="3550308", dest_municipio="SAO PAULO", dest_cep="01001000",
+        modalidade_frete="9", valor_produtos=Decimal(21 * itens), valor_total=Decimal(21 * itens),
+    )
+
+
+def build_nfe_minidom(builder, doc) -> str:
+    """Caminho anterior: serializa, reparseia com minidom e indenta"""
+    rough_string = ET.tostring(builder.build_nfe_element(doc), encoding='unicode')
+    return minidom.parseString(rough_string).toprettyxml(indent="  ", encoding=None)
+
+
+def build_envio_lote_minidom(builder, documentos, id_lote: str) -> str:
+    """Caminho anterior do enviNFe: cada NF-e é serializada e parseada de novo"""
+    envi_nfe = ET.Element("enviNFe", xmlns="http://www.portalfiscal.inf.br/nfe", versao="4.00")
+    ET.SubElement(envi_nfe, "idLote").text = id_lote.zfill(15)
+    ET.SubElement(envi_nfe, "indSinc").text = "0"
+    for doc in documentos:
+        nfe_xml = build_nfe_minidom(builder, doc)
+        envi_nfe.append(ET.fromstring(nfe_xml.replace('<?xml version="1.0" ?>', '').strip()))
+    rough_string = ET.tostring(envi_nfe, encoding='unicode')
+    return minidom.parseString(rough_string).toprettyxml(indent="  ", encoding=None)
+
+
+def medir(repeticoes: int, executar) -> float:
+    """Melhor tempo (ms) entre as repetições"""
+    melhor = float('inf')
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        executar()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor * 1000
+
+
+def main():
+    args = parse_args()
+
+    from services.nfe_xml_builder import NFeXMLBuilder
+
+    builder = NFeXMLBuilder()
+
+    logger.info(f"🔄 NF-e individual ({args.repeticoes} repetições, melhor tempo)")
+    for itens in args.itens:
+        doc = documento(1, itens)
+        anterior = medir(args.repeticoes, lambda: build_nfe_minidom(builder, doc))
+        compacto = medir(args.repeticoes, lambda: builder.build_nfe(doc))
+        tamanho_anterior = len(build_nfe_minidom(builder, doc).encode())
+        tamanho_compacto = len(builder.build_nfe(doc).encode())
+        logger.info(
+            f"{itens:>4} itens  minidom {anterior:9.2f} ms ({tamanho_anterior:>8} B)  "
+            f"compacto {compacto:9.2f} ms ({tamanho_compacto:>8} B)  {anterior / compacto:5.1f}x"
+        )
+
+    logger.info(f"🔄 enviNFe com {args.lote} NF-e")
+    for itens in args.itens:
+        documentos = [documento(n, itens) for n in range(1, args.lote + 1)]
+        anterior = medir(max(1, args.repeticoes // 5),
+                         lambda: build_envio_lote_minidom(builder, documentos, "1"))
+        compacto = medir(max(1, args.repeticoes // 5),
+                         lambda: builder.build_envio_lote(documentos, "1"))
+        logger.info(
+            f"{itens:>4} itens  minidom {anterior:9.2f} ms  compacto {compacto:9.2f} ms  "
+            f"{anterior / compacto:5.1f}x"
+        )
+
+    logger.info("✅ Benchmark concluído")
+
+
+if __name__ == '__main__':
+    main()
@@ -103,7 +103,7 @@ def init_database():
         # Newsletter
         NewsletterSubscriber, NewsletterTemplate, NewsletterCampaign, Campaign,
         # Notifications
-        Notification, NotificationTemplate, NotificationSubscription, NotificationLog,
+        Notification, NotificationTemplate, NotificationSubscription, NotificationLog, NotificationJob,
         # Media
         MediaFile,
         # Financial
@@ -122,6 +122,8 @@ def init_database():
         Wishlist, WishlistItem, WishlistShare,
         # PDV
         CashRegister, CashSession, CashMovement, Sale, SaleItem,
+        # Sales rollups
+        DailySalesRollup, DailyProductSalesRollup, DailyCustomerSalesRollup,
         # ERP
         PurchaseRequest, PurchaseRequestItem, SupplierContract,
         ProductionOrder, ProductionMaterial, QualityControl, MaterialRequirement,